@@ -110,7 +110,10 @@ export class TenantProvisionStack extends cdk.Stack {
       memoryLimitMiB: 512,
       environment: {
         AWS_ACCOUNT_ID: accountId,
-        AWS_REGION: region
+        AWS_REGION: region,
+        // Tokens are verified against the tenant user pool, see tenant_auth.py.
+        USER_POOL_ID: cdk.Fn.importValue('TenantUserpoolId'),
+        APP_CLIENT_ID: cdk.Fn.importValue('TenantUserPoolClientId')
       },
       logging: ecs.LogDriver.awsLogs({ streamPrefix: 'productmedia', logRetention: 7 })
     });
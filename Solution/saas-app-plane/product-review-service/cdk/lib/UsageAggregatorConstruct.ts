@@ -15,6 +15,8 @@ export interface UsageAggregatorProps {
     productReviewDBName: string
     rdsInstanceIdentifier: string
     rdsPostgresSg: ec2.SecurityGroup
+    // USAGE_OUTPUT_FORMAT per aggregator index (e.g. {'ecs-usage-aggregator.py': 'parquet'}), ndjson when not set
+    usageOutputFormats?: { [index: string]: string }
 }
 
 export class UsageAggregator extends Construct {
@@ -64,6 +66,19 @@ export class UsageAggregator extends Construct {
             resources: ['*'],
         }));
 
+        // pyarrow is too large to bundle into every aggregator, it is only attached to the ones writing Parquet.
+        const usageOutputFormats = props.usageOutputFormats ?? {}
+        const pyarrowLayer = Object.values(usageOutputFormats).some(format => format.toLowerCase() === 'parquet')
+            ? new lambda_python.PythonLayerVersion(this, 'PyarrowLayer', {
+                entry: path.join(__dirname, '../../src/layers/pyarrow'),
+                compatibleRuntimes: [lambda.Runtime.PYTHON_3_12]
+            })
+            : undefined
+        const outputFormatLayers = (index: string) =>
+            pyarrowLayer && usageOutputFormats[index]?.toLowerCase() === 'parquet' ? [pyarrowLayer] : []
+        const outputFormatEnvironment = (index: string): { [key: string]: string } =>
+            usageOutputFormats[index] ? { USAGE_OUTPUT_FORMAT: usageOutputFormats[index] } : {}
+
         const lambdaRDSIopsUsage = new lambda_python.PythonFunction(this, `RDSIopsUsageLambda${id}`, {
             entry: path.join(__dirname, '../../src/lambdas-aggregator'),
             index: 'rds-iops-usage.py',
@@ -75,10 +90,12 @@ export class UsageAggregator extends Construct {
                 subnetType: ec2.SubnetType.PRIVATE_WITH_EGRESS
             }),
             securityGroups: [aggregatorLambdaSg],
+            layers: outputFormatLayers('rds-iops-usage.py'),
             environment: {
                 SECRET_NAME: props.dbCredSecretName,
                 TENANT_USAGE_BUCKET: tenantUsageBucketName,
-                PRODUCT_REVIEW_DB_NAME: props.productReviewDBName
+                PRODUCT_REVIEW_DB_NAME: props.productReviewDBName,
+                ...outputFormatEnvironment('rds-iops-usage.py')
             },
             role: aggregatorLambdaRole,
             timeout: Duration.minutes(10),
@@ -100,10 +117,14 @@ export class UsageAggregator extends Construct {
                 subnetType: ec2.SubnetType.PRIVATE_WITH_EGRESS
             }),
             securityGroups: [aggregatorLambdaSg],
+            layers: outputFormatLayers('rds-storage-usage.py'),
             environment: {
                 SECRET_NAME: props.dbCredSecretName,
                 TENANT_USAGE_BUCKET: tenantUsageBucketName,
-                PRODUCT_REVIEW_DB_NAME: props.productReviewDBName
+                PRODUCT_REVIEW_DB_NAME: props.productReviewDBName,
+                STORAGE_USAGE_MODE: 'sample',
+                STORAGE_SAMPLE_MAX_ERROR: '0.01',
+                ...outputFormatEnvironment('rds-storage-usage.py')
             },
             role: aggregatorLambdaRole,
             timeout: Duration.minutes(10),
@@ -122,11 +143,13 @@ export class UsageAggregator extends Construct {
                 subnetType: ec2.SubnetType.PRIVATE_WITH_EGRESS
             }),
             securityGroups: [aggregatorLambdaSg],
+            layers: outputFormatLayers('rds-performance-insights.py'),
             environment: {
                 SECRET_NAME: props.dbCredSecretName,
                 TENANT_USAGE_BUCKET: tenantUsageBucketName,
                 PRODUCT_REVIEW_DB_NAME: props.productReviewDBName,
-                DB_IDENTIFIER: props.rdsInstanceIdentifier
+                DB_IDENTIFIER: props.rdsInstanceIdentifier,
+                ...outputFormatEnvironment('rds-performance-insights.py')
             },
             role: aggregatorLambdaRole,
             timeout: Duration.minutes(10),
@@ -144,11 +167,13 @@ export class UsageAggregator extends Construct {
                 subnetType: ec2.SubnetType.PRIVATE_WITH_EGRESS
             }),
             securityGroups: [aggregatorLambdaSg],
+            layers: outputFormatLayers('ecs-usage-aggregator.py'),
             environment: {
                 SECRET_NAME: props.dbCredSecretName,
                 TENANT_USAGE_BUCKET: tenantUsageBucketName,
                 PRODUCT_REVIEW_DB_NAME: props.productReviewDBName,
-                ECS_CLOUDWATCH_LOG_GROUP: 'ProductReviewLogGroup'
+                ECS_CLOUDWATCH_LOG_GROUP: 'ProductReviewLogGroup',
+                ...outputFormatEnvironment('ecs-usage-aggregator.py')
             },
             role: aggregatorLambdaRole,
             timeout: Duration.minutes(10),
@@ -3,7 +3,7 @@ from abc import ABC, abstractmethod
 
 class IAggregator(ABC):
     @abstractmethod
-    def calculate_daily_attribution_by_tenant(self):
+    def calculate_daily_attribution_by_tenant(self, checkpoint_store=None):
         pass
 
     @abstractmethod
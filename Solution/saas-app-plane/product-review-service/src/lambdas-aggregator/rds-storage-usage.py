@@ -1,4 +1,5 @@
 import psycopg
+from psycopg.rows import dict_row
 import json, os
 import boto3
 from collections import defaultdict
@@ -6,137 +7,97 @@ from decimal import Decimal
 import csv, json
 from datetime import datetime
 from utils.aggregator_util import (
-    get_s3_key,
-    get_line_delimited_json,
     get_formatted_start_of_day
 )
+from utils.output_format import write_usage_report
+from utils.secrets_cache import get_secrets_cache_from_env
+from utils.storage_estimates import (
+    DEFAULT_MAX_ERROR,
+    STORAGE_TRIGGERS,
+    STORAGE_USAGE_MODES,
+    compact_storage_counters,
+    drop_storage_counters,
+    estimate_table_usage,
+    get_storage_trigger_count,
+    get_table_size,
+    get_tenant_table_sizes,
+    get_tenant_tables,
+    seed_storage_counters
+)
+from utils.apportionment import (
+    usage_metric,
+    apportion_usage
+)
 
 s3 = boto3.client('s3')
 secrets_manager = boto3.client('secretsmanager')
+secrets_cache = get_secrets_cache_from_env(secrets_manager)
 
 tenant_usage_bucket = os.getenv("TENANT_USAGE_BUCKET")
 secret_name = os.environ['SECRET_NAME']
 db_name_fromenv = os.getenv("PRODUCT_REVIEW_DB_NAME")
+# sample, stats, counters or exact, the sampled modes meet STORAGE_SAMPLE_MAX_ERROR for every tenant's share
+storage_usage_mode = os.getenv("STORAGE_USAGE_MODE", "sample")
+storage_sample_max_error = float(os.getenv("STORAGE_SAMPLE_MAX_ERROR", DEFAULT_MAX_ERROR))
+if storage_usage_mode not in STORAGE_USAGE_MODES:
+    raise ValueError(f"STORAGE_USAGE_MODE must be one of {', '.join(STORAGE_USAGE_MODES)}")
 
 def lambda_handler(event, context):
-    try:
-        get_secret_value_response = secrets_manager.get_secret_value(
-            SecretId=secret_name
-    )
-    except Exception as e:
-        # Handle the exception here
-        raise e
-    
-    # Retrieve the secret value from the response
-    secret_value = get_secret_value_response['SecretString']
-    
-    #Assuming the secret value is a JSON string
-    secret_dict = json.loads(secret_value)
-    db_password = secret_dict['password']
+    # The database credentials are cached across invocations of the same Lambda environment.
+    secret_dict = secrets_cache.get_secret_json(secret_name)
     db_host = secret_dict['host']
     db_name = db_name_fromenv
     db_user = secret_dict['username']
     s3_bucket = tenant_usage_bucket
     schema = 'app'
-    print(db_host,db_name,db_user,db_password,s3_bucket)
+    print(db_host,db_name,db_user,s3_bucket)
     date = get_formatted_start_of_day()
     print(date)
     # Connect to the Aurora PostgreSQL database
     try:
-        conn = psycopg.connect(
-            host=db_host,
+        # Rotated credentials are rejected, call_with_secret fetches the secret again and reconnects.
+        conn = secrets_cache.call_with_secret(secret_name, lambda secret: psycopg.connect(
+            host=secret['host'],
             dbname=db_name,
-            user=db_user,
-            password=db_password
-        )
-        # Create a cursor object
-        cur = conn.cursor()
-        
-        # Get the list of tables with the 'tenant_id' column
-        cur.execute("""
-            SELECT relname AS table_name
-            FROM pg_catalog.pg_statio_user_tables
-            WHERE relname IN (
-                SELECT a.table_name
-                FROM information_schema.columns a
-                WHERE a.column_name = 'tenant_id'
-                GROUP BY a.table_name
-            )
-        """)
-        tables = [row[0] for row in cur.fetchall()]
-        
-        # Initialize dictionaries to store the results
+            user=secret['username'],
+            password=secret['password']
+        ))
+        # Estimate each tenant's share of every tenant table, see utils/storage_estimates.py.
         tenant_data_size_portions = defaultdict(float)
         total_tenant_data_sizes = defaultdict(float)
-        
-        # Iterate over the tables
-        for table_name in tables:
-            # Get the table data size and tenant data counts
-            # Suppress Semgrep rule for SQL injection risk: parameters are not user supplied.
-            # nosemgrep sqlalchemy-execute-raw-query
-            cur.execute(f"""
-                WITH tenant_user_size AS (
-                  SELECT
-                  relname AS table_name,
-                  pg_relation_size(relid) AS table_data_size
-                  FROM pg_catalog.pg_statio_user_tables
-                  WHERE relname = '{table_name}'
-                ), tenant_user_counts AS (
-                  SELECT tenant_id, count(*) AS tenant_data_count
-                  FROM {schema}.{table_name}
-                  GROUP BY tenant_id
-                )
-                SELECT
-                  tus.table_name,
-                  tuc.tenant_id,
-                  tuc.tenant_data_count,
-                  tus.table_data_size,
-                  ROUND((tuc.tenant_data_count / table_total_record_count), 2) * (tus.table_data_size) AS tenant_data_size_portion
-                FROM tenant_user_counts tuc
-                CROSS JOIN LATERAL (
-                  SELECT table_data_size, table_name
-                  FROM tenant_user_size
-                ) AS tus
-                CROSS JOIN LATERAL (
-                  SELECT sum((tenant_data_count)) AS table_total_record_count
-                  FROM tenant_user_counts
-                ) AS sum_data
-                WINDOW w AS (PARTITION BY tuc.tenant_id)
-                ORDER BY tuc.tenant_id;
-            """)
-            results = cur.fetchall()
-        
-            # Update the dictionaries with the results
-            for row in results:
-                tenant_id = row[1]
-                print(f'table_name: {row[0]}')
-                print(f'tenant_id: {row[1]}')
-                print(f'tenant_data_count: {row[2]}')
-                print(f'table_data_size: {row[3]}')
-                print(f'tenant_data_size_portion: {row[4]}')
-                tenant_data_size_portion = row[4]
-                tenant_data_size_portions[tenant_id] += float(tenant_data_size_portion)
-                total_tenant_data_sizes[tenant_id] += row[3]
-      
-            # Create the JSON data
-            json_data = []
-            for tenant_id, total_tenant_data_size in total_tenant_data_sizes.items():
-                tenant_data_size_portion_percentage = round((tenant_data_size_portions[tenant_id] / total_tenant_data_size) * 100, 1)
-                json_data.append({
-                    "tenant_id": tenant_id,
-                    "date": date,
-                    "service_name": "AmazonRDS",
-                    "usage_unit": "tenant_data_size",
-                    "tenant_usage": round(tenant_data_size_portions[tenant_id], 1),
-                    "total_usage": round(total_tenant_data_size, 1),
-                    "tenant_percent_usage": round(tenant_data_size_portion_percentage, 1)
-                })
-    
+        with conn.cursor(row_factory=dict_row) as cur:
+            tables = get_tenant_tables(cur, schema)
+            # The storage triggers only exist in the counters mode, nothing else compacts their deltas.
+            seed_all = bool(event and event.get('seed_storage_counters'))
+            for table in tables:
+                trigger_count = get_storage_trigger_count(cur, table)
+                if storage_usage_mode == 'counters':
+                    if seed_all or trigger_count != len(STORAGE_TRIGGERS):
+                        seed_storage_counters(conn, table)
+                elif trigger_count:
+                    drop_storage_counters(conn, table)
+            if storage_usage_mode == 'counters':
+                compact_storage_counters(cur)
+            conn.commit()
+
+            for table in tables:
+                usage, stats = estimate_table_usage(cur, table, storage_usage_mode, storage_sample_max_error)
+                print(stats)
+                table_size = get_table_size(table)
+                for tenant_id, tenant_data_size_portion in get_tenant_table_sizes(table, usage).items():
+                    tenant_data_size_portions[tenant_id] += tenant_data_size_portion
+                    total_tenant_data_sizes[tenant_id] += table_size
+
+        # Each tenant's data size portion is measured against the size of the tables it has data in
+        tenant_ids = list(total_tenant_data_sizes)
+        json_data = apportion_usage(tenant_ids, [date] * len(tenant_ids), [
+            usage_metric("tenant_data_size", [tenant_data_size_portions[tenant_id] for tenant_id in tenant_ids], "AmazonRDS",
+                         totals=[float(total_tenant_data_sizes[tenant_id]) for tenant_id in tenant_ids])
+        ])
+
         # Upload the JSON data to an S3 bucket    
-        tenant_aurora_usage_data = get_line_delimited_json(json_data)
         bucket_name = tenant_usage_bucket
-        s3_key = get_s3_key('fine_grained','product-review-db-storage')
-        response = s3.put_object(Body=str(tenant_aurora_usage_data), Bucket=bucket_name, Key=s3_key)
+        s3_key = write_usage_report(s3, bucket_name, 'fine_grained', 'product-review-db-storage', json_data)['key']
                     
         return {
             'statusCode': 200,
@@ -0,0 +1,83 @@
+import unittest
+import sys
+import os
+import threading
+from datetime import datetime, timedelta
+
+sys.path.append(
+    os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "")))
+
+from utils.pi_collector import (
+    collect_tenant_db_load,
+    fold_metric_list,
+    get_pi_time_windows
+)
+
+
+class StubPiClient:
+    # Returns the same two pages for every window: tenant1 and saasadmin on the first page,
+    # tenant2 on the second page behind a NextToken.
+    def __init__(self):
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def get_resource_metrics(self, **kwargs):
+        with self._lock:
+            self.calls.append(kwargs)
+        if 'NextToken' not in kwargs:
+            return {
+                'MetricList': [
+                    {'Key': {'Metric': 'db.load.avg'}, 'DataPoints': [{'Value': 10.0}]},
+                    {'Key': {'Metric': 'db.load.avg', 'Dimensions': {'db.user.name': 'tenant1'}},
+                     'DataPoints': [{'Value': 0.5}, {'Value': 0.0}, {'Timestamp': 'missing value'}]},
+                    {'Key': {'Metric': 'db.load.avg', 'Dimensions': {'db.user.name': 'saasadmin'}},
+                     'DataPoints': [{'Value': 3.0}]}
+                ],
+                'NextToken': 'page-2'
+            }
+        return {
+            'MetricList': [
+                {'Key': {'Metric': 'db.load.avg', 'Dimensions': {'db.user.name': 'tenant2'}},
+                 'DataPoints': [{'Value': 0.25}, {'Value': 0.25}]}
+            ]
+        }
+
+
+class TestPiCollector(unittest.TestCase):
+
+    def test_get_pi_time_windows(self):
+        start_time = datetime(2024, 7, 3)
+        windows = get_pi_time_windows(start_time, start_time + timedelta(minutes=150), 60)
+        self.assertEqual(len(windows), 3)
+        self.assertEqual(windows[0], (start_time, start_time + timedelta(minutes=60)))
+        self.assertEqual(windows[2], (start_time + timedelta(minutes=120), start_time + timedelta(minutes=150)))
+
+    def test_fold_metric_list_weights_by_period(self):
+        tenant_db_load = fold_metric_list(StubPiClient().get_resource_metrics()['MetricList'], 60, {})
+        self.assertEqual(tenant_db_load, {'tenant1': 30.0})
+
+    def test_collect_tenant_db_load(self):
+        pi_client = StubPiClient()
+        start_time = datetime(2024, 7, 3)
+        tenant_db_load, call_count = collect_tenant_db_load(
+            pi_client, 'RDS', 'db-ABC', start_time, start_time + timedelta(hours=24),
+            period_in_seconds=60, window_minutes=60, max_workers=4)
+
+        # 24 windows, two pages each.
+        self.assertEqual(call_count, 48)
+        self.assertEqual(len(pi_client.calls), 48)
+        self.assertAlmostEqual(tenant_db_load['tenant1'], 24 * 0.5 * 60)
+        self.assertAlmostEqual(tenant_db_load['tenant2'], 24 * 0.5 * 60)
+        self.assertNotIn('saasadmin', tenant_db_load)
+        self.assertTrue(all(call['PeriodInSeconds'] == 60 for call in pi_client.calls))
+        self.assertEqual(sum(1 for call in pi_client.calls if call.get('NextToken') == 'page-2'), 24)
+
+    def test_collect_tenant_db_load_rejects_invalid_period(self):
+        start_time = datetime(2024, 7, 3)
+        with self.assertRaises(ValueError):
+            collect_tenant_db_load(StubPiClient(), 'RDS', 'db-ABC', start_time,
+                                   start_time + timedelta(hours=1), period_in_seconds=30)
+
+
+if __name__ == "__main__":
+    unittest.main()
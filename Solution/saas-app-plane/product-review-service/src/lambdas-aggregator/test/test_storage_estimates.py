@@ -0,0 +1,186 @@
+import unittest
+import random
+import sys
+import os
+
+sys.path.append(
+    os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "")))
+
+from utils.storage_estimates import (
+    STORAGE_TRIGGERS,
+    drop_storage_counters,
+    estimate_table_usage,
+    estimate_tenant_usage,
+    get_sample_percent,
+    get_table_size,
+    get_tenant_table_sizes,
+    seed_storage_counters
+)
+
+TABLE = {'schema_name': 'app', 'table_name': 'product_reviews', 'relid': 1, 'reltuples': 200000.0,
+         'heap_size': 8000, 'toast_size': 1000, 'index_size': 3000}
+
+
+def get_table_blocks(block_count=4000, rows_per_block=50, seed=7):
+    # Tenants write in bursts, so their rows are clustered in blocks like in the pooled table.
+    rand = random.Random(seed)
+    tenants = ['tenant1', 'tenant2', 'tenant3', 'tenant4']
+    weights = [0.5, 0.3, 0.15, 0.05]
+    blocks = []
+    tenant_id = tenants[0]
+    for block in range(block_count):
+        rows = {}
+        for _ in range(rows_per_block):
+            if rand.random() < 0.1:
+                tenant_id = rand.choices(tenants, weights)[0]
+            rows[tenant_id] = rows.get(tenant_id, 0) + 1
+        blocks.append([{'block': block, 'tenant_id': tenant_id, 'row_count': row_count,
+                        'data_bytes': row_count * (100 if tenant_id == 'tenant4' else 60)}
+                       for tenant_id, row_count in rows.items()])
+    return blocks
+
+
+def sample_blocks(blocks, fraction, seed=11):
+    rand = random.Random(seed)
+    return [row for rows in blocks if rand.random() < fraction for row in rows]
+
+
+class FakeCursor:
+    # Answers the sample queries from the blocks, the stats query from stats_row.
+    def __init__(self, blocks, stats_row=None):
+        self.blocks = blocks
+        self.stats_row = stats_row
+        self.sample_percents = []
+        self.rows = []
+
+    def execute(self, query, params=None):
+        if 'pg_stats' in str(query):
+            self.rows = [self.stats_row] if self.stats_row else []
+            return
+        text = repr(query)
+        percent = 100.0
+        if 'tablesample' in text:
+            percent = float(text.split('Literal(')[1].split(')')[0])
+        self.sample_percents.append(percent)
+        self.rows = sample_blocks(self.blocks, percent / 100, seed=len(self.sample_percents))
+
+    def fetchall(self):
+        return self.rows
+
+    def fetchone(self):
+        return self.rows[0] if self.rows else None
+
+
+class FakeConnection:
+    # Keeps the statements of the trigger management as text.
+    def __init__(self):
+        self.statements = []
+        self.transactions = 0
+
+    def transaction(self):
+        self.transactions += 1
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def execute(self, query, params=None):
+        self.statements.append(query if isinstance(query, str) else query.as_string(None))
+
+
+class TestStorageEstimates(unittest.TestCase):
+
+    def test_exact_usage(self):
+        blocks = get_table_blocks(block_count=100)
+        usage, error = estimate_tenant_usage([row for rows in blocks for row in rows], 1.0)
+        self.assertEqual(error, 0.0)
+        self.assertAlmostEqual(sum(shares['row_share'] for shares in usage.values()), 1.0)
+        self.assertAlmostEqual(sum(shares['byte_share'] for shares in usage.values()), 1.0)
+        self.assertEqual(sum(shares['row_count'] for shares in usage.values()), 5000)
+
+    def test_sample_is_within_its_error(self):
+        blocks = get_table_blocks()
+        exact, _ = estimate_tenant_usage([row for rows in blocks for row in rows], 1.0)
+        usage, error = estimate_tenant_usage(sample_blocks(blocks, 0.1), 0.1)
+        self.assertGreater(error, 0.0)
+        self.assertLess(error, 0.1)
+        for tenant_id, shares in exact.items():
+            self.assertLessEqual(abs(usage[tenant_id]['row_share'] - shares['row_share']), error)
+            self.assertLessEqual(abs(usage[tenant_id]['byte_share'] - shares['byte_share']), error)
+
+    def test_empty_sample_has_no_bound(self):
+        self.assertEqual(estimate_tenant_usage([], 0.01), ({}, 1.0))
+        self.assertEqual(estimate_tenant_usage([], 1.0), ({}, 0.0))
+
+    def test_sample_percent(self):
+        # 9604 rows for 1% at 95% confidence.
+        self.assertAlmostEqual(get_sample_percent(960400, 0.01), 1.0)
+        self.assertEqual(get_sample_percent(5000, 0.01), 100.0)
+        self.assertEqual(get_sample_percent(-1, 0.01), 100.0)
+
+    def test_sample_grows_until_error_bound(self):
+        cur = FakeCursor(get_table_blocks())
+        usage, stats = estimate_table_usage(cur, TABLE, 'sample', max_error=0.03)
+        self.assertLessEqual(stats['error'], 0.03)
+        self.assertEqual(cur.sample_percents, sorted(cur.sample_percents))
+        self.assertEqual(stats['attempts'], len(cur.sample_percents))
+        self.assertEqual(set(usage), {'tenant1', 'tenant2', 'tenant3', 'tenant4'})
+
+    def test_exact_mode_scans_table(self):
+        cur = FakeCursor(get_table_blocks(block_count=10))
+        usage, stats = estimate_table_usage(cur, TABLE, 'exact')
+        self.assertEqual((cur.sample_percents, stats['mode'], stats['error']), ([100.0], 'exact', 0.0))
+
+    def test_stats_usage(self):
+        stats_row = {'null_frac': 0.0, 'tenant_ids': ['tenant2', 'tenant1'], 'tenant_freqs': [0.4, 0.6],
+                     'modified_rows': 100, 'analyze_rows': 30000}
+        cur = FakeCursor(get_table_blocks(block_count=10), stats_row)
+        usage, stats = estimate_table_usage(cur, TABLE, 'stats', max_error=0.01)
+        self.assertEqual(stats['mode'], 'stats')
+        self.assertEqual(cur.sample_percents, [])
+        self.assertEqual(list(usage), ['tenant1', 'tenant2'])
+        self.assertAlmostEqual(usage['tenant1']['row_count'], 120000.0)
+
+    def test_stale_stats_fall_back_to_sample(self):
+        stats_row = {'null_frac': 0.0, 'tenant_ids': ['tenant1'], 'tenant_freqs': [0.6],
+                     'modified_rows': 0, 'analyze_rows': 30000}
+        cur = FakeCursor(get_table_blocks(block_count=10), stats_row)
+        usage, stats = estimate_table_usage(cur, TABLE, 'stats', max_error=0.01)
+        self.assertEqual((stats['mode'], stats['fallback']), ('exact', 'error bound'))
+
+    def test_table_sizes_include_toast_and_indexes(self):
+        usage = {'tenant1': {'row_share': 0.5, 'byte_share': 0.25},
+                 'tenant2': {'row_share': 0.5, 'byte_share': 0.75}}
+        sizes = get_tenant_table_sizes(TABLE, usage)
+        self.assertEqual(sizes, {'tenant1': 9000 * 0.25 + 3000 * 0.5, 'tenant2': 9000 * 0.75 + 3000 * 0.5})
+        self.assertEqual(sum(sizes.values()), get_table_size(TABLE))
+
+    def test_seeding_creates_storage_triggers(self):
+        conn = FakeConnection()
+        seed_storage_counters(conn, TABLE)
+        self.assertEqual(conn.transactions, 1)
+        self.assertEqual(conn.statements[0], 'lock table "app"."product_reviews" in share row exclusive mode')
+        created = [statement for statement in conn.statements if statement.startswith('create trigger')]
+        self.assertEqual(len(created), len(STORAGE_TRIGGERS))
+        self.assertIn('create trigger "product_reviews_storage_update" after update on "app"."product_reviews" '
+                      'referencing old table as old_rows new table as new_rows for each statement', created[1])
+        # Triggers of an earlier seed are replaced, existing rows are counted after the triggers exist.
+        self.assertLess(conn.statements.index('drop trigger if exists "product_reviews_storage_insert" '
+                                              'on "app"."product_reviews"'),
+                        conn.statements.index(created[0]))
+        self.assertIn('insert into app.tenant_storage_counters', conn.statements[-1])
+
+    def test_dropping_removes_triggers_and_deltas(self):
+        conn = FakeConnection()
+        drop_storage_counters(conn, TABLE)
+        self.assertEqual(len([statement for statement in conn.statements
+                              if statement.startswith('drop trigger if exists')]), len(STORAGE_TRIGGERS))
+        self.assertIn('delete from app.tenant_storage_deltas where table_name = %s', conn.statements)
+        self.assertFalse(any(statement.startswith('create') for statement in conn.statements))
+
+
+if __name__ == '__main__':
+    unittest.main()
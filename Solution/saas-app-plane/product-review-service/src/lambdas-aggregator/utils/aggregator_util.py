@@ -1,8 +1,43 @@
+import io
+import random
 import time
+import zlib
 from datetime import datetime, timedelta, time as time_obj
 from decimal import *
 import json
 
+# S3 multipart uploads require every part but the last to be at least 5 MiB.
+MIN_MULTIPART_PART_SIZE = 5 * 1024 * 1024
+DEFAULT_PART_SIZE = 8 * 1024 * 1024
+
+
+# Logs Insights query states that are still in progress and the states that ended without results.
+RUNNING_QUERY_STATUSES = ('Scheduled', 'Running')
+FAILED_QUERY_STATUSES = ('Failed', 'Cancelled', 'Timeout')
+INITIAL_POLL_INTERVAL_SECONDS = 0.5
+MAX_POLL_INTERVAL_SECONDS = 8.0
+# Logs Insights returns at most 10,000 rows, a stats query with more groups is silently truncated.
+MAX_QUERY_RESULT_ROWS = 10000
+# Results this close to the cap are treated as truncated too.
+NEAR_RESULT_CAP_RATIO = 0.95
+
+
+def get_poll_delay(attempt, initial_delay=INITIAL_POLL_INTERVAL_SECONDS, max_delay=MAX_POLL_INTERVAL_SECONDS) -> float:
+    # Exponential backoff with jitter, half of the delay is fixed and the other half random so
+    # concurrent pollers spread out without ever polling in a tight loop.
+    delay = min(max_delay, initial_delay * (2 ** attempt))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def is_query_result_truncated(query_results, max_rows=MAX_QUERY_RESULT_ROWS, near_cap_ratio=NEAR_RESULT_CAP_RATIO):
+    # A result can only be missing groups when it is at (or near) the row cap. Every group needs at
+    # least one matched log event, so fewer matched records than the threshold rules it out.
+    threshold = int(max_rows * near_cap_ratio)
+    if len(query_results.get('results', [])) < threshold:
+        return False
+    records_matched = query_results.get('statistics', {}).get('recordsMatched')
+    return records_matched is None or records_matched >= threshold
+
 
 def query_cloudwatch_logs(logs, log_group_name, query_string, start_time, end_time) -> dict:
     query = logs.start_query(logGroupName=log_group_name,
@@ -12,11 +47,16 @@ def query_cloudwatch_logs(logs, log_group_name, query_string, start_time, end_ti
 
     query_results = logs.get_query_results(queryId=query["queryId"])
 
-    while query_results['status'] == 'Running' or query_results['status'] == 'Scheduled':
+    attempt = 0
+    while query_results['status'] in RUNNING_QUERY_STATUSES:
+        # Small queries finish in well under a second, so start polling quickly and back off.
         # nosem
-        time.sleep(5)
+        time.sleep(get_poll_delay(attempt))
+        attempt += 1
         query_results = logs.get_query_results(queryId=query["queryId"])
 
+    if is_query_result_truncated(query_results):
+        print(f"Logs Insights result for {log_group_name} is at the {MAX_QUERY_RESULT_ROWS} row cap and may be truncated")
     return query_results
 
 
@@ -46,9 +86,17 @@ def get_formatted_start_of_day(input_date=None):
     
     return formatted_date
 
-def get_s3_key(prefix, service):
-    # Get the current date and time.
-    now = datetime.now()
+def get_day_start_end_date_time(report_date):
+    # Epochs of the start of report_date and of the next day, in the same time zone as
+    # get_start_date_time and get_end_date_time.
+    time_zone = datetime.now().astimezone().tzinfo
+    start_of_day = datetime(report_date.year, report_date.month, report_date.day, tzinfo=time_zone)
+    return int(start_of_day.timestamp()), int((start_of_day + timedelta(days=1)).timestamp())
+
+
+def get_s3_key(prefix, service, extension='.json', report_date=None):
+    # Reports are keyed by the day they cover, which is today unless a report_date is given.
+    now = report_date if report_date is not None else datetime.now()
 
     # Format strings for year, month, and current date.
     year = now.strftime('%Y')  # Current year like '2024'.
@@ -56,16 +104,102 @@ def get_s3_key(prefix, service):
     current_date = now.strftime('%m-%d-%Y')  # Current date like '07-30-2024'.
 
     # Format the key with the current year, month, and date
-    key = prefix + '/year={}/month={}/{}-usage_by_tenant-{}.json'.format(year, month, service, current_date)
+    key = prefix + '/year={}/month={}/{}-usage_by_tenant-{}{}'.format(year, month, service, current_date, extension)
     return key
 
 
 def get_line_delimited_json(data):
-    # Initialize an empty string to hold all JSON strings.
-    line_delimited_json = ""
-
-    # Loop through each dictionary in the list, convert it to a JSON string, and append it to the string with a newline.
-    for item in data:
-        line_delimited_json += json.dumps(item) + "\n"
-
-    return line_delimited_json
+    # Serialize each dictionary to a JSON string and join them with newlines in a single pass.
+    return "".join(json.dumps(item) + "\n" for item in data)
+
+
+class StreamingNdjsonWriter:
+    # Streams usage records to S3 as line delimited JSON. Records are serialized into a buffer that
+    # is reused for every part, once the buffer passes part_size it is uploaded as a multipart
+    # upload part so the whole report never has to be held in memory. Reports smaller than one
+    # part are uploaded with a single put_object.
+    def __init__(self, s3, bucket, key, part_size=DEFAULT_PART_SIZE, gzip_output=False):
+        if part_size < MIN_MULTIPART_PART_SIZE:
+            raise ValueError(f"part_size must be at least {MIN_MULTIPART_PART_SIZE} bytes: {part_size}")
+        self.s3 = s3
+        self.bucket = bucket
+        self.key = key
+        self.part_size = part_size
+        self.buffer = io.BytesIO()
+        # wbits=31 writes a gzip container instead of a raw zlib stream.
+        self.compressor = zlib.compressobj(wbits=31) if gzip_output else None
+        self.upload_id = None
+        self.parts = []
+        self.records_written = 0
+        self.bytes_written = 0
+        self.bytes_uploaded = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def write(self, record):
+        data = (json.dumps(record) + "\n").encode('utf-8')
+        self.records_written += 1
+        self.bytes_written += len(data)
+        if self.compressor is not None:
+            data = self.compressor.compress(data)
+        self.buffer.write(data)
+        if self.buffer.tell() >= self.part_size:
+            self._upload_part()
+
+    def write_all(self, records):
+        for record in records:
+            self.write(record)
+
+    def _upload_part(self):
+        if self.upload_id is None:
+            response = self.s3.create_multipart_upload(Bucket=self.bucket, Key=self.key)
+            self.upload_id = response['UploadId']
+        body = self.buffer.getvalue()
+        part_number = len(self.parts) + 1
+        response = self.s3.upload_part(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+                                       PartNumber=part_number, Body=body)
+        self.parts.append({'ETag': response['ETag'], 'PartNumber': part_number})
+        self.bytes_uploaded += len(body)
+        self.buffer.seek(0)
+        self.buffer.truncate()
+
+    def close(self) -> dict:
+        if self.compressor is not None:
+            self.buffer.write(self.compressor.flush())
+        if self.upload_id is None:
+            body = self.buffer.getvalue()
+            self.s3.put_object(Body=body, Bucket=self.bucket, Key=self.key)
+            self.bytes_uploaded += len(body)
+        else:
+            if self.buffer.tell() > 0:
+                self._upload_part()
+            self.s3.complete_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+                                              MultipartUpload={'Parts': self.parts})
+        return self.get_stats()
+
+    def abort(self):
+        if self.upload_id is not None:
+            self.s3.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id)
+
+    def get_stats(self) -> dict:
+        return {'records_written': self.records_written, 'bytes_written': self.bytes_written,
+                'bytes_uploaded': self.bytes_uploaded, 'parts': len(self.parts)}
+
+
+def write_line_delimited_json(s3, bucket, key, records, gzip_output=False, part_size=DEFAULT_PART_SIZE) -> dict:
+    # Stream an iterable of usage records to s3://bucket/key and return the bytes and records written.
+    if gzip_output and not key.endswith('.gz'):
+        key += '.gz'
+    with StreamingNdjsonWriter(s3, bucket, key, part_size=part_size, gzip_output=gzip_output) as writer:
+        writer.write_all(records)
+    stats = writer.get_stats()
+    stats['key'] = key
+    print(f"Uploaded s3://{bucket}/{key}: {stats}")
+    return stats
@@ -0,0 +1,41 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+# Database settings shared by the tenant connection pools of the Flask service (global_db_pool, psycopg2)
+# and of the ASGI service (async_db_pool, psycopg), so neither imports the other's driver.
+
+import os
+import boto3
+
+from secrets_cache import get_secrets_cache_from_env
+
+secrets_manager = boto3.client('secretsmanager', region_name=os.environ['AWS_REGION'])
+# Tenant credentials are fetched once per SECRETS_CACHE_TTL_SECONDS instead of on every pool creation.
+secrets_cache = get_secrets_cache_from_env(secrets_manager)
+database = os.environ['DATABASE_NAME']
+
+# Every tenant pool can open up to DB_POOL_MAX_CONNECTIONS_PER_TENANT connections and all pools together stay within
+# DB_POOL_MAX_CONNECTIONS, pools idle for DB_POOL_IDLE_TTL_SECONDS are closed.
+DEFAULT_MAX_CONNECTIONS = 100
+DEFAULT_MIN_CONNECTIONS_PER_TENANT = 1
+DEFAULT_MAX_CONNECTIONS_PER_TENANT = 5
+DEFAULT_IDLE_TTL_SECONDS = 300
+
+
+class ConnectionBudgetExhausted(Exception):
+    pass
+
+
+def get_pool_manager_settings_from_env() -> dict:
+    # Keyword arguments of TenantPoolManager and AsyncTenantPoolManager.
+    return {
+        'max_connections': int(os.getenv("DB_POOL_MAX_CONNECTIONS", DEFAULT_MAX_CONNECTIONS)),
+        'max_connections_per_tenant': int(os.getenv("DB_POOL_MAX_CONNECTIONS_PER_TENANT",
+                                                    DEFAULT_MAX_CONNECTIONS_PER_TENANT)),
+        'idle_ttl_seconds': int(os.getenv("DB_POOL_IDLE_TTL_SECONDS", DEFAULT_IDLE_TTL_SECONDS))
+    }
+
+
+def get_min_connections_per_tenant(max_connections_per_tenant) -> int:
+    return min(int(os.getenv("DB_POOL_MIN_CONNECTIONS_PER_TENANT", DEFAULT_MIN_CONNECTIONS_PER_TENANT)),
+               max_connections_per_tenant)
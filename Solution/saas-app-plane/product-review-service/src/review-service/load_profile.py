@@ -0,0 +1,166 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+# Synthetic database load for the review service. The lab needs skewed, per-tenant DB load so that
+# Performance Insights and pg_stat_statements have something to attribute, but production requests
+# should only run their own queries. LOAD_PROFILE selects one of:
+#
+#   production  no injected load (default)
+#   synthetic   before its query, every request runs the extra work configured for its tenant
+#
+# The synthetic work is configured with LOAD_PROFILE_CONFIG, a JSON document such as
+#
+#   {"default": {"db_sleep_seconds": 1, "hold_seconds": 1},
+#    "tenants": {"tenant-a": {"db_cpu_rows": 2000000}, "tenant-b": {"db_io_rows": 500000, "db_sleep_seconds": 0}}}
+#
+# where a tenant's settings override the default ones:
+#
+#   db_sleep_seconds  pg_sleep on the tenant's connection, DB time spent waiting
+#   db_cpu_rows       md5 over a generate_series of that many rows, DB CPU
+#   db_io_rows        sort of that many rows with a small work_mem, so it spills to temp files, DB IO
+#   hold_seconds      time add and update hold their transaction open in the application before commit
+#
+# Without LOAD_PROFILE_CONFIG the synthetic profile reproduces the load the service used to hard-code:
+# pg_sleep(1) before every query, and one more second before add and update commit.
+
+import asyncio
+import json
+import os
+import threading
+import time
+
+PRODUCTION_PROFILE = 'production'
+SYNTHETIC_PROFILE = 'synthetic'
+DEFAULT_SYNTHETIC_LOAD = {'db_sleep_seconds': 1, 'hold_seconds': 1}
+LOAD_SETTINGS = ('db_sleep_seconds', 'db_cpu_rows', 'db_io_rows', 'hold_seconds')
+# work_mem of the IO statement, small enough that sorting a few thousand rows spills to disk.
+IO_WORK_MEM = '64kB'
+
+
+class TenantLoad:
+    def __init__(self, db_sleep_seconds=0, db_cpu_rows=0, db_io_rows=0, hold_seconds=0):
+        self.db_sleep_seconds = db_sleep_seconds
+        self.db_cpu_rows = db_cpu_rows
+        self.db_io_rows = db_io_rows
+        self.hold_seconds = hold_seconds
+
+    def get_statements(self):
+        # (sql, params) to run on the tenant's connection before its query, with the %s placeholders
+        # psycopg2 and psycopg both understand.
+        statements = []
+        if self.db_sleep_seconds > 0:
+            statements.append(("SELECT pg_sleep(%s)", (self.db_sleep_seconds,)))
+        if self.db_cpu_rows > 0:
+            statements.append(("SELECT count(*) FROM generate_series(1, %s) AS s(i) WHERE left(md5(i::text), 1) = 'a'",
+                               (self.db_cpu_rows,)))
+        if self.db_io_rows > 0:
+            statements.append((f"SET LOCAL work_mem = '{IO_WORK_MEM}'", None))
+            statements.append(("SELECT count(*) FROM (SELECT md5(i::text) AS h FROM generate_series(1, %s) AS s(i) "
+                               "ORDER BY h) AS sorted", (self.db_io_rows,)))
+            statements.append(("RESET work_mem", None))
+        return statements
+
+    def is_empty(self):
+        return not (self.db_sleep_seconds > 0 or self.db_cpu_rows > 0 or self.db_io_rows > 0 or self.hold_seconds > 0)
+
+
+def get_tenant_load(settings) -> TenantLoad:
+    unknown_settings = set(settings) - set(LOAD_SETTINGS)
+    if unknown_settings:
+        raise ValueError(f"Unknown load settings: {', '.join(sorted(unknown_settings))}")
+    for name, value in settings.items():
+        if not isinstance(value, (int, float)) or value < 0:
+            raise ValueError(f"{name} must be a non negative number")
+    return TenantLoad(
+        db_sleep_seconds=settings.get('db_sleep_seconds', 0),
+        db_cpu_rows=int(settings.get('db_cpu_rows', 0)),
+        db_io_rows=int(settings.get('db_io_rows', 0)),
+        hold_seconds=settings.get('hold_seconds', 0)
+    )
+
+
+class LoadProfile:
+    def __init__(self, name=PRODUCTION_PROFILE, config=None):
+        if name not in (PRODUCTION_PROFILE, SYNTHETIC_PROFILE):
+            raise ValueError(f"Unknown load profile {name}, expected {PRODUCTION_PROFILE} or {SYNTHETIC_PROFILE}")
+        self.name = name
+        config = config or {}
+        default_settings = config.get('default', DEFAULT_SYNTHETIC_LOAD)
+        self.default_load = get_tenant_load(default_settings)
+        self.tenant_loads = {tenant_id: get_tenant_load({**default_settings, **settings})
+                             for tenant_id, settings in config.get('tenants', {}).items()}
+        self.lock = threading.Lock()
+        # tenant_id -> {'requests': ..., 'db_seconds': ..., 'hold_seconds': ...} of the injected load
+        self.stats = {}
+
+    def get_tenant_load(self, tenant_id):
+        # None when nothing is injected for the tenant, which keeps the production path free of any extra work.
+        if self.name == PRODUCTION_PROFILE:
+            return None
+        tenant_load = self.tenant_loads.get(tenant_id, self.default_load)
+        return None if tenant_load.is_empty() else tenant_load
+
+    def record_db_load(self, tenant_id, seconds):
+        with self.lock:
+            tenant_stats = self._get_tenant_stats(tenant_id)
+            tenant_stats['requests'] += 1
+            tenant_stats['db_seconds'] += seconds
+
+    def record_hold(self, tenant_id, seconds):
+        with self.lock:
+            self._get_tenant_stats(tenant_id)['hold_seconds'] += seconds
+
+    def _get_tenant_stats(self, tenant_id):
+        return self.stats.setdefault(tenant_id, {'requests': 0, 'db_seconds': 0.0, 'hold_seconds': 0.0})
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            return {'profile': self.name,
+                    'tenants': {tenant_id: dict(tenant_stats) for tenant_id, tenant_stats in self.stats.items()}}
+
+
+def get_load_profile_from_env() -> LoadProfile:
+    config = os.getenv("LOAD_PROFILE_CONFIG")
+    return LoadProfile(os.getenv("LOAD_PROFILE", PRODUCTION_PROFILE), json.loads(config) if config else None)
+
+
+load_profile = get_load_profile_from_env()
+
+
+def inject_db_load(cursor, tenant_id):
+    # Runs the tenant's synthetic DB work on cursor, before the request's own query.
+    tenant_load = load_profile.get_tenant_load(tenant_id)
+    if tenant_load is None:
+        return
+    start_time = time.perf_counter()
+    for sql, params in tenant_load.get_statements():
+        cursor.execute(sql, params)
+    load_profile.record_db_load(tenant_id, time.perf_counter() - start_time)
+
+
+def hold_transaction(tenant_id):
+    # Keeps the write transaction (and its connection) open for the tenant's hold_seconds.
+    tenant_load = load_profile.get_tenant_load(tenant_id)
+    if tenant_load is None or tenant_load.hold_seconds == 0:
+        return
+    # nosemgrep allow sleep
+    time.sleep(tenant_load.hold_seconds)
+    load_profile.record_hold(tenant_id, tenant_load.hold_seconds)
+
+
+async def inject_db_load_async(cursor, tenant_id):
+    tenant_load = load_profile.get_tenant_load(tenant_id)
+    if tenant_load is None:
+        return
+    start_time = time.perf_counter()
+    for sql, params in tenant_load.get_statements():
+        await cursor.execute(sql, params)
+    load_profile.record_db_load(tenant_id, time.perf_counter() - start_time)
+
+
+async def hold_transaction_async(tenant_id):
+    tenant_load = load_profile.get_tenant_load(tenant_id)
+    if tenant_load is None or tenant_load.hold_seconds == 0:
+        return
+    await asyncio.sleep(tenant_load.hold_seconds)
+    load_profile.record_hold(tenant_id, tenant_load.hold_seconds)
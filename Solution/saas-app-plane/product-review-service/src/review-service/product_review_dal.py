@@ -3,133 +3,167 @@
 import sys, os
 from flask import jsonify
 import psycopg2
+from psycopg2.extras import execute_values
 import json
 from utils import DatabaseError
-from typing import List
+from typing import Iterator
 from product_review_model import Reviews
-from product_review_logger import create_emf_log
+from product_review_logger import record_metric
+from review_pagination import ReviewsPageRequest, FETCH_SIZE, build_reviews_query, get_page_count, to_review
+from load_profile import inject_db_load, hold_transaction
+from review_cache import review_cache
+from review_batch import ReviewBatch, INSERT_REVIEW_SQL, INSERT_REVIEWS_SQL, get_database_error, get_pages, to_row
 import global_db_pool
-import time
 
 class ProductReviewRepository():
     def __init__(self, logger) -> None:
         self.logger = logger
         
-    async def get_reviews(self, tenant_id: str) -> List[dict]:
+    def iter_reviews(self, tenant_id: str, page: ReviewsPageRequest) -> Iterator[dict]:
+        # Yields one page of reviews (plus one row to detect the next page), or every review when the client
+        # does not page, from a server side cursor, so the rows are fetched FETCH_SIZE at a time while the
+        # response is written instead of all at once.
+        # The connection is held until the generator is exhausted or closed.
         self.logger.info(f"Fetching reviews for tenant with connection pool {tenant_id}")
-        connection_pool = None
+        connection_pool, db_conn = global_db_pool.get_db_connection(tenant_id, self.logger)
+        number_of_reviews = 0
         try:
-            connection_pool =  global_db_pool.get_or_create_db_pool(tenant_id, self.logger)
-            db_conn=connection_pool.getconn()
             cursor = db_conn.cursor()
             # set role not required as we have connection pool per tenant model
             # cursor.execute("SET role = %s", (str(tenant_id),))
-            self.logger.info("Thread going to sleep for 1 second so to generate good data for db load")
-            cursor.execute("SELECT pg_sleep(1)")
-            cursor.execute("SELECT * FROM app.product_reviews")
-            results = cursor.fetchall()
-            
-            reviews = []
-            for row in results:
-                review = {
-                    'review_id': row[0],
-                    'product_id': row[1],
-                    'order_id': row[2],
-                    'rating': row[3],
-                    'review_description': row[4],
-                    'tenant_id': row[5],
-                    'review_date': row[6]
-                }
-                reviews.append(review)
-            
-            number_of_reviews = len(reviews)
-            await create_emf_log(tenant_id, "ReviewsFetched", number_of_reviews, "Count")            
-            self.logger.info(f"Total reviews fetched: {number_of_reviews}")
-            return reviews
-        except Exception as e:
-            return e
+            inject_db_load(cursor, tenant_id)
+            sql, params = build_reviews_query(tenant_id, page)
+            # A named cursor is a server side cursor, it lives in the transaction opened by this query.
+            with db_conn.cursor(name="product_reviews_page") as reviews_cursor:
+                reviews_cursor.itersize = FETCH_SIZE
+                reviews_cursor.execute(sql, params)
+                for row in reviews_cursor:
+                    number_of_reviews += 1
+                    yield to_review(row)
+            db_conn.commit()
         finally:
-            if connection_pool is not None: connection_pool.putconn(db_conn)
-            
-    
-    async def add_review(self, review):
+            connection_pool.putconn(db_conn)
+            record_metric(tenant_id, "ReviewsFetched", get_page_count(number_of_reviews, page), "Count")
+            self.logger.info(f"Total reviews fetched: {get_page_count(number_of_reviews, page)}")
+
+    def add_review(self, review):
         json_reviews = json.loads(review)
         self.logger.info(f"Adding review {json_reviews['review_id']} for tenant {json_reviews['tenant_id']}")
         connection_pool = None
         try:
-            connection_pool =  global_db_pool.get_or_create_db_pool(json_reviews['tenant_id'], self.logger)
-            db_conn=connection_pool.getconn()
+            connection_pool, db_conn = global_db_pool.get_db_connection(json_reviews['tenant_id'], self.logger)
             cursor = db_conn.cursor()
             # set role not required as we have connection pool per tenant model
             # cursor.execute("SET role = %s", (str(json_reviews['tenant_id']),))
-            self.logger.info("Thread going to sleep for 1 second so to generate good data for db load")
-            cursor.execute("SELECT pg_sleep(1)")
+            inject_db_load(cursor, json_reviews['tenant_id'])
             cursor.execute("INSERT INTO app.product_reviews (review_id, product_id, order_id, rating, review_description, tenant_id) VALUES (%s, %s, %s, %s, %s, %s)", 
                 (json_reviews['review_id'], json_reviews['product_id'], json_reviews['order_id'], json_reviews['rating'], json_reviews['review_description'], json_reviews['tenant_id']))
             recordsAdded = cursor.rowcount
-            # nosemgrep allow sleep
-            time.sleep(1)  # This will make the thread wait for 1 second
+            hold_transaction(json_reviews['tenant_id'])
             db_conn.commit()
+            review_cache.invalidate(json_reviews['tenant_id'])
             response = {
                 "RecordsAdded": recordsAdded
             }
             self.logger.info(f"Added {response['RecordsAdded']} review record: {json_reviews['review_id']} for tenant {json_reviews['tenant_id']}")
-            await create_emf_log(json_reviews['tenant_id'], "ReviewsAdded", 1, "Count")
+            record_metric(json_reviews['tenant_id'], "ReviewsAdded", 1, "Count")
             return response["RecordsAdded"]
         except Exception as e:
             return e       
         finally:
             if connection_pool is not None: connection_pool.putconn(db_conn)
 
+
+    def add_reviews(self, tenant_id: str, batch: ReviewBatch, reviews) -> int:
+        # Inserts the (index, review) pairs of a batch in one transaction with multi-row INSERTs. COPY is not
+        # used because Postgres does not allow COPY FROM into a table with row level security.
+        # A page that the database rejects is rolled back to its savepoint and retried row by row, so only
+        # the offending rows are reported in the batch.
+        self.logger.info(f"Adding batch of reviews for tenant {tenant_id}")
+        connection_pool, db_conn = global_db_pool.get_db_connection(tenant_id, self.logger)
+        try:
+            cursor = db_conn.cursor()
+            inject_db_load(cursor, tenant_id)
+            for page in get_pages(reviews):
+                cursor.execute("SAVEPOINT review_page")
+                try:
+                    execute_values(cursor, INSERT_REVIEWS_SQL, [to_row(review) for index, review in page],
+                                   page_size=len(page))
+                    cursor.execute("RELEASE SAVEPOINT review_page")
+                    batch.add_inserted(page)
+                except psycopg2.Error:
+                    cursor.execute("ROLLBACK TO SAVEPOINT review_page")
+                    self._add_rows(cursor, batch, page)
+            hold_transaction(tenant_id)
+            db_conn.commit()
+            review_cache.invalidate(tenant_id)
+        except Exception:
+            db_conn.rollback()
+            raise
+        finally:
+            connection_pool.putconn(db_conn)
+        records_added = len(batch.inserted)
+        self.logger.info(f"Added {records_added} of {batch.received} review records for tenant {tenant_id}")
+        # One metric for the whole batch instead of one per review.
+        record_metric(tenant_id, "ReviewsAdded", records_added, "Count")
+        return records_added
+
+    def _add_rows(self, cursor, batch, page):
+        for index, review in page:
+            cursor.execute("SAVEPOINT review_row")
+            try:
+                cursor.execute(INSERT_REVIEW_SQL, to_row(review))
+                cursor.execute("RELEASE SAVEPOINT review_row")
+                batch.add_inserted([(index, review)])
+            except psycopg2.Error as error:
+                cursor.execute("ROLLBACK TO SAVEPOINT review_row")
+                batch.add_error(index, get_database_error(error))
     
-    async def update_review(self, review:Reviews):
+    def update_review(self, review:Reviews):
         connection_pool = None
         self.logger.info(review.review_id)
         self.logger.info(f"Updating review {review.review_id} for tenant {review.tenant_id}")
         try:
-            connection_pool =  global_db_pool.get_or_create_db_pool(review.tenant_id, self.logger)
-            db_conn=connection_pool.getconn()
+            connection_pool, db_conn = global_db_pool.get_db_connection(review.tenant_id, self.logger)
             cursor = db_conn.cursor()
             # set role not required as we have connection pool per tenant model
             # cursor.execute("SET role = %s", (str(review.tenant_id),))
-            self.logger.info("Thread going to sleep for 1 second so to generate good data for db load")
-            cursor.execute("SELECT pg_sleep(1)")
+            inject_db_load(cursor, review.tenant_id)
             cursor.execute("UPDATE app.product_reviews SET rating = %s, review_description = %s WHERE review_id = %s AND tenant_id = %s",
                 (review.rating, review.review_description, review.review_id, review.tenant_id))
             recordsUpdated = cursor.rowcount
-            # nosemgrep allow sleep
-            time.sleep(1)  # This will make the thread wait for 1 second
+            hold_transaction(review.tenant_id)
             db_conn.commit()
+            review_cache.invalidate(review.tenant_id)
             response = {
                 "recordsUpdated": recordsUpdated
             }
             logger.info(f"Updated {response['recordsUpdated']} review record: {review.review_id} for tenant {review.tenant_id}")
-            await create_emf_log(review.tenant_id, "ReviewsUpdated", 1, "Count")
+            record_metric(review.tenant_id, "ReviewsUpdated", 1, "Count")
             return response["recordsUpdated"]
         except Exception as e:
             return e
         finally:
             if connection_pool is not None: connection_pool.putconn(db_conn)
                 
-    async def delete_review(self, review_id, tenant_id):
+    def delete_review(self, review_id, tenant_id):
         connection_pool = None
         try:
             self.logger.info(f"Deleting review {review_id} for tenant {tenant_id}")
-            connection_pool =  global_db_pool.get_or_create_db_pool(tenant_id, self.logger)
-            db_conn=connection_pool.getconn()
+            connection_pool, db_conn = global_db_pool.get_db_connection(tenant_id, self.logger)
             cursor = db_conn.cursor()
             # set role not required as we have connection pool per tenant model
             # cursor.execute("SET role = %s", (str(tenant_id),))
-            self.logger.info("Thread going to sleep for 1 second so to generate good data for db load")
-            cursor.execute("SELECT pg_sleep(1)")
+            inject_db_load(cursor, tenant_id)
             cursor.execute("DELETE FROM app.product_reviews WHERE review_id = %s AND tenant_id = %s", (review_id, tenant_id))
             recordsDeleted = cursor.rowcount
             db_conn.commit()
+            review_cache.invalidate(tenant_id)
             response = {
                 "recordsDeleted": recordsDeleted
             }
             self.logger.info(f"Deleted {response['recordsDeleted']} review record for tenant {tenant_id}")
-            await create_emf_log(tenant_id, "ReviewsDeleted", 1, "Count")
+            record_metric(tenant_id, "ReviewsDeleted", 1, "Count")
             return response["recordsDeleted"]
         except Exception as e:
             return e
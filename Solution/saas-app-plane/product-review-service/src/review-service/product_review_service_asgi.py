@@ -0,0 +1,250 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+# ASGI variant of product_review_service.py with the same routes and responses. Quart keeps the Flask
+# API, but handlers are coroutines running on one event loop and the repository uses psycopg async
+# connections, so a task can serve many concurrent tenants without a thread per request.
+# Run it with: python product_review_service_asgi.py (served by Hypercorn on port 80).
+
+from quart import Quart, Response, jsonify, request
+import uuid
+import io
+import os
+import logging
+import asyncio
+import time
+
+from product_review_async_dal import AsyncProductReviewRepository
+from product_review_logger import record_metric, metrics_aggregator
+from product_review_model import Reviews
+from utils import DatabaseError
+from review_pagination import InvalidPageRequest, parse_page_request, astream_reviews_page
+from review_batch import InvalidBatchRequest, ReviewBatch, get_batch_items
+from load_profile import load_profile
+from review_cache import review_cache
+from tenant_auth import InvalidToken, get_tenant_context_async, get_tenant_id, token_verifier
+import async_db_pool
+
+app = Quart(__name__)
+
+app.logger.setLevel(logging.DEBUG)
+app.logger.info("Starting async Review Service with connection pool per tenant")
+
+@app.before_request
+async def authenticate():
+    # Verifies the bearer token (cached per token until it expires) and puts the tenant on the request.
+    try:
+        request.tenant_context = await get_tenant_context_async(request.headers)
+    except InvalidToken as error:
+        app.logger.error(f"Rejected token: {error}")
+        return jsonify({"error": "Unauthorized"}), 401
+
+@app.after_serving
+async def close_db_pools():
+    await async_db_pool.async_pool_manager.close_all()
+    metrics_aggregator.close()
+
+@app.route('/')
+async def home():
+    return "Welcome to ProductService!!"
+
+@app.route('/health', methods=['GET'])
+async def health_check():
+    health_status = {
+        'status': 'UP',
+        'details': 'Application is running smoothly!!',
+        'connection_pools': async_db_pool.get_pool_stats(),
+        'load_profile': load_profile.get_stats(),
+        'review_cache': review_cache.get_stats(),
+        'metrics': metrics_aggregator.get_stats(),
+        'tenant_auth': token_verifier.get_stats()
+    }
+    return jsonify(health_status)
+
+@app.route('/productreview', methods=['GET'])
+async def get_reviews():
+    start_time = time.time()
+    tenant_id = get_tenant_id(request)
+
+    if tenant_id is None:
+        app.logger.error("Tenant ID not found")
+        return "error"
+    try:
+        page = parse_page_request(request.args)
+    except InvalidPageRequest as error:
+        return jsonify({"error": str(error)}), 400
+    app.logger.info(f"Retrieving reviews for tenant: {tenant_id}")
+    body, generation = await review_cache.get_page_async(tenant_id, page)
+    if body is not None:
+        app.logger.info(f"Serving reviews for tenant {tenant_id} from cache")
+        record_metric(tenant_id, "ReviewsCacheHits", 1, "Count")
+        execution_time = time.time() - start_time
+        record_metric(tenant_id, "ExecutionTime", execution_time, "Seconds")
+        return Response(body, mimetype='application/json')
+    try:
+        repo = AsyncProductReviewRepository(app.logger)
+        reviews = repo.iter_reviews(tenant_id, page)
+        # Read the first row before responding, so connection and query errors are still returned as an error.
+        first_review = await anext(reviews, None)
+    except Exception as e:
+        app.logger.error(f"Error retrieving reviews: {e}")
+        return jsonify({"error": str(e)})
+
+    async def generate():
+        chunks = []
+        try:
+            async for chunk in astream_reviews_page(first_review, reviews, page.limit, app.json.dumps):
+                chunks.append(chunk)
+                yield chunk.encode()
+            await review_cache.put_page_async(tenant_id, generation, page, ''.join(chunks))
+            execution_time = time.time() - start_time
+            record_metric(tenant_id, "ExecutionTime", execution_time, "Seconds")
+        except Exception as e:
+            # The response has started, the client sees a truncated body.
+            app.logger.error(f"Error streaming reviews for tenant {tenant_id}: {e}")
+        finally:
+            # Releases the connection when the page ends before the cursor does.
+            await reviews.aclose()
+
+    return Response(generate(), mimetype='application/json')
+
+@app.route('/productreview', methods=['POST'])
+async def add_review():
+    start_time = time.time()
+    tenant_id = get_tenant_id(request)
+
+    if tenant_id is None:
+        app.logger.error("Tenant ID not found")
+        return "Tenant ID not found"
+    data = await request.get_json()
+    if not data:
+        app.logger.error("Invalid request data")
+        return "Invalid request data"
+
+    # Validate input data
+    product_id = data["product_id"]
+    order_id = data["order_id"]
+    rating = data["rating"]
+    review_description = data["review_description"]
+
+    if not all([product_id, order_id, rating, review_description]):
+        return "Missing required fields"
+    review_id = str(uuid.uuid4())
+    try:
+        review = Reviews(review_id, product_id, order_id, rating, review_description, tenant_id)
+        app.logger.info(f"Preparing to add review for tenant: {tenant_id}")
+        response = await AsyncProductReviewRepository(app.logger).add_review(review)
+        app.logger.info(f"response:{response} ")
+
+        if response:
+            app.logger.info(f"Review {review_id} added successfully for tenant: {tenant_id}")
+            execution_time = time.time() - start_time
+            record_metric(tenant_id, "ExecutionTime", execution_time, "Seconds")
+            return jsonify({"message": f"{response} Review added successfully"})
+        else:
+            app.logger.error(f"Error in add_review : 0 review added for tenant: {tenant_id}")
+            return jsonify({"error": f"Error adding review: {response} records added"}), 500
+    except DatabaseError as error:
+        return jsonify({"error": error.error_message })
+    except Exception as e:
+        app.logger.error(f"Error in add_review while adding {review_id} for tenant: {tenant_id}: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/productreview/batch', methods=['POST'])
+async def add_reviews_batch():
+    start_time = time.time()
+    tenant_id = get_tenant_id(request)
+    if tenant_id is None:
+        app.logger.error("Tenant ID not found")
+        return jsonify({"error": "Tenant ID not found"}), 401
+
+    batch = ReviewBatch(tenant_id)
+    try:
+        # The body is read before parsing (up to MAX_CONTENT_LENGTH), unlike the Flask service which streams it.
+        items = get_batch_items(request.mimetype, io.BytesIO(await request.get_data()))
+        await AsyncProductReviewRepository(app.logger).add_reviews(tenant_id, batch, batch.get_reviews(items))
+    except InvalidBatchRequest as error:
+        app.logger.error(f"Invalid review batch for tenant {tenant_id}: {error}")
+        return jsonify({"error": str(error)}), 400
+    except Exception as e:
+        app.logger.error(f"Error in add_reviews_batch for tenant: {tenant_id}: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+    app.logger.info(f"Added {len(batch.inserted)} of {batch.received} reviews for tenant: {tenant_id}")
+    execution_time = time.time() - start_time
+    record_metric(tenant_id, "ExecutionTime", execution_time, "Seconds")
+    return jsonify(batch.get_response())
+
+@app.route('/productreview/<review_id>', methods=['PUT'])
+async def update_review(review_id):
+    start_time = time.time()
+    tenant_id = get_tenant_id(request)
+    if tenant_id is None:
+        app.logger.error("Tenant ID not found")
+        return jsonify({"error": "Tenant ID not found"})
+
+    app.logger.info(f"Preparing to update review {review_id} for tenant: {tenant_id}")
+    data = await request.get_json()
+
+    required_keys = {"product_id", "order_id", "rating", "review_description"}
+    missing_keys = required_keys - set(data.keys())
+    if missing_keys:
+        error_msg = f"Missing required fields or No valid fields provided for update: {', '.join(missing_keys)}"
+        app.logger.error(error_msg)
+        return jsonify({"error": error_msg})
+
+    try:
+        review = Reviews(review_id, data.get("product_id"), data.get("order_id"), data.get("rating"),
+                         data.get("review_description"), tenant_id=tenant_id)
+        response = await AsyncProductReviewRepository(app.logger).update_review(review)
+        app.logger.info(f"response:{response} ")
+        if response:
+            app.logger.info(f"Review {review_id} updated for tenant: {tenant_id}")
+            execution_time = time.time() - start_time
+            record_metric(tenant_id, "ExecutionTime", execution_time, "Seconds")
+            return jsonify({"message": f"{response} Review updated successfully"})
+        else:
+            app.logger.error(f"Error updating review {review_id} for tenant: {tenant_id}")
+            return jsonify({"error": f"{response} reviews updated"})
+    except DatabaseError as error:
+        return jsonify({"error": error.error_message })
+    except Exception as e:
+        app.logger.error(f"Error updating review {review_id}: {str(e)}")
+        return jsonify({"Error": "Error updating review"})
+
+@app.route('/productreview/<review_id>', methods=['DELETE'])
+async def delete_review(review_id):
+    start_time = time.time()
+    tenant_id = get_tenant_id(request)
+    if tenant_id is None:
+        app.logger.error("Tenant ID not found")
+        return "Tenant ID not found"
+
+    app.logger.info(f"Preparing to delete review {review_id} for tenant: {tenant_id}")
+    try:
+        reviews_response = await AsyncProductReviewRepository(app.logger).delete_review(review_id, tenant_id)
+        app.logger.info(f"response:{reviews_response}")
+        if not reviews_response:
+            app.logger.error(f"Error deleting review {review_id} for tenant: {tenant_id}")
+            return jsonify({"error": f"{reviews_response} Review deleted.Error deleting review"})
+        execution_time = time.time() - start_time
+        record_metric(tenant_id, "ExecutionTime", execution_time, "Seconds")
+        app.logger.info(f"{reviews_response} Review {review_id} deleted successfully for tenant: {tenant_id}")
+        return jsonify({"message": f"{reviews_response} Review deleted successfully"})
+    except DatabaseError as error:
+        return jsonify({"error": error.error_message })
+    except Exception as error:
+        app.logger.error(f"Error deleting review {review_id} for tenant: {tenant_id}")
+        return jsonify({"error": f"Error deleting review {review_id}"})
+
+
+async def serve():
+    from hypercorn.asyncio import serve as hypercorn_serve
+    from hypercorn.config import Config
+    config = Config()
+    config.bind = [f"0.0.0.0:{os.getenv('PORT', '80')}"]
+    await hypercorn_serve(app, config)
+
+
+if __name__ == '__main__':
+    asyncio.run(serve())
@@ -0,0 +1,150 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+# Request handling of POST /productreview/batch. The body is either a JSON array of reviews
+# (Content-Type: application/json) or one review per line (Content-Type: application/x-ndjson), each with
+# the fields of POST /productreview. NDJSON is parsed line by line while the rows are inserted, so a large
+# import does not have to fit in memory. Rows that fail validation or are rejected by the database are
+# reported by their position in the batch, all other rows are inserted in one transaction.
+
+import json
+import os
+import uuid
+
+from product_review_model import Reviews
+
+MAX_BATCH_ROWS = int(os.getenv("REVIEWS_MAX_BATCH_ROWS", 10000))
+# Rows per multi-row INSERT.
+INSERT_PAGE_SIZE = 500
+NDJSON_CONTENT_TYPES = ('application/x-ndjson', 'application/ndjson', 'application/jsonl')
+REVIEW_FIELDS = ('product_id', 'order_id', 'rating', 'review_description')
+MAX_INTEGER = 2 ** 31 - 1
+INSERT_REVIEW_SQL = ("INSERT INTO app.product_reviews (review_id, product_id, order_id, rating, review_description, tenant_id) "
+                     "VALUES (%s, %s, %s, %s, %s, %s)")
+# Multi-row form for psycopg2.extras.execute_values.
+INSERT_REVIEWS_SQL = ("INSERT INTO app.product_reviews (review_id, product_id, order_id, rating, review_description, tenant_id) "
+                      "VALUES %s")
+
+
+class InvalidBatchRequest(Exception):
+    pass
+
+
+class InvalidItem:
+    # Stands in for an NDJSON line that is not valid JSON, so it is reported like any invalid row.
+    def __init__(self, error):
+        self.error = error
+
+
+def iter_ndjson_items(lines):
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError as error:
+            yield InvalidItem(f"Invalid JSON: {error}")
+
+
+def get_batch_items(content_type, stream):
+    # Items of the request body, stream is the request body as a binary file.
+    if content_type in NDJSON_CONTENT_TYPES:
+        return iter_ndjson_items(stream)
+    if content_type == 'application/json':
+        try:
+            items = json.load(stream)
+        except ValueError as error:
+            raise InvalidBatchRequest(f"Invalid JSON: {error}")
+        if not isinstance(items, list):
+            raise InvalidBatchRequest("Expected a JSON array of reviews")
+        return iter(items)
+    raise InvalidBatchRequest(f"Unsupported content type {content_type}, expected application/json or "
+                              f"application/x-ndjson")
+
+
+def get_integer(item, name, minimum, maximum):
+    value = item.get(name)
+    # bool is an int in Python, but true is not a valid product id.
+    if isinstance(value, bool) or not isinstance(value, (int, str)):
+        raise ValueError(f"{name} must be an integer")
+    try:
+        value = int(value)
+    except ValueError:
+        raise ValueError(f"{name} must be an integer")
+    if value < minimum or value > maximum:
+        raise ValueError(f"{name} must be between {minimum} and {maximum}")
+    return value
+
+
+def validate_review(item, tenant_id) -> Reviews:
+    if isinstance(item, InvalidItem):
+        raise ValueError(item.error)
+    if not isinstance(item, dict):
+        raise ValueError("Expected a JSON object")
+    missing_fields = [field for field in REVIEW_FIELDS if item.get(field) in (None, '')]
+    if missing_fields:
+        raise ValueError(f"Missing required fields: {', '.join(missing_fields)}")
+    review_description = item['review_description']
+    if not isinstance(review_description, str):
+        raise ValueError("review_description must be a string")
+    return Reviews(str(uuid.uuid4()), get_integer(item, 'product_id', -MAX_INTEGER - 1, MAX_INTEGER),
+                   get_integer(item, 'order_id', -MAX_INTEGER - 1, MAX_INTEGER), get_integer(item, 'rating', 1, 5),
+                   review_description, tenant_id)
+
+
+class ReviewBatch:
+    def __init__(self, tenant_id):
+        self.tenant_id = tenant_id
+        self.received = 0
+        # (index, review_id) of the inserted rows
+        self.inserted = []
+        # (index, error) of the rejected rows
+        self.errors = []
+
+    def get_reviews(self, items):
+        # Yields (index, review) of the valid items and records the invalid ones.
+        for index, item in enumerate(items):
+            if index == MAX_BATCH_ROWS:
+                raise InvalidBatchRequest(f"A batch can have at most {MAX_BATCH_ROWS} reviews")
+            self.received += 1
+            try:
+                yield index, validate_review(item, self.tenant_id)
+            except ValueError as error:
+                self.errors.append((index, str(error)))
+
+    def add_inserted(self, page):
+        self.inserted.extend((index, review.review_id) for index, review in page)
+
+    def add_error(self, index, error):
+        self.errors.append((index, error))
+
+    def get_response(self) -> dict:
+        return {
+            "received": self.received,
+            "inserted": len(self.inserted),
+            "failed": len(self.errors),
+            "reviews": [{"index": index, "review_id": review_id} for index, review_id in self.inserted],
+            "errors": [{"index": index, "error": error} for index, error in sorted(self.errors)]
+        }
+
+
+def get_pages(reviews, page_size=INSERT_PAGE_SIZE):
+    page = []
+    for index_review in reviews:
+        page.append(index_review)
+        if len(page) == page_size:
+            yield page
+            page = []
+    if page:
+        yield page
+
+
+def to_row(review: Reviews):
+    return (review.review_id, review.product_id, review.order_id, review.rating, review.review_description,
+            review.tenant_id)
+
+
+def get_database_error(error):
+    # First line of the server message, without the DETAIL and CONTEXT psycopg appends.
+    message = getattr(error, 'pgerror', None) or str(error)
+    return message.strip().splitlines()[0] if message.strip() else type(error).__name__
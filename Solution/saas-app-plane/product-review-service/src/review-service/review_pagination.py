@@ -0,0 +1,159 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+# Keyset pagination of GET /productreview. Reviews are returned newest first, ordered by
+# (review_date, review_id), and a page continues strictly after the last review of the previous page,
+# so every page is an index range scan no matter how deep the client pages. The position is handed to
+# the client as an opaque cursor, the base64url encoded JSON of that last (review_date, review_id).
+#
+# GET /productreview?limit=100&product_id=42&min_rating=4&max_rating=5&cursor=<next_cursor>
+# responds with {"reviews": [...], "next_cursor": "<cursor>" or null}, streamed row by row. Without limit
+# and cursor the client does not page and gets every review as a plain JSON array, like before paging.
+
+import base64
+import json
+import os
+from datetime import datetime
+
+DEFAULT_PAGE_SIZE = int(os.getenv("REVIEWS_DEFAULT_PAGE_SIZE", 100))
+MAX_PAGE_SIZE = int(os.getenv("REVIEWS_MAX_PAGE_SIZE", 1000))
+# Rows the server side cursor fetches from Postgres per round trip.
+FETCH_SIZE = 200
+
+REVIEW_COLUMNS = ['review_id', 'product_id', 'order_id', 'rating', 'review_description', 'tenant_id', 'review_date']
+
+
+class InvalidPageRequest(Exception):
+    pass
+
+
+class ReviewsPageRequest:
+    def __init__(self, limit=DEFAULT_PAGE_SIZE, after=None, product_id=None, min_rating=None, max_rating=None):
+        # None when the client does not page
+        self.limit = limit
+        # (review_date, review_id) of the last review on the previous page
+        self.after = after
+        self.product_id = product_id
+        self.min_rating = min_rating
+        self.max_rating = max_rating
+
+
+def encode_cursor(review) -> str:
+    # isoformat keeps the microseconds of review_date, which the keyset comparison needs.
+    position = json.dumps([review['review_date'].isoformat(), review['review_id']])
+    return base64.urlsafe_b64encode(position.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        padded_cursor = cursor + '=' * (-len(cursor) % 4)
+        review_date, review_id = json.loads(base64.urlsafe_b64decode(padded_cursor.encode()))
+        return datetime.fromisoformat(review_date), str(review_id)
+    except (ValueError, TypeError) as error:
+        raise InvalidPageRequest(f"Invalid cursor: {cursor}") from error
+
+
+def get_int_arg(args, name, minimum, maximum):
+    value = args.get(name)
+    if value is None or value == '':
+        return None
+    try:
+        value = int(value)
+    except ValueError:
+        raise InvalidPageRequest(f"{name} must be an integer")
+    if value < minimum or value > maximum:
+        raise InvalidPageRequest(f"{name} must be between {minimum} and {maximum}")
+    return value
+
+
+def parse_page_request(args) -> ReviewsPageRequest:
+    # args is the query string of the request (request.args in Flask and Quart).
+    limit = get_int_arg(args, 'limit', 1, MAX_PAGE_SIZE)
+    min_rating = get_int_arg(args, 'min_rating', 1, 5)
+    max_rating = get_int_arg(args, 'max_rating', 1, 5)
+    if min_rating is not None and max_rating is not None and min_rating > max_rating:
+        raise InvalidPageRequest("min_rating must not be greater than max_rating")
+    cursor = args.get('cursor')
+    if limit is None and cursor:
+        limit = DEFAULT_PAGE_SIZE
+    return ReviewsPageRequest(
+        limit=limit,
+        after=decode_cursor(cursor) if cursor else None,
+        product_id=get_int_arg(args, 'product_id', -2 ** 31, 2 ** 31 - 1),
+        min_rating=min_rating,
+        max_rating=max_rating
+    )
+
+
+def build_reviews_query(tenant_id, page: ReviewsPageRequest):
+    # tenant_id = %s is redundant with row level security, but lets the planner use the tenant prefix of the
+    # (tenant_id, review_date, review_id) and (tenant_id, product_id, review_date, review_id) indexes.
+    conditions = ["tenant_id = %s"]
+    params = [tenant_id]
+    if page.product_id is not None:
+        conditions.append("product_id = %s")
+        params.append(page.product_id)
+    if page.min_rating is not None:
+        conditions.append("rating >= %s")
+        params.append(page.min_rating)
+    if page.max_rating is not None:
+        conditions.append("rating <= %s")
+        params.append(page.max_rating)
+    if page.after is not None:
+        conditions.append("(review_date, review_id) < (%s, %s)")
+        params.extend(page.after)
+    sql = (f"SELECT {', '.join(REVIEW_COLUMNS)} FROM app.product_reviews WHERE {' AND '.join(conditions)} "
+           f"ORDER BY review_date DESC, review_id DESC")
+    if page.limit is not None:
+        # One row more than the page, to know whether there is a next page.
+        sql += " LIMIT %s"
+        params.append(page.limit + 1)
+    return sql, params
+
+
+def get_page_count(number_of_reviews, page) -> int:
+    # Reviews sent of the rows read, the extra row of a page is not sent.
+    return number_of_reviews if page.limit is None else min(number_of_reviews, page.limit)
+
+
+def to_review(row) -> dict:
+    return dict(zip(REVIEW_COLUMNS, row))
+
+
+def stream_reviews_page(first_review, reviews, limit, dumps):
+    # Writes the page as JSON chunks while reviews are read from the database cursor. first_review was
+    # read before the response started, so query errors could still be returned as an error response.
+    # Without a limit every review is written as a plain JSON array.
+    paged = limit is not None
+    yield '{"reviews": [' if paged else '['
+    last_review = None
+    count = 0
+    review = first_review
+    while review is not None:
+        if count == limit:
+            # The extra row exists, so there is a next page starting after last_review.
+            yield f'], "next_cursor": {json.dumps(encode_cursor(last_review))}}}'
+            return
+        yield ('' if count == 0 else ', ') + dumps(review)
+        last_review = review
+        count += 1
+        review = next(reviews, None)
+    yield '], "next_cursor": null}' if paged else ']'
+
+
+async def astream_reviews_page(first_review, reviews, limit, dumps):
+    # stream_reviews_page for the ASGI service, reviews is an async iterator.
+    paged = limit is not None
+    yield '{"reviews": [' if paged else '['
+    last_review = None
+    count = 0
+    review = first_review
+    while review is not None:
+        if count == limit:
+            yield f'], "next_cursor": {json.dumps(encode_cursor(last_review))}}}'
+            return
+        yield ('' if count == 0 else ', ') + dumps(review)
+        last_review = review
+        count += 1
+        review = await anext(reviews, None)
+    yield '], "next_cursor": null}' if paged else ']'
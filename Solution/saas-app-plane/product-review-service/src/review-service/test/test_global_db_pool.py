@@ -0,0 +1,147 @@
+import unittest
+import sys
+import os
+import threading
+import time
+
+sys.path.append(
+    os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "")))
+
+os.environ.setdefault('AWS_REGION', 'us-east-1')
+os.environ.setdefault('DATABASE_NAME', 'test')
+
+from global_db_pool import ConnectionBudgetExhausted, TenantPoolManager
+
+
+class StubPool:
+    def __init__(self, tenant_id, maxconn):
+        self.tenant_id = tenant_id
+        self.maxconn = maxconn
+        self.last_used = time.monotonic()
+        self.connections_in_use = 0
+        self.closed = False
+        # Runs before the connection is taken, like a request of another thread would.
+        self.before_getconn = None
+
+    def getconn(self):
+        if self.before_getconn:
+            self.before_getconn()
+        if self.closed:
+            raise RuntimeError('connection pool is closed')
+        self.connections_in_use += 1
+        return object()
+
+    def putconn(self, conn):
+        self.connections_in_use -= 1
+
+    def get_open_connections(self):
+        return 0 if self.closed else max(1, self.connections_in_use)
+
+    def closeall(self):
+        self.closed = True
+
+
+class StubPoolFactory:
+    def __init__(self, delay=0.0, failing_tenants=()):
+        self.delay = delay
+        self.failing_tenants = failing_tenants
+        self.created = []
+        self.lock = threading.Lock()
+
+    def __call__(self, tenant_id, maxconn):
+        time.sleep(self.delay)
+        if tenant_id in self.failing_tenants:
+            raise RuntimeError('could not connect')
+        tenant_pool = StubPool(tenant_id, maxconn)
+        with self.lock:
+            self.created.append(tenant_pool)
+        return tenant_pool
+
+
+class TestTenantPoolManager(unittest.TestCase):
+
+    def test_reuses_tenant_pool(self):
+        factory = StubPoolFactory()
+        manager = TenantPoolManager(factory, max_connections=20, max_connections_per_tenant=5)
+        self.assertIs(manager.get_pool('tenant-1'), manager.get_pool('tenant-1'))
+        stats = manager.get_stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['pools']), (1, 1, 1))
+        self.assertEqual(stats['reserved_connections'], 5)
+
+    def test_concurrent_first_requests_create_one_pool(self):
+        factory = StubPoolFactory(delay=0.05)
+        manager = TenantPoolManager(factory, max_connections=20, max_connections_per_tenant=5)
+        pools = []
+        threads = [threading.Thread(target=lambda: pools.append(manager.get_pool('tenant-1'))) for _ in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(factory.created), 1)
+        self.assertTrue(all(tenant_pool is factory.created[0] for tenant_pool in pools))
+        self.assertEqual(manager.get_stats()['misses'], 1)
+
+    def test_evicts_least_recently_used_pool_when_budget_is_used(self):
+        factory = StubPoolFactory()
+        manager = TenantPoolManager(factory, max_connections=10, max_connections_per_tenant=5)
+        tenant_1 = manager.get_pool('tenant-1')
+        tenant_2 = manager.get_pool('tenant-2')
+        manager.get_pool('tenant-1')
+        manager.get_pool('tenant-3')
+        self.assertTrue(tenant_2.closed)
+        self.assertFalse(tenant_1.closed)
+        stats = manager.get_stats()
+        self.assertEqual((stats['evictions'], stats['pools'], stats['reserved_connections']), (1, 2, 10))
+
+    def test_pools_in_use_are_not_evicted(self):
+        factory = StubPoolFactory()
+        manager = TenantPoolManager(factory, max_connections=10, max_connections_per_tenant=5)
+        manager.get_pool('tenant-1').getconn()
+        manager.get_pool('tenant-2').getconn()
+        with self.assertRaises(ConnectionBudgetExhausted):
+            manager.get_pool('tenant-3')
+        self.assertEqual(manager.get_stats()['reserved_connections'], 10)
+
+    def test_pool_is_not_evicted_before_its_connection_is_taken(self):
+        factory = StubPoolFactory()
+        manager = TenantPoolManager(factory, max_connections=5, max_connections_per_tenant=5)
+        tenant_1 = manager.get_pool('tenant-1')
+        tenant_1.before_getconn = lambda: self.assertRaises(ConnectionBudgetExhausted, manager.get_pool, 'tenant-2')
+        tenant_pool, connection = manager.get_connection('tenant-1')
+        self.assertIs(tenant_pool, tenant_1)
+        self.assertFalse(tenant_1.closed)
+        # Once the connection is returned the pool can make room for another tenant.
+        tenant_pool.putconn(connection)
+        tenant_1.before_getconn = None
+        manager.get_pool('tenant-2')
+        self.assertTrue(tenant_1.closed)
+
+    def test_idle_pools_expire(self):
+        factory = StubPoolFactory()
+        manager = TenantPoolManager(factory, max_connections=20, max_connections_per_tenant=5, idle_ttl_seconds=60)
+        tenant_1 = manager.get_pool('tenant-1')
+        tenant_1.last_used -= 120
+        busy = manager.get_pool('tenant-2')
+        busy.getconn()
+        busy.last_used -= 120
+        manager.get_pool('tenant-3')
+        self.assertTrue(tenant_1.closed)
+        self.assertFalse(busy.closed)
+        self.assertEqual(manager.get_stats()['expirations'], 1)
+
+    def test_failed_creation_releases_budget(self):
+        factory = StubPoolFactory(failing_tenants=('tenant-1',))
+        manager = TenantPoolManager(factory, max_connections=5, max_connections_per_tenant=5)
+        with self.assertRaises(RuntimeError):
+            manager.get_pool('tenant-1')
+        self.assertIsNotNone(manager.get_pool('tenant-2'))
+        stats = manager.get_stats()
+        self.assertEqual((stats['creation_failures'], stats['reserved_connections']), (1, 5))
+
+    def test_budget_must_fit_one_tenant_pool(self):
+        with self.assertRaises(ValueError):
+            TenantPoolManager(StubPoolFactory(), max_connections=4, max_connections_per_tenant=5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+import unittest
+import sys
+import os
+
+sys.path.append(
+    os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "")))
+
+import load_profile
+from load_profile import LoadProfile, inject_db_load, inject_db_load_async
+
+
+class RecordingCursor:
+    def __init__(self):
+        self.statements = []
+
+    def execute(self, sql, params=None):
+        self.statements.append((sql, params))
+
+
+class AsyncRecordingCursor(RecordingCursor):
+    async def execute(self, sql, params=None):
+        self.statements.append((sql, params))
+
+
+class TestLoadProfile(unittest.TestCase):
+
+    def setUp(self):
+        self.load_profile = load_profile.load_profile
+
+    def tearDown(self):
+        load_profile.load_profile = self.load_profile
+
+    def test_production_profile_injects_nothing(self):
+        load_profile.load_profile = LoadProfile('production', {'default': {'db_sleep_seconds': 1}})
+        cursor = RecordingCursor()
+        inject_db_load(cursor, 'tenant-1')
+        self.assertEqual(cursor.statements, [])
+        self.assertEqual(load_profile.load_profile.get_stats()['tenants'], {})
+
+    def test_synthetic_profile_defaults_to_previous_load(self):
+        tenant_load = LoadProfile('synthetic').get_tenant_load('tenant-1')
+        self.assertEqual(tenant_load.get_statements(), [("SELECT pg_sleep(%s)", (1,))])
+        self.assertEqual(tenant_load.hold_seconds, 1)
+
+    def test_tenant_settings_override_default(self):
+        profile = LoadProfile('synthetic', {'default': {'db_sleep_seconds': 0.5},
+                                            'tenants': {'tenant-1': {'db_cpu_rows': 1000, 'db_sleep_seconds': 0},
+                                                        'tenant-2': {'db_io_rows': 5000}}})
+        statements = profile.get_tenant_load('tenant-1').get_statements()
+        self.assertEqual(len(statements), 1)
+        self.assertIn("md5", statements[0][0])
+        self.assertEqual(statements[0][1], (1000,))
+        statements = profile.get_tenant_load('tenant-2').get_statements()
+        self.assertEqual([sql.split()[0] for sql, params in statements], ['SELECT', 'SET', 'SELECT', 'RESET'])
+        self.assertEqual(profile.get_tenant_load('tenant-3').get_statements(), [("SELECT pg_sleep(%s)", (0.5,))])
+
+    def test_tenant_without_load(self):
+        profile = LoadProfile('synthetic', {'default': {}, 'tenants': {'tenant-1': {'db_sleep_seconds': 1}}})
+        self.assertIsNone(profile.get_tenant_load('tenant-2'))
+        self.assertIsNotNone(profile.get_tenant_load('tenant-1'))
+
+    def test_invalid_configuration(self):
+        with self.assertRaises(ValueError):
+            LoadProfile('lab')
+        with self.assertRaises(ValueError):
+            LoadProfile('synthetic', {'default': {'db_sleep': 1}})
+        with self.assertRaises(ValueError):
+            LoadProfile('synthetic', {'tenants': {'tenant-1': {'db_cpu_rows': -1}}})
+
+    def test_injected_load_is_recorded_per_tenant(self):
+        load_profile.load_profile = LoadProfile('synthetic', {'default': {'db_sleep_seconds': 0.1}})
+        cursor = RecordingCursor()
+        inject_db_load(cursor, 'tenant-1')
+        inject_db_load(cursor, 'tenant-1')
+        self.assertEqual(len(cursor.statements), 2)
+        stats = load_profile.load_profile.get_stats()
+        self.assertEqual(stats['profile'], 'synthetic')
+        self.assertEqual(stats['tenants']['tenant-1']['requests'], 2)
+
+
+class TestAsyncLoadProfile(unittest.IsolatedAsyncioTestCase):
+
+    async def test_async_injection(self):
+        saved_profile = load_profile.load_profile
+        load_profile.load_profile = LoadProfile('synthetic', {'default': {'db_cpu_rows': 10}})
+        try:
+            cursor = AsyncRecordingCursor()
+            await inject_db_load_async(cursor, 'tenant-1')
+            self.assertEqual(cursor.statements[0][1], (10,))
+            self.assertEqual(load_profile.load_profile.get_stats()['tenants']['tenant-1']['requests'], 1)
+        finally:
+            load_profile.load_profile = saved_profile
+
+
+if __name__ == '__main__':
+    unittest.main()
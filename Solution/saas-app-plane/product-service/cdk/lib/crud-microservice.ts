@@ -25,11 +25,18 @@ interface MicroserviceProps {
     getAll: string;
     update: string;
     delete: string;
+    batchCreate: string;
+    batchGet: string;
+    batchDelete: string;
   };
   logLevel: string;
   layers?: lambda.LayerVersion[];
   logGroup: logs.LogGroup,
-  authorizerFunctionArn: string
+  authorizerFunctionArn: string,
+  shardPolicy?: {
+    tenantDetailsTableName: string;
+    shardCountByTier: { [tier: string]: number };
+  };
 }
 
 export class Microservice extends Construct {
@@ -185,5 +192,88 @@ export class Microservice extends Construct {
     );
     this.table.grantWriteData(deleteLambdaFunctionConstruct.lambdaFunction);
     deleteLambdaFunctionConstruct.lambdaFunction.addEnvironment('TABLE_NAME', this.table.tableName);
+
+    // POST and DELETE <resource>/batch, POST <resource>/batch-get: up to BATCH_MAX_ITEMS items per call.
+    const batchResource = props.apiGatewayResource.addResource('batch');
+    const batchGetResource = props.apiGatewayResource.addResource('batch-get');
+
+    const batchCreateLambdaFunctionConstruct = new LambdaFunction(this, 'BatchCreateFunction', {
+      entry: props.entry,
+      handler: props.handlers.batchCreate,
+      index: props.index,
+      powertoolsServiceName: props.serviceName,
+      powertoolsNamespace: powertoolsNamespace,
+      logLevel: props.logLevel,
+      layers: props.layers,
+      logGroup: props.logGroup
+    });
+    batchResource.addMethod(
+      'POST',
+      new LambdaIntegration(batchCreateLambdaFunctionConstruct.lambdaFunction, {
+        proxy: true,
+      }),
+      methodOptions
+    );
+    this.table.grantWriteData(batchCreateLambdaFunctionConstruct.lambdaFunction);
+    batchCreateLambdaFunctionConstruct.lambdaFunction.addEnvironment('TABLE_NAME', this.table.tableName);
+
+    const batchGetLambdaFunctionConstruct = new LambdaFunction(this, 'BatchGetFunction', {
+      entry: props.entry,
+      handler: props.handlers.batchGet,
+      index: props.index,
+      powertoolsServiceName: props.serviceName,
+      powertoolsNamespace: powertoolsNamespace,
+      logLevel: props.logLevel,
+      layers: props.layers,
+      logGroup: props.logGroup
+    });
+    batchGetResource.addMethod(
+      'POST',
+      new LambdaIntegration(batchGetLambdaFunctionConstruct.lambdaFunction, {
+        proxy: true,
+      }),
+      methodOptions
+    );
+    this.table.grantReadData(batchGetLambdaFunctionConstruct.lambdaFunction);
+    batchGetLambdaFunctionConstruct.lambdaFunction.addEnvironment('TABLE_NAME', this.table.tableName);
+
+    const batchDeleteLambdaFunctionConstruct = new LambdaFunction(this, 'BatchDeleteFunction', {
+      entry: props.entry,
+      handler: props.handlers.batchDelete,
+      index: props.index,
+      powertoolsServiceName: props.serviceName,
+      powertoolsNamespace: powertoolsNamespace,
+      logLevel: props.logLevel,
+      layers: props.layers,
+      logGroup: props.logGroup
+    });
+    batchResource.addMethod(
+      'DELETE',
+      new LambdaIntegration(batchDeleteLambdaFunctionConstruct.lambdaFunction, {
+        proxy: true,
+      }),
+      methodOptions
+    );
+    this.table.grantWriteData(batchDeleteLambdaFunctionConstruct.lambdaFunction);
+    batchDeleteLambdaFunctionConstruct.lambdaFunction.addEnvironment('TABLE_NAME', this.table.tableName);
+
+    // Without a shard policy every tenant uses the legacy 9 write shards.
+    if (props.shardPolicy) {
+      const tenantDetailsTable = aws_dynamodb.Table.fromTableName(
+        this,
+        'TenantDetailsTable',
+        props.shardPolicy.tenantDetailsTableName
+      );
+      for (const lambdaFunction of [
+        getLambdaFunctionConstruct.lambdaFunction,
+        getAllLambdaFunctionConstruct.lambdaFunction,
+        createLambdaFunctionConstruct.lambdaFunction,
+        batchCreateLambdaFunctionConstruct.lambdaFunction,
+      ]) {
+        lambdaFunction.addEnvironment('TENANT_DETAILS_TABLE', tenantDetailsTable.tableName);
+        lambdaFunction.addEnvironment('SHARD_COUNT_BY_TIER', JSON.stringify(props.shardPolicy.shardCountByTier));
+        tenantDetailsTable.grant(lambdaFunction, 'dynamodb:GetItem', 'dynamodb:UpdateItem');
+      }
+    }
   }
 }
@@ -3,6 +3,7 @@
 pip install pylint
 
 SHARED_SERVICES_STACK_NAME='SharedServicesStack'
+SAAS_CONTROL_PLANE_STACK_NAME='SaaSControlPlaneStack'
 
 cd ../src
 #python3 -m pylint -E -d E0401 $(find . -iname "*.py" -not -path "./.aws-sam/*" -not -path "./extensions/*")
@@ -26,7 +27,17 @@ cd ../../../cdk
 npm install
 npm run build
 
-cdk deploy --all --require-approval never --concurrency 10 --asset-parallelism true
+# Shard counts per tenant are kept with the tenant details.
+TENANT_DETAILS_TABLE=$(
+  aws cloudformation describe-stacks \
+    --stack-name $SAAS_CONTROL_PLANE_STACK_NAME \
+    --query "Stacks[0].Outputs[?OutputKey=='ControlPlaneTenantDetailsTable'].OutputValue" \
+    --output text
+)
+echo "TENANT_DETAILS_TABLE: $TENANT_DETAILS_TABLE"
+
+cdk deploy --all --require-approval never --concurrency 10 --asset-parallelism true \
+  --context tenantDetailsTable="$TENANT_DETAILS_TABLE"
 
 # Deploy API services to stage.
 API_ID=$(
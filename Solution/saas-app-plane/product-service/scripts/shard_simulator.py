@@ -0,0 +1,128 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+# Read amplification and partition heat of the write shard policies for a tenant size distribution.
+#
+# Tenant sizes follow a Zipf distribution, the largest tenants are on the premium tier, the next ones
+# on advanced and the rest on basic. Writes and list requests of a tenant are proportional to its
+# size. Every policy places a sample of item ids with the same hashing as the services, then reports:
+#   - read amplification: queries a list of all of a tenant's items takes (one per shard and 1 MB page),
+#     over the queries of the same list on a single partition
+#   - partition heat: write rate of the hottest partition against the 1000 WCU a partition sustains
+#
+#   python scripts/shard_simulator.py --tenants 500 --writes-per-second 20000
+#   python scripts/shard_simulator.py --shard-count-by-tier '{"basic": 1, "advanced": 4, "premium": 16}'
+
+import argparse
+import json
+import math
+import os
+import sys
+from collections import Counter
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src")))
+
+from dal.shard_policy import LEGACY_SHARD_COUNT, MAX_SHARD_COUNT, get_write_suffix
+
+PARTITION_WCU = 1000
+PAGE_BYTES = 1024 * 1024
+SAMPLE_ITEMS = 2000
+
+
+def get_tenant_sizes(tenants, total_items, zipf_exponent) -> list:
+    weights = [1 / rank ** zipf_exponent for rank in range(1, tenants + 1)]
+    total_weight = sum(weights)
+    return [max(1, round(total_items * weight / total_weight)) for weight in weights]
+
+
+def get_tiers(tenants, tier_mix) -> list:
+    # tier_mix is [(tier, share)] from the largest tenants' tier down.
+    tiers = []
+    for tier, share in tier_mix:
+        tiers.extend([tier] * round(tenants * share))
+    return (tiers + [tier_mix[-1][0]] * tenants)[:tenants]
+
+
+def get_shard_heat(tenant_id, shard_count, item_count) -> float:
+    # Share of the tenant's writes that go to its hottest shard, from a sample of item ids.
+    sample = min(item_count, SAMPLE_ITEMS)
+    counts = Counter(get_write_suffix(f"{tenant_id}-item-{i}", shard_count) for i in range(sample))
+    return max(counts.values()) / sample
+
+
+def simulate(name, tenants, shard_counts, item_bytes, writes_per_second) -> dict:
+    items_per_page = max(1, PAGE_BYTES // item_bytes)
+    total_items = sum(size for size, _ in tenants)
+    amplification = []
+    hottest_partition = 0.0
+    hot_partitions = 0
+    for tenant_index, ((size, _), shard_count) in enumerate(zip(tenants, shard_counts)):
+        queries = shard_count * max(1, math.ceil(size / shard_count / items_per_page))
+        amplification.append(queries / math.ceil(size / items_per_page))
+        tenant_wcu = writes_per_second * size / total_items * math.ceil(item_bytes / 1024)
+        partition_wcu = tenant_wcu * get_shard_heat(f"tenant{tenant_index}", shard_count, size)
+        hottest_partition = max(hottest_partition, partition_wcu)
+        if partition_wcu > PARTITION_WCU:
+            hot_partitions += 1
+    return {
+        'policy': name,
+        'mean_shards': sum(shard_counts) / len(shard_counts),
+        'read_amplification': sum(amplification) / len(amplification),
+        'traffic_weighted_read_amplification':
+            sum(a * size for a, (size, _) in zip(amplification, tenants)) / total_items,
+        'hottest_partition_wcu': hottest_partition,
+        'tenants_over_partition_limit': hot_partitions,
+    }
+
+
+def get_grown_shard_counts(tenants, shard_counts, item_bytes, writes_per_second, headroom) -> list:
+    # Tier counts, grown for the tenants whose write rate needs more partitions.
+    total_items = sum(size for size, _ in tenants)
+    grown = []
+    for (size, _), shard_count in zip(tenants, shard_counts):
+        tenant_wcu = writes_per_second * size / total_items * math.ceil(item_bytes / 1024)
+        needed = math.ceil(tenant_wcu / (PARTITION_WCU * headroom))
+        grown.append(min(MAX_SHARD_COUNT, max(shard_count, needed)))
+    return grown
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Simulate write shard policies of the product and order tables')
+    parser.add_argument('--tenants', type=int, default=200)
+    parser.add_argument('--items', type=int, default=2000000, help='items of all tenants')
+    parser.add_argument('--zipf-exponent', type=float, default=1.1)
+    parser.add_argument('--item-bytes', type=int, default=1024)
+    parser.add_argument('--writes-per-second', type=float, default=5000, help='writes of all tenants')
+    parser.add_argument('--tier-mix', default='premium=0.05,advanced=0.25,basic=0.7',
+                        help='share of tenants per tier, from the largest tenants down')
+    parser.add_argument('--shard-count-by-tier', default='{"basic": 1, "advanced": 3, "premium": 9}')
+    parser.add_argument('--headroom', type=float, default=0.5,
+                        help="share of a partition's write capacity grown tenants stay under")
+    args = parser.parse_args(argv)
+
+    tier_mix = [(tier, float(share)) for tier, share in
+                (entry.split('=') for entry in args.tier_mix.split(','))]
+    shard_count_by_tier = json.loads(args.shard_count_by_tier)
+    tenants = list(zip(get_tenant_sizes(args.tenants, args.items, args.zipf_exponent),
+                       get_tiers(args.tenants, tier_mix)))
+    tier_counts = [shard_count_by_tier.get(tier, LEGACY_SHARD_COUNT) for _, tier in tenants]
+    policies = [
+        ('legacy', [LEGACY_SHARD_COUNT] * len(tenants)),
+        ('tier', tier_counts),
+        ('tier+grown', get_grown_shard_counts(tenants, tier_counts, args.item_bytes, args.writes_per_second,
+                                              args.headroom)),
+    ]
+
+    print(f"{args.tenants} tenants, {args.items} items, largest tenant {tenants[0][0]} items, "
+          f"{args.writes_per_second:.0f} writes/s")
+    print(f"{'policy':<12}{'shards':>8}{'read amp':>10}{'weighted':>10}{'hottest WCU':>13}{'tenants > 1000 WCU':>20}")
+    for name, shard_counts in policies:
+        result = simulate(name, tenants, shard_counts, args.item_bytes, args.writes_per_second)
+        print(f"{result['policy']:<12}{result['mean_shards']:>8.2f}{result['read_amplification']:>10.2f}"
+              f"{result['traffic_weighted_read_amplification']:>10.2f}{result['hottest_partition_wcu']:>13.0f}"
+              f"{result['tenants_over_partition_limit']:>20}")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,131 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+# BatchWriteItem and BatchGetItem over any number of items of one table. Requests are sent in chunks of
+# the most DynamoDB accepts (25 writes, 100 keys), one after the other so that a batch does not burst
+# over the table's provisioned capacity. Whatever DynamoDB leaves unprocessed is sent again after an
+# exponential backoff with full jitter; what is still unprocessed after BATCH_MAX_ATTEMPTS is returned
+# to the caller instead of failing the whole batch. Consumed capacity is summed over every call.
+
+import base64
+import json
+import os
+import random
+import time
+from collections import namedtuple
+from decimal import Decimal
+from types import SimpleNamespace
+
+from dal.sharded_query import add_consumed_capacity
+
+BATCH_WRITE_SIZE = 25
+BATCH_GET_SIZE = 100
+# Items a single API request may carry, every chunk is a DynamoDB round trip within the Lambda timeout.
+MAX_BATCH_ITEMS = int(os.getenv('BATCH_MAX_ITEMS', 1000))
+MAX_ATTEMPTS = int(os.getenv('BATCH_MAX_ATTEMPTS', 8))
+BASE_DELAY_SECONDS = 0.05
+MAX_DELAY_SECONDS = 2.0
+
+# unprocessed are the write requests or keys DynamoDB did not process after every attempt.
+BatchResult = namedtuple('BatchResult', ['items', 'unprocessed', 'consumed_capacity'])
+
+
+class InvalidBatchRequest(Exception):
+    pass
+
+
+def get_chunks(values, size) -> list:
+    return [values[i:i + size] for i in range(0, len(values), size)]
+
+
+def get_backoff_seconds(attempt) -> float:
+    # nosec - Suppress bandit. Not using for security purposes, B311: jitter of the retry delay.
+    return random.uniform(0, min(MAX_DELAY_SECONDS, BASE_DELAY_SECONDS * 2 ** attempt))
+
+
+def check_batch_size(values):
+    if not values:
+        raise InvalidBatchRequest("The batch is empty")
+    if len(values) > MAX_BATCH_ITEMS:
+        raise InvalidBatchRequest(f"A batch can have at most {MAX_BATCH_ITEMS} items")
+
+
+def get_batch_request(event, field) -> list:
+    # The list in field of the JSON body, its objects parsed like the single item handlers parse them.
+    body = event.get('body') or ''
+    if event.get('isBase64Encoded'):
+        body = base64.b64decode(body).decode('utf-8')
+    try:
+        request = json.loads(body, object_hook=lambda d: SimpleNamespace(**d), parse_float=Decimal)
+    except json.JSONDecodeError as e:
+        raise InvalidBatchRequest(f"Invalid JSON format: {e}")
+    values = getattr(request, field, None)
+    if not isinstance(values, list):
+        raise InvalidBatchRequest(f"The body must have a list of {field}")
+    check_batch_size(values)
+    return values
+
+
+def sum_consumed_capacity(total, consumed_capacities):
+    # Batch responses have a list of consumed capacities, one per table.
+    for consumed_capacity in consumed_capacities or []:
+        total = add_consumed_capacity(total, consumed_capacity)
+    return total
+
+
+def batch_write(table, write_requests, sleep=time.sleep) -> BatchResult:
+    # write_requests are {'PutRequest': {'Item': ...}} or {'DeleteRequest': {'Key': ...}}, a key must
+    # not appear twice within the batch.
+    client = table.meta.client
+    unprocessed = []
+    consumed_capacity = None
+    for chunk in get_chunks(write_requests, BATCH_WRITE_SIZE):
+        request_items = {table.name: chunk}
+        for attempt in range(MAX_ATTEMPTS):
+            if attempt:
+                sleep(get_backoff_seconds(attempt))
+            response = client.batch_write_item(RequestItems=request_items, ReturnConsumedCapacity='TOTAL')
+            consumed_capacity = sum_consumed_capacity(consumed_capacity, response.get('ConsumedCapacity'))
+            request_items = response.get('UnprocessedItems')
+            if not request_items:
+                break
+        if request_items:
+            unprocessed.extend(request_items[table.name])
+    return BatchResult([], unprocessed, consumed_capacity)
+
+
+def batch_get(table, keys, sleep=time.sleep) -> BatchResult:
+    # Items of the keys that exist, in no particular order. Duplicate keys are read once.
+    client = table.meta.client
+    keys = list({tuple(sorted(key.items())): key for key in keys}.values())
+    items = []
+    unprocessed = []
+    consumed_capacity = None
+    for chunk in get_chunks(keys, BATCH_GET_SIZE):
+        request_items = {table.name: {'Keys': chunk}}
+        for attempt in range(MAX_ATTEMPTS):
+            if attempt:
+                sleep(get_backoff_seconds(attempt))
+            response = client.batch_get_item(RequestItems=request_items, ReturnConsumedCapacity='TOTAL')
+            items.extend(response['Responses'].get(table.name, []))
+            consumed_capacity = sum_consumed_capacity(consumed_capacity, response.get('ConsumedCapacity'))
+            request_items = response.get('UnprocessedKeys')
+            if not request_items:
+                break
+        if request_items:
+            unprocessed.extend(request_items[table.name]['Keys'])
+    return BatchResult(items, unprocessed, consumed_capacity)
+
+
+def get_tenant_keys(tenantId, keys, sort_key) -> list:
+    # "<shardId>:<id>" keys of the API as DynamoDB keys, all of them in the tenant's shards.
+    dynamodb_keys = []
+    for key in keys:
+        if not isinstance(key, str) or key.count(':') != 1:
+            raise InvalidBatchRequest(f"Invalid key: {key}")
+        shardId, itemId = key.split(':')
+        shardTenantId, _, suffix = shardId.rpartition('-')
+        if shardTenantId != tenantId or not suffix.isdigit():
+            raise InvalidBatchRequest(f"Key {key} is not in the shards of tenant {tenantId}")
+        dynamodb_keys.append({'shardId': shardId, sort_key: itemId})
+    return dynamodb_keys
@@ -0,0 +1,212 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+# Number of write shards per tenant for the pooled product and order tables. A tenant's items are
+# written to the partition keys <tenantId>-1 .. <tenantId>-<shard count>, the shard of an item is a
+# jump consistent hash of its id, and listing the tenant's items reads exactly those shards.
+#
+# The shard count of a tenant is kept with its tenant details (<prefix>ShardCount, the prefix is
+# product or order) and cached for ttl_seconds. A tenant without one gets the count of its tier
+# (SHARD_COUNT_BY_TIER) on first use, unless it already has items beyond that count, written when every
+# tenant used the 9 legacy shards: it then keeps the legacy count.
+#
+# Shard counts only grow, so no item is ever outside the shards that are read. Growing is online:
+# readers fan out to the new count as soon as their cache refreshes, writers keep the previous count
+# until every reader has had time to refresh (twice the cache TTL after the change).
+#
+# Grow the shards of a tenant with:
+#   python dal/shard_policy.py <tenant details table> <tenant id> product|order <shard count>
+
+import argparse
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import namedtuple
+
+import boto3
+from boto3.dynamodb.conditions import Key
+from botocore.exceptions import ClientError
+
+LEGACY_SHARD_COUNT = 9
+MAX_SHARD_COUNT = 100
+DEFAULT_TTL_SECONDS = 60
+# Longer than the time writers wait after a change for any policy cache TTL in use.
+GROW_SETTLE_SECONDS = 3600
+
+# read_shard_count >= write_shard_count, they only differ while the shard count grows.
+ShardPolicy = namedtuple('ShardPolicy', ['read_shard_count', 'write_shard_count'])
+
+LEGACY_SHARD_POLICY = ShardPolicy(LEGACY_SHARD_COUNT, LEGACY_SHARD_COUNT)
+
+
+def get_stable_hash(value) -> int:
+    # hash() of a str differs between processes, every writer has to agree on the shard of an item.
+    return int.from_bytes(hashlib.sha256(value.encode()).digest()[:8], 'big')
+
+
+def jump_hash(key, buckets) -> int:
+    # Jump consistent hash (Lamping and Veach), growing from n to n + 1 buckets only moves 1/(n + 1)
+    # of the keys, to the new bucket.
+    bucket, jump = -1, 0
+    while jump < buckets:
+        bucket = jump
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        jump = int((bucket + 1) * (float(1 << 31) / float((key >> 33) + 1)))
+    return bucket
+
+
+def get_write_suffix(item_id, shard_count) -> int:
+    return 1 + jump_hash(get_stable_hash(item_id), shard_count)
+
+
+def get_write_shard_id(tenant_id, item_id, shard_policy) -> str:
+    return f"{tenant_id}-{get_write_suffix(item_id, shard_policy.write_shard_count)}"
+
+
+def get_read_shard_ids(tenant_id, shard_policy) -> list:
+    return [f"{tenant_id}-{suffix}" for suffix in range(1, shard_policy.read_shard_count + 1)]
+
+
+def get_shard_attributes(prefix) -> tuple:
+    return f"{prefix}ShardCount", f"{prefix}PreviousShardCount", f"{prefix}ShardCountChangedAt"
+
+
+def get_policy_from_record(record, prefix, now, grow_delay_seconds):
+    count_attribute, previous_attribute, changed_at_attribute = get_shard_attributes(prefix)
+    shard_count = record.get(count_attribute)
+    if shard_count is None:
+        return None
+    previous_shard_count = record.get(previous_attribute)
+    if previous_shard_count is not None and now < float(record.get(changed_at_attribute, 0)) + grow_delay_seconds:
+        return ShardPolicy(int(shard_count), int(previous_shard_count))
+    return ShardPolicy(int(shard_count), int(shard_count))
+
+
+def has_items_beyond(table, tenant_id, shard_count) -> bool:
+    # Whether any of the legacy shards after shard_count has an item of the tenant.
+    for suffix in range(shard_count + 1, LEGACY_SHARD_COUNT + 1):
+        response = table.query(KeyConditionExpression=Key('shardId').eq(f"{tenant_id}-{suffix}"),
+                               Select='COUNT', Limit=1)
+        if response['Count']:
+            return True
+    return False
+
+
+class ShardPolicyCache:
+    def __init__(self, tenant_details_table, attribute_prefix, tier_shard_counts=None,
+                 ttl_seconds=DEFAULT_TTL_SECONDS, clock=time.time):
+        self.tenant_details_table = tenant_details_table
+        self.attribute_prefix = attribute_prefix
+        self.tier_shard_counts = tier_shard_counts or {}
+        self.ttl_seconds = ttl_seconds
+        self.grow_delay_seconds = 2 * ttl_seconds
+        self.clock = clock
+        # tenant_id -> (tenant details record, time it was read)
+        self.entries = {}
+        self.lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'pinned': 0}
+
+    def get_policy(self, tenant_id, tier=None, table=None) -> ShardPolicy:
+        # table is the tenant's product or order table, used once per tenant to look for legacy items.
+        if self.tenant_details_table is None:
+            return LEGACY_SHARD_POLICY
+        now = self.clock()
+        with self.lock:
+            entry = self.entries.get(tenant_id)
+            if entry is not None and now - entry[1] < self.ttl_seconds:
+                self.stats['hits'] += 1
+                record = entry[0]
+            else:
+                self.stats['misses'] += 1
+                record = None
+        if record is None:
+            record = self._get_record(tenant_id)
+            if get_policy_from_record(record, self.attribute_prefix, now, self.grow_delay_seconds) is None:
+                record = self._pin_shard_count(tenant_id, tier, table)
+            with self.lock:
+                self.entries[tenant_id] = (record, now)
+        return get_policy_from_record(record, self.attribute_prefix, now, self.grow_delay_seconds)
+
+    def _get_record(self, tenant_id) -> dict:
+        response = self.tenant_details_table.get_item(Key={'tenantId': tenant_id},
+                                                      ProjectionExpression=', '.join(
+                                                          get_shard_attributes(self.attribute_prefix)))
+        return response.get('Item', {})
+
+    def _pin_shard_count(self, tenant_id, tier, table) -> dict:
+        shard_count = self.tier_shard_counts.get(tier, LEGACY_SHARD_COUNT)
+        if shard_count < LEGACY_SHARD_COUNT and table is not None and has_items_beyond(table, tenant_id, shard_count):
+            shard_count = LEGACY_SHARD_COUNT
+        count_attribute = get_shard_attributes(self.attribute_prefix)[0]
+        try:
+            # Only the first writer pins the count, the others read it.
+            self.tenant_details_table.update_item(
+                Key={'tenantId': tenant_id},
+                UpdateExpression='SET #count = :count',
+                ConditionExpression='attribute_not_exists(#count)',
+                ExpressionAttributeNames={'#count': count_attribute},
+                ExpressionAttributeValues={':count': shard_count})
+            self.stats['pinned'] += 1
+            return {count_attribute: shard_count}
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+            return self._get_record(tenant_id)
+
+
+def grow_shard_count(tenant_details_table, tenant_id, attribute_prefix, shard_count, now=None):
+    # Raises the shard count of a tenant, readers use it right away and writers once the readers'
+    # caches have been refreshed. A count that is not larger than the current one is rejected.
+    if not 1 <= shard_count <= MAX_SHARD_COUNT:
+        raise ValueError(f"shard count must be between 1 and {MAX_SHARD_COUNT}")
+    count_attribute, previous_attribute, changed_at_attribute = get_shard_attributes(attribute_prefix)
+    record = tenant_details_table.get_item(Key={'tenantId': tenant_id}).get('Item', {})
+    current_shard_count = int(record.get(count_attribute, LEGACY_SHARD_COUNT))
+    if shard_count <= current_shard_count:
+        raise ValueError(f"shard count of {tenant_id} is {current_shard_count}, it can only grow")
+    now = int(now if now is not None else time.time())
+    previous_shard_count = current_shard_count
+    if previous_attribute in record and now - float(record.get(changed_at_attribute, 0)) < GROW_SETTLE_SECONDS:
+        # Grown again before the writers moved to the last count, readers may not all use it yet.
+        previous_shard_count = int(record[previous_attribute])
+    condition = 'attribute_not_exists(#count)' if count_attribute not in record else '#count = :current'
+    values = {':count': shard_count, ':previous': previous_shard_count, ':changed_at': now}
+    if count_attribute in record:
+        values[':current'] = current_shard_count
+    tenant_details_table.update_item(
+        Key={'tenantId': tenant_id},
+        UpdateExpression='SET #count = :count, #previous = :previous, #changed_at = :changed_at',
+        ConditionExpression=condition,
+        ExpressionAttributeNames={'#count': count_attribute, '#previous': previous_attribute,
+                                  '#changed_at': changed_at_attribute},
+        ExpressionAttributeValues=values)
+    return current_shard_count
+
+
+def get_shard_policy_cache_from_env(attribute_prefix):
+    # Without TENANT_DETAILS_TABLE every tenant uses the legacy shards.
+    table_name = os.getenv('TENANT_DETAILS_TABLE')
+    tenant_details_table = boto3.resource('dynamodb').Table(table_name) if table_name else None
+    return ShardPolicyCache(tenant_details_table, attribute_prefix,
+                            json.loads(os.getenv('SHARD_COUNT_BY_TIER', '{}')),
+                            int(os.getenv('SHARD_POLICY_TTL_SECONDS', DEFAULT_TTL_SECONDS)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Grow the write shards of a tenant's products or orders")
+    parser.add_argument('tenant_details_table')
+    parser.add_argument('tenant_id')
+    parser.add_argument('service', choices=['product', 'order'])
+    parser.add_argument('shard_count', type=int)
+    args = parser.parse_args(argv)
+    table = boto3.resource('dynamodb').Table(args.tenant_details_table)
+    previous_shard_count = grow_shard_count(table, args.tenant_id, args.service, args.shard_count)
+    print(f"{args.service} shards of {args.tenant_id}: {previous_shard_count} -> {args.shard_count}, "
+          f"writers use the new shards once the services' policy caches have refreshed")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
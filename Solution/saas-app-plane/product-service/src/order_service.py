@@ -6,6 +6,8 @@ from utils import utils
 from utils import logger
 from utils import metrics_manager
 import dal.order_service_dal as order_service_dal
+import dal.sharded_query as sharded_query
+import dal.batch_operations as batch_operations
 from decimal import Decimal
 from types import SimpleNamespace
 from aws_lambda_powertools import Tracer
@@ -80,6 +82,69 @@ def get_orders(event, context):
     tracer.put_annotation(key="TenantId", value=tenantId)
 
     logger.log_with_tenant_context(event, "Request received to get all orders")
-    response = order_service_dal.get_orders(event, tenantId)
+    # ?limit=<n>&cursor=<next_cursor> returns a page, {"orders": [...], "next_cursor": ...}
+    try:
+        limit, cursor = sharded_query.get_page_request(event.get('queryStringParameters'))
+        response, consumed_capacity, next_cursor = order_service_dal.get_orders(event, tenantId, limit, cursor)
+    except sharded_query.InvalidPageRequest as e:
+        return utils.create_badrequest_response(str(e))
     metrics_manager.record_metric(event, "OrdersRetrieved", "Count", len(response))
+    logger.log_with_tenant_and_function_context(event, context, {"consumed_capacity": consumed_capacity},
+                                                "This log will be received by the Lambda extension using the Telemetry API")
+    if limit is not None:
+        return utils.generate_response({"orders": response, "next_cursor": next_cursor})
     return utils.generate_response(response)
+
+
+@tracer.capture_lambda_handler
+def create_orders(event, context):
+    tenantId = event['requestContext']['authorizer']['tenantId']
+    tracer.put_annotation(key="TenantId", value=tenantId)
+
+    logger.log_with_tenant_context(event, "Request received to create orders")
+    # {"orders": [<order>, ...]} returns the created orders and the keys of those DynamoDB did not write
+    try:
+        payloads = batch_operations.get_batch_request(event, 'orders')
+    except batch_operations.InvalidBatchRequest as e:
+        return utils.create_badrequest_response(str(e))
+    orders, unprocessed_keys, consumed_capacity = order_service_dal.create_orders(event, payloads)
+    logger.log_with_tenant_and_function_context(event, context, {"consumed_capacity": consumed_capacity},
+                                                "This log will be received by the Lambda extension using the Telemetry API")
+    metrics_manager.record_metric(event, "OrderCreated", "Count", len(orders))
+    return utils.generate_response({"orders": orders, "unprocessed_keys": unprocessed_keys})
+
+
+@tracer.capture_lambda_handler
+def batch_get_orders(event, context):
+    tenantId = event['requestContext']['authorizer']['tenantId']
+    tracer.put_annotation(key="TenantId", value=tenantId)
+
+    logger.log_with_tenant_context(event, "Request received to get orders by key")
+    # {"keys": ["<shardId>:<orderId>", ...]}, keys that do not exist are left out of the orders
+    try:
+        keys = batch_operations.get_batch_request(event, 'keys')
+        orders, unprocessed_keys, consumed_capacity = order_service_dal.get_orders_by_keys(event, keys)
+    except batch_operations.InvalidBatchRequest as e:
+        return utils.create_badrequest_response(str(e))
+    logger.log_with_tenant_and_function_context(event, context, {"consumed_capacity": consumed_capacity},
+                                                "This log will be received by the Lambda extension using the Telemetry API")
+    metrics_manager.record_metric(event, "OrdersRetrieved", "Count", len(orders))
+    return utils.generate_response({"orders": orders, "unprocessed_keys": unprocessed_keys})
+
+
+@tracer.capture_lambda_handler
+def delete_orders(event, context):
+    tenantId = event['requestContext']['authorizer']['tenantId']
+    tracer.put_annotation(key="TenantId", value=tenantId)
+
+    logger.log_with_tenant_context(event, "Request received to delete orders")
+    # {"keys": ["<shardId>:<orderId>", ...]}
+    try:
+        keys = batch_operations.get_batch_request(event, 'keys')
+        unprocessed_keys, consumed_capacity = order_service_dal.delete_orders(event, keys)
+    except batch_operations.InvalidBatchRequest as e:
+        return utils.create_badrequest_response(str(e))
+    logger.log_with_tenant_and_function_context(event, context, {"consumed_capacity": consumed_capacity},
+                                                "This log will be received by the Lambda extension using the Telemetry API")
+    metrics_manager.record_metric(event, "OrderDeleted", "Count", len(set(keys)) - len(unprocessed_keys))
+    return utils.generate_response({"message": "Successfully deleted the orders", "unprocessed_keys": unprocessed_keys})
@@ -0,0 +1,93 @@
+# Compares the latency of a GetItem through a DynamoDB resource created for every request, as the
+# DAL used to do, with one served from DynamoDBResourceCache. Requests go to a local stub that
+# speaks the DynamoDB JSON protocol over HTTP, so the numbers show the client side cost: model
+# loading, client creation and new connections. The TLS handshake a real endpoint adds on every new
+# connection is not included, in production the gap is larger.
+#
+# Usage: python test/benchmark_dynamodb_resource_cache.py [requests] [tenants]
+import sys
+import os
+import json
+import statistics
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.append(
+    os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "")))
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+import boto3
+
+from dal.dynamodb_resource_cache import DynamoDBResourceCache
+
+TABLE_NAME = 'Product-pooled'
+ITEM = {'shardId': {'S': 'tenant1-1'}, 'productId': {'S': 'p1'}, 'sku': {'S': 'sku1'},
+        'name': {'S': 'Product 1'}, 'price': {'N': '9.99'}, 'category': {'S': 'books'}}
+
+
+class StubDynamoDBHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        body = json.dumps({'Item': ITEM, 'ConsumedCapacity': {'TableName': TABLE_NAME, 'CapacityUnits': 0.5}})
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-amz-json-1.0')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body.encode())
+
+    def log_message(self, format, *args):
+        pass
+
+
+def get_event(tenant):
+    return {'requestContext': {'authorizer': {'accesskey': f'AKIA{tenant}', 'secretkey': f'secret{tenant}',
+                                              'sessiontoken': f'token{tenant}', 'tenantId': f'tenant{tenant}'}}}
+
+
+def get_uncached_table(event, endpoint_url):
+    authorizer = event['requestContext']['authorizer']
+    return boto3.resource('dynamodb', aws_access_key_id=authorizer['accesskey'],
+                          aws_secret_access_key=authorizer['secretkey'],
+                          aws_session_token=authorizer['sessiontoken'],
+                          endpoint_url=endpoint_url).Table(TABLE_NAME)
+
+
+def run(get_table, requests, tenants):
+    latencies = []
+    for i in range(requests):
+        event = get_event(i % tenants)
+        started = time.perf_counter()
+        get_table(event).get_item(Key={'shardId': 'tenant1-1', 'productId': 'p1'}, ReturnConsumedCapacity='TOTAL')
+        latencies.append((time.perf_counter() - started) * 1000)
+    return latencies
+
+
+def print_latencies(name, first, latencies):
+    latencies = sorted(latencies)
+    print(f"{name:<22} first {first:8.2f} ms  p50 {statistics.median(latencies):7.2f} ms  "
+          f"p99 {latencies[int(len(latencies) * 0.99) - 1]:7.2f} ms")
+
+
+def main():
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    tenants = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubDynamoDBHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    endpoint_url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    cache = DynamoDBResourceCache(endpoint_url=endpoint_url)
+    for name, get_table in (('resource per request', lambda event: get_uncached_table(event, endpoint_url)),
+                            ('cached resource', lambda event: cache.get_table(event, TABLE_NAME))):
+        latencies = run(get_table, requests, tenants)
+        # The first request of each tenant is a cold one in both cases, the percentiles leave them out.
+        print_latencies(name, latencies[0], latencies[tenants:])
+    print(f"{requests} requests, {tenants} tenants, cache {cache.get_stats()}")
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+import unittest
+import sys
+import os
+import gzip
+import json
+
+sys.path.append(
+    os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "")))
+
+from utils.aggregator_util import (
+    MIN_MULTIPART_PART_SIZE,
+    get_line_delimited_json,
+    write_line_delimited_json
+)
+
+
+class StubS3Client:
+    def __init__(self):
+        self.objects = {}
+        self.uploads = {}
+        self.aborted = []
+
+    def put_object(self, Body, Bucket, Key):
+        self.objects[Key] = Body
+
+    def create_multipart_upload(self, Bucket, Key):
+        upload_id = 'upload-{}'.format(len(self.uploads) + 1)
+        self.uploads[upload_id] = {}
+        return {'UploadId': upload_id}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        self.uploads[UploadId][PartNumber] = Body
+        return {'ETag': 'etag-{}'.format(PartNumber)}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        parts = self.uploads[UploadId]
+        self.objects[Key] = b"".join(parts[part['PartNumber']] for part in MultipartUpload['Parts'])
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self.aborted.append(UploadId)
+
+
+def get_usage_records(count):
+    for i in range(count):
+        yield {"tenant_id": "tenant{}".format(i), "date": "2024-07-03 00:00:00.000", "usage_unit": "API Calls",
+               "tenant_usage": i, "total_usage": count, "tenant_percent_usage": round(i / count * 100, 1)}
+
+
+class TestLineDelimitedJsonWriter(unittest.TestCase):
+
+    def test_small_report_uses_put_object(self):
+        s3 = StubS3Client()
+        stats = write_line_delimited_json(s3, 'bucket', 'usage.json', get_usage_records(10))
+        self.assertEqual(s3.objects['usage.json'].decode('utf-8'), get_line_delimited_json(get_usage_records(10)))
+        self.assertEqual(stats['records_written'], 10)
+        self.assertEqual(stats['bytes_written'], len(s3.objects['usage.json']))
+        self.assertEqual(stats['parts'], 0)
+        self.assertEqual(s3.uploads, {})
+
+    def test_large_report_uses_multipart_upload(self):
+        s3 = StubS3Client()
+        stats = write_line_delimited_json(s3, 'bucket', 'usage.json', get_usage_records(100000),
+                                          part_size=MIN_MULTIPART_PART_SIZE)
+        self.assertGreater(stats['parts'], 1)
+        self.assertEqual(stats['records_written'], 100000)
+        self.assertEqual(stats['bytes_uploaded'], len(s3.objects['usage.json']))
+        lines = s3.objects['usage.json'].decode('utf-8').splitlines()
+        self.assertEqual(len(lines), 100000)
+        self.assertEqual(json.loads(lines[-1])["tenant_id"], "tenant99999")
+
+    def test_gzip_output(self):
+        s3 = StubS3Client()
+        stats = write_line_delimited_json(s3, 'bucket', 'usage.json', get_usage_records(1000), gzip_output=True)
+        self.assertEqual(stats['key'], 'usage.json.gz')
+        body = gzip.decompress(s3.objects['usage.json.gz']).decode('utf-8')
+        self.assertEqual(body, get_line_delimited_json(get_usage_records(1000)))
+        self.assertEqual(stats['bytes_written'], len(body))
+        self.assertLess(stats['bytes_uploaded'], stats['bytes_written'])
+
+    def test_failed_generator_aborts_upload(self):
+        def failing_records():
+            yield from get_usage_records(100000)
+            raise RuntimeError("query failed")
+
+        s3 = StubS3Client()
+        with self.assertRaises(RuntimeError):
+            write_line_delimited_json(s3, 'bucket', 'usage.json', failing_records(), part_size=MIN_MULTIPART_PART_SIZE)
+        self.assertEqual(s3.aborted, ['upload-1'])
+        self.assertNotIn('usage.json', s3.objects)
+
+
+if __name__ == "__main__":
+    unittest.main()
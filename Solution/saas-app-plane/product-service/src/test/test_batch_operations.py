@@ -0,0 +1,138 @@
+import unittest
+import sys
+import os
+import base64
+import json
+from types import SimpleNamespace
+
+sys.path.append(
+    os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "")))
+
+from dal.batch_operations import (
+    MAX_ATTEMPTS,
+    InvalidBatchRequest,
+    batch_get,
+    batch_write,
+    get_batch_request,
+    get_tenant_keys
+)
+
+
+class StubClient:
+    # Leaves the last `throttled` requests of every call unprocessed for the first `throttled_calls` calls.
+    def __init__(self, items, throttled=0, throttled_calls=0):
+        self.items = items
+        self.throttled = throttled
+        self.throttled_calls = throttled_calls
+        self.calls = []
+
+    def _split(self, requests):
+        self.calls.append(len(requests))
+        if len(self.calls) <= self.throttled_calls and self.throttled:
+            return requests[:-self.throttled], requests[-self.throttled:]
+        return requests, []
+
+    def batch_write_item(self, RequestItems, ReturnConsumedCapacity):
+        (table_name, requests), = RequestItems.items()
+        assert len(requests) <= 25
+        processed, unprocessed = self._split(requests)
+        for request in processed:
+            if 'PutRequest' in request:
+                item = request['PutRequest']['Item']
+                self.items[(item['shardId'], item['productId'])] = item
+            else:
+                key = request['DeleteRequest']['Key']
+                self.items.pop((key['shardId'], key['productId']), None)
+        response = {'ConsumedCapacity': [{'TableName': table_name, 'CapacityUnits': float(len(processed))}]}
+        if unprocessed:
+            response['UnprocessedItems'] = {table_name: unprocessed}
+        return response
+
+    def batch_get_item(self, RequestItems, ReturnConsumedCapacity):
+        (table_name, request), = RequestItems.items()
+        assert len(request['Keys']) <= 100
+        processed, unprocessed = self._split(request['Keys'])
+        items = [self.items[(key['shardId'], key['productId'])] for key in processed
+                 if (key['shardId'], key['productId']) in self.items]
+        response = {'Responses': {table_name: items},
+                    'ConsumedCapacity': [{'TableName': table_name, 'CapacityUnits': 0.5 * len(processed)}]}
+        if unprocessed:
+            response['UnprocessedKeys'] = {table_name: {'Keys': unprocessed}}
+        return response
+
+
+class StubTable:
+    def __init__(self, client):
+        self.name = 'Product'
+        self.meta = SimpleNamespace(client=client)
+
+
+def get_puts(count):
+    return [{'PutRequest': {'Item': {'shardId': 'tenant1-1', 'productId': f"p{i:04d}"}}} for i in range(count)]
+
+
+class TestBatchOperations(unittest.TestCase):
+
+    def setUp(self):
+        self.sleeps = []
+
+    def test_writes_in_chunks_of_25(self):
+        client = StubClient({})
+        result = batch_write(StubTable(client), get_puts(60), sleep=self.sleeps.append)
+        self.assertEqual(client.calls, [25, 25, 10])
+        self.assertEqual(len(client.items), 60)
+        self.assertEqual(result.unprocessed, [])
+        self.assertEqual(result.consumed_capacity, {'TableName': 'Product', 'CapacityUnits': 60.0})
+        self.assertEqual(self.sleeps, [])
+
+    def test_retries_unprocessed_items_with_backoff(self):
+        client = StubClient({}, throttled=5, throttled_calls=2)
+        result = batch_write(StubTable(client), get_puts(30), sleep=self.sleeps.append)
+        # First chunk throttled twice, retried with its 5 unprocessed items.
+        self.assertEqual(client.calls, [25, 5, 5, 5])
+        self.assertEqual(len(client.items), 30)
+        self.assertEqual(result.unprocessed, [])
+        self.assertEqual(len(self.sleeps), 2)
+
+    def test_returns_items_still_unprocessed(self):
+        client = StubClient({}, throttled=3, throttled_calls=1000)
+        result = batch_write(StubTable(client), get_puts(10), sleep=self.sleeps.append)
+        self.assertEqual(len(client.calls), MAX_ATTEMPTS)
+        self.assertEqual(len(result.unprocessed), 3)
+        self.assertEqual(len(client.items), 7)
+
+    def test_gets_in_chunks_of_100(self):
+        client = StubClient({}, throttled=10, throttled_calls=1)
+        table = StubTable(client)
+        batch_write(table, get_puts(150), sleep=self.sleeps.append)
+        client.calls = []
+        keys = [{'shardId': 'tenant1-1', 'productId': f"p{i:04d}"} for i in range(0, 250)]
+        result = batch_get(table, keys + keys[:5], sleep=self.sleeps.append)
+        # The 10 unprocessed keys of the first chunk are read again.
+        self.assertEqual(client.calls, [100, 10, 100, 50])
+        self.assertEqual(sorted(item['productId'] for item in result.items), [f"p{i:04d}" for i in range(150)])
+        self.assertEqual(result.unprocessed, [])
+        self.assertEqual(result.consumed_capacity['CapacityUnits'], 0.5 * 250)
+
+    def test_tenant_keys(self):
+        self.assertEqual(get_tenant_keys('tenant1', ['tenant1-3:p1'], 'productId'),
+                         [{'shardId': 'tenant1-3', 'productId': 'p1'}])
+        for key in ('tenant2-3:p1', 'tenant1-x-3:p1', 'tenant1-x:p1', 'tenant1-3', 'tenant1-3:p1:x', 3):
+            with self.assertRaises(InvalidBatchRequest):
+                get_tenant_keys('tenant1', [key], 'productId')
+
+    def test_batch_request(self):
+        body = json.dumps({'products': [{'sku': '1', 'price': 9.99}]})
+        products = get_batch_request({'body': body}, 'products')
+        self.assertEqual(products[0].sku, '1')
+        self.assertEqual(str(products[0].price), '9.99')
+        encoded = {'body': base64.b64encode(body.encode()).decode(), 'isBase64Encoded': True}
+        self.assertEqual(len(get_batch_request(encoded, 'products')), 1)
+        for event in ({'body': None}, {'body': '{'}, {'body': '{"products": {}}'}, {'body': '{"products": []}'},
+                      {'body': json.dumps({'products': [{}] * 1001})}):
+            with self.assertRaises(InvalidBatchRequest):
+                get_batch_request(event, 'products')
+
+
+if __name__ == '__main__':
+    unittest.main()
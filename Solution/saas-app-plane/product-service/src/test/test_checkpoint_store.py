@@ -0,0 +1,106 @@
+import unittest
+import sys
+import os
+import tempfile
+
+sys.path.append(
+    os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "")))
+
+from utils.aggregator_util import get_start_date_time
+from utils.checkpoint_store import (
+    LocalFileCheckpointStore,
+    aggregate_incremental_usage,
+    sum_query_results
+)
+
+KEY_FIELDS = ['tenant_id', 'date']
+METRIC_FIELDS = ['total_billed_duration', 'total_capacity_units']
+
+
+def get_result(tenant_id, billed_duration, capacity_units):
+    return [{"field": "tenant_id", "value": tenant_id},
+            {"field": "date", "value": "2024-07-03 00:00:00.000"},
+            {"field": "total_billed_duration", "value": str(billed_duration)},
+            {"field": "total_capacity_units", "value": str(capacity_units)}]
+
+
+class StubAggregator:
+    # Returns a fixed usage per hour of the queried slice.
+    def __init__(self):
+        self.queried_slices = []
+
+    def aggregate_tenant_usage(self, start_date_time, end_date_time) -> dict:
+        self.queried_slices.append((start_date_time, end_date_time))
+        hours = (end_date_time - start_date_time) // 3600
+        return {"results": [get_result("tenant1", 100 * hours, 1.5 * hours),
+                            get_result("tenant2", 300 * hours, 0.5 * hours)]}
+
+
+def get_totals(usage_by_tenant):
+    return {tuple(row[key] for key in KEY_FIELDS): row for row in sum_query_results(usage_by_tenant, KEY_FIELDS, METRIC_FIELDS)}
+
+
+class TestCheckpointStore(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.checkpoint_store = LocalFileCheckpointStore(self.temp_dir.name)
+        self.start_date_time = get_start_date_time()
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_incremental_slices_match_full_day(self):
+        aggregator = StubAggregator()
+        for hour in range(1, 4):
+            usage_by_tenant = aggregate_incremental_usage(aggregator, self.checkpoint_store, 'fine_grained-product',
+                                                          KEY_FIELDS, METRIC_FIELDS,
+                                                          slice_end_time=self.start_date_time + hour * 3600)
+        # Each run only queried the new hour.
+        self.assertEqual(aggregator.queried_slices,
+                         [(self.start_date_time + hour * 3600, self.start_date_time + (hour + 1) * 3600) for hour in range(3)])
+
+        full_day = StubAggregator().aggregate_tenant_usage(self.start_date_time, self.start_date_time + 3 * 3600)
+        self.assertEqual(get_totals(usage_by_tenant), get_totals(full_day))
+        self.assertEqual(self.checkpoint_store.load('fine_grained-product')['high_watermark'], self.start_date_time + 3 * 3600)
+
+    def test_rerunning_slice_is_idempotent(self):
+        aggregator = StubAggregator()
+        first_run = aggregate_incremental_usage(aggregator, self.checkpoint_store, 'fine_grained-product',
+                                                KEY_FIELDS, METRIC_FIELDS,
+                                                slice_end_time=self.start_date_time + 3600)
+        second_run = aggregate_incremental_usage(aggregator, self.checkpoint_store, 'fine_grained-product',
+                                                 KEY_FIELDS, METRIC_FIELDS,
+                                                 slice_start_time=self.start_date_time,
+                                                 slice_end_time=self.start_date_time + 3600)
+        self.assertEqual(first_run, second_run)
+        self.assertEqual(len(self.checkpoint_store.load('fine_grained-product')['slices']), 1)
+
+    def test_overlapping_rerun_replaces_slices(self):
+        aggregator = StubAggregator()
+        for hour in range(1, 4):
+            aggregate_incremental_usage(aggregator, self.checkpoint_store, 'fine_grained-product',
+                                        KEY_FIELDS, METRIC_FIELDS, slice_end_time=self.start_date_time + hour * 3600)
+        # Half past the first hour to half past the second overlaps the slices of both hours.
+        usage_by_tenant = aggregate_incremental_usage(aggregator, self.checkpoint_store, 'fine_grained-product',
+                                                      KEY_FIELDS, METRIC_FIELDS,
+                                                      slice_start_time=self.start_date_time + 1800,
+                                                      slice_end_time=self.start_date_time + 5400)
+        self.assertEqual(aggregator.queried_slices[-1], (self.start_date_time, self.start_date_time + 7200))
+        full_day = StubAggregator().aggregate_tenant_usage(self.start_date_time, self.start_date_time + 3 * 3600)
+        self.assertEqual(get_totals(usage_by_tenant), get_totals(full_day))
+        self.assertEqual(sorted(self.checkpoint_store.load('fine_grained-product')['slices']),
+                         sorted(['{}-{}'.format(self.start_date_time, self.start_date_time + 7200),
+                                 '{}-{}'.format(self.start_date_time + 7200, self.start_date_time + 10800)]))
+
+    def test_no_new_slice_does_not_query(self):
+        aggregator = StubAggregator()
+        aggregate_incremental_usage(aggregator, self.checkpoint_store, 'fine_grained-product',
+                                    KEY_FIELDS, METRIC_FIELDS, slice_end_time=self.start_date_time + 3600)
+        aggregate_incremental_usage(aggregator, self.checkpoint_store, 'fine_grained-product',
+                                    KEY_FIELDS, METRIC_FIELDS, slice_end_time=self.start_date_time + 3600)
+        self.assertEqual(len(aggregator.queried_slices), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,108 @@
+import unittest
+import sys
+import os
+
+sys.path.append(
+    os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "")))
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+from dal.dynamodb_resource_cache import DynamoDBResourceCache, get_expiration_timestamp
+
+NOW = 1720000000
+
+
+class StubResource:
+    def __init__(self, credentials):
+        self.credentials = credentials
+        self.tables = 0
+
+    def Table(self, table_name):
+        self.tables += 1
+        return (self, table_name)
+
+
+class StubSession:
+    def __init__(self):
+        self.resources = []
+
+    def resource(self, service_name, **kwargs):
+        resource = StubResource(kwargs)
+        self.resources.append(resource)
+        return resource
+
+
+class Clock:
+    def __init__(self):
+        self.now = NOW
+
+    def __call__(self):
+        return self.now
+
+
+def get_event(tenant, expiration=None):
+    authorizer = {'accesskey': f'AKIA{tenant}', 'secretkey': f'secret{tenant}', 'sessiontoken': f'token{tenant}'}
+    if expiration is not None:
+        authorizer['expiration'] = expiration
+    return {'requestContext': {'authorizer': authorizer}}
+
+
+class TestDynamoDBResourceCache(unittest.TestCase):
+
+    def setUp(self):
+        self.session = StubSession()
+        self.clock = Clock()
+        self.cache = DynamoDBResourceCache(max_entries=2, clock=self.clock, session=self.session)
+
+    def test_reuses_resource_and_table(self):
+        table = self.cache.get_table(get_event(1), 'Product')
+        self.assertIs(self.cache.get_table(get_event(1), 'Product'), table)
+        self.assertEqual(len(self.session.resources), 1)
+        self.assertEqual(self.session.resources[0].tables, 1)
+        self.assertEqual(self.session.resources[0].credentials['aws_session_token'], 'token1')
+        self.assertEqual(self.cache.get_stats()['hits'], 1)
+
+    def test_new_credentials_get_new_resource(self):
+        first = self.cache.get_table(get_event(1), 'Product')[0]
+        second = self.cache.get_table(get_event(2), 'Product')[0]
+        self.assertIsNot(first, second)
+
+    def test_evicts_least_recently_used(self):
+        self.cache.get_table(get_event(1), 'Product')
+        self.cache.get_table(get_event(2), 'Product')
+        self.cache.get_table(get_event(1), 'Product')
+        self.cache.get_table(get_event(3), 'Product')
+        self.cache.get_table(get_event(1), 'Product')
+        stats = self.cache.get_stats()
+        self.assertEqual((stats['evictions'], stats['entries'], len(self.session.resources)), (1, 2, 3))
+        self.cache.get_table(get_event(2), 'Product')
+        self.assertEqual(len(self.session.resources), 4)
+
+    def test_drops_entry_before_token_expires(self):
+        expiration = '2024-07-03T10:46:40+00:00'
+        expires_at = get_expiration_timestamp(expiration)
+        self.clock.now = expires_at - 600
+        self.cache.get_table(get_event(1, expiration), 'Product')
+        self.clock.now = expires_at - 100
+        self.cache.get_table(get_event(1, expiration), 'Product')
+        self.assertEqual(len(self.session.resources), 1)
+        # Within the expiry margin the resource is not used anymore.
+        self.clock.now = expires_at - 30
+        self.cache.get_table(get_event(1, expiration), 'Product')
+        self.assertEqual(len(self.session.resources), 2)
+        self.assertEqual(self.cache.get_stats()['expired'], 2)
+
+    def test_default_ttl_without_expiration(self):
+        self.cache.get_table(get_event(1), 'Product')
+        self.clock.now += self.cache.default_ttl_seconds
+        self.cache.get_table(get_event(1), 'Product')
+        self.assertEqual(len(self.session.resources), 2)
+
+    def test_expiration_formats(self):
+        self.assertEqual(get_expiration_timestamp('2024-07-03T10:46:40Z'),
+                         get_expiration_timestamp('2024-07-03T10:46:40+00:00'))
+        self.assertIsNone(get_expiration_timestamp(None))
+
+
+if __name__ == '__main__':
+    unittest.main()
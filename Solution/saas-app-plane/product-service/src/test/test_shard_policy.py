@@ -0,0 +1,151 @@
+import unittest
+import sys
+import os
+import uuid
+from collections import Counter
+from decimal import Decimal
+
+sys.path.append(
+    os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "")))
+
+from botocore.exceptions import ClientError
+
+from dal.shard_policy import (
+    LEGACY_SHARD_COUNT,
+    ShardPolicy,
+    ShardPolicyCache,
+    get_read_shard_ids,
+    get_write_shard_id,
+    get_write_suffix,
+    grow_shard_count,
+    jump_hash
+)
+
+NOW = 1720000000
+
+
+class StubTenantDetailsTable:
+    # Handles the two conditions shard_policy uses, values come back as Decimal like from DynamoDB.
+    def __init__(self, items=None):
+        self.items = items or {}
+        self.get_items = 0
+
+    def get_item(self, Key, ProjectionExpression=None):
+        self.get_items += 1
+        item = self.items.get(Key['tenantId'])
+        return {'Item': dict(item)} if item is not None else {}
+
+    def update_item(self, Key, UpdateExpression, ConditionExpression, ExpressionAttributeNames,
+                    ExpressionAttributeValues):
+        item = self.items.setdefault(Key['tenantId'], {'tenantId': Key['tenantId']})
+        count_attribute = ExpressionAttributeNames['#count']
+        if ConditionExpression == 'attribute_not_exists(#count)':
+            failed = count_attribute in item
+        else:
+            failed = item.get(count_attribute) != ExpressionAttributeValues[':current']
+        if failed:
+            raise ClientError({'Error': {'Code': 'ConditionalCheckFailedException', 'Message': ''}}, 'UpdateItem')
+        for assignment in UpdateExpression[len('SET '):].split(', '):
+            name, value = assignment.split(' = ')
+            item[ExpressionAttributeNames[name]] = Decimal(ExpressionAttributeValues[value])
+
+
+class StubProductTable:
+    def __init__(self, shard_ids):
+        self.shard_ids = shard_ids
+        self.queries = 0
+
+    def query(self, KeyConditionExpression, Select, Limit):
+        self.queries += 1
+        shard_id = KeyConditionExpression.get_expression()['values'][1]
+        return {'Count': 1 if shard_id in self.shard_ids else 0}
+
+
+class Clock:
+    def __init__(self):
+        self.now = NOW
+
+    def __call__(self):
+        return self.now
+
+
+class TestShardPolicy(unittest.TestCase):
+
+    def setUp(self):
+        self.tenant_details = StubTenantDetailsTable()
+        self.clock = Clock()
+        self.policies = ShardPolicyCache(self.tenant_details, 'product', {'basic': 2, 'premium': 12},
+                                         ttl_seconds=60, clock=self.clock)
+
+    def test_jump_hash_only_moves_keys_to_new_shard(self):
+        keys = [str(uuid.UUID(int=i)) for i in range(2000)]
+        for shard_count in range(1, 12):
+            for key in keys:
+                before = get_write_suffix(key, shard_count)
+                after = get_write_suffix(key, shard_count + 1)
+                self.assertIn(after, (before, shard_count + 1))
+        counts = Counter(get_write_suffix(key, 4) for key in keys)
+        self.assertEqual(sorted(counts), [1, 2, 3, 4])
+        self.assertLess(max(counts.values()) - min(counts.values()), 150)
+        self.assertEqual(jump_hash(0, 1), 0)
+
+    def test_shard_ids(self):
+        policy = ShardPolicy(3, 2)
+        self.assertEqual(get_read_shard_ids('tenant1', policy), ['tenant1-1', 'tenant1-2', 'tenant1-3'])
+        self.assertIn(get_write_shard_id('tenant1', 'p1', policy), ['tenant1-1', 'tenant1-2'])
+
+    def test_unconfigured_uses_legacy_shards(self):
+        policies = ShardPolicyCache(None, 'product', {'basic': 1})
+        self.assertEqual(policies.get_policy('tenant1', 'basic'), ShardPolicy(LEGACY_SHARD_COUNT, LEGACY_SHARD_COUNT))
+
+    def test_new_tenant_gets_tier_shard_count(self):
+        table = StubProductTable([])
+        self.assertEqual(self.policies.get_policy('tenant1', 'basic', table), ShardPolicy(2, 2))
+        self.assertEqual(self.tenant_details.items['tenant1']['productShardCount'], 2)
+        # Cached until the TTL passes.
+        self.policies.get_policy('tenant1', 'basic', table)
+        self.assertEqual(self.tenant_details.get_items, 1)
+        self.clock.now += 60
+        self.policies.get_policy('tenant1', 'basic', table)
+        self.assertEqual(self.tenant_details.get_items, 2)
+
+    def test_tenant_with_legacy_items_keeps_legacy_shards(self):
+        table = StubProductTable(['tenant1-7'])
+        self.assertEqual(self.policies.get_policy('tenant1', 'basic', table), ShardPolicy(9, 9))
+        # Unknown tiers and tiers with more shards do not need to look.
+        self.assertEqual(self.policies.get_policy('tenant2', 'premium', table), ShardPolicy(12, 12))
+        self.assertEqual(self.policies.get_policy('tenant3', None, table), ShardPolicy(9, 9))
+        # Shards 3 to 7 of tenant1, the first item found is enough.
+        self.assertEqual(table.queries, 5)
+
+    def test_pinned_count_wins_over_tier(self):
+        self.tenant_details.items['tenant1'] = {'tenantId': 'tenant1', 'productShardCount': Decimal(4)}
+        self.assertEqual(self.policies.get_policy('tenant1', 'basic'), ShardPolicy(4, 4))
+
+    def test_growing_moves_readers_before_writers(self):
+        self.tenant_details.items['tenant1'] = {'tenantId': 'tenant1', 'productShardCount': Decimal(2)}
+        self.assertEqual(grow_shard_count(self.tenant_details, 'tenant1', 'product', 5, now=NOW), 2)
+        self.assertEqual(self.policies.get_policy('tenant1', 'basic'), ShardPolicy(5, 2))
+        self.clock.now += 119
+        self.assertEqual(self.policies.get_policy('tenant1', 'basic'), ShardPolicy(5, 2))
+        self.clock.now += 1
+        self.assertEqual(self.policies.get_policy('tenant1', 'basic'), ShardPolicy(5, 5))
+
+    def test_growing_again_keeps_writers_on_settled_count(self):
+        self.tenant_details.items['tenant1'] = {'tenantId': 'tenant1', 'productShardCount': Decimal(2)}
+        grow_shard_count(self.tenant_details, 'tenant1', 'product', 4, now=NOW)
+        grow_shard_count(self.tenant_details, 'tenant1', 'product', 6, now=NOW + 10)
+        self.assertEqual(self.policies.get_policy('tenant1', 'basic'), ShardPolicy(6, 2))
+
+    def test_shard_count_only_grows(self):
+        with self.assertRaises(ValueError):
+            grow_shard_count(self.tenant_details, 'tenant1', 'product', 9)
+        self.tenant_details.items['tenant1'] = {'tenantId': 'tenant1', 'productShardCount': Decimal(3)}
+        with self.assertRaises(ValueError):
+            grow_shard_count(self.tenant_details, 'tenant1', 'product', 2)
+        # A tenant without a pinned count is on the legacy shards.
+        self.assertEqual(grow_shard_count(self.tenant_details, 'tenant2', 'product', 10, now=NOW), 9)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,128 @@
+import unittest
+import sys
+import os
+
+sys.path.append(
+    os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "")))
+
+from boto3.dynamodb.conditions import And, Equals, GreaterThan, GreaterThanEquals
+
+from dal.sharded_query import (
+    InvalidPageRequest,
+    add_consumed_capacity,
+    decode_cursor,
+    get_page_request,
+    scatter_gather_query
+)
+
+
+class StubTable:
+    # Query of a table keyed by (shardId, productId) that returns at most page_size items per call.
+    def __init__(self, items, page_size=3):
+        self.items = sorted(items, key=lambda item: (item['shardId'], item['productId']))
+        self.page_size = page_size
+        self.queries = []
+
+    def query(self, KeyConditionExpression, ReturnConsumedCapacity, Limit=None, ExclusiveStartKey=None):
+        self.queries.append(Limit)
+        conditions = KeyConditionExpression.get_expression()['values'] \
+            if isinstance(KeyConditionExpression, And) else [KeyConditionExpression]
+        items = [item for item in self.items if all(self._matches(condition, item) for condition in conditions)]
+        if ExclusiveStartKey is not None:
+            items = [item for item in items if item['productId'] > ExclusiveStartKey['productId']]
+        page_size = min(self.page_size, Limit or self.page_size)
+        page = items[:page_size]
+        response = {'Items': page, 'ConsumedCapacity': {'TableName': 'Product', 'CapacityUnits': 0.5}}
+        if len(items) > page_size:
+            response['LastEvaluatedKey'] = {'shardId': page[-1]['shardId'], 'productId': page[-1]['productId']}
+        return response
+
+    def _matches(self, condition, item):
+        key, value = condition.get_expression()['values']
+        if isinstance(condition, Equals):
+            return item[key.name] == value
+        if isinstance(condition, GreaterThan):
+            return item[key.name] > value
+        if isinstance(condition, GreaterThanEquals):
+            return item[key.name] >= value
+        raise AssertionError(condition)
+
+
+def get_items(tenant_id='tenant1', shards=9, per_shard=7):
+    return [{'shardId': f"{tenant_id}-{suffix}", 'productId': f"p{(suffix * 37 + i * 11) % 100:03d}"}
+            for suffix in range(1, shards + 1) for i in range(per_shard)]
+
+
+class TestShardedQuery(unittest.TestCase):
+
+    def setUp(self):
+        self.items = get_items() + get_items('tenant2', per_shard=2)
+        self.table = StubTable(self.items)
+        self.shard_ids = [f"tenant1-{suffix}" for suffix in range(1, 10)]
+        self.expected = sorted((item for item in self.items if item['shardId'].startswith('tenant1-')),
+                               key=lambda item: (item['productId'], item['shardId']))
+
+    def test_reads_every_page_of_every_shard(self):
+        result = scatter_gather_query(self.table, 'shardId', self.shard_ids, 'productId')
+        self.assertEqual(result.items, self.expected)
+        self.assertIsNone(result.next_cursor)
+        # 7 items per shard in pages of 3
+        self.assertEqual(len(self.table.queries), 9 * 3)
+        self.assertEqual(result.consumed_capacity, {'TableName': 'Product', 'CapacityUnits': 0.5 * 27})
+
+    def test_pages_with_cursor(self):
+        pages = []
+        cursor = None
+        while True:
+            result = scatter_gather_query(self.table, 'shardId', self.shard_ids, 'productId', limit=10, cursor=cursor)
+            pages.append(result.items)
+            cursor = result.next_cursor
+            if cursor is None:
+                break
+        self.assertEqual([item for page in pages for item in page], self.expected)
+        self.assertEqual([len(page) for page in pages], [10] * 6 + [3])
+
+    def test_same_sort_key_in_several_shards(self):
+        items = [{'shardId': f"tenant1-{suffix}", 'productId': 'p1'} for suffix in range(1, 10)]
+        table = StubTable(items)
+        pages = []
+        cursor = None
+        while True:
+            result = scatter_gather_query(table, 'shardId', self.shard_ids, 'productId', limit=4, cursor=cursor)
+            pages.extend(result.items)
+            cursor = result.next_cursor
+            if cursor is None:
+                break
+        self.assertEqual([item['shardId'] for item in pages], [f"tenant1-{suffix}" for suffix in range(1, 10)])
+
+    def test_exact_last_page_has_no_cursor(self):
+        result = scatter_gather_query(self.table, 'shardId', self.shard_ids, 'productId', limit=63)
+        self.assertEqual(len(result.items), 63)
+        self.assertIsNone(result.next_cursor)
+
+    def test_shard_error_is_raised(self):
+        class FailingTable(StubTable):
+            def query(self, **kwargs):
+                raise RuntimeError('throttled')
+        with self.assertRaises(RuntimeError):
+            scatter_gather_query(FailingTable([]), 'shardId', self.shard_ids, 'productId')
+
+    def test_add_consumed_capacity(self):
+        total = add_consumed_capacity(None, {'TableName': 'Product', 'CapacityUnits': 1.0})
+        total = add_consumed_capacity(total, None)
+        total = add_consumed_capacity(total, {'TableName': 'Product', 'CapacityUnits': 2.5})
+        self.assertEqual(total, {'TableName': 'Product', 'CapacityUnits': 3.5})
+
+    def test_page_request(self):
+        self.assertEqual(get_page_request(None), (None, None))
+        self.assertEqual(get_page_request({'limit': '5'}), (5, None))
+        self.assertEqual(get_page_request({'cursor': 'abc'})[1], 'abc')
+        for parameters in ({'limit': 'x'}, {'limit': '0'}, {'limit': '100000'}):
+            with self.assertRaises(InvalidPageRequest):
+                get_page_request(parameters)
+        with self.assertRaises(InvalidPageRequest):
+            decode_cursor('not-a-cursor')
+
+
+if __name__ == '__main__':
+    unittest.main()
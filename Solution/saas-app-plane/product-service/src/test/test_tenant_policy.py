@@ -0,0 +1,53 @@
+import unittest
+import sys
+import os
+import glob
+import json
+import re
+import subprocess
+
+SRC = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ""))
+SHARED_SERVICES_SRC = os.path.abspath(os.path.join(SRC, "..", "..", "shared-services", "src"))
+
+# DynamoDB calls of the DAL on the tables it gets with the tenant's STS credentials.
+DAL_CALL = re.compile(r"\b(?:table|client)\.([a-z_]+)\(")
+
+GET_POLICY = """
+from utils import auth_manager
+print(auth_manager.getPolicyForUser('ProductService', 'tenant1', 'us-east-1', '123456789012'))
+"""
+
+
+def get_dal_actions():
+    actions = set()
+    for path in glob.glob(os.path.join(SRC, 'dal', '*.py')):
+        with open(path) as f:
+            for operation in DAL_CALL.findall(f.read()):
+                actions.add('dynamodb:' + ''.join(part.capitalize() for part in operation.split('_')))
+    return actions
+
+
+def get_product_service_policy():
+    # shared-services has its own utils package, the policy is read in a process of its own.
+    output = subprocess.run([sys.executable, '-c', GET_POLICY], cwd=SHARED_SERVICES_SRC, check=True,
+                            capture_output=True, text=True,
+                            env=dict(os.environ, AWS_DEFAULT_REGION='us-east-1')).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+@unittest.skipUnless(os.path.isdir(SHARED_SERVICES_SRC), "shared-services is not next to product-service")
+class TestTenantPolicy(unittest.TestCase):
+
+    def test_policy_allows_every_dal_action(self):
+        actions = get_dal_actions()
+        self.assertIn('dynamodb:BatchWriteItem', actions)
+        self.assertIn('dynamodb:Query', actions)
+        for statement in get_product_service_policy()['Statement']:
+            self.assertEqual(actions - set(statement['Action']), set())
+            # Tenant isolation stays on the partition key.
+            self.assertEqual(statement['Condition']['ForAllValues:StringLike']['dynamodb:LeadingKeys'],
+                             ['tenant1-*'])
+
+
+if __name__ == '__main__':
+    unittest.main()
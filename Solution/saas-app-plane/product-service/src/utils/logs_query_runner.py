@@ -0,0 +1,281 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+# Runs many Logs Insights queries concurrently. A usage query is split by log group, time shard
+# and tenant bucket, the parts are submitted together up to the concurrent query limit and their
+# results are summed back into one Logs Insights shaped result. Parts whose result reaches the
+# 10,000 row cap are split again until every result is complete.
+
+import asyncio
+import os
+import time
+
+from utils.aggregator_util import (
+    RUNNING_QUERY_STATUSES,
+    FAILED_QUERY_STATUSES,
+    get_poll_delay,
+    is_query_result_truncated
+)
+from utils.checkpoint_store import (
+    sum_query_results,
+    merge_slice_totals
+)
+
+# CloudWatch Logs allows a limited number of concurrent Logs Insights queries per account, leave
+# room for the other aggregators and for people running queries from the console.
+DEFAULT_MAX_CONCURRENT_QUERIES = 10
+DEFAULT_MAX_ATTEMPTS = 3
+# Logs Insights stops a query after 60 minutes, give up on it a little earlier.
+DEFAULT_QUERY_TIMEOUT_SECONDS = 55 * 60
+# start_query errors that mean the account is at its concurrent query limit or is throttled.
+RETRYABLE_START_ERRORS = ('LimitExceededException', 'ThrottlingException', 'ServiceUnavailableException')
+HEX_DIGITS = '0123456789abcdef'
+# Queries whose result hits the row cap are split in time down to a single day, then by tenant id
+# prefix up to this many characters.
+DEFAULT_MIN_TIME_SHARD_SECONDS = 24 * 60 * 60
+MAX_TENANT_PREFIX_LENGTH = 8
+
+
+class LogsQueryError(Exception):
+    pass
+
+
+def logs_query(log_group_name, query_string, start_time, end_time, filters=None, tenant_prefix=None,
+               tenant_digits=HEX_DIGITS):
+    # A query over one log group and time range. filters are stacked in front of the query, and
+    # tenant_prefix/tenant_digits describe which tenant ids it covers so it can be split further
+    # (tenant_prefix None means it can not be split by tenant).
+    filters = filters or []
+    query_string_with_filters = query_string
+    for filter_expression in reversed(filters):
+        query_string_with_filters = add_query_filter(query_string_with_filters, filter_expression)
+    return {'log_group_name': log_group_name, 'query_string': query_string_with_filters,
+            'base_query_string': query_string, 'start_time': start_time, 'end_time': end_time,
+            'filters': filters, 'tenant_prefix': tenant_prefix, 'tenant_digits': tenant_digits}
+
+
+def get_time_shards(start_time, end_time, shard_seconds=None) -> list:
+    # Split [start_time, end_time) into consecutive shards of at most shard_seconds.
+    if not shard_seconds or end_time - start_time <= shard_seconds:
+        return [(start_time, end_time)]
+    return [(shard_start, min(shard_start + shard_seconds, end_time))
+            for shard_start in range(start_time, end_time, shard_seconds)]
+
+
+def get_tenant_prefix_filter(tenant_field, prefix, digits):
+    return "{} like /(?i)^{}[{}]/".format(tenant_field, prefix, digits)
+
+
+def get_tenant_remainder_filter(tenant_field, prefix):
+    # Tenant ids that start with prefix but not with prefix followed by a hex digit, at the top
+    # level that includes log events without a tenant id.
+    if prefix == '':
+        return "not ispresent({0}) or {0} not like /(?i)^[0-9a-f]/".format(tenant_field)
+    return "{0} like /(?i)^{1}/ and {0} not like /(?i)^{1}[0-9a-f]/".format(tenant_field, prefix)
+
+
+def get_tenant_buckets(tenant_field, buckets) -> list:
+    # Tenant ids are UUIDs, so buckets are ranges of their first hex digit. The last bucket matches
+    # every tenant id that does not start with a hex digit so no log event is lost. Returns
+    # (filter, tenant_prefix, tenant_digits) for each bucket.
+    if not buckets or buckets <= 1:
+        return [(None, '', HEX_DIGITS)]
+    if buckets > len(HEX_DIGITS):
+        raise ValueError(f"At most {len(HEX_DIGITS)} tenant buckets are supported: {buckets}")
+    size = -(-len(HEX_DIGITS) // buckets)
+    tenant_buckets = [(get_tenant_prefix_filter(tenant_field, '', HEX_DIGITS[index:index + size]), '',
+                       HEX_DIGITS[index:index + size])
+                      for index in range(0, len(HEX_DIGITS), size)]
+    tenant_buckets.append((get_tenant_remainder_filter(tenant_field, ''), None, ''))
+    return tenant_buckets
+
+
+def add_query_filter(query_string, filter_expression):
+    if filter_expression is None:
+        return query_string
+    return "filter {} | {}".format(filter_expression, query_string)
+
+
+def get_sharded_queries(log_group_names, query_string, start_time, end_time, shard_seconds=None,
+                        tenant_field=None, tenant_buckets=None) -> list:
+    # One query per log group, time shard and tenant bucket.
+    buckets = get_tenant_buckets(tenant_field, tenant_buckets) if tenant_field else [(None, None, '')]
+    return [logs_query(log_group_name, query_string, shard_start, shard_end,
+                       filters=[filter_expression] if filter_expression else [],
+                       tenant_prefix=tenant_prefix, tenant_digits=tenant_digits)
+            for log_group_name in log_group_names
+            for shard_start, shard_end in get_time_shards(start_time, end_time, shard_seconds)
+            for filter_expression, tenant_prefix, tenant_digits in buckets]
+
+
+def split_query(query, tenant_field=None, min_time_shard_seconds=DEFAULT_MIN_TIME_SHARD_SECONDS) -> list:
+    # Split a query whose result hit the row cap. Usage is grouped by day, so the time range is
+    # halved while it spans more than min_time_shard_seconds; a single day is split by the next
+    # character of the tenant id instead. Returns [] when the query can not be split any further.
+    start_time, end_time = query['start_time'], query['end_time']
+    if end_time - start_time > min_time_shard_seconds:
+        middle = start_time + (end_time - start_time) // 2
+        return [dict(query, start_time=shard_start, end_time=shard_end)
+                for shard_start, shard_end in ((start_time, middle), (middle, end_time))]
+
+    prefix = query['tenant_prefix']
+    if tenant_field is None or prefix is None or len(prefix) >= MAX_TENANT_PREFIX_LENGTH:
+        return []
+    queries = [logs_query(query['log_group_name'], query['base_query_string'], start_time, end_time,
+                          filters=query['filters'] + [get_tenant_prefix_filter(tenant_field, prefix, digit)],
+                          tenant_prefix=prefix + digit)
+               for digit in query['tenant_digits']]
+    if query['tenant_digits'] == HEX_DIGITS:
+        queries.append(logs_query(query['log_group_name'], query['base_query_string'], start_time, end_time,
+                                  filters=query['filters'] + [get_tenant_remainder_filter(tenant_field, prefix)]))
+    return queries
+
+
+def get_error_code(error):
+    # botocore ClientErrors carry the service error code in their response.
+    return getattr(error, 'response', {}).get('Error', {}).get('Code')
+
+
+def merge_query_results(query_results, key_fields, metric_fields) -> dict:
+    # Sum the partial results of a split query. Only valid for metrics that add up, like count(*)
+    # and sum(), which is what the usage queries compute.
+    slices = {index: sum_query_results(query_result, key_fields, metric_fields)
+              for index, query_result in enumerate(query_results)}
+    merged = merge_slice_totals(slices, key_fields, metric_fields)
+    statistics = {}
+    for query_result in query_results:
+        for name, value in query_result.get('statistics', {}).items():
+            statistics[name] = statistics.get(name, 0.0) + value
+    merged['statistics'] = statistics
+    return merged
+
+
+class LogsQueryRunner:
+    def __init__(self, logs, max_concurrent_queries=DEFAULT_MAX_CONCURRENT_QUERIES,
+                 max_attempts=DEFAULT_MAX_ATTEMPTS, query_timeout_seconds=DEFAULT_QUERY_TIMEOUT_SECONDS,
+                 initial_poll_interval=None, max_poll_interval=None):
+        self.logs = logs
+        self.max_concurrent_queries = max_concurrent_queries
+        self.max_attempts = max_attempts
+        self.query_timeout_seconds = query_timeout_seconds
+        self.poll_delay_args = {}
+        if initial_poll_interval is not None:
+            self.poll_delay_args['initial_delay'] = initial_poll_interval
+        if max_poll_interval is not None:
+            self.poll_delay_args['max_delay'] = max_poll_interval
+        self.stats = {'queries': 0, 'queries_started': 0, 'polls': 0, 'retries': 0, 'splits': 0}
+
+    def run_queries(self, queries) -> list:
+        # Results are returned in the order of the queries.
+        return asyncio.run(self.run_queries_async(queries))
+
+    async def run_queries_async(self, queries) -> list:
+        # The semaphore is created inside the running event loop.
+        semaphore = asyncio.Semaphore(self.max_concurrent_queries)
+        self.stats['queries'] += len(queries)
+        return await asyncio.gather(*(self._run_query(semaphore, query) for query in queries))
+
+    async def _sleep(self, attempt):
+        await asyncio.sleep(get_poll_delay(attempt, **self.poll_delay_args))
+
+    async def _run_query(self, semaphore, query) -> dict:
+        async with semaphore:
+            status = None
+            for attempt in range(self.max_attempts):
+                if attempt > 0:
+                    self.stats['retries'] += 1
+                    await self._sleep(attempt)
+                query_id = await self._start_query(query)
+                query_results = await self._wait_for_results(query_id)
+                status = query_results['status']
+                if status not in FAILED_QUERY_STATUSES:
+                    return query_results
+                print(f"Logs Insights query {query_id} on {query['log_group_name']} ended with {status}, "
+                      f"attempt {attempt + 1} of {self.max_attempts}")
+            raise LogsQueryError(f"Logs Insights query on {query['log_group_name']} ended with {status} "
+                                 f"after {self.max_attempts} attempts")
+
+    async def _start_query(self, query) -> str:
+        attempt = 0
+        while True:
+            try:
+                response = await asyncio.to_thread(self.logs.start_query,
+                                                   logGroupName=query['log_group_name'],
+                                                   startTime=query['start_time'],
+                                                   endTime=query['end_time'],
+                                                   queryString=query['query_string'])
+                self.stats['queries_started'] += 1
+                return response['queryId']
+            except Exception as e:
+                # Other callers can hold the account's concurrent queries, wait for one to finish.
+                attempt += 1
+                if get_error_code(e) not in RETRYABLE_START_ERRORS or attempt >= self.max_attempts:
+                    raise
+                self.stats['retries'] += 1
+                await self._sleep(attempt)
+
+    async def _wait_for_results(self, query_id) -> dict:
+        deadline = time.monotonic() + self.query_timeout_seconds
+        attempt = 0
+        while True:
+            query_results = await asyncio.to_thread(self.logs.get_query_results, queryId=query_id)
+            self.stats['polls'] += 1
+            if query_results['status'] not in RUNNING_QUERY_STATUSES:
+                return query_results
+            if time.monotonic() >= deadline:
+                await asyncio.to_thread(self.logs.stop_query, queryId=query_id)
+                return dict(query_results, status='Timeout')
+            await self._sleep(attempt)
+            attempt += 1
+
+    def get_stats(self) -> dict:
+        return dict(self.stats)
+
+
+def run_planned_queries(runner, queries, tenant_field=None,
+                        min_time_shard_seconds=DEFAULT_MIN_TIME_SHARD_SECONDS) -> list:
+    # Run the queries, then split every query whose result is at the row cap and run its parts,
+    # until no result is truncated. Each round runs all of its queries concurrently.
+    complete_results = []
+    while queries:
+        round_results = runner.run_queries(queries)
+        split_queries = []
+        for query, query_results in zip(queries, round_results):
+            if not is_query_result_truncated(query_results):
+                complete_results.append(query_results)
+                continue
+            parts = split_query(query, tenant_field, min_time_shard_seconds)
+            if not parts:
+                print(f"Logs Insights result for {query['log_group_name']} with {query['filters']} is at the row "
+                      f"cap and can not be split further, usage may be truncated")
+                complete_results.append(query_results)
+                continue
+            runner.stats['splits'] += 1
+            split_queries.extend(parts)
+        queries = split_queries
+    return complete_results
+
+
+def get_logs_query_runner_from_env(logs) -> LogsQueryRunner:
+    return LogsQueryRunner(logs,
+                           max_concurrent_queries=int(os.getenv("LOGS_MAX_CONCURRENT_QUERIES",
+                                                                DEFAULT_MAX_CONCURRENT_QUERIES)),
+                           max_attempts=int(os.getenv("LOGS_QUERY_MAX_ATTEMPTS", DEFAULT_MAX_ATTEMPTS)))
+
+
+def run_sharded_query(logs, log_group_names, query_string, start_time, end_time, key_fields, metric_fields,
+                      tenant_field=None, runner=None) -> dict:
+    # Split a usage query by log group, time shard and tenant bucket, run the parts concurrently
+    # and merge them. LOGS_QUERY_SHARD_MINUTES and LOGS_QUERY_TENANT_BUCKETS control the split, by
+    # default the query runs once per log group and is only split when its result hits the row cap.
+    if runner is None:
+        runner = get_logs_query_runner_from_env(logs)
+    shard_minutes = int(os.getenv("LOGS_QUERY_SHARD_MINUTES", "0"))
+    tenant_buckets = int(os.getenv("LOGS_QUERY_TENANT_BUCKETS", "1"))
+    queries = get_sharded_queries(log_group_names, query_string, start_time, end_time,
+                                  shard_seconds=shard_minutes * 60, tenant_field=tenant_field,
+                                  tenant_buckets=tenant_buckets)
+    query_results = run_planned_queries(runner, queries, tenant_field)
+    merged = merge_query_results(query_results, key_fields, metric_fields)
+    print(f"Merged {len(query_results)} Logs Insights results: {runner.get_stats()}")
+    return merged
@@ -1,5 +1,9 @@
 #!/bin/bash
 
+# Copies today's usage reports to the previous days to generate sample data. To recompute the real
+# usage of past days, run the aggregators over the date range with utils/backfill.py instead, e.g.
+#   cd src && python -m utils.backfill coarse_grained_aggregator:CoarseGrainedAggregator --start 2024-07-01
+
 # Get region
 export AWS_REGION=$(aws configure get region)
 if [ -z "$AWS_REGION" ]; then
@@ -18,6 +22,17 @@ OUTPUT_LOCATION="s3://$ATHENA_OUTPUT_BUCKET_NAME/athena-query-results/"
 COARSE_GRAINED_LOCATION="s3://$TENANT_USAGE_BUCKET/coarse_grained/"
 FINE_GRAINED_LOCATION="s3://$TENANT_USAGE_BUCKET/fine_grained/"
 
+# Unload in the same format the aggregators write (USAGE_OUTPUT_FORMAT=parquet on the aggregator Lambdas).
+if [ "$USAGE_OUTPUT_FORMAT" == "parquet" ]; then
+    UNLOAD_FORMAT="PARQUET"
+    UNLOAD_COMPRESSION="SNAPPY"
+    DATE_EXPRESSION="DATE_ADD('day', DATE_OFFSET, CAST(date AS timestamp))"
+else
+    UNLOAD_FORMAT="JSON"
+    UNLOAD_COMPRESSION="NONE"
+    DATE_EXPRESSION="DATE_FORMAT(DATE_ADD('day', DATE_OFFSET, CAST(date AS timestamp)), '%Y-%m-%d 00:00:00.000')"
+fi
+
 # for loop the below section with decrement date_offset parameter
 for date_offset in {-1..-3}; do
     # Escape single quotes in the query
@@ -26,7 +41,7 @@ for date_offset in {-1..-3}; do
     COARSE_GRAINED_QUERY="UNLOAD (
         SELECT 
             tenant_id, 
-            DATE_FORMAT(DATE_ADD('day', $date_offset, CAST(date AS timestamp)), '%Y-%m-%d 00:00:00.000') AS date, 
+            ${DATE_EXPRESSION//DATE_OFFSET/$date_offset} AS date, 
             usage_unit, 
             tenant_usage, 
             total_usage, 
@@ -42,8 +57,8 @@ for date_offset in {-1..-3}; do
     )
     TO '$COARSE_GRAINED_LOCATION'
     WITH (
-        format = 'JSON',
-        compression = 'NONE',
+        format = '$UNLOAD_FORMAT',
+        compression = '$UNLOAD_COMPRESSION',
         partitioned_by = ARRAY['year', 'month']
     )"
 
@@ -80,7 +95,7 @@ for date_offset in {-1..-3}; do
     FINE_GRAINED_QUERY="UNLOAD (
         SELECT 
             tenant_id, 
-            DATE_FORMAT(DATE_ADD('day', $date_offset, CAST(date AS timestamp)), '%Y-%m-%d 00:00:00.000') AS date, 
+            ${DATE_EXPRESSION//DATE_OFFSET/$date_offset} AS date, 
             usage_unit, 
             service_name, 
             tenant_usage, 
@@ -97,8 +112,8 @@ for date_offset in {-1..-3}; do
     )
     TO '$FINE_GRAINED_LOCATION'
     WITH (
-        format = 'JSON',
-        compression = 'NONE',
+        format = '$UNLOAD_FORMAT',
+        compression = '$UNLOAD_COMPRESSION',
         partitioned_by = ARRAY['year', 'month']
     )"
 
@@ -8,11 +8,20 @@ from decimal import *
 from datetime import datetime
 
 from utils.aggregator_util import (
-    query_cloudwatch_logs,
     get_start_date_time,
-    get_end_date_time,
-    get_s3_key,
-    get_line_delimited_json
+    get_end_date_time
+)
+from utils.checkpoint_store import (
+    aggregate_incremental_usage,
+    get_checkpoint_store_from_env
+)
+from utils.output_format import write_usage_report
+from utils.logs_query_runner import run_sharded_query
+from utils.apportionment import (
+    get_result_columns,
+    to_int_column,
+    usage_metric,
+    apportion_usage
 )
 
 cloudformation = boto3.client('cloudformation')
@@ -25,55 +34,47 @@ tenant_usage_bucket = os.getenv("TENANT_USAGE_BUCKET")
 
 # This function needs to be scheduled on daily basis
 class CoarseGrainedAggregator(IAggregator):
-    def calculate_daily_attribution_by_tenant(self):
-        start_date_time = get_start_date_time()  # previous day epoch
-        end_date_time = get_end_date_time()  # current day epoch
-
-        usage_by_tenant = self.aggregate_tenant_usage(start_date_time, end_date_time)
+    # Logs Insights result fields used to merge incremental slices.
+    key_fields = ['TenantId', 'date']
+    metric_fields = ['ApiCalls']
+    # Where the daily reports are written in the tenant usage bucket.
+    report_prefix = 'coarse_grained'
+    report_service = 'product'
+
+    def calculate_daily_attribution_by_tenant(self, checkpoint_store=None):
+        if checkpoint_store is None:
+            start_date_time = get_start_date_time()  # previous day epoch
+            end_date_time = get_end_date_time()  # current day epoch
+
+            usage_by_tenant = self.aggregate_tenant_usage(start_date_time, end_date_time)
+        else:
+            # Only query the logs after the last checkpoint and merge them into the daily totals.
+            usage_by_tenant = aggregate_incremental_usage(self, checkpoint_store, 'coarse_grained-product',
+                                                          self.key_fields, self.metric_fields)
         print(usage_by_tenant)
 
         apportioned_usage = self.apportion_overall_usage_by_tenant(usage_by_tenant)
         print("CoarseGrainedAggregator apportioned_usage success: ", apportioned_usage)
-        line_delimited_json = get_line_delimited_json(apportioned_usage)
 
-        s3_key = get_s3_key('coarse_grained', 'product')
-        s3.put_object(Body=str(line_delimited_json), Bucket=tenant_usage_bucket, Key=s3_key)
+        write_usage_report(s3, tenant_usage_bucket, self.report_prefix, self.report_service, apportioned_usage)
 
     def apportion_overall_usage_by_tenant(self, usage_by_tenant) -> list:
-        tenant_usage = []
-        total_api_calls = 0
-        tenant_id = ''
-        date = ''
-        api_calls = 0
-        for result in usage_by_tenant['results']:
-            for field in result:
-                if field['field'] == 'ApiCalls':
-                    api_calls = int(field['value'])
-            total_api_calls += api_calls
-
-        for result in usage_by_tenant['results']:
-            for field in result:
-                if field['field'] == 'TenantId':
-                    tenant_id = field['value']
-                if field['field'] == 'date':
-                    date = field['value']
-                if field['field'] == 'ApiCalls':
-                    api_calls = int(field['value'])
-
-            tenant_usage.append({"tenant_id": tenant_id, "date": date, "usage_unit": "API Calls",
-                                 "tenant_usage": api_calls, "total_usage": total_api_calls,
-                                 "tenant_percent_usage": round((api_calls / total_api_calls) * 100,1)})
-
-        return tenant_usage
+        columns = get_result_columns(usage_by_tenant, ['TenantId', 'date', 'ApiCalls'])
+        api_calls = to_int_column(columns['ApiCalls'])
+
+        return apportion_usage(columns['TenantId'], columns['date'], [
+            usage_metric("API Calls", api_calls)
+        ], usage_precision=None)
 
     def aggregate_tenant_usage(self, start_date_time, end_date_time) -> dict:
         usage_by_tenant_query = 'stats count(*) as ApiCalls by tenantId as TenantId, datefloor(@timestamp, 1d) as date'
 
-        usage_by_tenant = query_cloudwatch_logs(logs, log_group_name,
-                                                usage_by_tenant_query, start_date_time, end_date_time)
+        usage_by_tenant = run_sharded_query(logs, [log_group_name], usage_by_tenant_query,
+                                            start_date_time, end_date_time, self.key_fields, self.metric_fields,
+                                            tenant_field='tenantId')
         return usage_by_tenant
 
 
 def lambda_handler(event, context):
     aggregator = CoarseGrainedAggregator()
-    aggregator.calculate_daily_attribution_by_tenant()
+    aggregator.calculate_daily_attribution_by_tenant(get_checkpoint_store_from_env(s3))
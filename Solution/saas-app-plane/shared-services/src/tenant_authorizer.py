@@ -98,6 +98,8 @@ def lambda_handler(event, context):
             'accesskey': credentials['AccessKeyId'],
             'secretkey': credentials['SecretAccessKey'],
             'sessiontoken': credentials["SessionToken"],
+            # Lets the services drop the clients they cache for these credentials before they expire
+            'expiration': credentials['Expiration'].isoformat(),
             'userName': user_name,
             'tenantId': tenant_id,
             'idpDetials': str(idp_details),
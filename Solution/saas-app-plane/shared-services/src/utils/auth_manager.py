@@ -75,7 +75,9 @@ def __getPolicyForProductService(tenant_id, region, aws_account_id):
                     "dynamodb:GetItem",
                     "dynamodb:PutItem",
                     "dynamodb:DeleteItem",
-                    "dynamodb:Query"
+                    "dynamodb:Query",
+                    "dynamodb:BatchGetItem",
+                    "dynamodb:BatchWriteItem"
                 ],
                 "Resource": [
                     "arn:aws:dynamodb:{0}:{1}:table/*".format(
@@ -96,7 +98,9 @@ def __getPolicyForProductService(tenant_id, region, aws_account_id):
                     "dynamodb:GetItem",
                     "dynamodb:PutItem",
                     "dynamodb:DeleteItem",
-                    "dynamodb:Query"
+                    "dynamodb:Query",
+                    "dynamodb:BatchGetItem",
+                    "dynamodb:BatchWriteItem"
                 ],
                 "Resource": [
                     "arn:aws:dynamodb:{0}:{1}:table/*".format(
@@ -0,0 +1,122 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import io
+import os
+from abc import ABC, abstractmethod
+from datetime import datetime
+
+from utils.aggregator_util import get_s3_key, write_line_delimited_json
+
+# Columns of a tenant usage record, in the order they are written.
+USAGE_COLUMNS = ['tenant_id', 'date', 'usage_unit', 'service_name', 'tenant_usage', 'total_usage',
+                 'tenant_percent_usage']
+# Low cardinality string columns that are dictionary encoded in columnar formats.
+DICTIONARY_COLUMNS = ['tenant_id', 'usage_unit', 'service_name']
+USAGE_DATE_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+DEFAULT_ROW_GROUP_SIZE = 100000
+
+
+class OutputFormat(ABC):
+    extension = ''
+
+    @abstractmethod
+    def write(self, s3, bucket, key, records) -> dict:
+        pass
+
+
+class NdjsonOutputFormat(OutputFormat):
+    def __init__(self, gzip_output=False):
+        self.gzip_output = gzip_output
+        self.extension = '.json'
+
+    def write(self, s3, bucket, key, records) -> dict:
+        return write_line_delimited_json(s3, bucket, key, records, gzip_output=self.gzip_output)
+
+
+class ParquetOutputFormat(OutputFormat):
+    def __init__(self, row_group_size=DEFAULT_ROW_GROUP_SIZE, compression='snappy'):
+        # pyarrow is only needed by the aggregators that write Parquet.
+        import pyarrow
+        import pyarrow.parquet
+        self.pa = pyarrow
+        self.pq = pyarrow.parquet
+        self.row_group_size = row_group_size
+        self.compression = compression
+        self.extension = '.parquet'
+        self.schema = pyarrow.schema([
+            ('tenant_id', pyarrow.string()),
+            ('date', pyarrow.timestamp('ms')),
+            ('usage_unit', pyarrow.string()),
+            ('service_name', pyarrow.string()),
+            ('tenant_usage', pyarrow.float64()),
+            ('total_usage', pyarrow.float64()),
+            ('tenant_percent_usage', pyarrow.float64())
+        ])
+
+    def _to_row_group(self, rows):
+        columns = {column: [] for column in USAGE_COLUMNS}
+        for row in rows:
+            for column in USAGE_COLUMNS:
+                value = row.get(column)
+                if column == 'date' and isinstance(value, str):
+                    value = datetime.strptime(value, USAGE_DATE_FORMAT)
+                elif value is not None and column in ('tenant_usage', 'total_usage', 'tenant_percent_usage'):
+                    value = float(value)
+                columns[column].append(value)
+        return self.pa.Table.from_pydict(columns, schema=self.schema)
+
+    def write(self, s3, bucket, key, records) -> dict:
+        # Records are written in row groups as they arrive, each with min/max statistics so
+        # Athena can skip row groups that do not match a tenant or date predicate.
+        buffer = io.BytesIO()
+        records_written = 0
+        row_groups = 0
+        with self.pq.ParquetWriter(buffer, self.schema, compression=self.compression,
+                                   use_dictionary=DICTIONARY_COLUMNS, write_statistics=True) as writer:
+            rows = []
+            for record in records:
+                rows.append(record)
+                if len(rows) >= self.row_group_size:
+                    writer.write_table(self._to_row_group(rows))
+                    records_written += len(rows)
+                    row_groups += 1
+                    rows = []
+            if rows or row_groups == 0:
+                writer.write_table(self._to_row_group(rows))
+                records_written += len(rows)
+                row_groups += 1
+        body = buffer.getvalue()
+        s3.put_object(Body=body, Bucket=bucket, Key=key)
+        stats = {'records_written': records_written, 'bytes_uploaded': len(body), 'row_groups': row_groups,
+                 'key': key}
+        print(f"Uploaded s3://{bucket}/{key}: {stats}")
+        return stats
+
+
+def get_output_format(format_name=None) -> OutputFormat:
+    # The report format is selected with the USAGE_OUTPUT_FORMAT environment variable.
+    if format_name is None:
+        format_name = os.getenv("USAGE_OUTPUT_FORMAT", "ndjson")
+    format_name = format_name.lower()
+    if format_name in ('ndjson', 'json'):
+        return NdjsonOutputFormat()
+    if format_name == 'ndjson-gzip':
+        return NdjsonOutputFormat(gzip_output=True)
+    if format_name == 'parquet':
+        return ParquetOutputFormat()
+    raise ValueError(f"Unsupported usage output format: {format_name}")
+
+
+def write_usage_report(s3, bucket, prefix, service, records, output_format=None, report_date=None) -> dict:
+    # Write the apportioned usage records under prefix/year=/month=/ in the configured format.
+    if output_format is None:
+        output_format = get_output_format()
+    s3_key = get_s3_key(prefix, service, output_format.extension, report_date)
+    return output_format.write(s3, bucket, s3_key, records)
+
+
+def usage_report_exists(s3, bucket, prefix, service, report_date=None) -> bool:
+    # True when a report for the day has already been written, in any output format.
+    response = s3.list_objects_v2(Bucket=bucket, Prefix=get_s3_key(prefix, service, '', report_date), MaxKeys=1)
+    return response.get('KeyCount', 0) > 0
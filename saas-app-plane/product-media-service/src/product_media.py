@@ -2,19 +2,18 @@ from flask import Flask, request, jsonify, Response
 import boto3
 from botocore.exceptions import NoCredentialsError, PartialCredentialsError, ClientError
 import os
-from jose import jwk, jwt
-from jose.utils import base64url_decode
+from tenant_auth import InvalidToken, get_tenant_context, get_tenant_id
 
 app = Flask(__name__)
 
-def get_tenant_id(request):
-    bearer_token = request.headers.get('Authorization')
-    if not bearer_token:
-        return None
-    token = bearer_token.split(" ")[1]
-    # get the tenant id from the token
-    tenant_id = jwt.get_unverified_claims(token)['custom:tenantId']
-    return tenant_id
+@app.before_request
+def authenticate():
+    # Verifies the bearer token (cached per token until it expires) and puts the tenant on the request.
+    try:
+        request.tenant_context = get_tenant_context(request.headers)
+    except InvalidToken as error:
+        app.logger.error(f"Rejected token: {error}")
+        return jsonify({"error": "Unauthorized"}), 401
 
 @app.route('/')
 def home():
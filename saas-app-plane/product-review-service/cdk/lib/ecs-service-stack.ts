@@ -104,7 +104,12 @@ export class ECSServiceStack extends cdk.Stack {
         AWS_EMF_LOG_GROUP_NAME: "ProductReviewLogGroup",
         AWS_EMF_LOG_STREAM_NAME: "ProductReview",
         AWS_EMF_AGENT_ENDPOINT: "tcp://localhost:25888",
-        AWS_EMF_NAMESPACE: "saas-app"
+        AWS_EMF_NAMESPACE: "saas-app",
+        // Inject per-tenant DB load for the usage attribution lab, see load_profile.py. Use "production" for none.
+        LOAD_PROFILE: "synthetic",
+        // Tokens are verified against the tenant user pool, see tenant_auth.py.
+        USER_POOL_ID: cdk.Fn.importValue('TenantUserpoolId'),
+        APP_CLIENT_ID: cdk.Fn.importValue('TenantUserPoolClientId')
       },
       logging: ecs.LogDriver.awsLogs({
         streamPrefix: 'ProductReview',
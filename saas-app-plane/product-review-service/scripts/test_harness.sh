@@ -1,5 +1,7 @@
 #!/bin/bash -e
 
+# Seeds data and drives the deployed service through API Gateway. For repeatable throughput, latency and
+# attribution numbers against a local instance use load_generator.py.
 SAAS_CONTROL_PLANE_STACK_NAME=SaaSControlPlaneStack
 SHARED_SERVICES_STACK_NAME=SharedServicesStack
 echo "Testing Product Review service..."
@@ -4,11 +4,20 @@ import os
 from datetime import datetime
 
 from utils.aggregator_util import (
-    query_cloudwatch_logs,
     get_start_date_time,
-    get_end_date_time,
-    get_s3_key,
-    get_line_delimited_json
+    get_end_date_time
+)
+from utils.checkpoint_store import (
+    aggregate_incremental_usage,
+    get_checkpoint_store_from_env
+)
+from utils.output_format import write_usage_report
+from utils.logs_query_runner import run_sharded_query
+from utils.apportionment import (
+    get_result_columns,
+    to_float_column,
+    usage_metric,
+    apportion_usage
 )
 
 logs = boto3.client('logs')
@@ -18,19 +27,29 @@ tenant_usage_bucket = os.getenv("TENANT_USAGE_BUCKET")
 ecs_log_group = os.getenv("ECS_CLOUDWATCH_LOG_GROUP")
 
 class FineGrainedAggregator(IAggregator):
-    def calculate_daily_attribution_by_tenant(self):
+    # Logs Insights result fields used to merge incremental slices.
+    key_fields = ['Tenant', 'date', 'ServiceName']
+    metric_fields = ['ExecutionTime']
+    # Where the daily reports are written in the tenant usage bucket.
+    report_prefix = 'fine_grained'
+    report_service = 'product-review-ecs'
+
+    def calculate_daily_attribution_by_tenant(self, checkpoint_store=None):
         try:
-            # Get start and end datetime for daily usage.
-            start_date_time = get_start_date_time()  # previous day epoch
-            end_date_time = get_end_date_time()  # current day epoch
-    
-            # Logs Insights to retrieve aggregated fine-grained consumption metrics for billing duration and DynamoDB Capacity units.
-            usage_by_tenant = self.aggregate_tenant_usage(start_date_time, end_date_time)
+            if checkpoint_store is None:
+                # Get start and end datetime for daily usage.
+                start_date_time = get_start_date_time()  # previous day epoch
+                end_date_time = get_end_date_time()  # current day epoch
+
+                # Logs Insights to retrieve aggregated fine-grained consumption metrics for billing duration and DynamoDB Capacity units.
+                usage_by_tenant = self.aggregate_tenant_usage(start_date_time, end_date_time)
+            else:
+                # Only query the logs after the last checkpoint and merge them into the daily totals.
+                usage_by_tenant = aggregate_incremental_usage(self, checkpoint_store, 'fine_grained-product-review-ecs',
+                                                              self.key_fields, self.metric_fields)
             apportioned_usage = self.apportion_overall_usage_by_tenant(usage_by_tenant)
     
-            line_delimited_json = get_line_delimited_json(apportioned_usage)
-            s3_key = get_s3_key('fine_grained','product-review-ecs')
-            s3.put_object(Body=str(line_delimited_json), Bucket=tenant_usage_bucket, Key=s3_key)
+            s3_key = write_usage_report(s3, tenant_usage_bucket, self.report_prefix, self.report_service, apportioned_usage)['key']
             return {
                 'statusCode': 200,
                 'body': f'ECS tenant usage data  uploaded to S3 at s3://{tenant_usage_bucket}/{s3_key}'
@@ -39,36 +58,12 @@ class FineGrainedAggregator(IAggregator):
             print("error:", str(e))
             
     def apportion_overall_usage_by_tenant(self, usage_by_tenant) -> list:
-        tenant_usage = []
-        total_billed_duration = 0
-        tenant_id = ''
-        date = ''
-        tenant_total_billed_duration = 0
-        # Calculate totals first.
-        for result in usage_by_tenant['results']:
-            for field in result:
-                if field['field'] in ['ExecutionTime']:
-                    total_billed_duration += float(field['value'])
-                
-        # Iterate results per tenant.
-        for result in usage_by_tenant['results']:
-            tenant_total_billed_duration = 0
-            for field in result:
-                if field['field'] == 'Tenant':
-                    tenant_id = field['value']
-                if field['field'] == 'date':
-                    date = field['value']
-                if field['field'] in ['ExecutionTime']:
-                    tenant_total_billed_duration += float(field['value'])
-                
-            # ECS billed_duration_ms.
-            tenant_usage.append({"tenant_id": tenant_id, "date": date, "usage_unit": "execution_duration_seconds",
-                                 "service_name": "AmazonECS",
-                                 "tenant_usage": round(tenant_total_billed_duration, 1), "total_usage": round(total_billed_duration, 1),
-                                 "tenant_percent_usage": round(
-                                     (tenant_total_billed_duration / total_billed_duration) * 100, 1)})
+        columns = get_result_columns(usage_by_tenant, ['Tenant', 'date', 'ExecutionTime'])
 
-        return tenant_usage
+        return apportion_usage(columns['Tenant'], columns['date'], [
+            # ECS execution time.
+            usage_metric("execution_duration_seconds", to_float_column(columns['ExecutionTime']), "AmazonECS")
+        ])
 
     def aggregate_tenant_usage(self, start_date_time, end_date_time) -> dict:
         #TODO: Uncomment the below lines to aggregate the Execution time 
@@ -78,15 +73,16 @@ class FineGrainedAggregator(IAggregator):
         #usage_by_tenant_query += "| sort by Tenant" 
     
 
-        usage_by_tenant = query_cloudwatch_logs(logs, ecs_log_group,
-                                                usage_by_tenant_query, start_date_time, end_date_time)
+        usage_by_tenant = run_sharded_query(logs, [ecs_log_group], usage_by_tenant_query,
+                                            start_date_time, end_date_time, self.key_fields, self.metric_fields,
+                                            tenant_field='Tenant')
         print(f'usage_by_tenant: {usage_by_tenant}')
         return usage_by_tenant
 
     
 def lambda_handler(event, context):
     aggregator = FineGrainedAggregator()
-    ecsaggregator = aggregator.calculate_daily_attribution_by_tenant()
+    ecsaggregator = aggregator.calculate_daily_attribution_by_tenant(get_checkpoint_store_from_env(s3))
     return 
     {
         'statusCode': 200,
@@ -9,121 +9,88 @@ import json
 import psycopg
 from psycopg.rows import dict_row
 from utils.aggregator_util import (
-    get_s3_key,
-    get_line_delimited_json,
     get_formatted_start_of_day
 )
+from utils.output_format import write_usage_report
+from utils.secrets_cache import get_secrets_cache_from_env
+from utils.checkpoint_store import S3CheckpointStore, get_checkpoint_store_from_env
+from utils.statement_snapshots import get_tenant_usage_rows, take_statement_snapshot, update_daily_usage
+from utils.apportionment import (
+    get_row_columns,
+    to_float_column,
+    usage_metric,
+    apportion_usage
+)
 
 s3 = boto3.client('s3')
 secrets_manager = boto3.client('secretsmanager')
+secrets_cache = get_secrets_cache_from_env(secrets_manager)
 
 tenant_usage_bucket = os.getenv("TENANT_USAGE_BUCKET")
 secret_name = os.environ['SECRET_NAME']
 db_name_fromenv = os.getenv("PRODUCT_REVIEW_DB_NAME")
 
+CHECKPOINT_NAME = 'fine_grained-product-review-pg_stat'
+
+
+def get_blocks_written_read(columns, block_type):
+    return [float(blks_read + blks_written) for blks_read, blks_written
+            in zip(columns[f"{block_type}_blks_read"], columns[f"{block_type}_blks_written"])]
+
+
+def get_tenant_aurora_usage(results, date):
+    # Apportion the execution time, read/write block units and WAL bytes across tenants
+    columns = get_row_columns(results, ['tenant_id', 'total_exec_time', 'shared_blks_read', 'shared_blks_written',
+                                        'local_blks_read', 'local_blks_written', 'temp_blks_read',
+                                        'temp_blks_written', 'wal_bytes'])
+    return apportion_usage(columns['tenant_id'], [date] * len(results), [
+        usage_metric("execution_duration_ms", to_float_column(columns['total_exec_time']), "AmazonRDS"),
+        usage_metric("shared_blks_written_read", get_blocks_written_read(columns, 'shared'), "AmazonRDS"),
+        usage_metric("local_blks_written_read", get_blocks_written_read(columns, 'local'), "AmazonRDS"),
+        usage_metric("temp_blks_written_read", get_blocks_written_read(columns, 'temp'), "AmazonRDS"),
+        usage_metric("wal_bytes", to_float_column(columns['wal_bytes']), "AmazonRDS")
+    ])
+
 
 def lambda_handler(event, context):
     
-    try:
-        get_secret_value_response = secrets_manager.get_secret_value(
-            SecretId=secret_name
-    )
-    except Exception as e:
-        # Handle the exception here
-        raise e
-    
-    # Retrieve the secret value from the response
-    secret_value = get_secret_value_response['SecretString']
-    
-    #Assuming the secret value is a JSON string
-    secret_dict = json.loads(secret_value)
-    db_password = secret_dict['password']
+    # The database credentials are cached across invocations of the same Lambda environment.
+    secret_dict = secrets_cache.get_secret_json(secret_name)
     db_host = secret_dict['host']
     db_name = db_name_fromenv
     db_user = secret_dict['username']
     s3_bucket = tenant_usage_bucket
-    print(db_host,db_name,db_user,db_password,s3_bucket)
+    print(db_host,db_name,db_user,s3_bucket)
     # get the date to be used in the output report
     date = get_formatted_start_of_day()
     print(date)
     # Connect to the Aurora PostgreSQL database
     try:
-        conn = psycopg.connect(
-            host=db_host,
+        # Rotated credentials are rejected, call_with_secret fetches the secret again and reconnects.
+        conn = secrets_cache.call_with_secret(secret_name, lambda secret: psycopg.connect(
+            host=secret['host'],
             dbname=db_name,
-            user=db_user,
-            password=db_password
-        )
+            user=secret['username'],
+            password=secret['password']
+        ))
+
+        # pg_stat_statements is never reset, the usage since the previous run is the difference between
+        # its counters and the snapshot kept in the checkpoint, see utils/statement_snapshots.py.
+        checkpoint_store = get_checkpoint_store_from_env(s3) or S3CheckpointStore(s3, s3_bucket)
+        snapshot = take_statement_snapshot(conn)
+        checkpoint, stats = update_daily_usage(checkpoint_store.load(CHECKPOINT_NAME), snapshot, date)
+        print(stats)
+        if stats['baseline']:
+            checkpoint_store.save(CHECKPOINT_NAME, checkpoint)
+            return {
+                'statusCode': 200,
+                'body': 'First pg_stat_statements snapshot stored, usage is reported from the next run'
+            }
+        tenant_aurora_usage = get_tenant_aurora_usage(get_tenant_usage_rows(checkpoint['daily_usage']), date)
 
-        # Create a cursor with RealDictCursor to get the results as a dictionary
-        with conn.cursor(row_factory=dict_row) as cur:
-            # Execute the SQL statement
-            cur.execute("""
-            select a.userid as db_user_id, b.rolname as tenant_id, sum(a.total_exec_time) as total_exec_time, 
-            sum(a.shared_blks_read) as shared_blks_read, sum(a.shared_blks_written) as shared_blks_written 
-            from pg_stat_statements a, pg_catalog.pg_roles b 
-            where a.userid = b.oid and b.rolname not in ('rdsadmin','postgres', 'saasadmin')
-            group by tenant_id, a.userid;
-                """)
-            # Get the results as a list of dictionaries
-            results = cur.fetchall()
-            print(results)
-        # Upload the results to an S3 bucket as a CSV file
-        total_usage_execution_time = 0.0
-        total_shared_blks_written_read = 0.0
-        
-        # calculate the total execution time and total shared read/write block units
-        for data in results:
-            print("data",data)
-            total_usage_execution_time +=  data['total_exec_time']
-            total_shared_blks_written_read += float(data['shared_blks_read'])
-            total_shared_blks_written_read += float(data['shared_blks_written'])
-        
-        print(total_usage_execution_time)
-        print(total_shared_blks_written_read)
-        ## calculate aggregate per tenant_id
-        tenant_aurora_usage = []
-        
-        for row in results:
-            print(row)
-            tenant_usage_read_write_block = 0.0
-            tenant_id = row['tenant_id']
-            tenant_usage_execution_time = row['total_exec_time']
-            tenant_usage_read_write_block = float(row['shared_blks_read'] + row['shared_blks_written'])
-            print('tenant_usage_execution_time',tenant_usage_execution_time)
-            print('tenant_usage_read_write_block',tenant_usage_read_write_block)
-            # check if total_usage_execution_time is zero to avoid division by zero error
-            if total_usage_execution_time == 0:
-                total_usage_execution_time = 1
-            tenant_aurora_usage.append({"tenant_id": tenant_id, "date": date, "usage_unit": "execution_duration_ms",
-                "service_name": "AmazonRDS", 
-                "tenant_usage": round(tenant_usage_execution_time, 1),
-                "total_usage": round(total_usage_execution_time, 1),
-                "tenant_percent_usage": round((tenant_usage_execution_time / total_usage_execution_time) *100, 1)
-            })
-            print('percentage:',(tenant_usage_execution_time / total_usage_execution_time) *100)
-            # check if total_shared_blks_written_read is zero to avoid division by zero error
-            if total_shared_blks_written_read == 0:
-                total_shared_blks_written_read = 1
-            tenant_aurora_usage.append({"tenant_id": tenant_id, "date": date, "usage_unit": "shared_blks_written_read",
-                "service_name": "AmazonRDS", 
-                "tenant_usage": round(tenant_usage_read_write_block, 1),
-                "total_usage": round(total_shared_blks_written_read, 1),
-                "tenant_percent_usage": round((tenant_usage_read_write_block / total_shared_blks_written_read) *100, 1)
-            })
-        
-        tenant_aurora_usage_line_delimited = get_line_delimited_json(tenant_aurora_usage) 
-        s3_key = get_s3_key('fine_grained', 'product-review-pg_stat')
-        response = s3.put_object(
-                        Bucket=s3_bucket,
-                        Key=s3_key,
-                        Body=str(tenant_aurora_usage_line_delimited))
-                
-        # now that we have collected the data points we shall do pg_stat_statements_reset() so that to avoid double counting during next run
-        # for lab purposes, this had been commented out. For production scenario, you can un-comment it out
-        # cur.execute("""
-        # SELECT pg_stat_statements_reset();
-        # """)
+        s3_key = write_usage_report(s3, s3_bucket, 'fine_grained', 'product-review-pg_stat', tenant_aurora_usage)['key']
+        # Saved after the report, a failed write leaves the previous snapshot and the next run covers both intervals.
+        checkpoint_store.save(CHECKPOINT_NAME, checkpoint)
         return {
             'statusCode': 200,
             'body': f'Data from pg_stat_statements uploaded to S3 at s3://{s3_bucket}/{s3_key}'
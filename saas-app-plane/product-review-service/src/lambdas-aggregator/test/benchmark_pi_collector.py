@@ -0,0 +1,75 @@
+# Compares the Performance Insights call count and wall time of the previous one call per
+# minute loop with the windowed collector, against a stub client with simulated API latency.
+#
+# Usage: python test/benchmark_pi_collector.py [latency_ms]
+import sys
+import os
+import time
+import threading
+from datetime import datetime, timedelta
+
+sys.path.append(
+    os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "")))
+
+from utils.pi_collector import collect_tenant_db_load, fold_metric_list
+
+
+class LatencyPiClient:
+    def __init__(self, latency_seconds, tenant_count=25):
+        self.latency_seconds = latency_seconds
+        self.tenant_count = tenant_count
+        self.call_count = 0
+        self._lock = threading.Lock()
+
+    def get_resource_metrics(self, **kwargs):
+        with self._lock:
+            self.call_count += 1
+        time.sleep(self.latency_seconds)
+        points = int((kwargs['EndTime'] - kwargs['StartTime']).total_seconds() // kwargs['PeriodInSeconds'])
+        return {
+            'MetricList': [
+                {'Key': {'Metric': 'db.load.avg', 'Dimensions': {'db.user.name': f'tenant{i}'}},
+                 'DataPoints': [{'Value': 0.1}] * points}
+                for i in range(self.tenant_count)
+            ]
+        }
+
+
+def legacy_minute_loop(pi_client, start_of_day, end_time):
+    # Same request pattern as the original lambda_handler: one call per minute with PeriodInSeconds=1.
+    tenant_db_load = {}
+    for i in range(1440):
+        iteration_end_time = end_time - timedelta(minutes=i)
+        start_time = iteration_end_time - timedelta(minutes=1)
+        if start_time < start_of_day:
+            break
+        response = pi_client.get_resource_metrics(
+            ServiceType='RDS', Identifier='db-BENCHMARK',
+            MetricQueries=[{'Metric': 'db.load.avg', 'GroupBy': {'Group': 'db.user'}}],
+            StartTime=start_time, EndTime=iteration_end_time, PeriodInSeconds=1)
+        fold_metric_list(response['MetricList'], 1, tenant_db_load)
+    return tenant_db_load
+
+
+def run(latency_ms):
+    start_of_day = datetime(2024, 7, 3)
+    end_time = start_of_day + timedelta(hours=24)
+
+    legacy_client = LatencyPiClient(latency_ms / 1000.0)
+    started = time.perf_counter()
+    legacy_load = legacy_minute_loop(legacy_client, start_of_day, end_time)
+    legacy_seconds = time.perf_counter() - started
+
+    windowed_client = LatencyPiClient(latency_ms / 1000.0)
+    started = time.perf_counter()
+    windowed_load, _ = collect_tenant_db_load(windowed_client, 'RDS', 'db-BENCHMARK', start_of_day, end_time)
+    windowed_seconds = time.perf_counter() - started
+
+    print(f'simulated latency per call: {latency_ms} ms')
+    print(f'{"collector":<12}{"calls":>8}{"wall time (s)":>16}{"tenant0 load":>16}')
+    print(f'{"legacy":<12}{legacy_client.call_count:>8}{legacy_seconds:>16.2f}{legacy_load["tenant0"]:>16.1f}')
+    print(f'{"windowed":<12}{windowed_client.call_count:>8}{windowed_seconds:>16.2f}{windowed_load["tenant0"]:>16.1f}')
+
+
+if __name__ == "__main__":
+    run(float(sys.argv[1]) if len(sys.argv) > 1 else 20.0)
@@ -0,0 +1,126 @@
+import unittest
+import sys
+import os
+from datetime import datetime
+from decimal import Decimal
+
+sys.path.append(
+    os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "")))
+
+from utils.statement_snapshots import (
+    STATEMENT_COUNTERS,
+    get_statement_deltas,
+    get_tenant_usage_rows,
+    take_statement_snapshot,
+    update_daily_usage
+)
+
+STATS_RESET = '2024-07-01T00:00:00+00:00'
+
+
+def get_statement(tenant_id, calls, total_exec_time, **counters):
+    return {'tenant_id': tenant_id, **{counter: 0 for counter in STATEMENT_COUNTERS},
+            'calls': calls, 'total_exec_time': total_exec_time, **counters}
+
+
+def get_snapshot(statements, stats_reset=STATS_RESET):
+    return {'stats_reset': stats_reset, 'statements': statements}
+
+
+class FakeCursor:
+    def __init__(self, rows):
+        self.rows = rows
+        self.statements = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def execute(self, sql, params=None):
+        self.statements.append((sql, params))
+
+    def fetchone(self):
+        return {'stats_reset': datetime(2024, 7, 1)}
+
+    def __iter__(self):
+        return iter(self.rows)
+
+
+class FakeConnection:
+    def __init__(self, rows):
+        self.cursor_ = FakeCursor(rows)
+
+    def cursor(self, row_factory=None):
+        return self.cursor_
+
+
+class TestStatementSnapshots(unittest.TestCase):
+
+    def test_take_snapshot(self):
+        row = {'userid': 16400, 'queryid': -42, 'dbid': 5, 'tenant_id': 'tenant1',
+               **{counter: Decimal(3) for counter in STATEMENT_COUNTERS}, 'total_exec_time': 1.5,
+               'wal_bytes': Decimal('1024')}
+        conn = FakeConnection([row])
+        snapshot = take_statement_snapshot(conn)
+        self.assertEqual(snapshot['stats_reset'], '2024-07-01T00:00:00')
+        statement = snapshot['statements']['16400:-42:5']
+        self.assertEqual((statement['tenant_id'], statement['calls'], statement['total_exec_time'],
+                          statement['wal_bytes']), ('tenant1', 3, 1.5, 1024))
+        # The admin roles are excluded in the query.
+        self.assertIn('saasadmin', conn.cursor_.statements[1][1][0])
+
+    def test_first_snapshot_is_a_baseline(self):
+        deltas, stats = get_statement_deltas(None, get_snapshot({'1:1:1': get_statement('tenant1', 5, 10.0)}))
+        self.assertEqual(deltas, [])
+        self.assertTrue(stats['baseline'])
+
+    def test_deltas_between_snapshots(self):
+        previous = get_snapshot({'1:1:1': get_statement('tenant1', 5, 10.0, shared_blks_read=7),
+                                 '2:1:1': get_statement('tenant2', 1, 1.0)})
+        current = get_snapshot({'1:1:1': get_statement('tenant1', 8, 16.5, shared_blks_read=9),
+                                '2:1:1': get_statement('tenant2', 1, 1.0),
+                                '2:2:1': get_statement('tenant2', 2, 4.0)})
+        deltas, stats = get_statement_deltas(previous, current)
+        # Statements that did not run in the interval are left out.
+        self.assertEqual([(delta['tenant_id'], delta['calls'], delta['total_exec_time'], delta['shared_blks_read'])
+                          for delta in deltas], [('tenant1', 3, 6.5, 2), ('tenant2', 2, 4.0, 0)])
+        self.assertEqual((stats['new_statements'], stats['reset_statements'], stats['stats_reset']), (1, 0, False))
+
+    def test_reset_statement_counts_from_zero(self):
+        # The entry was evicted and re-created, it ran twice since.
+        previous = get_snapshot({'1:1:1': get_statement('tenant1', 50, 100.0)})
+        current = get_snapshot({'1:1:1': get_statement('tenant1', 2, 3.0)})
+        deltas, stats = get_statement_deltas(previous, current)
+        self.assertEqual((deltas[0]['calls'], deltas[0]['total_exec_time']), (2, 3.0))
+        self.assertEqual(stats['reset_statements'], 1)
+
+    def test_stats_reset_counts_everything_from_zero(self):
+        previous = get_snapshot({'1:1:1': get_statement('tenant1', 5, 10.0)})
+        current = get_snapshot({'1:1:1': get_statement('tenant1', 6, 12.0)}, stats_reset='2024-07-02T00:00:00')
+        deltas, stats = get_statement_deltas(previous, current)
+        self.assertEqual(deltas[0]['calls'], 6)
+        self.assertTrue(stats['stats_reset'])
+
+    def test_daily_usage_accumulates_and_rolls_over(self):
+        day = '2024-07-01 00:00:00'
+        checkpoint, stats = update_daily_usage(None, get_snapshot({'1:1:1': get_statement('tenant1', 1, 1.0)}), day)
+        self.assertEqual(checkpoint['daily_usage'], {})
+        for calls in (3, 6):
+            checkpoint, stats = update_daily_usage(
+                checkpoint, get_snapshot({'1:1:1': get_statement('tenant1', calls, calls * 1.0),
+                                          '2:1:1': get_statement('tenant2', calls, 0.5 * calls)}), day)
+        rows = get_tenant_usage_rows(checkpoint['daily_usage'])
+        self.assertEqual([(row['tenant_id'], row['calls'], row['total_exec_time']) for row in rows],
+                         [('tenant1', 5, 5.0), ('tenant2', 6, 3.0)])
+
+        checkpoint, stats = update_daily_usage(
+            checkpoint, get_snapshot({'1:1:1': get_statement('tenant1', 7, 7.0),
+                                      '2:1:1': get_statement('tenant2', 6, 3.0)}), '2024-07-02 00:00:00')
+        self.assertEqual(get_tenant_usage_rows(checkpoint['daily_usage'])[0]['calls'], 1)
+        self.assertEqual(len(checkpoint['daily_usage']), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
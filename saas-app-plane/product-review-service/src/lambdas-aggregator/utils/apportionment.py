@@ -0,0 +1,90 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+# Column oriented apportionment shared by the usage aggregators. Query results are converted to
+# one list per field once, and totals, shares and rounding are computed a whole column at a time.
+
+from itertools import repeat
+
+
+def get_result_columns(usage_by_tenant, fields) -> dict:
+    # Convert Logs Insights results into one column per field. Missing fields are left empty.
+    columns = {field: [] for field in fields}
+    column_items = list(columns.items())
+    for result in usage_by_tenant['results']:
+        values = {field['field']: field['value'] for field in result}
+        for field, column in column_items:
+            column.append(values.get(field, ''))
+    return columns
+
+
+def get_row_columns(rows, fields) -> dict:
+    # Convert database rows (dictionaries) into one column per field.
+    return {field: [row[field] for row in rows] for field in fields}
+
+
+def to_float_column(values) -> list:
+    return [float(value) if value not in ('', None) else 0.0 for value in values]
+
+
+def to_int_column(values) -> list:
+    return [int(value) if value not in ('', None) else 0 for value in values]
+
+
+def get_percent_column(usage, totals, precision=1) -> list:
+    # Share of each value in its total, a zero total always gives a share of 0.
+    # precision=None rounds to a whole number like round(x).
+    return [round((value / total) * 100 if total else 0.0, precision) for value, total in zip(usage, totals)]
+
+
+def get_percent_column_of_total(usage, total, precision=1) -> list:
+    # Same as get_percent_column when every row shares one total.
+    if not total:
+        return [round(0.0, precision)] * len(usage)
+    return [round((value / total) * 100, precision) for value in usage]
+
+
+def round_column(values, precision) -> list:
+    if precision is None:
+        return list(values)
+    return [round(value, precision) for value in values]
+
+
+def usage_metric(usage_unit, values, service_name=None, totals=None):
+    # Describes one apportioned metric. The total defaults to the sum of the column, per row
+    # totals can be passed when a tenant's usage is not measured against the overall total.
+    return {'usage_unit': usage_unit, 'service_name': service_name, 'values': values, 'totals': totals}
+
+
+def get_metric_records(tenant_ids, dates, metric, usage_precision, percent_precision) -> list:
+    values = metric['values']
+    if metric['totals'] is None:
+        total = sum(values)
+        rounded_totals = repeat(total if usage_precision is None else round(total, usage_precision), len(values))
+        percents = get_percent_column_of_total(values, total, percent_precision)
+    else:
+        rounded_totals = round_column(metric['totals'], usage_precision)
+        percents = get_percent_column(values, metric['totals'], percent_precision)
+    usage = round_column(values, usage_precision)
+
+    usage_unit = metric['usage_unit']
+    service_name = metric['service_name']
+    if service_name is None:
+        return [{"tenant_id": tenant_id, "date": date, "usage_unit": usage_unit, "tenant_usage": tenant_usage,
+                 "total_usage": total_usage, "tenant_percent_usage": percent}
+                for tenant_id, date, tenant_usage, total_usage, percent
+                in zip(tenant_ids, dates, usage, rounded_totals, percents)]
+    return [{"tenant_id": tenant_id, "date": date, "usage_unit": usage_unit, "service_name": service_name,
+             "tenant_usage": tenant_usage, "total_usage": total_usage, "tenant_percent_usage": percent}
+            for tenant_id, date, tenant_usage, total_usage, percent
+            in zip(tenant_ids, dates, usage, rounded_totals, percents)]
+
+
+def apportion_usage(tenant_ids, dates, metrics, usage_precision=1, percent_precision=1) -> list:
+    # Build the tenant usage records for every row and metric. Records are ordered by row and
+    # then by metric, matching the order the aggregators have always written.
+    metric_records = [get_metric_records(tenant_ids, dates, metric, usage_precision, percent_precision)
+                      for metric in metrics]
+    if len(metric_records) == 1:
+        return metric_records[0]
+    return [record for row_records in zip(*metric_records) for record in row_records]
@@ -0,0 +1,116 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import timedelta
+
+# Periods accepted by the Performance Insights GetResourceMetrics API.
+PI_ALLOWED_PERIODS_IN_SECONDS = (1, 60, 300, 3600, 86400)
+# Maximum number of db.user groups Performance Insights returns per metric query.
+PI_MAX_GROUP_LIMIT = 25
+DEFAULT_PERIOD_IN_SECONDS = 60
+DEFAULT_WINDOW_MINUTES = 60
+DEFAULT_MAX_WORKERS = 4
+DB_ADMIN_USERS = ('saasadmin', 'rdsadmin')
+
+
+def get_pi_time_windows(start_time, end_time, window_minutes=DEFAULT_WINDOW_MINUTES):
+    # Split [start_time, end_time) into consecutive windows, the last one may be shorter.
+    windows = []
+    window = timedelta(minutes=window_minutes)
+    window_start = start_time
+    while window_start < end_time:
+        window_end = min(window_start + window, end_time)
+        windows.append((window_start, window_end))
+        window_start = window_end
+    return windows
+
+
+def get_db_load_metric_queries():
+    return [
+        {
+            'Metric': 'db.load.avg',
+            'GroupBy': {
+                'Group': 'db.user',
+                'Limit': PI_MAX_GROUP_LIMIT
+            }
+        }
+    ]
+
+
+def fold_metric_list(metric_list, period_in_seconds, tenant_db_load, excluded_users=DB_ADMIN_USERS):
+    # Add the db.load.avg data points of one GetResourceMetrics page to the per tenant totals.
+    # Each data point is the average active sessions over the period, so it is weighted by the
+    # period length to keep the totals comparable to a sum of one second samples.
+    for metric in metric_list:
+        dimensions = metric['Key'].get('Dimensions')
+        if not dimensions or 'db.user.name' not in dimensions:
+            continue
+        user = dimensions['db.user.name']
+        if user in excluded_users:
+            continue
+        sum_db_load = 0.0
+        for data_point in metric.get('DataPoints', []):
+            value = data_point.get('Value')
+            if not isinstance(value, (int, float)) or value <= 0.0:
+                continue
+            sum_db_load += value * period_in_seconds
+        if sum_db_load <= 0.0:
+            continue
+        tenant_db_load[user] = tenant_db_load.get(user, 0.0) + sum_db_load
+    return tenant_db_load
+
+
+def collect_window_db_load(pi_client, service_type, resource_id, start_time, end_time,
+                           period_in_seconds=DEFAULT_PERIOD_IN_SECONDS):
+    # Retrieve one time window, following NextToken until all pages are read.
+    tenant_db_load = {}
+    call_count = 0
+    request = {
+        'ServiceType': service_type,
+        'Identifier': resource_id,
+        'MetricQueries': get_db_load_metric_queries(),
+        'StartTime': start_time,
+        'EndTime': end_time,
+        'PeriodInSeconds': period_in_seconds
+    }
+    while True:
+        response = pi_client.get_resource_metrics(**request)
+        call_count += 1
+        fold_metric_list(response.get('MetricList', []), period_in_seconds, tenant_db_load)
+        next_token = response.get('NextToken')
+        if not next_token:
+            break
+        request['NextToken'] = next_token
+    return tenant_db_load, call_count
+
+
+def collect_tenant_db_load(pi_client, service_type, resource_id, start_time, end_time,
+                           period_in_seconds=DEFAULT_PERIOD_IN_SECONDS,
+                           window_minutes=DEFAULT_WINDOW_MINUTES,
+                           max_workers=DEFAULT_MAX_WORKERS):
+    # Collect the db.load.avg per db.user for [start_time, end_time) by fanning the time
+    # windows out over a bounded thread pool and folding each window into the tenant totals
+    # as soon as it completes. Returns the per tenant totals and the number of API calls made.
+    if period_in_seconds not in PI_ALLOWED_PERIODS_IN_SECONDS:
+        raise ValueError(f"PeriodInSeconds must be one of {PI_ALLOWED_PERIODS_IN_SECONDS}: {period_in_seconds}")
+    if window_minutes * 60 < period_in_seconds:
+        raise ValueError(f"Window of {window_minutes} minutes is shorter than the period of {period_in_seconds} seconds")
+
+    total_tenant_db_load = {}
+    call_count = 0
+    windows = get_pi_time_windows(start_time, end_time, window_minutes)
+    if not windows:
+        return total_tenant_db_load, call_count
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(windows)))) as executor:
+        futures = [executor.submit(collect_window_db_load, pi_client, service_type, resource_id,
+                                   window_start, window_end, period_in_seconds)
+                   for window_start, window_end in windows]
+        for future in as_completed(futures):
+            window_db_load, window_call_count = future.result()
+            call_count += window_call_count
+            for tenant_id, db_load in window_db_load.items():
+                total_tenant_db_load[tenant_id] = total_tenant_db_load.get(tenant_id, 0.0) + db_load
+
+    return total_tenant_db_load, call_count
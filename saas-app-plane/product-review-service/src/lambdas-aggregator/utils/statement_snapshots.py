@@ -0,0 +1,112 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+# Per interval tenant usage from pg_stat_statements without resetting it. Its counters are cumulative,
+# so every run takes a snapshot of the counters of each statement, keyed by (userid, queryid, dbid),
+# and attributes the difference to the previous snapshot to the tenant role that ran the statement.
+# A counter that went backwards means the entry was reset or evicted and re-created since the previous
+# snapshot, and a changed pg_stat_statements_info.stats_reset means all of them were reset: in both
+# cases the current counters are the usage since the reset, which happened within the interval.
+#
+# The snapshot and the running totals of the current day are kept in a checkpoint, so the aggregator
+# can run as often as needed and every run rewrites the daily report with the totals so far.
+
+from decimal import Decimal
+
+from psycopg.rows import dict_row
+
+DB_ADMIN_USERS = ('rdsadmin', 'postgres', 'saasadmin')
+# Cumulative counters of pg_stat_statements (1.8 or later) attributed to tenants. total_exec_time is
+# in milliseconds, the block counters in blocks and wal_bytes in bytes.
+STATEMENT_COUNTERS = (
+    'calls', 'total_exec_time',
+    'shared_blks_hit', 'shared_blks_read', 'shared_blks_dirtied', 'shared_blks_written',
+    'local_blks_hit', 'local_blks_read', 'local_blks_dirtied', 'local_blks_written',
+    'temp_blks_read', 'temp_blks_written', 'wal_bytes'
+)
+
+# Statements tracked with pg_stat_statements.track = all have a top level and a nested entry, they are
+# summed into one entry per key.
+STATEMENT_SNAPSHOT_SQL = """
+    select s.userid, s.queryid, s.dbid, r.rolname as tenant_id,
+    {counters}
+    from pg_stat_statements s, pg_catalog.pg_roles r
+    where s.userid = r.oid and r.rolname <> all(%s)
+    group by s.userid, s.queryid, s.dbid, r.rolname
+""".format(counters=',\n    '.join(f"sum(s.{counter}) as {counter}" for counter in STATEMENT_COUNTERS))
+
+STATS_RESET_SQL = "select stats_reset from pg_stat_statements_info"
+
+
+def get_statement_key(row):
+    return f"{row['userid']}:{row['queryid']}:{row['dbid']}"
+
+
+def to_counter_value(value):
+    # Sums of bigint columns come back as Decimal, snapshots are stored as JSON.
+    if value is None:
+        return 0
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    return value
+
+
+def take_statement_snapshot(conn, excluded_users=DB_ADMIN_USERS) -> dict:
+    with conn.cursor(row_factory=dict_row) as cur:
+        cur.execute(STATS_RESET_SQL)
+        stats_reset = cur.fetchone()['stats_reset']
+        cur.execute(STATEMENT_SNAPSHOT_SQL, (list(excluded_users),))
+        statements = {get_statement_key(row): {'tenant_id': row['tenant_id'],
+                                               **{counter: to_counter_value(row[counter])
+                                                  for counter in STATEMENT_COUNTERS}}
+                      for row in cur}
+    return {'stats_reset': stats_reset.isoformat() if stats_reset else None, 'statements': statements}
+
+
+def get_statement_deltas(previous_snapshot, snapshot) -> tuple:
+    # Returns the usage of every statement since the previous snapshot and how it was computed.
+    stats = {'statements': len(snapshot['statements']), 'new_statements': 0, 'reset_statements': 0,
+             'stats_reset': False, 'baseline': previous_snapshot is None}
+    if previous_snapshot is None:
+        # Without a previous snapshot the counters cover an unknown period, they are only the baseline.
+        return [], stats
+    stats['stats_reset'] = previous_snapshot['stats_reset'] != snapshot['stats_reset']
+    previous_statements = {} if stats['stats_reset'] else previous_snapshot['statements']
+
+    deltas = []
+    for key, statement in snapshot['statements'].items():
+        previous = previous_statements.get(key)
+        if previous is None:
+            stats['new_statements'] += 1
+            delta = {counter: statement[counter] for counter in STATEMENT_COUNTERS}
+        elif any(statement[counter] < previous.get(counter, 0) for counter in STATEMENT_COUNTERS):
+            stats['reset_statements'] += 1
+            delta = {counter: statement[counter] for counter in STATEMENT_COUNTERS}
+        else:
+            delta = {counter: statement[counter] - previous.get(counter, 0) for counter in STATEMENT_COUNTERS}
+        if delta['calls'] or delta['total_exec_time']:
+            deltas.append({'tenant_id': statement['tenant_id'], **delta})
+    return deltas, stats
+
+
+def add_tenant_usage(tenant_usage, deltas) -> dict:
+    # Add statement deltas to the per tenant totals, tenant_id -> {counter: value}.
+    for delta in deltas:
+        totals = tenant_usage.setdefault(delta['tenant_id'], {counter: 0 for counter in STATEMENT_COUNTERS})
+        for counter in STATEMENT_COUNTERS:
+            totals[counter] += delta[counter]
+    return tenant_usage
+
+
+def get_tenant_usage_rows(tenant_usage) -> list:
+    return [{'tenant_id': tenant_id, **counters} for tenant_id, counters in sorted(tenant_usage.items())]
+
+
+def update_daily_usage(checkpoint, snapshot, day) -> tuple:
+    # Adds the usage since the checkpoint's snapshot to the totals of day and returns the new checkpoint,
+    # to be saved once the report is written. Usage of an interval that spans midnight counts for the new day.
+    previous_snapshot = checkpoint['snapshot'] if checkpoint else None
+    daily_usage = checkpoint['daily_usage'] if checkpoint and checkpoint['day'] == day else {}
+    deltas, stats = get_statement_deltas(previous_snapshot, snapshot)
+    stats['tenants'] = len({delta['tenant_id'] for delta in deltas})
+    return {'day': day, 'snapshot': snapshot, 'daily_usage': add_tenant_usage(daily_usage, deltas)}, stats
@@ -0,0 +1,299 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+# Per tenant storage of the pooled tables without counting every row every day. Each table's size,
+# heap, TOAST and indexes, is apportioned by the tenants' share of its data, which is one of:
+#
+#   sample    TABLESAMPLE SYSTEM of just enough blocks for the configured error bound (the default)
+#   stats     the tenant_id frequencies ANALYZE keeps in pg_stats, falls back to sample when they do
+#             not cover every tenant or are too stale for the error bound
+#   counters  per tenant row counts and data bytes kept by statement triggers, created on the tables
+#             by seed_storage_counters and dropped again when the aggregator runs in another mode
+#   exact     a full scan of the table
+#
+# The heap and TOAST size is apportioned by the tenants' share of the row data (pg_column_size, which
+# includes the TOASTed values) and the index size by their share of the rows. The error bound is the
+# largest deviation of any tenant's share from its exact value, at 95% confidence.
+
+import math
+
+from psycopg import sql
+
+STORAGE_USAGE_MODES = ('sample', 'stats', 'counters', 'exact')
+DEFAULT_MAX_ERROR = 0.01
+CONFIDENCE_Z = 1.96
+# The sample grows until the error bound is met, the last attempt scans the whole table.
+MAX_SAMPLE_ATTEMPTS = 4
+
+# Maintained by the storage triggers, they are not tenant tables themselves.
+STORAGE_COUNTER_TABLES = ('tenant_storage_deltas', 'tenant_storage_counters')
+# Transition tables allow a single event per trigger, the triggers are named <table>_storage_<suffix>.
+STORAGE_TRIGGERS = (
+    ('insert', 'insert', 'new table as new_rows'),
+    ('update', 'update', 'old table as old_rows new table as new_rows'),
+    ('delete', 'delete', 'old table as old_rows'),
+)
+
+TENANT_TABLES_SQL = """
+    select n.nspname as schema_name, c.relname as table_name, c.oid as relid, c.reltuples,
+    pg_relation_size(c.oid) as heap_size,
+    pg_table_size(c.oid) - pg_relation_size(c.oid) as toast_size,
+    pg_indexes_size(c.oid) as index_size
+    from pg_catalog.pg_class c
+    join pg_catalog.pg_namespace n on n.oid = c.relnamespace
+    join pg_catalog.pg_attribute a on a.attrelid = c.oid and a.attname = 'tenant_id' and not a.attisdropped
+    where c.relkind = 'r' and n.nspname = %s and c.relname <> all(%s)
+    order by c.relname
+"""
+
+# Rows and row data per (block, tenant), blocks are the sampling units of TABLESAMPLE SYSTEM.
+SAMPLE_SQL = """
+    select (t.ctid::text::point)[0]::bigint as block, t.tenant_id,
+    count(*) as row_count, sum(pg_column_size(t.*)) as data_bytes
+    from {table} t {sample}
+    group by 1, 2
+"""
+
+TENANT_STATS_SQL = """
+    select s.null_frac, s.most_common_vals::text::text[] as tenant_ids, s.most_common_freqs as tenant_freqs,
+    coalesce(u.n_mod_since_analyze, 0) as modified_rows,
+    300 * current_setting('default_statistics_target')::int as analyze_rows
+    from pg_catalog.pg_stats s
+    join pg_catalog.pg_stat_user_tables u on u.schemaname = s.schemaname and u.relname = s.tablename
+    where s.schemaname = %s and s.tablename = %s and s.attname = 'tenant_id'
+"""
+
+# Deltas are insert only so concurrent writers never wait on a counter row, each run folds them
+# into the counters.
+COMPACT_COUNTERS_SQL = """
+    with moved as (
+      delete from app.tenant_storage_deltas
+      returning table_name, tenant_id, row_count, data_bytes
+    )
+    insert into app.tenant_storage_counters as c (table_name, tenant_id, row_count, data_bytes)
+    select table_name, tenant_id, sum(row_count), sum(data_bytes)
+    from moved
+    group by table_name, tenant_id
+    on conflict (table_name, tenant_id) do update
+    set row_count = c.row_count + excluded.row_count, data_bytes = c.data_bytes + excluded.data_bytes
+"""
+
+STORAGE_TRIGGER_COUNT_SQL = """
+    select count(*) as trigger_count
+    from pg_catalog.pg_trigger
+    where tgrelid = %s and tgname = any(%s)
+"""
+
+COUNTED_USAGE_SQL = """
+    select tenant_id, row_count, data_bytes
+    from app.tenant_storage_counters
+    where table_name = %s and row_count > 0
+"""
+
+
+def get_tenant_tables(cur, schema) -> list:
+    cur.execute(TENANT_TABLES_SQL, (schema, list(STORAGE_COUNTER_TABLES)))
+    return cur.fetchall()
+
+
+def get_sample_percent(reltuples, max_error=DEFAULT_MAX_ERROR, z=CONFIDENCE_Z) -> float:
+    # Rows a simple random sample needs for the error bound at the worst case share of 50%. Tenant
+    # rows are clustered in blocks, so a block sample can need more, see get_sampled_usage.
+    if reltuples <= 0:
+        # Never analyzed, the table size is unknown.
+        return 100.0
+    sample_rows = (z / max_error) ** 2 * 0.25
+    return min(100.0, 100.0 * sample_rows / reltuples)
+
+
+def get_share_error(tenant_blocks, share, block_totals, sum_squared_totals, sample_fraction, z=CONFIDENCE_Z) -> float:
+    # Confidence interval of a ratio estimated from a cluster sample, the blocks are the clusters:
+    # var = (1 - f) / (m (m - 1) mean_total^2) * sum_b (y_b - share * x_b)^2
+    # Blocks without rows of the tenant (y_b = 0) contribute share^2 * x_b^2, which is summed once for
+    # all blocks in sum_squared_totals and corrected for the blocks the tenant has rows in.
+    if sample_fraction >= 1:
+        return 0.0
+    block_count = len(block_totals)
+    if block_count < 2:
+        return 1.0
+    mean_total = sum(block_totals.values()) / block_count
+    if not mean_total:
+        return 0.0
+    residuals = share * share * sum_squared_totals + sum(
+        value * value - 2 * share * value * block_totals[block] for block, value in tenant_blocks.items())
+    variance = (1 - sample_fraction) * max(residuals, 0.0) / (block_count * (block_count - 1) * mean_total ** 2)
+    return z * math.sqrt(variance)
+
+
+def estimate_tenant_usage(rows, sample_fraction, z=CONFIDENCE_Z) -> tuple:
+    # Returns the tenants' share of the rows and row data of the sampled blocks, and the largest
+    # error of any share.
+    block_rows = {}
+    block_bytes = {}
+    tenant_rows = {}
+    tenant_bytes = {}
+    for row in rows:
+        block = row['block']
+        block_rows[block] = block_rows.get(block, 0) + row['row_count']
+        block_bytes[block] = block_bytes.get(block, 0) + row['data_bytes']
+        tenant_rows.setdefault(row['tenant_id'], {})[block] = row['row_count']
+        tenant_bytes.setdefault(row['tenant_id'], {})[block] = row['data_bytes']
+
+    if not block_rows:
+        return {}, (0.0 if sample_fraction >= 1 else 1.0)
+    total_rows = sum(block_rows.values())
+    total_bytes = sum(block_bytes.values())
+    squared_rows = sum(value * value for value in block_rows.values())
+    squared_bytes = sum(value * value for value in block_bytes.values())
+
+    usage = {}
+    error = 0.0
+    for tenant_id in sorted(tenant_rows):
+        row_count = sum(tenant_rows[tenant_id].values())
+        data_bytes = sum(tenant_bytes[tenant_id].values())
+        row_share = row_count / total_rows
+        byte_share = data_bytes / total_bytes if total_bytes else row_share
+        usage[tenant_id] = {'row_count': row_count / sample_fraction, 'row_share': row_share,
+                            'byte_share': byte_share}
+        error = max(error,
+                    get_share_error(tenant_rows[tenant_id], row_share, block_rows, squared_rows, sample_fraction, z),
+                    get_share_error(tenant_bytes[tenant_id], byte_share, block_bytes, squared_bytes, sample_fraction, z))
+    return usage, error
+
+
+def sample_table(cur, table, percent) -> list:
+    sample = sql.SQL('')
+    if percent < 100:
+        sample = sql.SQL("tablesample system ({})").format(sql.Literal(percent))
+    cur.execute(sql.SQL(SAMPLE_SQL).format(
+        table=sql.Identifier(table['schema_name'], table['table_name']), sample=sample))
+    return cur.fetchall()
+
+
+def get_sampled_usage(cur, table, max_error=DEFAULT_MAX_ERROR, percent=None) -> tuple:
+    if percent is None:
+        percent = get_sample_percent(table['reltuples'], max_error)
+    attempts = 0
+    while True:
+        attempts += 1
+        usage, error = estimate_tenant_usage(sample_table(cur, table, percent), percent / 100)
+        if error <= max_error or percent >= 100:
+            break
+        # The variance falls with the number of sampled blocks.
+        percent = 100.0 if attempts + 1 >= MAX_SAMPLE_ATTEMPTS else \
+            min(100.0, percent * max(2.0, (error / max_error) ** 2))
+    return usage, {'table': table['table_name'], 'mode': 'sample' if percent < 100 else 'exact',
+                   'sample_percent': round(percent, 4), 'attempts': attempts, 'error': round(error, 4)}
+
+
+def get_stats_usage(cur, table, max_error=DEFAULT_MAX_ERROR, z=CONFIDENCE_Z) -> tuple:
+    # Returns None as the usage when the statistics cannot meet the error bound.
+    stats = {'table': table['table_name'], 'mode': 'stats'}
+    cur.execute(TENANT_STATS_SQL, (table['schema_name'], table['table_name']))
+    row = cur.fetchone()
+    reltuples = table['reltuples']
+    if row is None or not row['tenant_ids'] or reltuples <= 0:
+        return None, {**stats, 'fallback': 'no statistics'}
+
+    covered = sum(row['tenant_freqs'])
+    # Frequencies of tenants missing from the list, rows modified since ANALYZE and the error of
+    # ANALYZE's own sample all add to the error of the shares.
+    sample_rows = min(reltuples, row['analyze_rows'])
+    error = (z * math.sqrt(0.25 / sample_rows * (1 - sample_rows / reltuples))
+             + max(0.0, 1 - row['null_frac'] - covered)
+             + row['modified_rows'] / reltuples)
+    stats['error'] = round(error, 4)
+    if error > max_error:
+        return None, {**stats, 'fallback': 'error bound'}
+    usage = {tenant_id: {'row_count': freq * reltuples, 'row_share': freq / covered, 'byte_share': freq / covered}
+             for tenant_id, freq in sorted(zip(row['tenant_ids'], row['tenant_freqs']))}
+    return usage, stats
+
+
+def compact_storage_counters(cur):
+    cur.execute(COMPACT_COUNTERS_SQL)
+
+
+def get_counted_usage(cur, table) -> tuple:
+    cur.execute(COUNTED_USAGE_SQL, (table['table_name'],))
+    rows = cur.fetchall()
+    total_rows = sum(row['row_count'] for row in rows)
+    total_bytes = sum(row['data_bytes'] for row in rows)
+    usage = {row['tenant_id']: {'row_count': row['row_count'], 'row_share': row['row_count'] / total_rows,
+                                'byte_share': row['data_bytes'] / total_bytes if total_bytes else 0.0}
+             for row in sorted(rows, key=lambda row: row['tenant_id'])}
+    return usage, {'table': table['table_name'], 'mode': 'counters'}
+
+
+def get_storage_trigger_names(table) -> list:
+    return [f"{table['table_name']}_storage_{suffix}" for suffix, _, _ in STORAGE_TRIGGERS]
+
+
+def get_storage_trigger_count(cur, table) -> int:
+    # len(STORAGE_TRIGGERS) when the table's rows are counted, fewer triggers miss some of the writes.
+    cur.execute(STORAGE_TRIGGER_COUNT_SQL, (table['relid'], get_storage_trigger_names(table)))
+    return cur.fetchone()['trigger_count']
+
+
+def drop_storage_triggers(conn, table):
+    for name in get_storage_trigger_names(table):
+        conn.execute(sql.SQL("drop trigger if exists {} on {}").format(
+            sql.Identifier(name), sql.Identifier(table['schema_name'], table['table_name'])))
+
+
+def seed_storage_counters(conn, table):
+    # Creates the storage triggers of a table for the counters mode and counts its existing rows. Writes
+    # wait for the lock, so every row is either counted here or by a delta of the triggers, not both.
+    with conn.transaction():
+        conn.execute(sql.SQL("lock table {} in share row exclusive mode").format(
+            sql.Identifier(table['schema_name'], table['table_name'])))
+        drop_storage_triggers(conn, table)
+        for name, (_, event, referencing) in zip(get_storage_trigger_names(table), STORAGE_TRIGGERS):
+            conn.execute(sql.SQL(
+                "create trigger {} after {} on {} referencing {} "
+                "for each statement execute function app.count_tenant_storage()").format(
+                sql.Identifier(name), sql.SQL(event), sql.Identifier(table['schema_name'], table['table_name']),
+                sql.SQL(referencing)))
+        conn.execute("delete from app.tenant_storage_deltas where table_name = %s", (table['table_name'],))
+        conn.execute("delete from app.tenant_storage_counters where table_name = %s", (table['table_name'],))
+        conn.execute(sql.SQL("""
+            insert into app.tenant_storage_counters (table_name, tenant_id, row_count, data_bytes)
+            select {table_name}, t.tenant_id, count(*), sum(pg_column_size(t.*))
+            from {table} t
+            group by t.tenant_id
+        """).format(table_name=sql.Literal(table['table_name']),
+                    table=sql.Identifier(table['schema_name'], table['table_name'])))
+
+
+def drop_storage_counters(conn, table):
+    # Outside the counters mode nothing compacts the deltas, the triggers go along with what they counted.
+    with conn.transaction():
+        drop_storage_triggers(conn, table)
+        conn.execute("delete from app.tenant_storage_deltas where table_name = %s", (table['table_name'],))
+        conn.execute("delete from app.tenant_storage_counters where table_name = %s", (table['table_name'],))
+
+
+def estimate_table_usage(cur, table, mode, max_error=DEFAULT_MAX_ERROR) -> tuple:
+    # Returns tenant_id -> {row_count, row_share, byte_share} and how it was estimated.
+    if mode == 'counters':
+        return get_counted_usage(cur, table)
+    if mode == 'exact':
+        return get_sampled_usage(cur, table, max_error, percent=100.0)
+    if mode == 'stats':
+        usage, stats = get_stats_usage(cur, table, max_error)
+        if usage is not None:
+            return usage, stats
+        usage, sample_stats = get_sampled_usage(cur, table, max_error)
+        return usage, {**sample_stats, 'fallback': stats['fallback']}
+    return get_sampled_usage(cur, table, max_error)
+
+
+def get_tenant_table_sizes(table, usage) -> dict:
+    # Apportion the heap and TOAST size by the share of row data and the index size by the share of rows.
+    data_size = table['heap_size'] + table['toast_size']
+    return {tenant_id: data_size * shares['byte_share'] + table['index_size'] * shares['row_share']
+            for tenant_id, shares in usage.items()}
+
+
+def get_table_size(table) -> int:
+    return table['heap_size'] + table['toast_size'] + table['index_size']
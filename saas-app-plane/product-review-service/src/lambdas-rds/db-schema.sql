@@ -13,10 +13,52 @@
     CONSTRAINT review_order_unique UNIQUE (review_id, order_id, product_id)
   );
 
+-- indexes for the keyset paginated GET /productreview, newest reviews first per tenant,
+-- optionally for one product (a rating range is filtered on these scans)
+CREATE INDEX IF NOT EXISTS product_reviews_tenant_date_idx
+  ON app.product_reviews (tenant_id, review_date, review_id);
+CREATE INDEX IF NOT EXISTS product_reviews_tenant_product_date_idx
+  ON app.product_reviews (tenant_id, product_id, review_date, review_id);
+
 -- enable RLS on pooled table
 ALTER TABLE app.product_reviews ENABLE ROW LEVEL SECURITY;
 CREATE POLICY tenant_user_isolation_policy ON app.product_reviews
 USING (tenant_id::TEXT = current_user);
 
+-- per tenant row counts and row data for the counters mode of the storage usage aggregator
+-- (STORAGE_USAGE_MODE=counters). The aggregator creates the statement triggers on the tenant tables
+-- when it first runs in that mode and drops them in the other modes. The triggers append deltas per
+-- statement, so writers never wait on a shared counter row, and the aggregator folds them into
+-- tenant_storage_counters.
+CREATE TABLE app.tenant_storage_deltas (
+  table_name TEXT NOT NULL,
+  tenant_id TEXT NOT NULL,
+  row_count BIGINT NOT NULL,
+  data_bytes BIGINT NOT NULL
+);
+CREATE TABLE app.tenant_storage_counters (
+  table_name TEXT NOT NULL,
+  tenant_id TEXT NOT NULL,
+  row_count BIGINT NOT NULL,
+  data_bytes BIGINT NOT NULL,
+  PRIMARY KEY (table_name, tenant_id)
+);
+
+-- runs as the owner, tenants have no privileges on the counter tables
+CREATE OR REPLACE FUNCTION app.count_tenant_storage() RETURNS trigger
+LANGUAGE plpgsql SECURITY DEFINER SET search_path = pg_catalog, app AS $$
+BEGIN
+  IF TG_OP IN ('INSERT', 'UPDATE') THEN
+    INSERT INTO app.tenant_storage_deltas (table_name, tenant_id, row_count, data_bytes)
+    SELECT TG_TABLE_NAME, r.tenant_id, count(*), sum(pg_column_size(r.*)) FROM new_rows r GROUP BY r.tenant_id;
+  END IF;
+  IF TG_OP IN ('UPDATE', 'DELETE') THEN
+    INSERT INTO app.tenant_storage_deltas (table_name, tenant_id, row_count, data_bytes)
+    SELECT TG_TABLE_NAME, r.tenant_id, -count(*), -sum(pg_column_size(r.*)) FROM old_rows r GROUP BY r.tenant_id;
+  END IF;
+  RETURN NULL;
+END
+$$;
+
 -- enable pg_stat_statements
 CREATE EXTENSION pg_stat_statements;
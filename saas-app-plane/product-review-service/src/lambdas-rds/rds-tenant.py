@@ -2,8 +2,11 @@ import boto3
 import os
 import psycopg
 import json
+from secrets_cache import get_secrets_cache_from_env
 
 secrets_manager = boto3.client('secretsmanager')
+# Secrets are cached across invocations of the same Lambda environment.
+secrets_cache = get_secrets_cache_from_env(secrets_manager)
 creds_secret_name = os.getenv('DB_CRED_SECRET_NAME')                
 db_name = os.getenv('DB_NAME') 
 
@@ -14,15 +17,15 @@ def handler(event, context):
         tenant_id = event.get('tenantId') 
         tenant_secret_name = event.get('tenantSecretName')
                 
-        password, username, host, port = get_secret_value(creds_secret_name)
         tenant_password, tenant_username, tenant_host, tenant_port = get_secret_value(tenant_secret_name)
 
-        connection = psycopg.connect(dbname=db_name,
-                            host=host,
-                            port=port,
-                            user=username,
-                            password=password,
-                            autocommit=True)
+        # Rotated admin credentials are rejected, call_with_secret fetches the secret again and reconnects.
+        connection = secrets_cache.call_with_secret(creds_secret_name, lambda secret: psycopg.connect(dbname=db_name,
+                            host=secret["host"],
+                            port=secret["port"],
+                            user=secret["username"],
+                            password=secret["password"],
+                            autocommit=True))
     
         if tenant_state == 'PROVISION':
             with open(os.path.join(os.path.dirname(__file__), 'rds-tenant-provision.sql'), 'r') as f:
@@ -56,10 +59,7 @@ def query(connection, sql):
     connection.execute(sql)    
 
 def get_secret_value(secret_id):
-    response = secrets_manager.get_secret_value(SecretId=secret_id)
-
-    #convert string to json
-    secret_value = json.loads(response['SecretString'])
+    secret_value = secrets_cache.get_secret_json(secret_id)
     
     password = secret_value["password"]
     username = secret_value["username"]
@@ -2,8 +2,11 @@ import boto3
 import os
 import psycopg
 import json
+from secrets_cache import get_secrets_cache_from_env
 
 secrets_manager = boto3.client('secretsmanager')
+# Secrets are cached across invocations of the same Lambda environment.
+secrets_cache = get_secrets_cache_from_env(secrets_manager)
 
 def handler(event, context):
     try:
@@ -50,10 +53,7 @@ def query(connection, sql):
     connection.execute(sql)    
 
 def get_secret_value(secret_id):
-    response = secrets_manager.get_secret_value(SecretId=secret_id)
-
-    #convert string to json
-    secret_value = json.loads(response['SecretString'])
+    secret_value = secrets_cache.get_secret_json(secret_id)
     
     password = secret_value["password"]
     username = secret_value["username"]
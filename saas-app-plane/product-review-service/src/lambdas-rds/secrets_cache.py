@@ -0,0 +1,144 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+# In-memory cache of Secrets Manager secrets. A secret is fetched once and served from memory for
+# ttl_seconds. In the last refresh_ahead_seconds of that window the cached value is still returned
+# while a background thread fetches the new one, so callers do not wait on Secrets Manager. Callers
+# that miss at the same time share a single get_secret_value call. When the credentials in a secret
+# are rejected (the password was rotated), call_with_secret fetches the secret again and retries.
+
+import json
+import os
+import threading
+import time
+
+DEFAULT_TTL_SECONDS = 300
+DEFAULT_REFRESH_AHEAD_SECONDS = 60
+# SQLSTATE codes Postgres returns for rejected credentials.
+AUTHENTICATION_ERROR_CODES = ('28P01', '28000')
+
+
+def is_authentication_error(error):
+    # psycopg2 and psycopg report the SQLSTATE differently, and connection errors often only carry
+    # the server message.
+    code = getattr(error, 'pgcode', None) or getattr(error, 'sqlstate', None)
+    if code in AUTHENTICATION_ERROR_CODES:
+        return True
+    return 'password authentication failed' in str(error)
+
+
+class SecretsCache:
+    def __init__(self, secrets_manager, ttl_seconds=DEFAULT_TTL_SECONDS,
+                 refresh_ahead_seconds=DEFAULT_REFRESH_AHEAD_SECONDS, clock=time.monotonic):
+        self.secrets_manager = secrets_manager
+        self.ttl_seconds = ttl_seconds
+        self.refresh_ahead_seconds = min(refresh_ahead_seconds, ttl_seconds)
+        self.clock = clock
+        # secret_id -> (secret string, time it was fetched)
+        self.entries = {}
+        # secret_id -> event set when the fetch in progress for it completes
+        self.fetches = {}
+        self.lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'fetches': 0, 'background_refreshes': 0, 'fetch_errors': 0,
+                      'invalidations': 0}
+
+    def get_secret_string(self, secret_id) -> str:
+        with self.lock:
+            entry = self.entries.get(secret_id)
+            if entry is not None:
+                age = self.clock() - entry[1]
+                if age < self.ttl_seconds:
+                    self.stats['hits'] += 1
+                    if age >= self.ttl_seconds - self.refresh_ahead_seconds and secret_id not in self.fetches:
+                        self._start_background_refresh(secret_id)
+                    return entry[0]
+            self.stats['misses'] += 1
+        return self._fetch(secret_id)
+
+    def get_secret_json(self, secret_id) -> dict:
+        return json.loads(self.get_secret_string(secret_id))
+
+    def invalidate(self, secret_id):
+        with self.lock:
+            if self.entries.pop(secret_id, None) is not None:
+                self.stats['invalidations'] += 1
+
+    def call_with_secret(self, secret_id, function):
+        # Call function with the secret parsed as JSON. If the database rejects the credentials the
+        # cached secret is dropped and function is called once more with the current secret.
+        try:
+            return function(self.get_secret_json(secret_id))
+        except Exception as error:
+            if not is_authentication_error(error):
+                raise
+            print(f"Credentials in {secret_id} were rejected, fetching the secret again")
+            self.invalidate(secret_id)
+            return function(self.get_secret_json(secret_id))
+
+    def _fetch(self, secret_id) -> str:
+        # Single flight: the first caller fetches, callers arriving meanwhile wait for its result.
+        with self.lock:
+            fetch = self.fetches.get(secret_id)
+            if fetch is None:
+                fetch = self.fetches[secret_id] = threading.Event()
+                owner = True
+            else:
+                owner = False
+        if owner:
+            try:
+                return self._get_secret_value(secret_id)
+            finally:
+                with self.lock:
+                    del self.fetches[secret_id]
+                fetch.set()
+        fetch.wait()
+        with self.lock:
+            entry = self.entries.get(secret_id)
+        if entry is None:
+            # The fetch this caller waited on failed, try once on its own.
+            return self._fetch(secret_id)
+        return entry[0]
+
+    def _get_secret_value(self, secret_id) -> str:
+        try:
+            response = self.secrets_manager.get_secret_value(SecretId=secret_id)
+        except Exception:
+            with self.lock:
+                self.stats['fetch_errors'] += 1
+            raise
+        secret_string = response['SecretString']
+        with self.lock:
+            self.stats['fetches'] += 1
+            self.entries[secret_id] = (secret_string, self.clock())
+        return secret_string
+
+    def _start_background_refresh(self, secret_id):
+        # Called with the lock held, so no other fetch of secret_id can start before this one is registered.
+        fetch = self.fetches[secret_id] = threading.Event()
+        self.stats['background_refreshes'] += 1
+
+        def refresh():
+            try:
+                self._get_secret_value(secret_id)
+            except Exception as error:
+                # Keep serving the cached value until it expires.
+                print(f"Background refresh of {secret_id} failed: {error}")
+            finally:
+                with self.lock:
+                    del self.fetches[secret_id]
+                fetch.set()
+
+        threading.Thread(target=refresh, daemon=True).start()
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            stats = dict(self.stats)
+            stats['secrets'] = len(self.entries)
+            return stats
+
+
+def get_secrets_cache_from_env(secrets_manager) -> SecretsCache:
+    return SecretsCache(secrets_manager,
+                        ttl_seconds=int(os.getenv("SECRETS_CACHE_TTL_SECONDS", DEFAULT_TTL_SECONDS)),
+                        refresh_ahead_seconds=int(os.getenv("SECRETS_CACHE_REFRESH_AHEAD_SECONDS",
+                                                            DEFAULT_REFRESH_AHEAD_SECONDS)))
@@ -0,0 +1,257 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+# Tenant connection pools for the ASGI service. Same model as global_db_pool, a pool per tenant
+# within a global connection budget with idle-TTL and LRU eviction, but the pools are psycopg
+# AsyncConnectionPools and everything runs on the event loop, so waiting on the database does not
+# hold a thread. The secrets and pool settings are shared with global_db_pool through db_config, so this
+# module does not load psycopg2.
+
+import asyncio
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+import psycopg
+from psycopg_pool import AsyncConnectionPool
+
+from db_config import (
+    ConnectionBudgetExhausted,
+    DEFAULT_MAX_CONNECTIONS,
+    DEFAULT_MAX_CONNECTIONS_PER_TENANT,
+    DEFAULT_IDLE_TTL_SECONDS,
+    database,
+    get_min_connections_per_tenant,
+    get_pool_manager_settings_from_env,
+    secrets_cache
+)
+from secrets_cache import is_authentication_error
+
+
+class AsyncTenantPool:
+    def __init__(self, connection_pool):
+        self.connection_pool = connection_pool
+        self.last_used = time.monotonic()
+        self.connections_in_use = 0
+
+    def connection(self):
+        # async with tenant_pool.connection() as db_conn: ...
+        return AsyncTenantConnection(self)
+
+    def get_open_connections(self):
+        return self.connection_pool.get_stats().get('pool_size', 0)
+
+    async def close(self):
+        await self.connection_pool.close()
+
+
+class AsyncTenantConnection:
+    # Checks a connection out of a tenant pool for one async with block and tracks it as in use.
+    def __init__(self, tenant_pool):
+        self.tenant_pool = tenant_pool
+        self.connection_context = None
+
+    async def __aenter__(self):
+        self.tenant_pool.connections_in_use += 1
+        self.tenant_pool.last_used = time.monotonic()
+        self.connection_context = self.tenant_pool.connection_pool.connection()
+        try:
+            return await self.connection_context.__aenter__()
+        except BaseException:
+            self.tenant_pool.connections_in_use -= 1
+            raise
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        try:
+            return await self.connection_context.__aexit__(exc_type, exc_value, traceback)
+        finally:
+            self.tenant_pool.connections_in_use -= 1
+            self.tenant_pool.last_used = time.monotonic()
+
+
+class AsyncTenantPoolManager:
+    def __init__(self, create_pool, max_connections=DEFAULT_MAX_CONNECTIONS,
+                 max_connections_per_tenant=DEFAULT_MAX_CONNECTIONS_PER_TENANT,
+                 idle_ttl_seconds=DEFAULT_IDLE_TTL_SECONDS):
+        if max_connections < max_connections_per_tenant:
+            raise ValueError(f"max_connections ({max_connections}) must be at least max_connections_per_tenant "
+                             f"({max_connections_per_tenant})")
+        # await create_pool(tenant_id, max_size) builds the open AsyncTenantPool of a tenant.
+        self.create_pool = create_pool
+        self.max_connections = max_connections
+        self.max_connections_per_tenant = max_connections_per_tenant
+        self.idle_ttl_seconds = idle_ttl_seconds
+        # Tenant pools from least to most recently used.
+        self.pools = OrderedDict()
+        self.reserved_connections = 0
+        # Futures of the pools being created, concurrent first requests for a tenant await the same one.
+        self.creating = {}
+        # tenant_id -> requests between the lookup of the tenant's pool and the checkout of their connection,
+        # the pool is not closed. A request waiting for a pool being created is pinned while it waits.
+        self.pins = {}
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0, 'creation_failures': 0}
+
+    @asynccontextmanager
+    async def connection(self, tenant_id):
+        # async with manager.connection(tenant_id) as db_conn: ... The pool is pinned until the connection is
+        # checked out, from then on the connection in use keeps it open.
+        tenant_pool = await self.get_pool(tenant_id, pin=True)
+        pinned = True
+        try:
+            async with tenant_pool.connection() as db_conn:
+                self._unpin(tenant_id)
+                pinned = False
+                yield db_conn
+        finally:
+            if pinned:
+                self._unpin(tenant_id)
+
+    async def get_pool(self, tenant_id, pin=False) -> AsyncTenantPool:
+        # Only awaits give other requests a chance to run, so the bookkeeping between them needs no lock.
+        tenant_pool = self.pools.get(tenant_id)
+        if tenant_pool is not None:
+            self.stats['hits'] += 1
+            self.pools.move_to_end(tenant_id)
+            tenant_pool.last_used = time.monotonic()
+            if pin:
+                self._pin(tenant_id)
+            return tenant_pool
+        creating = self.creating.get(tenant_id)
+        if creating is not None:
+            self.stats['hits'] += 1
+            if not pin:
+                return await asyncio.shield(creating)
+            # Pinned before waiting, the creator's task can evict pools before this one resumes.
+            self._pin(tenant_id)
+            try:
+                return await asyncio.shield(creating)
+            except BaseException:
+                self._unpin(tenant_id)
+                raise
+
+        self.stats['misses'] += 1
+        # Registered before the first await, so requests arriving meanwhile wait for this pool.
+        creating = self.creating[tenant_id] = asyncio.get_running_loop().create_future()
+        reserved = False
+        try:
+            await self._reserve_connections()
+            reserved = True
+            tenant_pool = await self.create_pool(tenant_id, self.max_connections_per_tenant)
+        except BaseException as error:
+            if reserved:
+                self.reserved_connections -= self.max_connections_per_tenant
+            self.stats['creation_failures'] += 1
+            del self.creating[tenant_id]
+            creating.set_exception(error)
+            # Mark the exception as retrieved when nobody else was waiting for it.
+            creating.exception()
+            raise
+        self.pools[tenant_id] = tenant_pool
+        del self.creating[tenant_id]
+        if pin:
+            self._pin(tenant_id)
+        creating.set_result(tenant_pool)
+        return tenant_pool
+
+    def _pin(self, tenant_id):
+        self.pins[tenant_id] = self.pins.get(tenant_id, 0) + 1
+
+    def _unpin(self, tenant_id):
+        if self.pins[tenant_id] == 1:
+            del self.pins[tenant_id]
+        else:
+            self.pins[tenant_id] -= 1
+
+    def _is_idle(self, tenant_id):
+        return self.pools[tenant_id].connections_in_use == 0 and tenant_id not in self.pins
+
+    async def _reserve_connections(self):
+        await self.evict_expired_pools()
+        for tenant_id in list(self.pools):
+            if self.reserved_connections + self.max_connections_per_tenant <= self.max_connections:
+                break
+            if self._is_idle(tenant_id):
+                await self._close_pool(tenant_id)
+                self.stats['evictions'] += 1
+        if self.reserved_connections + self.max_connections_per_tenant > self.max_connections:
+            raise ConnectionBudgetExhausted(f"All {self.max_connections} database connections are reserved by "
+                                            f"tenant pools in use")
+        self.reserved_connections += self.max_connections_per_tenant
+
+    async def evict_expired_pools(self):
+        expires_before = time.monotonic() - self.idle_ttl_seconds
+        for tenant_id, tenant_pool in list(self.pools.items()):
+            if tenant_pool.last_used < expires_before and self._is_idle(tenant_id):
+                await self._close_pool(tenant_id)
+                self.stats['expirations'] += 1
+
+    async def _close_pool(self, tenant_id):
+        # Remove the pool before awaiting, so no request picks it up while it closes.
+        tenant_pool = self.pools.pop(tenant_id)
+        self.reserved_connections -= self.max_connections_per_tenant
+        try:
+            await tenant_pool.close()
+        except Exception as error:
+            print(f"Error while closing connection pool of tenant {tenant_id}: {error}")
+
+    async def close_all(self):
+        for tenant_id in list(self.pools):
+            await self._close_pool(tenant_id)
+
+    def get_stats(self) -> dict:
+        stats = dict(self.stats)
+        stats['pools'] = len(self.pools)
+        stats['open_connections'] = sum(tenant_pool.get_open_connections() for tenant_pool in self.pools.values())
+        stats['reserved_connections'] = self.reserved_connections
+        stats['max_connections'] = self.max_connections
+        return stats
+
+
+async def create_async_tenant_pool(tenant_id, max_size) -> AsyncTenantPool:
+    # get the secrets for every tenantId using the key pattern <tenantId>Credentials
+    secret_id = tenant_id + 'Credentials'
+
+    async def connect(secret_value):
+        connect_kwargs = {'host': secret_value["host"], 'port': secret_value["port"], 'dbname': database,
+                          'user': secret_value["username"], 'password': secret_value["password"]}
+        # The pool retries failed connections in the background, connect once directly so rejected
+        # credentials surface here instead of as a pool timeout on the first request.
+        probe = await psycopg.AsyncConnection.connect(**connect_kwargs)
+        await probe.close()
+        connection_pool = AsyncConnectionPool(
+            min_size=get_min_connections_per_tenant(max_size),
+            max_size=max_size,
+            kwargs=connect_kwargs,
+            open=False
+        )
+        await connection_pool.open()
+        return AsyncTenantPool(connection_pool)
+
+    secret_value = await asyncio.to_thread(secrets_cache.get_secret_json, secret_id)
+    try:
+        return await connect(secret_value)
+    except Exception as error:
+        if not is_authentication_error(error):
+            raise
+        # The password was rotated, fetch the secret again and reconnect.
+        secrets_cache.invalidate(secret_id)
+        secret_value = await asyncio.to_thread(secrets_cache.get_secret_json, secret_id)
+        return await connect(secret_value)
+
+
+async_pool_manager = AsyncTenantPoolManager(create_async_tenant_pool, **get_pool_manager_settings_from_env())
+
+
+async def get_or_create_db_pool(tenant_id) -> AsyncTenantPool:
+    return await async_pool_manager.get_pool(tenant_id)
+
+
+def db_connection(tenant_id):
+    # async with db_connection(tenant_id) as db_conn: a connection of the tenant's pool, which is not closed
+    # between the lookup and the checkout.
+    return async_pool_manager.connection(tenant_id)
+
+
+def get_pool_stats():
+    stats = async_pool_manager.get_stats()
+    stats['secrets_cache'] = secrets_cache.get_stats()
+    return stats
@@ -2,59 +2,240 @@
 # SPDX-License-Identifier: MIT-0
 
 import os
+import threading
+import time
+from collections import OrderedDict
 import psycopg2
 from psycopg2 import pool
 import json
-import boto3
 from botocore.exceptions import ClientError
 
-secrets_manager = boto3.client('secretsmanager', region_name=os.environ['AWS_REGION'])
-database = os.environ['DATABASE_NAME']
-# Global variable to store connection pools
+from db_config import (
+    ConnectionBudgetExhausted,
+    DEFAULT_MAX_CONNECTIONS,
+    DEFAULT_MAX_CONNECTIONS_PER_TENANT,
+    DEFAULT_IDLE_TTL_SECONDS,
+    database,
+    get_min_connections_per_tenant,
+    get_pool_manager_settings_from_env,
+    secrets_cache
+)
+
 # For Amazon RDS Performance Insights DBLoad metrics, need to have connections per tenant/db-user to get db-user level metrics
-# so implemented global connection pools array which is array of connection pools, will create connection pool per tenant/tenantId during the first invocation
-# and re-use the same connection pool for subsequent invocations. Necessary bootstarpping steps (warm-up) would avoid the initial connection pool creation latencies
-# global connection pools array
-global_connection_pools = {}
-def get_or_create_db_pool(tenantId, logger):
-    print("inside get_or_create_db_pool")
-    global global_connection_pools
-    if tenantId in global_connection_pools:
-        logger.info(f"tenantId In global_connection_pools {tenantId}")
-        return global_connection_pools[tenantId]
-    if tenantId not in global_connection_pools:
-        logger.info(f"tenantId not in global_connection_pools {tenantId}")
-        tenant_connection_pool = None
+# so there is a connection pool per tenant/tenantId, created during the first invocation for the tenant
+# and re-used for subsequent invocations. Necessary bootstarpping steps (warm-up) would avoid the initial connection pool creation latencies.
+# Every tenant pool can open up to DB_POOL_MAX_CONNECTIONS_PER_TENANT connections and all pools together stay within
+# DB_POOL_MAX_CONNECTIONS, so a task serving thousands of tenants does not exhaust max_connections on the database.
+# Pools that have been idle for DB_POOL_IDLE_TTL_SECONDS are closed, and when the budget is used up the least
+# recently used idle pool is closed to make room for a new tenant. get_connection pins the pool from the lookup
+# until its connection is taken, from then on the connection in use keeps the pool open until putconn.
+
+class TenantConnectionPool(pool.ThreadedConnectionPool):
+    # A thread safe pool that records when it was last used, so the pool manager can close idle pools.
+    def __init__(self, minconn, maxconn, *args, **kwargs):
+        self.last_used = time.monotonic()
+        super().__init__(minconn, maxconn, *args, **kwargs)
+
+    def getconn(self, key=None):
+        self.last_used = time.monotonic()
+        return super().getconn(key)
+
+    def putconn(self, conn=None, key=None, close=False):
+        self.last_used = time.monotonic()
+        super().putconn(conn, key, close)
+
+    @property
+    def connections_in_use(self):
+        return len(self._used)
+
+    def get_open_connections(self):
+        return len(self._pool) + len(self._used)
+
+
+class TenantPoolManager:
+    def __init__(self, create_pool, max_connections=DEFAULT_MAX_CONNECTIONS,
+                 max_connections_per_tenant=DEFAULT_MAX_CONNECTIONS_PER_TENANT,
+                 idle_ttl_seconds=DEFAULT_IDLE_TTL_SECONDS):
+        if max_connections < max_connections_per_tenant:
+            raise ValueError(f"max_connections ({max_connections}) must be at least max_connections_per_tenant "
+                             f"({max_connections_per_tenant})")
+        # create_pool(tenant_id, maxconn) builds the connection pool of a tenant.
+        self.create_pool = create_pool
+        self.max_connections = max_connections
+        self.max_connections_per_tenant = max_connections_per_tenant
+        self.idle_ttl_seconds = idle_ttl_seconds
+        # Tenant pools from least to most recently used.
+        self.pools = OrderedDict()
+        # Connections reserved by open pools and pools being created.
+        self.reserved_connections = 0
+        self.lock = threading.Lock()
+        # One lock per tenant whose pool is being created, so concurrent first requests wait for a single pool.
+        self.creation_locks = {}
+        # tenant_id -> requests between the lookup of the tenant's pool and getconn, the pool is not closed.
+        self.pins = {}
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0, 'creation_failures': 0}
+
+    def get_connection(self, tenant_id):
+        # Returns (pool, connection), the connection goes back with pool.putconn(connection).
+        tenant_pool = self.get_pool(tenant_id, pin=True)
+        try:
+            return tenant_pool, tenant_pool.getconn()
+        finally:
+            with self.lock:
+                self._unpin(tenant_id)
+
+    def get_pool(self, tenant_id, pin=False):
+        with self.lock:
+            tenant_pool = self._get_cached_pool(tenant_id, pin)
+            if tenant_pool is not None:
+                return tenant_pool
+            creation_lock = self.creation_locks.setdefault(tenant_id, threading.Lock())
+
+        with creation_lock:
+            with self.lock:
+                # Another request may have created the pool while this one waited.
+                tenant_pool = self._get_cached_pool(tenant_id, pin)
+                if tenant_pool is not None:
+                    return tenant_pool
+                self.stats['misses'] += 1
+                self._reserve_connections()
+
+            try:
+                tenant_pool = self.create_pool(tenant_id, self.max_connections_per_tenant)
+            except Exception:
+                with self.lock:
+                    self.reserved_connections -= self.max_connections_per_tenant
+                    self.stats['creation_failures'] += 1
+                    self.creation_locks.pop(tenant_id, None)
+                raise
+
+            with self.lock:
+                self.pools[tenant_id] = tenant_pool
+                self.creation_locks.pop(tenant_id, None)
+                if pin:
+                    self.pins[tenant_id] = self.pins.get(tenant_id, 0) + 1
+            return tenant_pool
+
+    def _get_cached_pool(self, tenant_id, pin=False):
+        # Called with the lock held.
+        tenant_pool = self.pools.get(tenant_id)
+        if tenant_pool is None:
+            return None
+        self.stats['hits'] += 1
+        self.pools.move_to_end(tenant_id)
+        tenant_pool.last_used = time.monotonic()
+        if pin:
+            self.pins[tenant_id] = self.pins.get(tenant_id, 0) + 1
+        return tenant_pool
+
+    def _unpin(self, tenant_id):
+        # Called with the lock held.
+        if self.pins[tenant_id] == 1:
+            del self.pins[tenant_id]
+        else:
+            self.pins[tenant_id] -= 1
+
+    def _is_idle(self, tenant_id):
+        # Called with the lock held.
+        return self.pools[tenant_id].connections_in_use == 0 and tenant_id not in self.pins
+
+    def _reserve_connections(self):
+        # Called with the lock held. Close expired pools, then least recently used idle pools, until there is
+        # room for one more tenant pool.
+        self.evict_expired_pools()
+        for tenant_id in list(self.pools):
+            if self.reserved_connections + self.max_connections_per_tenant <= self.max_connections:
+                break
+            if self._is_idle(tenant_id):
+                self._close_pool(tenant_id)
+                self.stats['evictions'] += 1
+        if self.reserved_connections + self.max_connections_per_tenant > self.max_connections:
+            raise ConnectionBudgetExhausted(f"All {self.max_connections} database connections are reserved by "
+                                            f"tenant pools in use")
+        self.reserved_connections += self.max_connections_per_tenant
+
+    def evict_expired_pools(self):
+        # Called with the lock held.
+        expires_before = time.monotonic() - self.idle_ttl_seconds
+        for tenant_id, tenant_pool in list(self.pools.items()):
+            if tenant_pool.last_used < expires_before and self._is_idle(tenant_id):
+                self._close_pool(tenant_id)
+                self.stats['expirations'] += 1
+
+    def _close_pool(self, tenant_id):
+        tenant_pool = self.pools.pop(tenant_id)
+        self.reserved_connections -= self.max_connections_per_tenant
         try:
-            # get the secrets for every tenantId using the key pattern <tenantId>Credentials
-            # secrets got added during tenant provisioning
-            secretId=tenantId+'Credentials'
-            password, host, port, username = get_secret_withSecretId(secretId, logger)
-            tenant_connection_pool = pool.SimpleConnectionPool(
-                        minconn=1,
-                        maxconn=5,
-                        host=host,
-                        database=database,
-                        user=username,
-                        password=password,
-                        port=port
-                    )
-            logger.info("Connection pool created successfully")
-            global_connection_pools[tenantId] = tenant_connection_pool
-            return tenant_connection_pool
+            tenant_pool.closeall()
         except (Exception, psycopg2.Error) as error:
-            logger.info(f"Error while connecting to PostgreSQL {error}")
+            print(f"Error while closing connection pool of tenant {tenant_id}: {error}")
+
+    def close_all(self):
+        with self.lock:
+            for tenant_id in list(self.pools):
+                self._close_pool(tenant_id)
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            stats = dict(self.stats)
+            stats['pools'] = len(self.pools)
+            stats['open_connections'] = sum(tenant_pool.get_open_connections() for tenant_pool in self.pools.values())
+            stats['reserved_connections'] = self.reserved_connections
+            stats['max_connections'] = self.max_connections
+            return stats
+
+
+def create_tenant_pool(tenantId, maxconn):
+    # get the secrets for every tenantId using the key pattern <tenantId>Credentials
+    # secrets got added during tenant provisioning
+    secretId = tenantId + 'Credentials'
+
+    def connect(secret_value):
+        return TenantConnectionPool(
+            minconn=get_min_connections_per_tenant(maxconn),
+            maxconn=maxconn,
+            host=secret_value["host"],
+            database=database,
+            user=secret_value["username"],
+            password=secret_value["password"],
+            port=secret_value["port"]
+        )
+
+    # A rotated password makes the cached secret stale, call_with_secret fetches it again and reconnects.
+    return secrets_cache.call_with_secret(secretId, connect)
+
+
+pool_manager = TenantPoolManager(create_tenant_pool, **get_pool_manager_settings_from_env())
+
+
+def get_or_create_db_pool(tenantId, logger):
+    try:
+        return pool_manager.get_pool(tenantId)
+    except (Exception, psycopg2.Error) as error:
+        logger.info(f"Error while connecting to PostgreSQL {error}")
+
+
+def get_db_connection(tenantId, logger):
+    # (pool, connection) of the tenant, the pool is not closed before the connection goes back with putconn.
+    try:
+        return pool_manager.get_connection(tenantId)
+    except (Exception, psycopg2.Error) as error:
+        logger.info(f"Error while connecting to PostgreSQL {error}")
+        raise
+
+
+def get_pool_stats():
+    stats = pool_manager.get_stats()
+    stats['secrets_cache'] = secrets_cache.get_stats()
+    return stats
 
-def get_secret_withSecretId(secretId, logger):
-    print("inside get_secret", secretId)
-    # Retrieve the secret value from Secrets Manager
-    response = secrets_manager.get_secret_value(SecretId=secretId)
 
-    #convert string to json
-    secret_value = json.loads(response['SecretString'])
+def get_secret_withSecretId(secretId):
+    # Retrieve the secret value from Secrets Manager, through the cache
+    secret_value = secrets_cache.get_secret_json(secretId)
     password = secret_value["password"]
     host = secret_value["host"]
     port = secret_value["port"]
     username = secret_value["username"]
-    logger.info(f"DB details {host}, {port}, {username}")
-    return password, host, port, username
\ No newline at end of file
+    print(f"DB details {host}, {port}, {username}")
+    return password, host, port, username
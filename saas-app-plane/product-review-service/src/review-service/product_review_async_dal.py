@@ -0,0 +1,112 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+from typing import AsyncIterator
+import psycopg
+from product_review_model import Reviews
+from product_review_logger import record_metric
+from review_pagination import ReviewsPageRequest, FETCH_SIZE, build_reviews_query, get_page_count, to_review
+from load_profile import inject_db_load_async, hold_transaction_async
+from review_cache import review_cache
+from review_batch import ReviewBatch, INSERT_REVIEW_SQL, get_database_error, get_pages, to_row
+import async_db_pool
+
+# Async version of ProductReviewRepository for the ASGI service. Queries run on psycopg async
+# connections from the tenant's AsyncConnectionPool, so a request waiting on the database yields the
+# event loop to other requests instead of blocking a thread.
+class AsyncProductReviewRepository():
+    def __init__(self, logger) -> None:
+        self.logger = logger
+
+    async def iter_reviews(self, tenant_id: str, page: ReviewsPageRequest) -> AsyncIterator[dict]:
+        # Async generator over one page of reviews (plus one row to detect the next page), or every review when
+        # the client does not page, read from a server side cursor FETCH_SIZE rows at a time. The connection is held until the generator is exhausted or closed.
+        self.logger.info(f"Fetching reviews for tenant with connection pool {tenant_id}")
+        number_of_reviews = 0
+        try:
+            async with async_db_pool.db_connection(tenant_id) as db_conn:
+                async with db_conn.cursor() as cursor:
+                    await inject_db_load_async(cursor, tenant_id)
+                sql, params = build_reviews_query(tenant_id, page)
+                async with db_conn.cursor(name="product_reviews_page") as cursor:
+                    cursor.itersize = FETCH_SIZE
+                    await cursor.execute(sql, params)
+                    async for row in cursor:
+                        number_of_reviews += 1
+                        yield to_review(row)
+        finally:
+            record_metric(tenant_id, "ReviewsFetched", get_page_count(number_of_reviews, page), "Count")
+            self.logger.info(f"Total reviews fetched: {get_page_count(number_of_reviews, page)}")
+
+    async def add_review(self, review: Reviews):
+        self.logger.info(f"Adding review {review.review_id} for tenant {review.tenant_id}")
+        async with async_db_pool.db_connection(review.tenant_id) as db_conn:
+            async with db_conn.cursor() as cursor:
+                await inject_db_load_async(cursor, review.tenant_id)
+                await cursor.execute("INSERT INTO app.product_reviews (review_id, product_id, order_id, rating, review_description, tenant_id) VALUES (%s, %s, %s, %s, %s, %s)",
+                    (review.review_id, review.product_id, review.order_id, review.rating, review.review_description, review.tenant_id))
+                records_added = cursor.rowcount
+                await hold_transaction_async(review.tenant_id)
+            await db_conn.commit()
+        await review_cache.invalidate_async(review.tenant_id)
+        self.logger.info(f"Added {records_added} review record: {review.review_id} for tenant {review.tenant_id}")
+        record_metric(review.tenant_id, "ReviewsAdded", 1, "Count")
+        return records_added
+
+    async def add_reviews(self, tenant_id: str, batch: ReviewBatch, reviews) -> int:
+        # Same as ProductReviewRepository.add_reviews. psycopg runs executemany in pipeline mode, so a page
+        # of rows is sent without waiting for each INSERT, and nested transaction blocks are savepoints.
+        self.logger.info(f"Adding batch of reviews for tenant {tenant_id}")
+        async with async_db_pool.db_connection(tenant_id) as db_conn:
+            async with db_conn.transaction():
+                async with db_conn.cursor() as cursor:
+                    await inject_db_load_async(cursor, tenant_id)
+                    for page in get_pages(reviews):
+                        try:
+                            async with db_conn.transaction():
+                                await cursor.executemany(INSERT_REVIEW_SQL, [to_row(review) for index, review in page])
+                            batch.add_inserted(page)
+                        except psycopg.Error:
+                            await self._add_rows(db_conn, cursor, batch, page)
+                    await hold_transaction_async(tenant_id)
+        await review_cache.invalidate_async(tenant_id)
+        records_added = len(batch.inserted)
+        self.logger.info(f"Added {records_added} of {batch.received} review records for tenant {tenant_id}")
+        record_metric(tenant_id, "ReviewsAdded", records_added, "Count")
+        return records_added
+
+    async def _add_rows(self, db_conn, cursor, batch, page):
+        for index, review in page:
+            try:
+                async with db_conn.transaction():
+                    await cursor.execute(INSERT_REVIEW_SQL, to_row(review))
+                batch.add_inserted([(index, review)])
+            except psycopg.Error as error:
+                batch.add_error(index, get_database_error(error))
+
+    async def update_review(self, review: Reviews):
+        self.logger.info(f"Updating review {review.review_id} for tenant {review.tenant_id}")
+        async with async_db_pool.db_connection(review.tenant_id) as db_conn:
+            async with db_conn.cursor() as cursor:
+                await inject_db_load_async(cursor, review.tenant_id)
+                await cursor.execute("UPDATE app.product_reviews SET rating = %s, review_description = %s WHERE review_id = %s AND tenant_id = %s",
+                    (review.rating, review.review_description, review.review_id, review.tenant_id))
+                records_updated = cursor.rowcount
+                await hold_transaction_async(review.tenant_id)
+            await db_conn.commit()
+        await review_cache.invalidate_async(review.tenant_id)
+        self.logger.info(f"Updated {records_updated} review record: {review.review_id} for tenant {review.tenant_id}")
+        record_metric(review.tenant_id, "ReviewsUpdated", 1, "Count")
+        return records_updated
+
+    async def delete_review(self, review_id, tenant_id):
+        self.logger.info(f"Deleting review {review_id} for tenant {tenant_id}")
+        async with async_db_pool.db_connection(tenant_id) as db_conn:
+            async with db_conn.cursor() as cursor:
+                await inject_db_load_async(cursor, tenant_id)
+                await cursor.execute("DELETE FROM app.product_reviews WHERE review_id = %s AND tenant_id = %s", (review_id, tenant_id))
+                records_deleted = cursor.rowcount
+            await db_conn.commit()
+        await review_cache.invalidate_async(tenant_id)
+        self.logger.info(f"Deleted {records_deleted} review record for tenant {tenant_id}")
+        record_metric(tenant_id, "ReviewsDeleted", 1, "Count")
+        return records_deleted
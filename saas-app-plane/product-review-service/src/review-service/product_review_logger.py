@@ -1,20 +1,101 @@
 import logging
 import os
 import json
-from aws_embedded_metrics import metric_scope
+import atexit
+import threading
+from aws_embedded_metrics.logger.metrics_logger_factory import create_metrics_logger
 import logging
 
 logger = logging.getLogger('review_svc.logger')
 logger.setLevel(logging.DEBUG)
 
-@metric_scope
-async def create_emf_log(tenant_id, metric_name, metric_value, metric_unit, metrics):
-    logger.info(f"inside emf logging...")
-    try:
-        
-        metrics.put_dimensions({"Tenant": tenant_id})
-        metrics.put_metric(metric_name, metric_value, metric_unit)
-        await metrics.flush()
-    except Exception as e:
-        logger.error(f"Error creating EMF log: {e}")
+# Metrics are buffered per process and written as batched EMF documents instead of one document per
+# metric. Samples are grouped by tenant (the Tenant dimension) and every metric of a tenant is written as
+# the sum of its values since the last flush, with the number of values in the <metric>Samples property.
+# Each metric stays a scalar in the log line, an EMF value array would be flattened by Logs Insights into
+# ExecutionTime.0, ExecutionTime.1, ... which the usage aggregators do not read. The buffer is flushed every
+# EMF_FLUSH_INTERVAL_MS, as soon as it holds EMF_MAX_BUFFERED_SAMPLES samples, and when the process exits.
+DEFAULT_FLUSH_INTERVAL_MS = 1000
+DEFAULT_MAX_BUFFERED_SAMPLES = 1000
 
+
+class MetricsAggregator:
+    def __init__(self, flush_interval_seconds=DEFAULT_FLUSH_INTERVAL_MS / 1000,
+                 max_buffered_samples=DEFAULT_MAX_BUFFERED_SAMPLES, create_logger=create_metrics_logger):
+        self.flush_interval_seconds = flush_interval_seconds
+        self.max_buffered_samples = max_buffered_samples
+        self.create_logger = create_logger
+        # tenant_id -> {(metric_name, metric_unit): [values]}
+        self.samples = {}
+        self.buffered_samples = 0
+        self.lock = threading.Lock()
+        # Serializes flushes of the background thread and close.
+        self.flush_lock = threading.Lock()
+        self.flush_requested = threading.Event()
+        self.thread = None
+        self.closed = False
+        self.stats = {'samples': 0, 'flushes': 0, 'flush_errors': 0}
+
+    def put_metric(self, tenant_id, metric_name, metric_value, metric_unit):
+        with self.lock:
+            if self.thread is None and not self.closed:
+                # Started on first use, so importing the module does not start a thread.
+                self.thread = threading.Thread(target=self._run, name='emf-flush', daemon=True)
+                self.thread.start()
+            self.samples.setdefault(tenant_id, {}).setdefault((metric_name, metric_unit), []).append(metric_value)
+            self.buffered_samples += 1
+            self.stats['samples'] += 1
+            if self.buffered_samples >= self.max_buffered_samples:
+                self.flush_requested.set()
+
+    def _run(self):
+        while not self.closed:
+            self.flush_requested.wait(self.flush_interval_seconds)
+            self.flush_requested.clear()
+            self.flush()
+
+    def flush(self):
+        with self.flush_lock:
+            with self.lock:
+                samples, self.samples = self.samples, {}
+                self.buffered_samples = 0
+            for tenant_id, tenant_samples in samples.items():
+                try:
+                    metrics = self.create_logger()
+                    metrics.put_dimensions({"Tenant": tenant_id})
+                    for (metric_name, metric_unit), values in tenant_samples.items():
+                        metrics.put_metric(metric_name, sum(values), metric_unit)
+                        metrics.set_property(f"{metric_name}Samples", len(values))
+                    metrics.flush_sync()
+                except Exception as e:
+                    logger.error(f"Error creating EMF log: {e}")
+                    with self.lock:
+                        self.stats['flush_errors'] += 1
+            with self.lock:
+                self.stats['flushes'] += 1
+
+    def close(self):
+        # Flushes what is buffered and stops the background thread.
+        self.closed = True
+        self.flush_requested.set()
+        if self.thread is not None:
+            self.thread.join(timeout=5)
+        self.flush()
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            stats = dict(self.stats)
+            stats['buffered_samples'] = self.buffered_samples
+            return stats
+
+
+metrics_aggregator = MetricsAggregator(
+    flush_interval_seconds=int(os.getenv("EMF_FLUSH_INTERVAL_MS", DEFAULT_FLUSH_INTERVAL_MS)) / 1000,
+    max_buffered_samples=int(os.getenv("EMF_MAX_BUFFERED_SAMPLES", DEFAULT_MAX_BUFFERED_SAMPLES))
+)
+atexit.register(metrics_aggregator.close)
+
+
+def record_metric(tenant_id, metric_name, metric_value, metric_unit):
+    # Buffers one sample, it does not block on the EMF sink.
+    metrics_aggregator.put_metric(tenant_id, metric_name, metric_value, metric_unit)
@@ -1,18 +1,22 @@
 # Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
 # SPDX-License-Identifier: MIT-0
 
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request
 import uuid
 import os , json, sys
 import logging
-import asyncio
+import signal
 import time
-from jose import jwk, jwt
-from jose.utils import base64url_decode
 
 from product_review_dal import ProductReviewRepository, DatabaseError
-from product_review_logger import create_emf_log
+from product_review_logger import record_metric, metrics_aggregator
 from product_review_model import Reviews
+from review_pagination import InvalidPageRequest, parse_page_request, stream_reviews_page
+from review_batch import InvalidBatchRequest, ReviewBatch, get_batch_items
+from load_profile import load_profile
+from review_cache import review_cache
+from tenant_auth import InvalidToken, get_tenant_context, get_tenant_id, token_verifier
+import global_db_pool
 # import init_db_pool
 
 app = Flask(__name__)
@@ -20,14 +24,14 @@ app = Flask(__name__)
 app.logger.setLevel(logging.DEBUG)
 app.logger.info("Starting Review Service with connection pool per tenant")
 
-def get_tenant_id(request):
-    bearer_token = request.headers.get('Authorization')
-    if not bearer_token:
-        return None
-    token = bearer_token.split(" ")[1]
-    # get the tenant id from the token
-    tenant_id = jwt.get_unverified_claims(token)['custom:tenantId']
-    return tenant_id
+@app.before_request
+def authenticate():
+    # Verifies the bearer token (cached per token until it expires) and puts the tenant on the request.
+    try:
+        request.tenant_context = get_tenant_context(request.headers)
+    except InvalidToken as error:
+        app.logger.error(f"Rejected token: {error}")
+        return jsonify({"error": "Unauthorized"}), 401
 
 @app.route('/')
 def home():
@@ -37,7 +41,12 @@ def home():
 def health_check():
     health_status = {
         'status': 'UP',
-        'details': 'Application is running smoothly!!'
+        'details': 'Application is running smoothly!!',
+        'connection_pools': global_db_pool.get_pool_stats(),
+        'load_profile': load_profile.get_stats(),
+        'review_cache': review_cache.get_stats(),
+        'metrics': metrics_aggregator.get_stats(),
+        'tenant_auth': token_verifier.get_stats()
     }
     return jsonify(health_status)
 
@@ -55,24 +64,48 @@ def get_reviews():
     if tenant_id is None:
         app.logger.error("Tenant ID not found")
         return "error"
+    try:
+        page = parse_page_request(request.args)
+    except InvalidPageRequest as error:
+        return jsonify({"error": str(error)}), 400
     app.logger.info(f"Retrieving reviews for tenant: {tenant_id}")
-    #Get a connection from already initialized connection pool and get reviews from database
+    body, generation = review_cache.get_page(tenant_id, page)
+    if body is not None:
+        app.logger.info(f"Serving reviews for tenant {tenant_id} from cache")
+        # Attributes the read to the tenant without database time.
+        record_metric(tenant_id, "ReviewsCacheHits", 1, "Count")
+        execution_time = time.time() - start_time
+        record_metric(tenant_id, "ExecutionTime", execution_time, "Seconds")
+        return Response(body, mimetype='application/json')
+    #Get a connection from already initialized connection pool and stream the page of reviews from database
     try:
         repo = ProductReviewRepository(app.logger)
-        reviews_response = asyncio.run(repo.get_reviews(tenant_id))
-        app.logger.info(f"Retrieved {len(reviews_response)} reviews for tenant: {tenant_id}")
-        end_time = time.time()  # Record the end time
-        execution_time = end_time - start_time  # Calculate the execution time
-        
-        #TODO: review below line which logs execution time. 
-        asyncio.run(create_emf_log(tenant_id, "ExecutionTime", execution_time, "Seconds"))
-
-        return jsonify(reviews_response) # Return reviews as JSON response 
-    
+        reviews = repo.iter_reviews(tenant_id, page)
+        # Read the first row before responding, so connection and query errors are still returned as an error.
+        first_review = next(reviews, None)
     except Exception as e:
         app.logger.error(f"Error retrieving reviews: {e}")
         return jsonify({"error": str(e)})
 
+    def generate():
+        chunks = []
+        try:
+            for chunk in stream_reviews_page(first_review, reviews, page.limit, app.json.dumps):
+                chunks.append(chunk)
+                yield chunk
+            review_cache.put_page(tenant_id, generation, page, ''.join(chunks))
+            end_time = time.time()  # Record the end time
+            execution_time = end_time - start_time  # Calculate the execution time
+            record_metric(tenant_id, "ExecutionTime", execution_time, "Seconds")
+        except Exception as e:
+            # The response has started, the client sees a truncated body.
+            app.logger.error(f"Error streaming reviews for tenant {tenant_id}: {e}")
+        finally:
+            # Releases the connection when the page ends before the cursor does.
+            reviews.close()
+
+    return Response(generate(), mimetype='application/json')
+
 @app.route('/productreview', methods=['POST'])
 def add_review():
     start_time = time.time()
@@ -101,14 +134,14 @@ def add_review():
         review = Reviews(review_id, product_id, order_id, rating, review_description, tenant_id)
         app.logger.info(f"Preparing to add review for tenant: {tenant_id}")
         review_repo = ProductReviewRepository(app.logger)
-        response = asyncio.run(review_repo.add_review(json.dumps(review.__dict__)))
+        response = review_repo.add_review(json.dumps(review.__dict__))
         app.logger.info(f"response:{response} ")
 
         if response:
             app.logger.info(f"Review {review_id} added successfully for tenant: {tenant_id}")
             end_time = time.time()  # Record the end time
             execution_time = end_time - start_time  # Calculate the execution time
-            asyncio.run(create_emf_log(tenant_id, "ExecutionTime", execution_time, "Seconds"))
+            record_metric(tenant_id, "ExecutionTime", execution_time, "Seconds")
             return jsonify({"message": f"{response} Review added successfully"})
         else:
             app.logger.error(f"Error in add_review : 0 review added for tenant: {tenant_id}")
@@ -119,6 +152,33 @@ def add_review():
         app.logger.error(f"Error in add_review while adding {review_id} for tenant: {tenant_id}: {str(e)}")
         return jsonify({"error": str(e)}), 500
     
+@app.route('/productreview/batch', methods=['POST'])
+def add_reviews_batch():
+    start_time = time.time()
+    tenant_id = get_tenant_id(request)
+    if tenant_id is None:
+        app.logger.error("Tenant ID not found")
+        return jsonify({"error": "Tenant ID not found"}), 401
+
+    batch = ReviewBatch(tenant_id)
+    try:
+        # NDJSON bodies are read line by line while the reviews are inserted.
+        items = get_batch_items(request.mimetype, request.stream)
+        review_repo = ProductReviewRepository(app.logger)
+        review_repo.add_reviews(tenant_id, batch, batch.get_reviews(items))
+    except InvalidBatchRequest as error:
+        app.logger.error(f"Invalid review batch for tenant {tenant_id}: {error}")
+        return jsonify({"error": str(error)}), 400
+    except Exception as e:
+        app.logger.error(f"Error in add_reviews_batch for tenant: {tenant_id}: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+    app.logger.info(f"Added {len(batch.inserted)} of {batch.received} reviews for tenant: {tenant_id}")
+    end_time = time.time()  # Record the end time
+    execution_time = end_time - start_time  # Calculate the execution time
+    record_metric(tenant_id, "ExecutionTime", execution_time, "Seconds")
+    return jsonify(batch.get_response())
+
 @app.route('/productreview/<review_id>', methods=['PUT'])
 def update_review(review_id):
     start_time = time.time()
@@ -152,13 +212,13 @@ def update_review(review_id):
         review = Reviews(review_id, product_id, order_id, rating, review_description, tenant_id=tenant_id)
         app.logger.info(f"Review object created: {review.review_id}")
         review_repository = ProductReviewRepository(app.logger)   
-        response=asyncio.run(review_repository.update_review(review))
+        response=review_repository.update_review(review)
         app.logger.info(f"response:{response} ")
         if response:
             app.logger.info(f"Review {review_id} updated for tenant: {tenant_id}")
             end_time = time.time()  # Record the end time
             execution_time = end_time - start_time  # Calculate the execution time
-            asyncio.run(create_emf_log(tenant_id, "ExecutionTime", execution_time, "Seconds"))
+            record_metric(tenant_id, "ExecutionTime", execution_time, "Seconds")
             return jsonify({"message": f"{response} Review updated successfully"})
         else:
             app.logger.error(f"Error updating review {review_id} for tenant: {tenant_id}")
@@ -184,14 +244,14 @@ def delete_review(review_id):
     app.logger.info(f"Preparing to delete review {review_id} for tenant: {tenant_id}")
     try:
         review_repository = ProductReviewRepository(app.logger)
-        reviews_response = asyncio.run(review_repository.delete_review(review_id, tenant_id))
+        reviews_response = review_repository.delete_review(review_id, tenant_id)
         app.logger.info(f"response:{reviews_response}")
         if not reviews_response:
             app.logger.error(f"Error deleting review {review_id} for tenant: {tenant_id}")
             return jsonify({"error": f"{reviews_response} Review deleted.Error deleting review"})
         end_time = time.time()  # Record the end time
         execution_time = end_time - start_time  # Calculate the execution time
-        asyncio.run(create_emf_log(tenant_id, "ExecutionTime", execution_time, "Seconds"))
+        record_metric(tenant_id, "ExecutionTime", execution_time, "Seconds")
         app.logger.info(f"{reviews_response} Review {review_id} deleted successfully for tenant: {tenant_id}")
         return jsonify({"message": f"{reviews_response} Review deleted successfully"})
     except DatabaseError as error:
@@ -202,5 +262,7 @@ def delete_review(review_id):
 
 
 if __name__ == '__main__':
+    # ECS stops the task with SIGTERM, exit normally so buffered metrics are flushed at exit.
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
     app.run(host='0.0.0.0', port=80 ,debug=False)
 
@@ -0,0 +1,220 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+# Read cache of GET /productreview pages. A page is cached as the JSON body that was sent, keyed by
+# tenant, tenant generation and the page parameters (limit, filters and cursor). Writes of a tenant bump
+# its generation, so every page cached before the write is no longer found, including pages a
+# concurrent read stores after the write, because that read looked up the old generation.
+#
+# The pages are kept in Redis when REVIEWS_CACHE_REDIS_URL is set, so all tasks of the service share the
+# cache and its invalidations. Without Redis the cache is off: an in process cache (LRU bounded by entries
+# and bytes, with a TTL) only sees the writes of its own task, so it is only turned on by setting
+# REVIEWS_CACHE_MAX_ENTRIES, for a service that runs as a single process.
+# Hits and misses are counted per tenant: a hit costs no database time, so tenants with many hits use a
+# smaller share of the database than their request count suggests.
+
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+DEFAULT_TTL_SECONDS = 30
+DEFAULT_MAX_ENTRIES = 10000
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+# Pages larger than this are not cached, so one page cannot evict most of the cache.
+DEFAULT_MAX_ENTRY_BYTES = 1024 * 1024
+
+logger = logging.getLogger('review_svc.cache')
+
+
+class LocalCacheStore:
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, max_bytes=DEFAULT_MAX_BYTES, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.clock = clock
+        # key -> (value, expires_at), from least to most recently used
+        self.entries = OrderedDict()
+        self.size = 0
+        self.generations = {}
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[1] <= self.clock():
+                self._remove(key)
+                return None
+            self.entries.move_to_end(key)
+            return entry[0]
+
+    def set(self, key, value, ttl_seconds):
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = (value, self.clock() + ttl_seconds)
+            self.size += len(value)
+            while self.entries and (len(self.entries) > self.max_entries or self.size > self.max_bytes):
+                self._remove(next(iter(self.entries)))
+                self.evictions += 1
+
+    def _remove(self, key):
+        value, expires_at = self.entries.pop(key)
+        self.size -= len(value)
+
+    def get_generation(self, tenant_id):
+        with self.lock:
+            return self.generations.get(tenant_id, 0)
+
+    def increment_generation(self, tenant_id):
+        with self.lock:
+            self.generations[tenant_id] = self.generations.get(tenant_id, 0) + 1
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            return {'store': 'local', 'entries': len(self.entries), 'bytes': self.size, 'evictions': self.evictions}
+
+
+class RedisCacheStore:
+    # Works with any Redis compatible server (ElastiCache, Valkey, MemoryDB). Size is bounded by the
+    # server's maxmemory and eviction policy, entries expire with their TTL.
+    def __init__(self, client, key_prefix='productreview'):
+        self.client = client
+        self.key_prefix = key_prefix
+
+    def get(self, key):
+        value = self.client.get(f"{self.key_prefix}:{key}")
+        return value.decode() if value is not None else None
+
+    def set(self, key, value, ttl_seconds):
+        self.client.set(f"{self.key_prefix}:{key}", value.encode(), ex=max(1, int(ttl_seconds)))
+
+    def get_generation(self, tenant_id):
+        return int(self.client.get(f"{self.key_prefix}:{tenant_id}:generation") or 0)
+
+    def increment_generation(self, tenant_id):
+        self.client.incr(f"{self.key_prefix}:{tenant_id}:generation")
+
+    def get_stats(self) -> dict:
+        return {'store': 'redis'}
+
+
+def get_page_key(page) -> str:
+    return f"{page.limit}:{page.product_id}:{page.min_rating}:{page.max_rating}:{page.after}"
+
+
+class ReviewCache:
+    def __init__(self, store, ttl_seconds=DEFAULT_TTL_SECONDS, max_entry_bytes=DEFAULT_MAX_ENTRY_BYTES,
+                 remote=False):
+        self.store = store
+        self.ttl_seconds = ttl_seconds
+        self.max_entry_bytes = max_entry_bytes
+        # Remote stores block on the network, the ASGI service calls them from a thread.
+        self.remote = remote
+        self.lock = threading.Lock()
+        # tenant_id -> {'hits': ..., 'misses': ..., 'invalidations': ...}
+        self.tenant_stats = {}
+        self.errors = 0
+
+    def get_page(self, tenant_id, page):
+        # Returns (body, generation), body is None on a miss and generation is passed to put_page.
+        # A cache that cannot be reached is treated as a miss, reviews are then read from the database.
+        try:
+            generation = self.store.get_generation(tenant_id)
+            body = self.store.get(f"{tenant_id}:{generation}:{get_page_key(page)}")
+        except Exception as error:
+            self._record_error(error)
+            return None, None
+        self._record(tenant_id, 'hits' if body is not None else 'misses')
+        return body, generation
+
+    def put_page(self, tenant_id, generation, page, body):
+        if generation is None or len(body) > self.max_entry_bytes:
+            return
+        try:
+            self.store.set(f"{tenant_id}:{generation}:{get_page_key(page)}", body, self.ttl_seconds)
+        except Exception as error:
+            self._record_error(error)
+
+    def invalidate(self, tenant_id):
+        try:
+            self.store.increment_generation(tenant_id)
+        except Exception as error:
+            # Pages of the tenant stay cached until their TTL expires.
+            self._record_error(error)
+            return
+        self._record(tenant_id, 'invalidations')
+
+    async def get_page_async(self, tenant_id, page):
+        if self.remote:
+            return await asyncio.to_thread(self.get_page, tenant_id, page)
+        return self.get_page(tenant_id, page)
+
+    async def put_page_async(self, tenant_id, generation, page, body):
+        if self.remote:
+            return await asyncio.to_thread(self.put_page, tenant_id, generation, page, body)
+        return self.put_page(tenant_id, generation, page, body)
+
+    async def invalidate_async(self, tenant_id):
+        if self.remote:
+            return await asyncio.to_thread(self.invalidate, tenant_id)
+        return self.invalidate(tenant_id)
+
+    def _record(self, tenant_id, counter):
+        with self.lock:
+            tenant_stats = self.tenant_stats.setdefault(tenant_id, {'hits': 0, 'misses': 0, 'invalidations': 0})
+            tenant_stats[counter] += 1
+
+    def _record_error(self, error):
+        logger.warning(f"Review cache error: {error}")
+        with self.lock:
+            self.errors += 1
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            stats = {'ttl_seconds': self.ttl_seconds, 'errors': self.errors,
+                     'tenants': {tenant_id: dict(tenant_stats) for tenant_id, tenant_stats in self.tenant_stats.items()}}
+        stats.update(self.store.get_stats())
+        return stats
+
+
+class DisabledReviewCache(ReviewCache):
+    # No Redis and no REVIEWS_CACHE_MAX_ENTRIES: every read goes to the database.
+    def __init__(self):
+        super().__init__(None)
+
+    def get_page(self, tenant_id, page):
+        return None, None
+
+    def put_page(self, tenant_id, generation, page, body):
+        pass
+
+    def invalidate(self, tenant_id):
+        pass
+
+    def get_stats(self) -> dict:
+        return {'store': 'disabled'}
+
+
+def get_review_cache_from_env() -> ReviewCache:
+    ttl_seconds = int(os.getenv("REVIEWS_CACHE_TTL_SECONDS", DEFAULT_TTL_SECONDS))
+    max_entry_bytes = int(os.getenv("REVIEWS_CACHE_MAX_ENTRY_BYTES", DEFAULT_MAX_ENTRY_BYTES))
+    redis_url = os.getenv("REVIEWS_CACHE_REDIS_URL")
+    if redis_url:
+        # Only needed when a shared cache is configured.
+        import redis
+        client = redis.Redis.from_url(redis_url, socket_timeout=0.2, socket_connect_timeout=0.2)
+        return ReviewCache(RedisCacheStore(client), ttl_seconds, max_entry_bytes, remote=True)
+    # In process entries are opt in, a cache of one task serves pages the writes of other tasks changed.
+    max_entries = int(os.getenv("REVIEWS_CACHE_MAX_ENTRIES", 0))
+    if max_entries == 0 or ttl_seconds == 0:
+        return DisabledReviewCache()
+    store = LocalCacheStore(max_entries, int(os.getenv("REVIEWS_CACHE_MAX_BYTES", DEFAULT_MAX_BYTES)))
+    return ReviewCache(store, ttl_seconds, max_entry_bytes)
+
+
+review_cache = get_review_cache_from_env()
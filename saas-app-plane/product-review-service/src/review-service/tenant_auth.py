@@ -0,0 +1,238 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+# Verified tenant context for the ECS services. The bearer token of a request is verified against the
+# tenant user pool's JWKS (signature, expiry, issuer and audience) and the tenant id is only read from
+# verified claims. Verification is done once per token: the decoded claims are kept in an LRU keyed by
+# the token's SHA-256 until the token expires, and the JWKS is cached and refetched after
+# TENANT_AUTH_JWKS_TTL_SECONDS or when a token is signed with a key id it does not know (key rotation).
+#
+# Configuration:
+#   USER_POOL_ID                     the tenant user pool, the JWKS and the expected issuer are derived from it
+#   APP_CLIENT_ID                    expected audience of the (id) token, not checked when unset
+#   JWKS_URL                         JWKS location when it is not the Cognito user pool one
+#   TENANT_AUTH_JWKS_TTL_SECONDS     how long the JWKS is used before it is refetched (3600)
+#   TENANT_AUTH_MAX_CACHED_TOKENS    verified tokens kept in the LRU (10000, 0 verifies every request)
+# Without USER_POOL_ID or JWKS_URL no token can be verified and every request with a token is rejected.
+
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+import urllib.request
+from collections import OrderedDict, namedtuple
+from jose import jwt
+from jose.exceptions import JOSEError
+
+TENANT_ID_CLAIM = 'custom:tenantId'
+ALGORITHMS = ['RS256']
+DEFAULT_JWKS_TTL_SECONDS = 3600
+DEFAULT_MAX_CACHED_TOKENS = 10000
+# An unknown key id refetches the JWKS at most this often, tokens with made up key ids must not turn
+# into one JWKS request each.
+MIN_JWKS_REFRESH_SECONDS = 60
+JWKS_TIMEOUT_SECONDS = 5
+
+TenantContext = namedtuple('TenantContext', ['tenant_id', 'claims'])
+
+
+class InvalidToken(Exception):
+    pass
+
+
+def fetch_jwks(jwks_url):
+    with urllib.request.urlopen(jwks_url, timeout=JWKS_TIMEOUT_SECONDS) as f:
+        response = f.read()
+    return json.loads(response.decode('utf-8'))
+
+
+class JwksCache:
+    def __init__(self, jwks_url, ttl_seconds=DEFAULT_JWKS_TTL_SECONDS, fetch=fetch_jwks, clock=time.time):
+        self.jwks_url = jwks_url
+        self.ttl_seconds = ttl_seconds
+        self.fetch = fetch
+        self.clock = clock
+        self.keys = {}
+        self.fetched_at = None
+        self.lock = threading.Lock()
+        self.stats = {'fetches': 0, 'fetch_errors': 0}
+
+    def get_key(self, kid):
+        with self.lock:
+            now = self.clock()
+            stale = self.fetched_at is None or now - self.fetched_at >= self.ttl_seconds
+            unknown = kid not in self.keys and (self.fetched_at is None
+                                                or now - self.fetched_at >= MIN_JWKS_REFRESH_SECONDS)
+            if stale or unknown:
+                self._refresh(now)
+            key = self.keys.get(kid)
+        if key is None:
+            raise InvalidToken(f"Signing key {kid} not found in JWKS")
+        return key
+
+    def _refresh(self, now):
+        try:
+            jwks = self.fetch(self.jwks_url)
+        except Exception as e:
+            # The keys fetched before stay in use, the next request tries again.
+            self.stats['fetch_errors'] += 1
+            if not self.keys:
+                raise InvalidToken(f"Unable to fetch JWKS: {e}")
+            return
+        self.keys = {key['kid']: key for key in jwks.get('keys', [])}
+        self.fetched_at = now
+        self.stats['fetches'] += 1
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            stats = dict(self.stats)
+            stats['keys'] = len(self.keys)
+            return stats
+
+
+class TokenVerifier:
+    def __init__(self, jwks, audience=None, issuer=None, max_cached_tokens=DEFAULT_MAX_CACHED_TOKENS,
+                 clock=time.time):
+        self.jwks = jwks
+        self.audience = audience
+        self.issuer = issuer
+        self.max_cached_tokens = max_cached_tokens
+        self.clock = clock
+        # sha256(token) -> (expiry, claims), least recently used first
+        self.tokens = OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'rejected': 0, 'evictions': 0}
+
+    def get_cached_claims(self, token):
+        token_hash = hashlib.sha256(token.encode()).digest()
+        with self.lock:
+            entry = self.tokens.get(token_hash)
+            if entry is not None:
+                expiry, claims = entry
+                if self.clock() < expiry:
+                    self.tokens.move_to_end(token_hash)
+                    self.stats['hits'] += 1
+                    return claims
+                del self.tokens[token_hash]
+            self.stats['misses'] += 1
+        return None
+
+    def verify(self, token):
+        # Returns the verified claims of the token, raises InvalidToken.
+        claims = self.get_cached_claims(token)
+        if claims is not None:
+            return claims
+        try:
+            claims = self._decode(token)
+        except InvalidToken:
+            with self.lock:
+                self.stats['rejected'] += 1
+            raise
+        self._put(token, claims)
+        return claims
+
+    async def verify_async(self, token):
+        # Cached tokens are served on the event loop, only a verification (and JWKS fetch) runs in a thread.
+        claims = self.get_cached_claims(token)
+        if claims is not None:
+            return claims
+        return await asyncio.to_thread(self.verify, token)
+
+    def _decode(self, token):
+        try:
+            kid = jwt.get_unverified_header(token).get('kid')
+            key = self.jwks.get_key(kid)
+            # at_hash is only checked together with the access token, which the services do not receive.
+            return jwt.decode(token, key, algorithms=ALGORITHMS, audience=self.audience, issuer=self.issuer,
+                              options={'verify_aud': self.audience is not None, 'verify_at_hash': False,
+                                       'require_exp': True})
+        except JOSEError as e:
+            raise InvalidToken(str(e))
+
+    def _put(self, token, claims):
+        if self.max_cached_tokens <= 0:
+            return
+        token_hash = hashlib.sha256(token.encode()).digest()
+        with self.lock:
+            self.tokens[token_hash] = (claims['exp'], claims)
+            self.tokens.move_to_end(token_hash)
+            while len(self.tokens) > self.max_cached_tokens:
+                self.tokens.popitem(last=False)
+                self.stats['evictions'] += 1
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            stats = dict(self.stats)
+            stats['cached_tokens'] = len(self.tokens)
+        stats['jwks'] = self.jwks.get_stats()
+        return stats
+
+
+class UnconfiguredTokenVerifier:
+    # Used when neither USER_POOL_ID nor JWKS_URL is set, tokens cannot be verified so none is accepted.
+    def verify(self, token):
+        raise InvalidToken("Token verification is not configured, set USER_POOL_ID or JWKS_URL")
+
+    async def verify_async(self, token):
+        return self.verify(token)
+
+    def get_stats(self) -> dict:
+        return {'configured': False}
+
+
+def get_token_verifier_from_env():
+    user_pool_id = os.getenv('USER_POOL_ID')
+    jwks_url = os.getenv('JWKS_URL')
+    issuer = None
+    if user_pool_id:
+        region = os.getenv('AWS_REGION')
+        issuer = f"https://cognito-idp.{region}.amazonaws.com/{user_pool_id}"
+        jwks_url = jwks_url or f"{issuer}/.well-known/jwks.json"
+    if not jwks_url:
+        return UnconfiguredTokenVerifier()
+    jwks = JwksCache(jwks_url, ttl_seconds=int(os.getenv('TENANT_AUTH_JWKS_TTL_SECONDS', DEFAULT_JWKS_TTL_SECONDS)))
+    return TokenVerifier(jwks, audience=os.getenv('APP_CLIENT_ID') or None, issuer=issuer,
+                         max_cached_tokens=int(os.getenv('TENANT_AUTH_MAX_CACHED_TOKENS', DEFAULT_MAX_CACHED_TOKENS)))
+
+
+token_verifier = get_token_verifier_from_env()
+
+
+def get_bearer_token(headers):
+    bearer_token = headers.get('Authorization')
+    if not bearer_token:
+        return None
+    scheme, _, token = bearer_token.partition(' ')
+    if scheme.lower() != 'bearer' or not token:
+        raise InvalidToken("Authorization header is not a bearer token")
+    return token.strip()
+
+
+def to_tenant_context(claims):
+    tenant_id = claims.get(TENANT_ID_CLAIM)
+    if not tenant_id:
+        raise InvalidToken(f"Token has no {TENANT_ID_CLAIM} claim")
+    return TenantContext(tenant_id, claims)
+
+
+def get_tenant_context(headers):
+    # None when the request has no token, raises InvalidToken when it has one that does not verify.
+    token = get_bearer_token(headers)
+    if token is None:
+        return None
+    return to_tenant_context(token_verifier.verify(token))
+
+
+async def get_tenant_context_async(headers):
+    token = get_bearer_token(headers)
+    if token is None:
+        return None
+    return to_tenant_context(await token_verifier.verify_async(token))
+
+
+def get_tenant_id(request):
+    # The tenant id the authentication hook verified for the request, None without a token.
+    tenant_context = getattr(request, 'tenant_context', None)
+    return tenant_context.tenant_id if tenant_context else None
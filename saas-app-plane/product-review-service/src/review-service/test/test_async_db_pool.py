@@ -0,0 +1,154 @@
+import unittest
+import sys
+import os
+import asyncio
+import time
+from contextlib import asynccontextmanager
+
+sys.path.append(
+    os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "")))
+
+os.environ.setdefault('AWS_REGION', 'us-east-1')
+os.environ.setdefault('DATABASE_NAME', 'test')
+
+from async_db_pool import AsyncTenantPool, AsyncTenantPoolManager
+from db_config import ConnectionBudgetExhausted
+
+
+class StubAsyncPool:
+    def __init__(self, tenant_id, max_size):
+        self.tenant_id = tenant_id
+        self.max_size = max_size
+        self.last_used = time.monotonic()
+        self.connections_in_use = 0
+        self.closed = False
+
+    def get_open_connections(self):
+        return 0 if self.closed else max(1, self.connections_in_use)
+
+    async def close(self):
+        self.closed = True
+
+
+class StubConnectionPool:
+    # Stands in for the psycopg AsyncConnectionPool of an AsyncTenantPool.
+    def __init__(self):
+        self.closed = False
+
+    @asynccontextmanager
+    async def connection(self):
+        if self.closed:
+            raise RuntimeError('the pool is closed')
+        yield object()
+
+    def get_stats(self):
+        return {'pool_size': 0 if self.closed else 1}
+
+    async def close(self):
+        self.closed = True
+
+
+async def create_tenant_pool(tenant_id, max_size):
+    await asyncio.sleep(0.01)
+    return AsyncTenantPool(StubConnectionPool())
+
+
+class StubAsyncPoolFactory:
+    def __init__(self, delay=0.0, failing_tenants=()):
+        self.delay = delay
+        self.failing_tenants = failing_tenants
+        self.created = []
+
+    async def __call__(self, tenant_id, max_size):
+        await asyncio.sleep(self.delay)
+        if tenant_id in self.failing_tenants:
+            raise RuntimeError('could not connect')
+        tenant_pool = StubAsyncPool(tenant_id, max_size)
+        self.created.append(tenant_pool)
+        return tenant_pool
+
+
+class TestAsyncTenantPoolManager(unittest.IsolatedAsyncioTestCase):
+
+    async def test_reuses_tenant_pool(self):
+        manager = AsyncTenantPoolManager(StubAsyncPoolFactory(), max_connections=20, max_connections_per_tenant=5)
+        self.assertIs(await manager.get_pool('tenant-1'), await manager.get_pool('tenant-1'))
+        stats = manager.get_stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['pools']), (1, 1, 1))
+        self.assertEqual(stats['reserved_connections'], 5)
+
+    async def test_concurrent_first_requests_create_one_pool(self):
+        factory = StubAsyncPoolFactory(delay=0.05)
+        manager = AsyncTenantPoolManager(factory, max_connections=20, max_connections_per_tenant=5)
+        pools = await asyncio.gather(*[manager.get_pool('tenant-1') for _ in range(10)])
+        self.assertEqual(len(factory.created), 1)
+        self.assertTrue(all(tenant_pool is factory.created[0] for tenant_pool in pools))
+        self.assertEqual(manager.get_stats()['misses'], 1)
+
+    async def test_evicts_least_recently_used_pool_when_budget_is_used(self):
+        factory = StubAsyncPoolFactory()
+        manager = AsyncTenantPoolManager(factory, max_connections=10, max_connections_per_tenant=5)
+        tenant_1 = await manager.get_pool('tenant-1')
+        await manager.get_pool('tenant-2')
+        # tenant-1 becomes the most recently used, so tenant-2 is evicted for tenant-3.
+        await manager.get_pool('tenant-1')
+        await manager.get_pool('tenant-3')
+        self.assertEqual(list(manager.pools), ['tenant-1', 'tenant-3'])
+        self.assertTrue(factory.created[1].closed)
+        self.assertFalse(tenant_1.closed)
+        self.assertEqual(manager.get_stats()['evictions'], 1)
+
+    async def test_budget_exhausted_when_all_pools_are_in_use(self):
+        manager = AsyncTenantPoolManager(StubAsyncPoolFactory(), max_connections=10, max_connections_per_tenant=5)
+        for tenant_id in ('tenant-1', 'tenant-2'):
+            (await manager.get_pool(tenant_id)).connections_in_use = 1
+        with self.assertRaises(ConnectionBudgetExhausted):
+            await manager.get_pool('tenant-3')
+        self.assertEqual(manager.get_stats()['reserved_connections'], 10)
+
+    async def test_waiting_request_keeps_pool_until_checkout(self):
+        manager = AsyncTenantPoolManager(create_tenant_pool, max_connections=5, max_connections_per_tenant=5)
+
+        async def read():
+            async with manager.connection('tenant-1') as db_conn:
+                return db_conn
+
+        async def create_then_need_room():
+            await manager.get_pool('tenant-1')
+            # Runs before the waiting request resumes, the pool it waited for must not be evicted.
+            with self.assertRaises(ConnectionBudgetExhausted):
+                await manager.get_pool('tenant-2')
+
+        creator = asyncio.create_task(create_then_need_room())
+        await asyncio.sleep(0)
+        db_conn, _ = await asyncio.gather(read(), creator)
+        self.assertIsNotNone(db_conn)
+        self.assertEqual(manager.pins, {})
+        self.assertFalse(manager.pools['tenant-1'].connection_pool.closed)
+        # Without a request holding it, the pool makes room for another tenant.
+        await manager.get_pool('tenant-2')
+        self.assertEqual(list(manager.pools), ['tenant-2'])
+
+    async def test_expires_idle_pools(self):
+        factory = StubAsyncPoolFactory()
+        manager = AsyncTenantPoolManager(factory, max_connections=20, max_connections_per_tenant=5,
+                                         idle_ttl_seconds=60)
+        tenant_pool = await manager.get_pool('tenant-1')
+        tenant_pool.last_used -= 61
+        await manager.evict_expired_pools()
+        self.assertTrue(tenant_pool.closed)
+        stats = manager.get_stats()
+        self.assertEqual((stats['pools'], stats['expirations'], stats['reserved_connections']), (0, 1, 0))
+
+    async def test_failed_creation_releases_reservation(self):
+        factory = StubAsyncPoolFactory(delay=0.01, failing_tenants=('tenant-1',))
+        manager = AsyncTenantPoolManager(factory, max_connections=10, max_connections_per_tenant=5)
+        results = await asyncio.gather(*[manager.get_pool('tenant-1') for _ in range(3)], return_exceptions=True)
+        self.assertTrue(all(isinstance(result, RuntimeError) for result in results))
+        stats = manager.get_stats()
+        self.assertEqual((stats['creation_failures'], stats['reserved_connections']), (1, 0))
+        self.assertEqual(manager.creating, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
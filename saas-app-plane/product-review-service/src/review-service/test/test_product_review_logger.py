@@ -0,0 +1,186 @@
+import unittest
+import sys
+import os
+import re
+import json
+import threading
+
+sys.path.append(
+    os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "")))
+
+from aws_embedded_metrics.logger.metrics_logger import MetricsLogger
+from aws_embedded_metrics.serializers.log_serializer import LogSerializer
+
+from product_review_logger import MetricsAggregator
+
+ECS_USAGE_AGGREGATOR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "lambdas-aggregator",
+                                                    "ecs-usage-aggregator.py"))
+
+
+class FakeMetricsLogger:
+    def __init__(self, flushed):
+        self.flushed = flushed
+        self.dimensions = None
+        self.metrics = {}
+        self.properties = {}
+
+    def put_dimensions(self, dimensions):
+        self.dimensions = dimensions
+
+    def put_metric(self, name, value, unit):
+        self.metrics.setdefault((name, unit), []).append(value)
+
+    def set_property(self, key, value):
+        self.properties[key] = value
+
+    def flush_sync(self):
+        self.flushed.append(self)
+
+
+class FakeMetricsLoggerFactory:
+    def __init__(self):
+        self.flushed = []
+        self.fail = False
+        self.flush_event = threading.Event()
+
+    def __call__(self):
+        if self.fail:
+            raise RuntimeError('sink unavailable')
+        self.flush_event.set()
+        return FakeMetricsLogger(self.flushed)
+
+
+class StubSink:
+    def __init__(self):
+        self.contexts = []
+
+    def accept(self, context):
+        self.contexts.append(context)
+
+
+class StubEnvironment:
+    def __init__(self, sink):
+        self.sink = sink
+
+    def get_name(self):
+        return 'Local'
+
+    def get_type(self):
+        return 'Local'
+
+    def get_log_group_name(self):
+        return 'review-service'
+
+    def configure_context(self, context):
+        pass
+
+    def get_sink(self):
+        return self.sink
+
+
+def get_log_insights_fields(log_line) -> dict:
+    # Fields Logs Insights discovers in a JSON log event, arrays are flattened into <name>.<index>.
+    fields = {}
+
+    def flatten(prefix, value):
+        if isinstance(value, dict):
+            for key, item in value.items():
+                flatten(f"{prefix}.{key}" if prefix else key, item)
+        elif isinstance(value, list):
+            for index, item in enumerate(value):
+                flatten(f"{prefix}.{index}", item)
+        else:
+            fields[prefix] = value
+
+    flatten('', json.loads(log_line))
+    return fields
+
+
+class TestMetricsAggregator(unittest.TestCase):
+
+    def test_flushes_through_metrics_logger(self):
+        # The aws-embedded-metrics MetricsLogger the service runs with, only the sink is a stub.
+        sink = StubSink()
+
+        async def resolve_environment():
+            return StubEnvironment(sink)
+
+        aggregator = MetricsAggregator(flush_interval_seconds=60,
+                                       create_logger=lambda: MetricsLogger(resolve_environment))
+        aggregator.put_metric('tenant-1', 'ReviewsFetched', 2, 'Count')
+        aggregator.put_metric('tenant-1', 'ReviewsFetched', 3, 'Count')
+        aggregator.close()
+        self.assertEqual(aggregator.get_stats()['flush_errors'], 0)
+        self.assertEqual(len(sink.contexts), 1)
+        context = sink.contexts[0]
+        self.assertEqual(context.metrics['ReviewsFetched'].values, [5])
+        self.assertEqual(context.properties['ReviewsFetchedSamples'], 2)
+        self.assertIn({'Tenant': 'tenant-1'}, context.dimensions)
+
+    @unittest.skipUnless(os.path.isfile(ECS_USAGE_AGGREGATOR), "lambdas-aggregator is not next to review-service")
+    def test_flushed_log_line_is_read_by_ecs_usage_aggregator(self):
+        sink = StubSink()
+
+        async def resolve_environment():
+            return StubEnvironment(sink)
+
+        aggregator = MetricsAggregator(flush_interval_seconds=60,
+                                       create_logger=lambda: MetricsLogger(resolve_environment))
+        for execution_time in (0.25, 0.5, 1.25):
+            aggregator.put_metric('tenant-1', 'ExecutionTime', execution_time, 'Seconds')
+        aggregator.close()
+        log_lines = [line for context in sink.contexts for line in LogSerializer.serialize(context)]
+        with open(ECS_USAGE_AGGREGATOR) as f:
+            query = f.read()
+        # The fields of "filter ispresent(...)" and "stats sum(...)" of the aggregator's Logs Insights query.
+        filtered = re.findall(r"ispresent\((\w+)\)", query)
+        summed = re.findall(r"stats sum\((\w+)\)", query)
+        self.assertEqual((filtered, summed), (['ExecutionTime'], ['ExecutionTime']))
+        events = [get_log_insights_fields(line) for line in log_lines]
+        matched = [fields for fields in events if all(field in fields for field in filtered)]
+        self.assertEqual(sum(fields[summed[0]] for fields in matched), 2.0)
+        self.assertEqual({fields['Tenant'] for fields in matched}, {'tenant-1'})
+
+    def test_batches_samples_per_tenant(self):
+        factory = FakeMetricsLoggerFactory()
+        aggregator = MetricsAggregator(flush_interval_seconds=60, create_logger=factory)
+        for value in (1, 2, 3):
+            aggregator.put_metric('tenant-1', 'ReviewsFetched', value, 'Count')
+        aggregator.put_metric('tenant-1', 'ExecutionTime', 0.5, 'Seconds')
+        aggregator.put_metric('tenant-2', 'ReviewsFetched', 4, 'Count')
+        aggregator.close()
+        self.assertEqual(len(factory.flushed), 2)
+        tenant_1 = next(metrics for metrics in factory.flushed if metrics.dimensions == {'Tenant': 'tenant-1'})
+        self.assertEqual(tenant_1.metrics, {('ReviewsFetched', 'Count'): [6],
+                                            ('ExecutionTime', 'Seconds'): [0.5]})
+        self.assertEqual(tenant_1.properties, {'ReviewsFetchedSamples': 3, 'ExecutionTimeSamples': 1})
+        stats = aggregator.get_stats()
+        self.assertEqual((stats['samples'], stats['buffered_samples']), (5, 0))
+
+    def test_flushes_when_buffer_is_full(self):
+        factory = FakeMetricsLoggerFactory()
+        aggregator = MetricsAggregator(flush_interval_seconds=60, max_buffered_samples=3, create_logger=factory)
+        for value in range(3):
+            aggregator.put_metric('tenant-1', 'ReviewsAdded', value, 'Count')
+        self.assertTrue(factory.flush_event.wait(5))
+        aggregator.close()
+        self.assertEqual(sum(metrics.properties['ReviewsAddedSamples'] for metrics in factory.flushed), 3)
+
+    def test_flushes_on_interval(self):
+        factory = FakeMetricsLoggerFactory()
+        aggregator = MetricsAggregator(flush_interval_seconds=0.01, create_logger=factory)
+        aggregator.put_metric('tenant-1', 'ReviewsAdded', 1, 'Count')
+        self.assertTrue(factory.flush_event.wait(5))
+        aggregator.close()
+
+    def test_sink_errors_are_counted(self):
+        factory = FakeMetricsLoggerFactory()
+        factory.fail = True
+        aggregator = MetricsAggregator(flush_interval_seconds=60, create_logger=factory)
+        aggregator.put_metric('tenant-1', 'ReviewsAdded', 1, 'Count')
+        aggregator.close()
+        self.assertEqual(aggregator.get_stats()['flush_errors'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
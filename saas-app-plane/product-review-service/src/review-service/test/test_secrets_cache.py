@@ -0,0 +1,144 @@
+import unittest
+import sys
+import os
+import json
+import threading
+import time
+
+sys.path.append(
+    os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "")))
+
+from secrets_cache import SecretsCache, is_authentication_error
+
+
+class StubSecretsManager:
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.passwords = {}
+        self.calls = 0
+        self.lock = threading.Lock()
+        self.fail = False
+
+    def get_secret_value(self, SecretId):
+        with self.lock:
+            self.calls += 1
+        time.sleep(self.delay)
+        if self.fail:
+            raise RuntimeError('Secrets Manager unavailable')
+        return {'SecretString': json.dumps({'username': SecretId, 'password': self.passwords.get(SecretId, 'secret-1'),
+                                            'host': 'localhost', 'port': 5432})}
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class AuthenticationError(Exception):
+    pgcode = '28P01'
+
+
+def wait_for_background_refresh(cache, secret_id):
+    while True:
+        with cache.lock:
+            fetch = cache.fetches.get(secret_id)
+        if fetch is None:
+            return
+        fetch.wait()
+
+
+class TestSecretsCache(unittest.TestCase):
+
+    def test_cached_until_ttl(self):
+        client = StubSecretsManager()
+        clock = Clock()
+        cache = SecretsCache(client, ttl_seconds=300, refresh_ahead_seconds=0, clock=clock)
+        for _ in range(5):
+            self.assertEqual(cache.get_secret_json('tenant-1Credentials')['password'], 'secret-1')
+        self.assertEqual(client.calls, 1)
+        clock.now += 301
+        cache.get_secret_json('tenant-1Credentials')
+        self.assertEqual(client.calls, 2)
+        stats = cache.get_stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['fetches']), (4, 2, 2))
+
+    def test_concurrent_misses_share_one_fetch(self):
+        client = StubSecretsManager(delay=0.05)
+        cache = SecretsCache(client)
+        values = []
+        threads = [threading.Thread(target=lambda: values.append(cache.get_secret_string('tenant-1Credentials')))
+                   for _ in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(client.calls, 1)
+        self.assertEqual(len(set(values)), 1)
+        self.assertEqual(len(values), 10)
+
+    def test_refreshes_in_background_before_expiry(self):
+        client = StubSecretsManager()
+        clock = Clock()
+        cache = SecretsCache(client, ttl_seconds=300, refresh_ahead_seconds=60, clock=clock)
+        cache.get_secret_json('tenant-1Credentials')
+        client.passwords['tenant-1Credentials'] = 'secret-2'
+        clock.now += 250
+        # The cached value is returned while the new one is fetched.
+        self.assertEqual(cache.get_secret_json('tenant-1Credentials')['password'], 'secret-1')
+        wait_for_background_refresh(cache, 'tenant-1Credentials')
+        self.assertEqual(cache.get_secret_json('tenant-1Credentials')['password'], 'secret-2')
+        self.assertEqual(client.calls, 2)
+        self.assertEqual(cache.get_stats()['background_refreshes'], 1)
+
+    def test_failed_background_refresh_keeps_cached_value(self):
+        client = StubSecretsManager()
+        clock = Clock()
+        cache = SecretsCache(client, ttl_seconds=300, refresh_ahead_seconds=60, clock=clock)
+        cache.get_secret_json('tenant-1Credentials')
+        client.fail = True
+        clock.now += 250
+        cache.get_secret_json('tenant-1Credentials')
+        wait_for_background_refresh(cache, 'tenant-1Credentials')
+        self.assertEqual(cache.get_secret_json('tenant-1Credentials')['password'], 'secret-1')
+        self.assertEqual(cache.get_stats()['fetch_errors'], 1)
+
+    def test_refetches_secret_when_credentials_are_rejected(self):
+        client = StubSecretsManager()
+        cache = SecretsCache(client)
+        cache.get_secret_json('tenant-1Credentials')
+        # The password is rotated after it was cached.
+        client.passwords['tenant-1Credentials'] = 'secret-2'
+        attempts = []
+
+        def connect(secret):
+            attempts.append(secret['password'])
+            if secret['password'] != 'secret-2':
+                raise AuthenticationError('password authentication failed for user "tenant-1"')
+            return 'connection'
+
+        self.assertEqual(cache.call_with_secret('tenant-1Credentials', connect), 'connection')
+        self.assertEqual(attempts, ['secret-1', 'secret-2'])
+        self.assertEqual(client.calls, 2)
+
+    def test_other_errors_are_not_retried(self):
+        client = StubSecretsManager()
+        cache = SecretsCache(client)
+
+        def connect(secret):
+            raise RuntimeError('could not connect to server')
+
+        with self.assertRaises(RuntimeError):
+            cache.call_with_secret('tenant-1Credentials', connect)
+        self.assertEqual(client.calls, 1)
+
+    def test_authentication_error_detection(self):
+        self.assertTrue(is_authentication_error(AuthenticationError()))
+        self.assertTrue(is_authentication_error(Exception('FATAL:  password authentication failed for user "x"')))
+        self.assertFalse(is_authentication_error(Exception('connection refused')))
+
+
+if __name__ == '__main__':
+    unittest.main()
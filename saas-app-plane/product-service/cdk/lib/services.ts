@@ -55,6 +55,10 @@ export class Services extends Construct {
     });
     
     this.serverlessServicesLogGroupArn = serverlessServicesLogGroup.logGroupArn
+
+    // Write shards per tenant by tier, pinned in the tenant details the first time a tenant is seen.
+    const tenantDetailsTableName = this.node.tryGetContext('tenantDetailsTable');
+    const shardCountByTier = { basic: 1, advanced: 3, premium: 9 };
     
     this.productMicroservice = new Microservice(this, 'ProductMicroservice', {
       index: 'product_service.py',
@@ -68,11 +72,18 @@ export class Services extends Construct {
         get: 'get_product',
         update: 'update_product',
         delete: 'delete_product',
+        batchCreate: 'create_products',
+        batchGet: 'batch_get_products',
+        batchDelete: 'delete_products',
       },
       logLevel: 'DEBUG',
       layers: [telemetryAPIExtension],
       logGroup: serverlessServicesLogGroup,
       authorizerFunctionArn: props.authorizerFunctionArn,
+      shardPolicy: tenantDetailsTableName ? {
+        tenantDetailsTableName: tenantDetailsTableName,
+        shardCountByTier: shardCountByTier,
+      } : undefined,
     });
     this.productMicroservice.table.grantReadWriteData(props.tenantScopedAccessRole);
 
@@ -84,6 +95,9 @@ export class Services extends Construct {
         get: 'get_order',
         update: 'update_order',
         delete: 'delete_order',
+        batchCreate: 'create_orders',
+        batchGet: 'batch_get_orders',
+        batchDelete: 'delete_orders',
       },
       serviceName: 'OrderService',
       entry: path.join(__dirname, '../../src'),
@@ -93,6 +107,10 @@ export class Services extends Construct {
       layers: [telemetryAPIExtension],
       logGroup: serverlessServicesLogGroup,
       authorizerFunctionArn: props.authorizerFunctionArn,
+      shardPolicy: tenantDetailsTableName ? {
+        tenantDetailsTableName: tenantDetailsTableName,
+        shardCountByTier: shardCountByTier,
+      } : undefined,
     });
     this.orderMicroservice.table.grantReadWriteData(props.tenantScopedAccessRole);
 
@@ -0,0 +1,113 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+# DynamoDB resources kept across warm invocations, one per set of tenant STS credentials. Creating a
+# resource loads the service and resource models and opens a new connection pool, so the first request
+# with new credentials pays for it and the next ones reuse the resource and its open connections.
+# All resources are created from one boto3 session, so the models are loaded once per environment.
+# An entry is dropped shortly before its session token expires, and the least recently used entry
+# once there are more than max_entries.
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+import boto3
+import botocore.session
+
+DEFAULT_MAX_ENTRIES = 64
+# The authorizer's credentials are valid for an hour, when the expiration is not passed along the
+# entry is kept for the shortest duration STS issues.
+DEFAULT_TTL_SECONDS = 900
+# Requests that start right before the expiration still have time to complete.
+EXPIRY_MARGIN_SECONDS = 60
+
+
+def get_expiration_timestamp(expiration):
+    # The authorizer passes the expiration as an ISO 8601 string.
+    if not expiration:
+        return None
+    if isinstance(expiration, datetime):
+        return expiration.timestamp()
+    return datetime.fromisoformat(expiration.replace('Z', '+00:00')).timestamp()
+
+
+class DynamoDBResourceCache:
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, default_ttl_seconds=DEFAULT_TTL_SECONDS,
+                 expiry_margin_seconds=EXPIRY_MARGIN_SECONDS, clock=time.time, session=None, **resource_kwargs):
+        self.max_entries = max_entries
+        self.default_ttl_seconds = default_ttl_seconds
+        self.expiry_margin_seconds = expiry_margin_seconds
+        self.clock = clock
+        # One botocore session, and with it one loader, for every resource. The credentials are passed
+        # to each resource, the session itself has none.
+        self.session = session or boto3.session.Session(botocore_session=botocore.session.get_session())
+        self.resource_kwargs = resource_kwargs
+        # (access key, secret key, session token) -> (expires at, resource, tables by name), least
+        # recently used first
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'expired': 0, 'evictions': 0}
+
+    def get_resource(self, access_key, secret_key, session_token, expiration=None):
+        return self._get_entry(access_key, secret_key, session_token, expiration)[1]
+
+    def get_table(self, event, table_name):
+        # The tenant's STS credentials are passed by the authorizer in the request context.
+        authorizer = event['requestContext']['authorizer']
+        entry = self._get_entry(authorizer['accesskey'], authorizer['secretkey'], authorizer['sessiontoken'],
+                                authorizer.get('expiration'))
+        # Building a Table is not free either, they are kept with the resource.
+        table = entry[2].get(table_name)
+        if table is None:
+            table = entry[2].setdefault(table_name, entry[1].Table(table_name))
+        return table
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            return {**self.stats, 'entries': len(self.entries)}
+
+    def _get_entry(self, access_key, secret_key, session_token, expiration):
+        key = (access_key, secret_key, session_token)
+        now = self.clock()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                if now < entry[0]:
+                    self.entries.move_to_end(key)
+                    self.stats['hits'] += 1
+                    return entry
+                del self.entries[key]
+                self.stats['expired'] += 1
+            self.stats['misses'] += 1
+
+            expires_at = get_expiration_timestamp(expiration)
+            if expires_at is None:
+                expires_at = now + self.default_ttl_seconds
+            # Sessions are not thread safe, resources are created under the lock.
+            resource = self.session.resource('dynamodb', aws_access_key_id=access_key,
+                                             aws_secret_access_key=secret_key, aws_session_token=session_token,
+                                             **self.resource_kwargs)
+            entry = (expires_at - self.expiry_margin_seconds, resource, {})
+            self.entries[key] = entry
+            self._evict(now)
+            return entry
+
+    def _evict(self, now):
+        for key in [key for key, entry in self.entries.items() if entry[0] <= now]:
+            del self.entries[key]
+            self.stats['expired'] += 1
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.stats['evictions'] += 1
+
+
+def get_resource_cache_from_env(**resource_kwargs):
+    return DynamoDBResourceCache(max_entries=int(os.getenv('DYNAMODB_RESOURCE_CACHE_SIZE', DEFAULT_MAX_ENTRIES)),
+                                 **resource_kwargs)
+
+
+# Shared by the DAL modules, reused across warm invocations.
+resource_cache = get_resource_cache_from_env()
@@ -9,15 +9,17 @@ import uuid
 from models.order_models import Order
 from utils import logger
 
-import random
-import threading
 from boto3.dynamodb.conditions import Key
+from dal.dynamodb_resource_cache import resource_cache
+from dal.sharded_query import scatter_gather_query
+from dal.batch_operations import batch_get, batch_write, get_tenant_keys
+from dal.shard_policy import get_read_shard_ids, get_shard_policy_cache_from_env, get_write_shard_id
 
 table_name = os.environ['TABLE_NAME']
 dynamodb = None
 
-suffix_start = 1 
-suffix_end = 10
+# Shards per tenant, kept with the tenant details
+shard_policies = get_shard_policy_cache_from_env('order')
  
 
 def get_order(event, key):
@@ -57,19 +59,14 @@ def delete_order(event, key):
 def create_order(event, payload):
     tenantId = event['requestContext']['authorizer']['tenantId']
     table = __get_dynamodb_table(event, dynamodb)
-    # nosec - Suppress bandit. Not using for security purposes, B311: Standard pseudo-random generators are not suitable for security/cryptographic purposes.
-    suffix = random.randrange(suffix_start, suffix_end)
-    shardId = tenantId+"-"+str(suffix)
+    shard_policy = shard_policies.get_policy(tenantId, event['requestContext']['authorizer'].get('tenantTier'), table)
+    orderId = str(uuid.uuid4())
+    shardId = get_write_shard_id(tenantId, orderId, shard_policy)
     
-    order = Order(shardId, str(uuid.uuid4()), payload.orderName, payload.orderProducts)
+    order = Order(shardId, orderId, payload.orderName, payload.orderProducts)
 
     try:
-        response = table.put_item(Item={
-        'shardId':shardId,
-        'orderId': order.orderId, 
-        'orderName': order.orderName,
-        'orderProducts': get_order_products_dict(order.orderProducts)
-        }, ReturnConsumedCapacity='TOTAL')
+        response = table.put_item(Item=get_order_item(order), ReturnConsumedCapacity='TOTAL')
         consumed_capacity = response['ConsumedCapacity']
     except ClientError as e:
         logger.error(e.response['Error']['Message'])
@@ -103,42 +100,83 @@ def update_order(event, payload, key):
         logger.info("UpdateItem succeeded:")
         return order, consumed_capacity
 
-def get_orders(event, tenantId):
+def get_orders(event, tenantId, limit=None, cursor=None):
     table = __get_dynamodb_table(event, dynamodb)
-    get_all_products_response = []
-
+    shard_policy = shard_policies.get_policy(tenantId, event['requestContext']['authorizer'].get('tenantTier'), table)
     try:
-        __query_all_partitions(tenantId,get_all_products_response, table)
+        result = scatter_gather_query(table, 'shardId', get_read_shard_ids(tenantId, shard_policy), 'orderId',
+                                      limit, cursor)
     except ClientError as e:
         logger.error(e.response['Error']['Message'])
         raise Exception('Error getting all orders', e) 
     else:
         logger.info("Get orders succeeded")
-        return get_all_products_response
+        orders = [Order(item['shardId'], item['orderId'], item['orderName'], item['orderProducts'])
+                  for item in result.items]
+        return orders, result.consumed_capacity, result.next_cursor
 
-def __query_all_partitions(tenantId,get_all_products_response, table):
-    threads = []    
-    
-    for suffix in range(suffix_start, suffix_end):
-        partition_id = tenantId+'-'+str(suffix)
-        
-        thread = threading.Thread(target=__get_tenant_data, args=[partition_id, get_all_products_response, table])
-        threads.append(thread)
-        
-    # Start threads
-    for thread in threads:
-        thread.start()
-    # Ensure all threads are finished
-    for thread in threads:
-        thread.join()
-           
-def __get_tenant_data(partition_id, get_all_products_response, table):    
-    logger.info(partition_id)
-    response = table.query(KeyConditionExpression=Key('shardId').eq(partition_id))    
-    if (len(response['Items']) > 0):
-        for item in response['Items']:
-            order = Order(item['shardId'], item['orderId'], item['orderName'], item['orderProducts'])
-            get_all_products_response.append(order)
+def create_orders(event, payloads):
+    tenantId = event['requestContext']['authorizer']['tenantId']
+    table = __get_dynamodb_table(event, dynamodb)
+    shard_policy = shard_policies.get_policy(tenantId, event['requestContext']['authorizer'].get('tenantTier'), table)
+
+    orders = []
+    for payload in payloads:
+        orderId = str(uuid.uuid4())
+        shardId = get_write_shard_id(tenantId, orderId, shard_policy)
+        orders.append(Order(shardId, orderId, payload.orderName, payload.orderProducts))
+
+    try:
+        result = batch_write(table, [{'PutRequest': {'Item': get_order_item(order)}} for order in orders])
+    except ClientError as e:
+        logger.error(e.response['Error']['Message'])
+        raise Exception('Error adding orders', e)
+    else:
+        unprocessed_keys = [request['PutRequest']['Item']['shardId'] + ':' + request['PutRequest']['Item']['orderId']
+                            for request in result.unprocessed]
+        logger.info("BatchWriteItem succeeded, unprocessed: " + str(len(unprocessed_keys)))
+        unprocessed = set(unprocessed_keys)
+        created = [order for order in orders if order.key not in unprocessed]
+        return created, unprocessed_keys, result.consumed_capacity
+
+def get_orders_by_keys(event, keys):
+    tenantId = event['requestContext']['authorizer']['tenantId']
+    table = __get_dynamodb_table(event, dynamodb)
+    try:
+        result = batch_get(table, get_tenant_keys(tenantId, keys, 'orderId'))
+    except ClientError as e:
+        logger.error(e.response['Error']['Message'])
+        raise Exception('Error getting orders', e)
+    else:
+        logger.info("BatchGetItem succeeded")
+        orders = [Order(item['shardId'], item['orderId'], item['orderName'], item['orderProducts'])
+                  for item in result.items]
+        unprocessed_keys = [key['shardId'] + ':' + key['orderId'] for key in result.unprocessed]
+        return orders, unprocessed_keys, result.consumed_capacity
+
+def delete_orders(event, keys):
+    tenantId = event['requestContext']['authorizer']['tenantId']
+    table = __get_dynamodb_table(event, dynamodb)
+    # A key can only be written once per BatchWriteItem call.
+    dynamodb_keys = get_tenant_keys(tenantId, list(dict.fromkeys(keys)), 'orderId')
+    try:
+        result = batch_write(table, [{'DeleteRequest': {'Key': key}} for key in dynamodb_keys])
+    except ClientError as e:
+        logger.error(e.response['Error']['Message'])
+        raise Exception('Error deleting orders', e)
+    else:
+        logger.info("BatchWriteItem succeeded")
+        unprocessed_keys = [request['DeleteRequest']['Key']['shardId'] + ':' + request['DeleteRequest']['Key']['orderId']
+                            for request in result.unprocessed]
+        return unprocessed_keys, result.consumed_capacity
+
+def get_order_item(order):
+    return {
+        'shardId': order.shardId,
+        'orderId': order.orderId,
+        'orderName': order.orderName,
+        'orderProducts': get_order_products_dict(order.orderProducts)
+    }
 
 def __get_dynamodb_table(event, dynamodb):
     """ Determine the table name based upo pooled vs silo model
@@ -150,15 +188,7 @@ def __get_dynamodb_table(event, dynamodb):
         [type]: [description]
     """
 
-    accesskey = event['requestContext']['authorizer']['accesskey']
-    secretkey = event['requestContext']['authorizer']['secretkey']
-    sessiontoken = event['requestContext']['authorizer']['sessiontoken']    
-    dynamodb = boto3.resource('dynamodb',
-            aws_access_key_id=accesskey,
-            aws_secret_access_key=secretkey,
-            aws_session_token=sessiontoken
-            )        
-    return dynamodb.Table(table_name)
+    return resource_cache.get_table(event, table_name)
 
 def get_order_products_dict(orderProducts):
     orderProductList = []
@@ -7,20 +7,21 @@ import boto3
 from botocore.exceptions import ClientError
 import uuid
 from utils import logger
-import random
-import threading
 
 from models.product_models import Product
 from types import SimpleNamespace
 from boto3.dynamodb.conditions import Key
+from dal.dynamodb_resource_cache import resource_cache
+from dal.sharded_query import scatter_gather_query
+from dal.batch_operations import batch_get, batch_write, get_tenant_keys
+from dal.shard_policy import get_read_shard_ids, get_shard_policy_cache_from_env, get_write_shard_id
 
 
 table_name = os.environ['TABLE_NAME']
 dynamodb = None
 
-suffix_start = 1 
-suffix_end = 10
-get_tenant_data_consumed_capacity = None
+# Shards per tenant, kept with the tenant details
+shard_policies = get_shard_policy_cache_from_env('product')
 
 def get_product(event, key):
     table = __get_dynamodb_table(event, dynamodb)
@@ -31,7 +32,7 @@ def get_product(event, key):
         logger.log_with_tenant_context(event, shardId)
         logger.log_with_tenant_context(event, productId)
 
-        #TODO: Add ReturnConsumedCapacity='TOTAL' to the response. Comment out line 35 and then uncomment line 36.
+        #TODO: Add ReturnConsumedCapacity='TOTAL' to the response. Comment out line 36 and then uncomment line 37.
         response = table.get_item(Key={'shardId': shardId, 'productId': productId})
         #response = table.get_item(Key={'shardId': shardId, 'productId': productId}, ReturnConsumedCapacity='TOTAL')
         
@@ -65,23 +66,15 @@ def create_product(event, payload):
     tenantId = event['requestContext']['authorizer']['tenantId']    
     table = __get_dynamodb_table(event, dynamodb)
 
-    # nosec - Suppress bandit. Not using for security purposes, B311: Standard pseudo-random generators are not suitable for security/cryptographic purposes.
-    suffix = random.randrange(suffix_start, suffix_end)
-    shardId = tenantId+"-"+str(suffix)
+    shard_policy = shard_policies.get_policy(tenantId, event['requestContext']['authorizer'].get('tenantTier'), table)
+    productId = str(uuid.uuid4())
+    shardId = get_write_shard_id(tenantId, productId, shard_policy)
 
-    product = Product(shardId, str(uuid.uuid4()), payload.sku,payload.name, payload.price, payload.category)
+    product = Product(shardId, productId, payload.sku,payload.name, payload.price, payload.category)
     
     try:
         response = table.put_item(
-            Item=
-                {
-                    'shardId': shardId,  
-                    'productId': product.productId,
-                    'sku': product.sku,
-                    'name': product.name,
-                    'price': product.price,
-                    'category': product.category
-                },
+            Item=get_product_item(product),
             ReturnConsumedCapacity='TOTAL'
         )
         logger.info(response)
@@ -124,55 +117,86 @@ def update_product(event, payload, key):
         logger.info("UpdateItem succeeded:")
         return product, consumed_capacity
 
-def get_products(event, tenantId):    
+def get_products(event, tenantId, limit=None, cursor=None):
     table = __get_dynamodb_table(event, dynamodb)
-    get_all_products_response =[]
+    shard_policy = shard_policies.get_policy(tenantId, event['requestContext']['authorizer'].get('tenantTier'), table)
     try:
-        __query_all_partitions(tenantId,get_all_products_response, table)
+        result = scatter_gather_query(table, 'shardId', get_read_shard_ids(tenantId, shard_policy), 'productId',
+                                      limit, cursor)
     except ClientError as e:
         logger.error(e.response['Error']['Message'])
         raise Exception('Error getting all products', e)
     else:
         logger.info("Get products succeeded")
-        global get_tenant_data_consumed_capacity
-        return get_all_products_response, get_tenant_data_consumed_capacity
+        products = [Product(item['shardId'], item['productId'], item['sku'], item['name'], item['price'], item['category'])
+                    for item in result.items]
+        return products, result.consumed_capacity, result.next_cursor
 
-def __query_all_partitions(tenantId,get_all_products_response, table):
-    threads = []    
-    
-    for suffix in range(suffix_start, suffix_end):
-        partition_id = tenantId+'-'+str(suffix)
-        
-        thread = threading.Thread(target=__get_tenant_data, args=[partition_id, get_all_products_response, table])
-        threads.append(thread)
-        
-    # Start threads
-    for thread in threads:
-        thread.start()
-    # Ensure all threads are finished
-    for thread in threads:
-        thread.join()
-           
-def __get_tenant_data(partition_id, get_all_products_response, table):    
-    logger.info(partition_id)
-    response = table.query(KeyConditionExpression=Key('shardId').eq(partition_id), ReturnConsumedCapacity='TOTAL')
-    global get_tenant_data_consumed_capacity
-    # TODO: need to total the capacity units for all threads.
-    get_tenant_data_consumed_capacity = response['ConsumedCapacity']
-    if (len(response['Items']) > 0):
-        for item in response['Items']:
-            product = Product(item['shardId'], item['productId'], item['sku'], item['name'], item['price'], item['category'])
-            get_all_products_response.append(product)
+def create_products(event, payloads):
+    tenantId = event['requestContext']['authorizer']['tenantId']
+    table = __get_dynamodb_table(event, dynamodb)
+    shard_policy = shard_policies.get_policy(tenantId, event['requestContext']['authorizer'].get('tenantTier'), table)
+
+    products = []
+    for payload in payloads:
+        productId = str(uuid.uuid4())
+        shardId = get_write_shard_id(tenantId, productId, shard_policy)
+        products.append(Product(shardId, productId, payload.sku, payload.name, payload.price, payload.category))
+
+    try:
+        result = batch_write(table, [{'PutRequest': {'Item': get_product_item(product)}} for product in products])
+    except ClientError as e:
+        logger.error(e.response['Error']['Message'])
+        raise Exception('Error adding products', e)
+    else:
+        unprocessed_keys = [request['PutRequest']['Item']['shardId'] + ':' + request['PutRequest']['Item']['productId']
+                            for request in result.unprocessed]
+        logger.info("BatchWriteItem succeeded, unprocessed: " + str(len(unprocessed_keys)))
+        unprocessed = set(unprocessed_keys)
+        created = [product for product in products if product.key not in unprocessed]
+        return created, unprocessed_keys, result.consumed_capacity
+
+def get_products_by_keys(event, keys):
+    tenantId = event['requestContext']['authorizer']['tenantId']
+    table = __get_dynamodb_table(event, dynamodb)
+    try:
+        result = batch_get(table, get_tenant_keys(tenantId, keys, 'productId'))
+    except ClientError as e:
+        logger.error(e.response['Error']['Message'])
+        raise Exception('Error getting products', e)
+    else:
+        logger.info("BatchGetItem succeeded")
+        products = [Product(item['shardId'], item['productId'], item['sku'], item['name'], item['price'], item['category'])
+                    for item in result.items]
+        unprocessed_keys = [key['shardId'] + ':' + key['productId'] for key in result.unprocessed]
+        return products, unprocessed_keys, result.consumed_capacity
+
+def delete_products(event, keys):
+    tenantId = event['requestContext']['authorizer']['tenantId']
+    table = __get_dynamodb_table(event, dynamodb)
+    # A key can only be written once per BatchWriteItem call.
+    dynamodb_keys = get_tenant_keys(tenantId, list(dict.fromkeys(keys)), 'productId')
+    try:
+        result = batch_write(table, [{'DeleteRequest': {'Key': key}} for key in dynamodb_keys])
+    except ClientError as e:
+        logger.error(e.response['Error']['Message'])
+        raise Exception('Error deleting products', e)
+    else:
+        logger.info("BatchWriteItem succeeded")
+        unprocessed_keys = [request['DeleteRequest']['Key']['shardId'] + ':' + request['DeleteRequest']['Key']['productId']
+                            for request in result.unprocessed]
+        return unprocessed_keys, result.consumed_capacity
+
+def get_product_item(product):
+    return {
+        'shardId': product.shardId,
+        'productId': product.productId,
+        'sku': product.sku,
+        'name': product.name,
+        'price': product.price,
+        'category': product.category
+    }
 
 def __get_dynamodb_table(event, dynamodb):    
     
-    accesskey = event['requestContext']['authorizer']['accesskey']
-    secretkey = event['requestContext']['authorizer']['secretkey']
-    sessiontoken = event['requestContext']['authorizer']['sessiontoken']    
-    dynamodb = boto3.resource('dynamodb',
-            aws_access_key_id=accesskey,
-            aws_secret_access_key=secretkey,
-            aws_session_token=sessiontoken
-            )       
-        
-    return dynamodb.Table(table_name)
+    return resource_cache.get_table(event, table_name)
@@ -0,0 +1,135 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+# Scatter-gather over the write shards of a tenant. A tenant's items are spread over the partition
+# keys <tenantId>-<suffix>, so reading all of them takes one query per shard. The shard queries run
+# on a bounded thread pool that lives across warm invocations, each one follows LastEvaluatedKey
+# until its shard is read (or has enough items for the page), and their consumed capacity is summed.
+#
+# Items of all shards are merged in (sort key, shard id) order, the order every shard returns its
+# items in. With a limit, the position of the last item returned is handed out as an opaque cursor,
+# the base64url encoded JSON of that (sort key, shard id), and the next page continues strictly after
+# it in every shard.
+
+import base64
+import heapq
+import json
+import os
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+from boto3.dynamodb.conditions import Key
+
+DEFAULT_PAGE_SIZE = int(os.getenv('SHARDED_QUERY_DEFAULT_PAGE_SIZE', 100))
+MAX_PAGE_SIZE = int(os.getenv('SHARDED_QUERY_MAX_PAGE_SIZE', 1000))
+CAPACITY_UNITS = ('CapacityUnits', 'ReadCapacityUnits', 'WriteCapacityUnits')
+
+# Shared by every scatter-gather of the environment, the shard queries wait on DynamoDB.
+executor = ThreadPoolExecutor(max_workers=int(os.getenv('SHARDED_QUERY_MAX_WORKERS', 16)),
+                              thread_name_prefix='sharded-query')
+
+ShardedQueryResult = namedtuple('ShardedQueryResult', ['items', 'consumed_capacity', 'next_cursor'])
+ShardResult = namedtuple('ShardResult', ['items', 'consumed_capacity', 'exhausted'])
+
+
+class InvalidPageRequest(Exception):
+    pass
+
+
+def encode_cursor(sort_key_value, shard_id) -> str:
+    position = json.dumps([sort_key_value, shard_id])
+    return base64.urlsafe_b64encode(position.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor) -> tuple:
+    try:
+        padded_cursor = cursor + '=' * (-len(cursor) % 4)
+        sort_key_value, shard_id = json.loads(base64.urlsafe_b64decode(padded_cursor.encode()))
+        return str(sort_key_value), str(shard_id)
+    except (ValueError, TypeError) as error:
+        raise InvalidPageRequest(f"Invalid cursor: {cursor}") from error
+
+
+def get_page_request(query_parameters) -> tuple:
+    # (limit, cursor) of a GET request, both None when the client does not page.
+    query_parameters = query_parameters or {}
+    limit = query_parameters.get('limit')
+    cursor = query_parameters.get('cursor') or None
+    if limit in (None, ''):
+        return (DEFAULT_PAGE_SIZE if cursor else None), cursor
+    try:
+        limit = int(limit)
+    except ValueError:
+        raise InvalidPageRequest(f"limit must be an integer: {limit}")
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        raise InvalidPageRequest(f"limit must be between 1 and {MAX_PAGE_SIZE}")
+    return limit, cursor
+
+
+def add_consumed_capacity(total, consumed_capacity):
+    # Sums the capacity units of ReturnConsumedCapacity='TOTAL' responses of one table.
+    if not consumed_capacity:
+        return total
+    if total is None:
+        return dict(consumed_capacity)
+    total = dict(total)
+    for name in CAPACITY_UNITS:
+        if name in consumed_capacity:
+            total[name] = total.get(name, 0) + consumed_capacity[name]
+    return total
+
+
+def query_shard(table, partition_key, shard_id, sort_key, after=None, limit=None) -> ShardResult:
+    key_condition = Key(partition_key).eq(shard_id)
+    if after is not None:
+        # Strictly after (sort key, shard id): shards up to the cursor's one continue after its sort
+        # key, the shards ordered after it also return an item with that same sort key.
+        sort_key_value, after_shard_id = after
+        if shard_id <= after_shard_id:
+            key_condition = key_condition & Key(sort_key).gt(sort_key_value)
+        else:
+            key_condition = key_condition & Key(sort_key).gte(sort_key_value)
+
+    items = []
+    consumed_capacity = None
+    query_kwargs = {'KeyConditionExpression': key_condition, 'ReturnConsumedCapacity': 'TOTAL'}
+    while True:
+        if limit is not None:
+            query_kwargs['Limit'] = limit - len(items)
+        response = table.query(**query_kwargs)
+        items.extend(response['Items'])
+        consumed_capacity = add_consumed_capacity(consumed_capacity, response.get('ConsumedCapacity'))
+        last_evaluated_key = response.get('LastEvaluatedKey')
+        if last_evaluated_key is None:
+            return ShardResult(items, consumed_capacity, True)
+        if limit is not None and len(items) >= limit:
+            return ShardResult(items, consumed_capacity, False)
+        query_kwargs['ExclusiveStartKey'] = last_evaluated_key
+
+
+def scatter_gather_query(table, partition_key, shard_ids, sort_key, limit=None, cursor=None) -> ShardedQueryResult:
+    after = decode_cursor(cursor) if cursor else None
+    futures = [executor.submit(query_shard, table, partition_key, shard_id, sort_key, after, limit)
+               for shard_id in shard_ids]
+    # Every shard query completes (or fails) before the first error is raised.
+    shard_results = [future.exception() or future.result() for future in futures]
+    for shard_result in shard_results:
+        if isinstance(shard_result, BaseException):
+            raise shard_result
+
+    consumed_capacity = None
+    for shard_result in shard_results:
+        consumed_capacity = add_consumed_capacity(consumed_capacity, shard_result.consumed_capacity)
+    merged = heapq.merge(*[shard_result.items for shard_result in shard_results],
+                         key=lambda item: (item[sort_key], item[partition_key]))
+    if limit is None:
+        return ShardedQueryResult(list(merged), consumed_capacity, None)
+
+    items = list(islice(merged, limit + 1))
+    has_more = len(items) > limit or not all(shard_result.exhausted for shard_result in shard_results)
+    items = items[:limit]
+    next_cursor = None
+    if has_more and items:
+        next_cursor = encode_cursor(items[-1][sort_key], items[-1][partition_key])
+    return ShardedQueryResult(items, consumed_capacity, next_cursor)
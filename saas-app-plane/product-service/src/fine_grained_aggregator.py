@@ -4,11 +4,20 @@ import os
 from datetime import datetime
 
 from utils.aggregator_util import (
-    query_cloudwatch_logs,
     get_start_date_time,
-    get_end_date_time,
-    get_s3_key,
-    get_line_delimited_json
+    get_end_date_time
+)
+from utils.checkpoint_store import (
+    aggregate_incremental_usage,
+    get_checkpoint_store_from_env
+)
+from utils.output_format import write_usage_report
+from utils.logs_query_runner import run_sharded_query
+from utils.apportionment import (
+    get_result_columns,
+    to_float_column,
+    usage_metric,
+    apportion_usage
 )
 
 logs = boto3.client('logs')
@@ -18,63 +27,40 @@ tenant_usage_bucket = os.getenv("TENANT_USAGE_BUCKET")
 
 
 class FineGrainedAggregator(IAggregator):
-    def calculate_daily_attribution_by_tenant(self):
-        # Get start and end datetime for daily usage.
-        start_date_time = get_start_date_time()  # previous day epoch
-        end_date_time = get_end_date_time()  # current day epoch
-
-        # Logs Insights to retrieve aggregated fine-grained consumption metrics for billing duration and DynamoDB Capacity units.
-        usage_by_tenant = self.aggregate_tenant_usage(start_date_time, end_date_time)
+    # Logs Insights result fields used to merge incremental slices.
+    key_fields = ['tenant_id', 'date']
+    metric_fields = ['total_billed_duration', 'total_capacity_units']
+    # Where the daily reports are written in the tenant usage bucket.
+    report_prefix = 'fine_grained'
+    report_service = 'product'
+
+    def calculate_daily_attribution_by_tenant(self, checkpoint_store=None):
+        if checkpoint_store is None:
+            # Get start and end datetime for daily usage.
+            start_date_time = get_start_date_time()  # previous day epoch
+            end_date_time = get_end_date_time()  # current day epoch
+
+            # Logs Insights to retrieve aggregated fine-grained consumption metrics for billing duration and DynamoDB Capacity units.
+            usage_by_tenant = self.aggregate_tenant_usage(start_date_time, end_date_time)
+        else:
+            # Only query the logs after the last checkpoint and merge them into the daily totals.
+            usage_by_tenant = aggregate_incremental_usage(self, checkpoint_store, 'fine_grained-product',
+                                                          self.key_fields, self.metric_fields)
         apportioned_usage = self.apportion_overall_usage_by_tenant(usage_by_tenant)
 
-        line_delimited_json = get_line_delimited_json(apportioned_usage)
-        s3_key = get_s3_key('fine_grained', 'product')
-        s3.put_object(Body=str(line_delimited_json), Bucket=tenant_usage_bucket, Key=s3_key)
+        write_usage_report(s3, tenant_usage_bucket, self.report_prefix, self.report_service, apportioned_usage)
 
         return apportioned_usage
 
     def apportion_overall_usage_by_tenant(self, usage_by_tenant) -> list:
-        tenant_usage = []
-        total_billed_duration = 0
-        total_capacity_units = 0
-        tenant_id = ''
-        date = ''
-        tenant_total_billed_duration = 0
-        tenant_total_capacity_units = 0
-        # Calculate totals first.
-        for result in usage_by_tenant['results']:
-            for field in result:
-                if field['field'] == 'total_billed_duration':
-                    total_billed_duration += float(field['value'])
-                if field['field'] == 'total_capacity_units':
-                    total_capacity_units += float(field['value'])
-
-        # Iterate results per tenant.
-        for result in usage_by_tenant['results']:
-            for field in result:
-                if field['field'] == 'tenant_id':
-                    tenant_id = field['value']
-                if field['field'] == 'date':
-                    date = field['value']
-                if field['field'] == 'total_billed_duration':
-                    tenant_total_billed_duration = float(field['value'])
-                if field['field'] == 'total_capacity_units':
-                    tenant_total_capacity_units = float(field['value'])
+        columns = get_result_columns(usage_by_tenant, ['tenant_id', 'date', 'total_billed_duration', 'total_capacity_units'])
 
+        return apportion_usage(columns['tenant_id'], columns['date'], [
             # DynamoDB CapacityUnits.
-            tenant_usage.append({"tenant_id": tenant_id, "date": date, "usage_unit": "ConsumedCapacity",
-                                 "service_name": "AmazonDynamoDB",
-                                 "tenant_usage": round(tenant_total_capacity_units, 1), "total_usage": round(total_capacity_units, 1),
-                                 "tenant_percent_usage": round((tenant_total_capacity_units / total_capacity_units) * 100, 1)})
-
+            usage_metric("ConsumedCapacity", to_float_column(columns['total_capacity_units']), "AmazonDynamoDB"),
             # Lambda billed_duration_ms.
-            tenant_usage.append({"tenant_id": tenant_id, "date": date, "usage_unit": "billed_duration_ms",
-                                 "service_name": "AWSLambda",
-                                 "tenant_usage": round(tenant_total_billed_duration, 1), "total_usage": round(total_billed_duration, 1),
-                                 "tenant_percent_usage": round(
-                                     (tenant_total_billed_duration / total_billed_duration) * 100, 1)})
-
-        return tenant_usage
+            usage_metric("billed_duration_ms", to_float_column(columns['total_billed_duration']), "AWSLambda")
+        ])
 
     def aggregate_tenant_usage(self, start_date_time, end_date_time) -> dict:
         usage_by_tenant_query = ''
@@ -84,11 +70,12 @@ class FineGrainedAggregator(IAggregator):
         #usage_by_tenant_query += "| stats sum(billed_duration_ms) as total_billed_duration, sum(consumed_capacity.CapacityUnits) as total_capacity_units by tenant_id, datefloor(_aws.Timestamp, 1d) as date"
         #usage_by_tenant_query += "| sort by tenant_id "
 
-        usage_by_tenant = query_cloudwatch_logs(logs, "serverless-services-log-group",
-                                                usage_by_tenant_query, start_date_time, end_date_time)
+        usage_by_tenant = run_sharded_query(logs, ["serverless-services-log-group"], usage_by_tenant_query,
+                                            start_date_time, end_date_time, self.key_fields, self.metric_fields,
+                                            tenant_field='tenant_id')
         return usage_by_tenant
 
 
 def lambda_handler(event, context):
     aggregator = FineGrainedAggregator()
-    tenant_usage = aggregator.calculate_daily_attribution_by_tenant()
+    tenant_usage = aggregator.calculate_daily_attribution_by_tenant(get_checkpoint_store_from_env(s3))
@@ -6,6 +6,8 @@ from utils import utils
 from utils import logger
 from utils import metrics_manager
 import dal.product_service_dal as product_service_dal
+import dal.sharded_query as sharded_query
+import dal.batch_operations as batch_operations
 from decimal import Decimal
 from aws_lambda_powertools import Tracer
 from types import SimpleNamespace
@@ -26,7 +28,7 @@ def get_product(event, context):
     logger.log_with_tenant_context(event, key)
     product, consumed_capacity = product_service_dal.get_product(event, key)
     
-    #TODO: uncomment the below lines 30 and 31 to add DynamoDB consumed capacity to the logs
+    #TODO: uncomment the below lines 32 and 33 to add DynamoDB consumed capacity to the logs
     #logger.log_with_tenant_and_function_context(event, context, {"consumed_capacity": consumed_capacity},
     #                                             "This log will be received by the Lambda extension using the Telemetry API")
     
@@ -107,8 +109,69 @@ def get_products(event, context):
     tracer.put_annotation(key="TenantId", value=tenantId)
 
     logger.log_with_tenant_context(event, "Request received to get all products")
-    response, consumed_capacity = product_service_dal.get_products(event, tenantId)
+    # ?limit=<n>&cursor=<next_cursor> returns a page, {"products": [...], "next_cursor": ...}
+    try:
+        limit, cursor = sharded_query.get_page_request(event.get('queryStringParameters'))
+        response, consumed_capacity, next_cursor = product_service_dal.get_products(event, tenantId, limit, cursor)
+    except sharded_query.InvalidPageRequest as e:
+        return utils.create_badrequest_response(str(e))
     metrics_manager.record_metric(event, "ProductsRetrieved", "Count", len(response))
     logger.log_with_tenant_and_function_context(event, context, {"consumed_capacity": consumed_capacity},
                                                 "This log will be received by the Lambda extension using the Telemetry API")
+    if limit is not None:
+        return utils.generate_response({"products": response, "next_cursor": next_cursor})
     return utils.generate_response(response)
+
+
+@tracer.capture_lambda_handler
+def create_products(event, context):
+    tenantId = event['requestContext']['authorizer']['tenantId']
+    tracer.put_annotation(key="TenantId", value=tenantId)
+
+    logger.log_with_tenant_context(event, "Request received to create products")
+    # {"products": [<product>, ...]} returns the created products and the keys of those DynamoDB did not write
+    try:
+        payloads = batch_operations.get_batch_request(event, 'products')
+    except batch_operations.InvalidBatchRequest as e:
+        return utils.create_badrequest_response(str(e))
+    products, unprocessed_keys, consumed_capacity = product_service_dal.create_products(event, payloads)
+    logger.log_with_tenant_and_function_context(event, context, {"consumed_capacity": consumed_capacity},
+                                                "This log will be received by the Lambda extension using the Telemetry API")
+    metrics_manager.record_metric(event, "ProductCreated", "Count", len(products))
+    return utils.generate_response({"products": products, "unprocessed_keys": unprocessed_keys})
+
+
+@tracer.capture_lambda_handler
+def batch_get_products(event, context):
+    tenantId = event['requestContext']['authorizer']['tenantId']
+    tracer.put_annotation(key="TenantId", value=tenantId)
+
+    logger.log_with_tenant_context(event, "Request received to get products by key")
+    # {"keys": ["<shardId>:<productId>", ...]}, keys that do not exist are left out of the products
+    try:
+        keys = batch_operations.get_batch_request(event, 'keys')
+        products, unprocessed_keys, consumed_capacity = product_service_dal.get_products_by_keys(event, keys)
+    except batch_operations.InvalidBatchRequest as e:
+        return utils.create_badrequest_response(str(e))
+    logger.log_with_tenant_and_function_context(event, context, {"consumed_capacity": consumed_capacity},
+                                                "This log will be received by the Lambda extension using the Telemetry API")
+    metrics_manager.record_metric(event, "ProductsRetrieved", "Count", len(products))
+    return utils.generate_response({"products": products, "unprocessed_keys": unprocessed_keys})
+
+
+@tracer.capture_lambda_handler
+def delete_products(event, context):
+    tenantId = event['requestContext']['authorizer']['tenantId']
+    tracer.put_annotation(key="TenantId", value=tenantId)
+
+    logger.log_with_tenant_context(event, "Request received to delete products")
+    # {"keys": ["<shardId>:<productId>", ...]}
+    try:
+        keys = batch_operations.get_batch_request(event, 'keys')
+        unprocessed_keys, consumed_capacity = product_service_dal.delete_products(event, keys)
+    except batch_operations.InvalidBatchRequest as e:
+        return utils.create_badrequest_response(str(e))
+    logger.log_with_tenant_and_function_context(event, context, {"consumed_capacity": consumed_capacity},
+                                                "This log will be received by the Lambda extension using the Telemetry API")
+    metrics_manager.record_metric(event, "ProductDeleted", "Count", len(set(keys)) - len(unprocessed_keys))
+    return utils.generate_response({"message": "Successfully deleted the products", "unprocessed_keys": unprocessed_keys})
@@ -0,0 +1,83 @@
+# Compares the previous nested field loop apportionment with the column oriented apportionment
+# module on a Logs Insights result of 100k tenant rows.
+#
+# Usage: python test/benchmark_apportionment.py [row_count]
+import sys
+import os
+import time
+
+sys.path.append(
+    os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "")))
+
+from utils.apportionment import get_result_columns, to_float_column, usage_metric, apportion_usage
+
+
+def get_usage_by_tenant(row_count):
+    return {"results": [
+        [{"field": "tenant_id", "value": "tenant{}".format(i)}, {"field": "date", "value": "2024-07-03 00:00:00.000"},
+         {"field": "total_billed_duration", "value": str(100 + i % 997)},
+         {"field": "total_capacity_units", "value": str(0.5 + i % 13)}]
+        for i in range(row_count)]}
+
+
+def legacy_apportion(usage_by_tenant):
+    # The loops FineGrainedAggregator.apportion_overall_usage_by_tenant used before the apportionment module.
+    tenant_usage = []
+    total_billed_duration = 0
+    total_capacity_units = 0
+    for result in usage_by_tenant['results']:
+        for field in result:
+            if field['field'] == 'total_billed_duration':
+                total_billed_duration += float(field['value'])
+            if field['field'] == 'total_capacity_units':
+                total_capacity_units += float(field['value'])
+    for result in usage_by_tenant['results']:
+        for field in result:
+            if field['field'] == 'tenant_id':
+                tenant_id = field['value']
+            if field['field'] == 'date':
+                date = field['value']
+            if field['field'] == 'total_billed_duration':
+                tenant_total_billed_duration = float(field['value'])
+            if field['field'] == 'total_capacity_units':
+                tenant_total_capacity_units = float(field['value'])
+        tenant_usage.append({"tenant_id": tenant_id, "date": date, "usage_unit": "ConsumedCapacity",
+                             "service_name": "AmazonDynamoDB",
+                             "tenant_usage": round(tenant_total_capacity_units, 1), "total_usage": round(total_capacity_units, 1),
+                             "tenant_percent_usage": round((tenant_total_capacity_units / total_capacity_units) * 100, 1)})
+        tenant_usage.append({"tenant_id": tenant_id, "date": date, "usage_unit": "billed_duration_ms",
+                             "service_name": "AWSLambda",
+                             "tenant_usage": round(tenant_total_billed_duration, 1), "total_usage": round(total_billed_duration, 1),
+                             "tenant_percent_usage": round((tenant_total_billed_duration / total_billed_duration) * 100, 1)})
+    return tenant_usage
+
+
+def columnar_apportion(usage_by_tenant):
+    columns = get_result_columns(usage_by_tenant, ['tenant_id', 'date', 'total_billed_duration', 'total_capacity_units'])
+    return apportion_usage(columns['tenant_id'], columns['date'], [
+        usage_metric("ConsumedCapacity", to_float_column(columns['total_capacity_units']), "AmazonDynamoDB"),
+        usage_metric("billed_duration_ms", to_float_column(columns['total_billed_duration']), "AWSLambda")
+    ])
+
+
+def run(row_count, repeat=5):
+    usage_by_tenant = get_usage_by_tenant(row_count)
+    timings = {}
+    outputs = {}
+    for name, apportion in [("legacy", legacy_apportion), ("columnar", columnar_apportion)]:
+        best = None
+        for _ in range(repeat):
+            started = time.perf_counter()
+            outputs[name] = apportion(usage_by_tenant)
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        timings[name] = best
+
+    print(f'{row_count} tenant rows, best of {repeat}')
+    for name, elapsed in timings.items():
+        print(f'{name:<10}{elapsed * 1000:>10.1f} ms')
+    print(f'identical output: {outputs["legacy"] == outputs["columnar"]}')
+
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
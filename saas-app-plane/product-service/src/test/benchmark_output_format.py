@@ -0,0 +1,74 @@
+# Compares the size of a tenant usage report written as NDJSON and as Parquet, and the bytes a
+# query that only reads tenant_id and tenant_percent_usage has to scan in each format.
+#
+# Usage: python test/benchmark_output_format.py [tenant_count]
+import sys
+import os
+import io
+import time
+
+sys.path.append(
+    os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "")))
+
+import pyarrow.parquet as pq
+
+from utils.output_format import NdjsonOutputFormat, ParquetOutputFormat
+
+USAGE_UNITS = [("ConsumedCapacity", "AmazonDynamoDB"), ("billed_duration_ms", "AWSLambda")]
+
+
+class StubS3Client:
+    def __init__(self):
+        self.objects = {}
+
+    def put_object(self, Body, Bucket, Key):
+        self.objects[Key] = Body
+
+    def create_multipart_upload(self, Bucket, Key):
+        self.objects[Key] = b""
+        return {'UploadId': Key}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        self.objects[Key] += Body
+        return {'ETag': str(PartNumber)}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        pass
+
+
+def get_usage_records(tenant_count):
+    for i in range(tenant_count):
+        for usage_unit, service_name in USAGE_UNITS:
+            yield {"tenant_id": "7052bcff-1c38-494b-bc42-{:012d}".format(i), "date": "2024-07-03 00:00:00.000",
+                   "usage_unit": usage_unit, "service_name": service_name, "tenant_usage": float(i % 997),
+                   "total_usage": 497503.0 * tenant_count / 997, "tenant_percent_usage": round(100.0 / tenant_count, 1)}
+
+
+def run(tenant_count):
+    results = []
+    for name, output_format in [("ndjson", NdjsonOutputFormat()), ("parquet", ParquetOutputFormat())]:
+        s3 = StubS3Client()
+        started = time.perf_counter()
+        output_format.write(s3, 'bucket', 'report', get_usage_records(tenant_count))
+        elapsed = time.perf_counter() - started
+        body = s3.objects['report']
+        if name == "parquet":
+            # Athena reads only the column chunks of the projected columns.
+            metadata = pq.ParquetFile(io.BytesIO(body)).metadata
+            projected = {"tenant_id", "tenant_percent_usage"}
+            scanned = sum(metadata.row_group(r).column(c).total_compressed_size
+                          for r in range(metadata.num_row_groups)
+                          for c in range(metadata.num_columns)
+                          if metadata.row_group(r).column(c).path_in_schema in projected)
+        else:
+            scanned = len(body)
+        results.append((name, len(body), scanned, elapsed))
+
+    print(f'{tenant_count} tenants x {len(USAGE_UNITS)} usage units')
+    print(f'{"format":<10}{"object bytes":>16}{"scanned bytes":>16}{"write (s)":>12}')
+    for name, size, scanned, elapsed in results:
+        print(f'{name:<10}{size:>16}{scanned:>16}{elapsed:>12.2f}')
+
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 50000)
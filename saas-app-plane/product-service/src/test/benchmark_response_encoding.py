@@ -0,0 +1,47 @@
+# Compares the time to encode a get_products response through jsonpickle, as generate_response used
+# to do, with encode_to_json_object, and checks both give the same body.
+#
+# Usage: python test/benchmark_response_encoding.py [products] [runs]
+import sys
+import os
+import statistics
+import time
+from decimal import Decimal
+
+sys.path.append(
+    os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "")))
+
+from models.product_models import Product
+from utils.utils import encode_to_json_object, encode_with_jsonpickle
+
+
+def get_products(count):
+    # Prices come back from DynamoDB as Decimal.
+    return [Product(f"tenant1-{i % 9 + 1}", f"4f1c2a9e-{i:012d}", f"SKU-{i:06d}", f"Product {i}",
+                    Decimal(i % 10000) / 100, 'category')
+            for i in range(count)]
+
+
+def run(encode, value, runs):
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        body = encode(value)
+        timings.append((time.perf_counter() - started) * 1000)
+    return body, timings
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    runs = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    products = get_products(count)
+    bodies = []
+    for name, encode in (('jsonpickle', encode_with_jsonpickle), ('encode_to_json_object', encode_to_json_object)):
+        body, timings = run(encode, products, runs)
+        bodies.append(body)
+        print(f"{name:<22} p50 {statistics.median(timings):8.2f} ms  min {min(timings):8.2f} ms")
+    print(f"{count} products, {len(bodies[0])} bytes, same body: {bodies[0] == bodies[1]}")
+
+
+if __name__ == '__main__':
+    main()
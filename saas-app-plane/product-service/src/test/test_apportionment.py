@@ -0,0 +1,72 @@
+import unittest
+import sys
+import os
+
+sys.path.append(
+    os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "")))
+
+from utils.apportionment import (
+    apportion_usage,
+    get_percent_column,
+    get_result_columns,
+    get_row_columns,
+    to_float_column,
+    usage_metric
+)
+
+
+class TestApportionment(unittest.TestCase):
+
+    def setUp(self):
+        self.usage_by_tenant = {"results": [
+            [{"field": "tenant_id", "value": "tenant1"}, {"field": "date", "value": "2024-07-03 00:00:00.000"},
+             {"field": "total_billed_duration", "value": "8110"}, {"field": "total_capacity_units", "value": "1.5"}],
+            [{"field": "tenant_id", "value": "tenant2"}, {"field": "date", "value": "2024-07-03 00:00:00.000"},
+             {"field": "total_billed_duration", "value": "9875"}]
+        ]}
+
+    def test_get_result_columns(self):
+        columns = get_result_columns(self.usage_by_tenant, ['tenant_id', 'total_capacity_units'])
+        self.assertEqual(columns['tenant_id'], ['tenant1', 'tenant2'])
+        # Missing fields are empty and count as zero usage.
+        self.assertEqual(to_float_column(columns['total_capacity_units']), [1.5, 0.0])
+
+    def test_get_row_columns(self):
+        columns = get_row_columns([{'tenant_id': 'tenant1', 'total_exec_time': 2.0},
+                                   {'tenant_id': 'tenant2', 'total_exec_time': 6.0}], ['tenant_id', 'total_exec_time'])
+        self.assertEqual(columns, {'tenant_id': ['tenant1', 'tenant2'], 'total_exec_time': [2.0, 6.0]})
+
+    def test_apportion_usage_multiple_metrics(self):
+        columns = get_result_columns(self.usage_by_tenant, ['tenant_id', 'date', 'total_billed_duration', 'total_capacity_units'])
+        tenant_usage = apportion_usage(columns['tenant_id'], columns['date'], [
+            usage_metric("ConsumedCapacity", to_float_column(columns['total_capacity_units']), "AmazonDynamoDB"),
+            usage_metric("billed_duration_ms", to_float_column(columns['total_billed_duration']), "AWSLambda")
+        ])
+        self.assertEqual(len(tenant_usage), 4)
+        self.assertEqual(tenant_usage[0], {"tenant_id": "tenant1", "date": "2024-07-03 00:00:00.000",
+                                           "usage_unit": "ConsumedCapacity", "service_name": "AmazonDynamoDB",
+                                           "tenant_usage": 1.5, "total_usage": 1.5, "tenant_percent_usage": 100.0})
+        self.assertEqual(tenant_usage[1]["usage_unit"], "billed_duration_ms")
+        self.assertEqual(tenant_usage[1]["total_usage"], 17985.0)
+        self.assertEqual(tenant_usage[1]["tenant_percent_usage"], 45.1)
+        self.assertEqual(tenant_usage[3]["tenant_percent_usage"], 54.9)
+
+    def test_zero_total(self):
+        tenant_usage = apportion_usage(['tenant1', 'tenant2'], ['2024-07-03', '2024-07-03'], [
+            usage_metric("API Calls", [0, 0])
+        ], usage_precision=None)
+        self.assertEqual([record["tenant_percent_usage"] for record in tenant_usage], [0.0, 0.0])
+        self.assertEqual(tenant_usage[0]["total_usage"], 0)
+        self.assertNotIn("service_name", tenant_usage[0])
+
+    def test_per_row_totals_and_whole_percentages(self):
+        self.assertEqual(get_percent_column([1.0, 2.0], [3.0, 3.0], None), [33, 67])
+        tenant_usage = apportion_usage(['tenant1'], ['2024-07-03'], [
+            usage_metric("tenant_data_size", [25.0], "AmazonRDS", totals=[200.0])
+        ])
+        self.assertEqual(tenant_usage[0]["total_usage"], 200.0)
+        self.assertEqual(tenant_usage[0]["tenant_percent_usage"], 12.5)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,106 @@
+import unittest
+import sys
+import os
+import json
+import threading
+from datetime import date
+
+sys.path.append(
+    os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "")))
+
+from i_aggregator import IAggregator
+from utils.aggregator_util import get_day_start_end_date_time, get_s3_key
+from utils.backfill import get_backfill_days, run_backfill
+from utils.output_format import NdjsonOutputFormat
+
+
+class StubS3Client:
+    def __init__(self):
+        self.objects = {}
+
+    def put_object(self, Body, Bucket, Key):
+        self.objects[Key] = Body
+
+    def list_objects_v2(self, Bucket, Prefix, MaxKeys=1000):
+        keys = [key for key in sorted(self.objects) if key.startswith(Prefix)][:MaxKeys]
+        return {'KeyCount': len(keys), 'Contents': [{'Key': key} for key in keys]}
+
+
+class StubAggregator(IAggregator):
+    report_prefix = 'fine_grained'
+    report_service = 'product'
+
+    def __init__(self, failing_days=()):
+        self.failing_days = failing_days
+        self.lock = threading.Lock()
+        self.queried = []
+
+    def calculate_daily_attribution_by_tenant(self, checkpoint_store=None):
+        pass
+
+    def aggregate_tenant_usage(self, start_date_time, end_date_time) -> dict:
+        with self.lock:
+            self.queried.append((start_date_time, end_date_time))
+        if start_date_time in self.failing_days:
+            raise RuntimeError('query failed')
+        return {'results': [start_date_time]}
+
+    def apportion_overall_usage_by_tenant(self, usage_by_tenant) -> list:
+        return [{'tenant_id': 'tenant-1', 'date': usage_by_tenant['results'][0]},
+                {'tenant_id': 'tenant-2', 'date': usage_by_tenant['results'][0]}]
+
+
+class TestBackfill(unittest.TestCase):
+
+    def test_backfill_days_include_both_ends(self):
+        days = get_backfill_days(date(2024, 2, 27), date(2024, 3, 1))
+        self.assertEqual(days, [date(2024, 2, 27), date(2024, 2, 28), date(2024, 2, 29), date(2024, 3, 1)])
+        with self.assertRaises(ValueError):
+            get_backfill_days(date(2024, 3, 1), date(2024, 2, 1))
+
+    def test_s3_key_uses_report_date(self):
+        self.assertEqual(get_s3_key('fine_grained', 'product', '.json', date(2023, 12, 31)),
+                         'fine_grained/year=2023/month=12/product-usage_by_tenant-12-31-2023.json')
+
+    def test_writes_each_day_to_its_partition(self):
+        s3 = StubS3Client()
+        aggregator = StubAggregator()
+        stats = run_backfill(aggregator, s3, 'bucket', date(2024, 1, 30), date(2024, 2, 2), max_workers=3,
+                             output_format=NdjsonOutputFormat())
+        self.assertEqual(stats['written'], 4)
+        self.assertEqual(stats['records'], 8)
+        self.assertEqual(sorted(s3.objects), [
+            'fine_grained/year=2024/month=01/product-usage_by_tenant-01-30-2024.json',
+            'fine_grained/year=2024/month=01/product-usage_by_tenant-01-31-2024.json',
+            'fine_grained/year=2024/month=02/product-usage_by_tenant-02-01-2024.json',
+            'fine_grained/year=2024/month=02/product-usage_by_tenant-02-02-2024.json'])
+        # Each day is queried over its own 24 hours.
+        start_date_time, end_date_time = get_day_start_end_date_time(date(2024, 2, 1))
+        self.assertIn((start_date_time, end_date_time), aggregator.queried)
+        key = 'fine_grained/year=2024/month=02/product-usage_by_tenant-02-01-2024.json'
+        self.assertEqual(json.loads(s3.objects[key].splitlines()[0])['date'], start_date_time)
+
+    def test_skips_existing_days_unless_forced(self):
+        s3 = StubS3Client()
+        run_backfill(StubAggregator(), s3, 'bucket', date(2024, 1, 1), date(2024, 1, 2),
+                     output_format=NdjsonOutputFormat())
+        aggregator = StubAggregator()
+        stats = run_backfill(aggregator, s3, 'bucket', date(2024, 1, 1), date(2024, 1, 3),
+                             output_format=NdjsonOutputFormat())
+        self.assertEqual((stats['written'], stats['skipped']), (1, 2))
+        self.assertEqual(len(aggregator.queried), 1)
+
+        stats = run_backfill(StubAggregator(), s3, 'bucket', date(2024, 1, 1), date(2024, 1, 3), force=True,
+                             output_format=NdjsonOutputFormat())
+        self.assertEqual((stats['written'], stats['skipped']), (3, 0))
+
+    def test_failed_day_does_not_stop_the_others(self):
+        failing_day = get_day_start_end_date_time(date(2024, 1, 2))[0]
+        stats = run_backfill(StubAggregator(failing_days=(failing_day,)), StubS3Client(), 'bucket',
+                             date(2024, 1, 1), date(2024, 1, 3), output_format=NdjsonOutputFormat())
+        self.assertEqual((stats['written'], stats['failed']), (2, 1))
+        self.assertEqual(stats['failed_days'], ['2024-01-02'])
+
+
+if __name__ == '__main__':
+    unittest.main()
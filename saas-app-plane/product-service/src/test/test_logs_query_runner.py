@@ -0,0 +1,245 @@
+import unittest
+import sys
+import os
+import random
+import re
+import threading
+import uuid
+
+sys.path.append(
+    os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "")))
+
+from utils.logs_query_runner import (
+    LogsQueryError,
+    LogsQueryRunner,
+    get_sharded_queries,
+    get_tenant_buckets,
+    get_time_shards,
+    merge_query_results,
+    run_planned_queries,
+    run_sharded_query
+)
+from utils.aggregator_util import MAX_QUERY_RESULT_ROWS
+
+
+class LimitExceededError(Exception):
+    def __init__(self):
+        super().__init__('LimitExceededException')
+        self.response = {'Error': {'Code': 'LimitExceededException'}}
+
+
+class FakeLogsClient:
+    # Answers every query with the rows returned by results_for(query) after a number of polls.
+    # statuses lists the final status of successive runs of the same query string.
+    def __init__(self, results_for, polls_before_complete=2, statuses=None, limit_exceeded=0):
+        self.results_for = results_for
+        self.polls_before_complete = polls_before_complete
+        self.statuses = statuses or {}
+        self.limit_exceeded = limit_exceeded
+        self.lock = threading.Lock()
+        self.queries = {}
+        self.started = []
+        self.stopped = []
+        self.running = 0
+        self.max_running = 0
+
+    def start_query(self, logGroupName, startTime, endTime, queryString):
+        with self.lock:
+            if self.limit_exceeded > 0:
+                self.limit_exceeded -= 1
+                raise LimitExceededError()
+            query_id = 'query-{}'.format(len(self.started) + 1)
+            query = {'log_group_name': logGroupName, 'start_time': startTime, 'end_time': endTime,
+                     'query_string': queryString}
+            runs = sum(1 for started in self.started if started['query_string'] == queryString)
+            statuses = self.statuses.get(queryString, [])
+            status = statuses[runs] if runs < len(statuses) else 'Complete'
+            self.queries[query_id] = {'query': query, 'polls': 0, 'status': status}
+            self.started.append(query)
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+            return {'queryId': query_id}
+
+    def get_query_results(self, queryId):
+        with self.lock:
+            state = self.queries[queryId]
+            state['polls'] += 1
+            if state['polls'] <= self.polls_before_complete:
+                return {'status': 'Running', 'results': []}
+            self.running -= 1
+            if state['status'] != 'Complete':
+                return {'status': state['status'], 'results': []}
+            rows = self.results_for(state['query'])
+            return {'status': 'Complete', 'results': rows[:MAX_QUERY_RESULT_ROWS],
+                    'statistics': {'recordsMatched': float(len(rows)), 'recordsScanned': 10.0, 'bytesScanned': 100.0}}
+
+    def stop_query(self, queryId):
+        self.stopped.append(queryId)
+        return {'success': True}
+
+
+def get_tenant_predicate(query_string):
+    # Translates the tenant filters the planner adds in front of a query into a Python predicate.
+    expressions = []
+    for expression in re.findall(r'filter (.*?) \|', query_string):
+        expression = re.sub(r'not ispresent\(\w+\)', 'False', expression)
+        expression = re.sub(r'\w+ not like /\(\?i\)(.*?)/', lambda match: f'not re.match({match.group(1)!r}, t)',
+                            expression)
+        expression = re.sub(r'\w+ like /\(\?i\)(.*?)/', lambda match: f're.match({match.group(1)!r}, t)', expression)
+        expressions.append('({})'.format(expression))
+    code = compile(' and '.join(expressions) or 'True', '<filter>', 'eval')
+    return lambda tenant_id: eval(code, {'re': re, 't': tenant_id})
+
+
+class UsageLogs:
+    # One API call log event per tenant per day.
+    def __init__(self, tenant_count, days):
+        generator = random.Random(42)
+        self.tenant_ids = [str(uuid.UUID(int=generator.getrandbits(128))) for _ in range(tenant_count)]
+        self.days = days
+
+    def results_for(self, query):
+        matches = get_tenant_predicate(query['query_string'])
+        tenant_ids = [tenant_id for tenant_id in self.tenant_ids if matches(tenant_id)]
+        return [api_calls_row(tenant_id, 1, day)
+                for day in range(self.days) if query['start_time'] <= day * 86400 < query['end_time']
+                for tenant_id in tenant_ids]
+
+
+def api_calls_row(tenant_id, api_calls, day=0):
+    return [{'field': 'TenantId', 'value': tenant_id}, {'field': 'date', 'value': 'day-{}'.format(day)},
+            {'field': 'ApiCalls', 'value': str(api_calls)}]
+
+
+def get_runner(logs, **kwargs):
+    return LogsQueryRunner(logs, initial_poll_interval=0.001, max_poll_interval=0.002, **kwargs)
+
+
+class TestLogsQueryRunner(unittest.TestCase):
+
+    def test_time_shards_cover_range(self):
+        self.assertEqual(get_time_shards(0, 100), [(0, 100)])
+        self.assertEqual(get_time_shards(0, 100, 40), [(0, 40), (40, 80), (80, 100)])
+
+    def test_tenant_buckets(self):
+        self.assertEqual(get_tenant_buckets('tenantId', 1), [(None, '', '0123456789abcdef')])
+        buckets = get_tenant_buckets('tenantId', 4)
+        self.assertEqual(len(buckets), 5)
+        self.assertEqual(buckets[0], ('tenantId like /(?i)^[0123]/', '', '0123'))
+        self.assertIn('not ispresent(tenantId)', buckets[-1][0])
+
+    def test_sharded_queries(self):
+        queries = get_sharded_queries(['group-a', 'group-b'], 'stats count(*) as ApiCalls by tenantId', 0, 7200,
+                                      shard_seconds=3600, tenant_field='tenantId', tenant_buckets=2)
+        # 2 log groups x 2 time shards x (2 tenant buckets + the remainder bucket).
+        self.assertEqual(len(queries), 12)
+        self.assertTrue(queries[0]['query_string'].startswith('filter tenantId like'))
+
+    def test_runs_queries_concurrently_up_to_limit(self):
+        logs = FakeLogsClient(lambda query: [api_calls_row('t1', 1)])
+        queries = get_sharded_queries(['group'], 'stats count(*)', 0, 3600 * 8, shard_seconds=3600)
+        results = get_runner(logs, max_concurrent_queries=3).run_queries(queries)
+        self.assertEqual(len(results), 8)
+        self.assertEqual(len(logs.started), 8)
+        self.assertLessEqual(logs.max_running, 3)
+        self.assertGreater(logs.max_running, 1)
+
+    def test_results_keep_query_order(self):
+        logs = FakeLogsClient(lambda query: [api_calls_row('t1', query['start_time'])])
+        queries = get_sharded_queries(['group'], 'stats count(*)', 0, 500, shard_seconds=100)
+        results = get_runner(logs).run_queries(queries)
+        self.assertEqual([result['results'][0][2]['value'] for result in results], ['0', '100', '200', '300', '400'])
+
+    def test_retries_failed_timeout_and_cancelled(self):
+        logs = FakeLogsClient(lambda query: [api_calls_row('t1', 5)],
+                              statuses={'stats count(*)': ['Failed', 'Timeout', 'Complete']})
+        runner = get_runner(logs)
+        results = runner.run_queries(get_sharded_queries(['group'], 'stats count(*)', 0, 100))
+        self.assertEqual(results[0]['status'], 'Complete')
+        self.assertEqual(len(logs.started), 3)
+        self.assertEqual(runner.get_stats()['retries'], 2)
+
+    def test_raises_after_max_attempts(self):
+        logs = FakeLogsClient(lambda query: [], statuses={'stats count(*)': ['Cancelled'] * 3})
+        with self.assertRaises(LogsQueryError):
+            get_runner(logs, max_attempts=3).run_queries(get_sharded_queries(['group'], 'stats count(*)', 0, 100))
+
+    def test_retries_start_when_concurrency_limit_exceeded(self):
+        logs = FakeLogsClient(lambda query: [api_calls_row('t1', 1)], limit_exceeded=2)
+        results = get_runner(logs).run_queries(get_sharded_queries(['group'], 'stats count(*)', 0, 100))
+        self.assertEqual(results[0]['status'], 'Complete')
+
+    def test_stops_query_after_client_timeout(self):
+        logs = FakeLogsClient(lambda query: [], polls_before_complete=1000)
+        runner = get_runner(logs, max_attempts=1, query_timeout_seconds=0.01)
+        with self.assertRaises(LogsQueryError):
+            runner.run_queries(get_sharded_queries(['group'], 'stats count(*)', 0, 100))
+        self.assertEqual(logs.stopped, ['query-1'])
+
+    def test_merge_sums_partial_results(self):
+        merged = merge_query_results([
+            {'results': [api_calls_row('t1', 2), api_calls_row('t2', 3)], 'statistics': {'recordsMatched': 2.0}},
+            {'results': [api_calls_row('t1', 4)], 'statistics': {'recordsMatched': 1.0}}
+        ], ['TenantId', 'date'], ['ApiCalls'])
+        values = {result[0]['value']: result[2]['value'] for result in merged['results']}
+        self.assertEqual(values, {'t1': '6', 't2': '3'})
+        self.assertEqual(merged['statistics']['recordsMatched'], 3.0)
+
+    def test_run_sharded_query_merges_every_part(self):
+        os.environ['LOGS_QUERY_SHARD_MINUTES'] = '60'
+        try:
+            logs = FakeLogsClient(lambda query: [api_calls_row('t1', 1), api_calls_row('t2', 2)])
+            merged = run_sharded_query(logs, ['group'], 'stats count(*)', 0, 3600 * 24, ['TenantId', 'date'],
+                                       ['ApiCalls'], runner=get_runner(logs))
+        finally:
+            del os.environ['LOGS_QUERY_SHARD_MINUTES']
+        self.assertEqual(len(logs.started), 24)
+        values = {result[0]['value']: result[2]['value'] for result in merged['results']}
+        self.assertEqual(values, {'t1': '24', 't2': '48'})
+
+    def get_api_calls(self, merged):
+        return sum(int(result[2]['value']) for result in merged['results'])
+
+    def test_single_day_at_row_cap_is_split_by_tenant_prefix(self):
+        usage_logs = UsageLogs(12000, 1)
+        logs = FakeLogsClient(usage_logs.results_for, polls_before_complete=0)
+        runner = get_runner(logs)
+        results = run_planned_queries(runner, get_sharded_queries(['group'], 'stats count(*)', 0, 86400,
+                                                                  tenant_field='tenantId'), 'tenantId')
+        merged = merge_query_results(results, ['TenantId', 'date'], ['ApiCalls'])
+        self.assertEqual(len(merged['results']), 12000)
+        self.assertEqual(self.get_api_calls(merged), 12000)
+        # The capped query and one query per hex digit plus the remainder.
+        self.assertEqual(len(logs.started), 1 + 17)
+        self.assertEqual(runner.get_stats()['splits'], 1)
+
+    def test_multiple_days_at_row_cap_are_split_by_time(self):
+        usage_logs = UsageLogs(4000, 3)
+        logs = FakeLogsClient(usage_logs.results_for, polls_before_complete=0)
+        results = run_planned_queries(get_runner(logs), get_sharded_queries(['group'], 'stats count(*)', 0, 3 * 86400,
+                                                                            tenant_field='tenantId'), 'tenantId')
+        merged = merge_query_results(results, ['TenantId', 'date'], ['ApiCalls'])
+        self.assertEqual(len(merged['results']), 12000)
+        self.assertEqual(self.get_api_calls(merged), 12000)
+        self.assertTrue(all('filter' not in query['query_string'] for query in logs.started))
+
+    def test_split_tenant_bucket_only_queries_its_digits(self):
+        usage_logs = UsageLogs(25000, 1)
+        logs = FakeLogsClient(usage_logs.results_for, polls_before_complete=0)
+        queries = get_sharded_queries(['group'], 'stats count(*)', 0, 86400, tenant_field='tenantId', tenant_buckets=2)
+        merged = merge_query_results(run_planned_queries(get_runner(logs), queries, 'tenantId'),
+                                     ['TenantId', 'date'], ['ApiCalls'])
+        self.assertEqual(self.get_api_calls(merged), 25000)
+        # 3 bucket queries, both hex buckets are capped and split into their 8 digits.
+        self.assertEqual(len(logs.started), 3 + 16)
+
+    def test_result_that_can_not_be_split_is_kept(self):
+        usage_logs = UsageLogs(11000, 1)
+        logs = FakeLogsClient(usage_logs.results_for, polls_before_complete=0)
+        results = run_planned_queries(get_runner(logs), get_sharded_queries(['group'], 'stats count(*)', 0, 86400))
+        self.assertEqual(len(results), 1)
+        self.assertEqual(len(results[0]['results']), MAX_QUERY_RESULT_ROWS)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+import unittest
+import sys
+import os
+import io
+import json
+from datetime import datetime
+
+sys.path.append(
+    os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "")))
+
+import pyarrow.parquet as pq
+
+from utils.output_format import (
+    NdjsonOutputFormat,
+    ParquetOutputFormat,
+    get_output_format,
+    write_usage_report
+)
+
+
+class StubS3Client:
+    def __init__(self):
+        self.objects = {}
+
+    def put_object(self, Body, Bucket, Key):
+        self.objects[Key] = Body
+
+
+def get_usage_records(count):
+    for i in range(count):
+        yield {"tenant_id": "tenant{}".format(i % 50), "date": "2024-07-03 00:00:00.000",
+               "usage_unit": "billed_duration_ms", "service_name": "AWSLambda",
+               "tenant_usage": float(i), "total_usage": 1000.0, "tenant_percent_usage": round(i / 10, 1)}
+
+
+class TestOutputFormat(unittest.TestCase):
+
+    def test_get_output_format(self):
+        self.assertIsInstance(get_output_format('ndjson'), NdjsonOutputFormat)
+        self.assertIsInstance(get_output_format('parquet'), ParquetOutputFormat)
+        with self.assertRaises(ValueError):
+            get_output_format('csv')
+
+    def test_parquet_round_trip(self):
+        s3 = StubS3Client()
+        records = list(get_usage_records(250))
+        stats = write_usage_report(s3, 'bucket', 'fine_grained', 'product', records,
+                                   ParquetOutputFormat(row_group_size=100))
+        self.assertRegex(stats['key'], r"^fine_grained/year=\d{4}/month=\d{2}/product-usage_by_tenant-\d{2}-\d{2}-\d{4}\.parquet$")
+        self.assertEqual(stats['records_written'], 250)
+        self.assertEqual(stats['row_groups'], 3)
+
+        parquet_file = pq.ParquetFile(io.BytesIO(s3.objects[stats['key']]))
+        self.assertEqual(parquet_file.metadata.num_row_groups, 3)
+        tenant_id_column = parquet_file.metadata.row_group(0).column(0)
+        self.assertIn('RLE_DICTIONARY', tenant_id_column.encodings)
+        self.assertEqual(parquet_file.metadata.row_group(0).column(4).statistics.max, 99.0)
+
+        rows = parquet_file.read().to_pylist()
+        self.assertEqual(len(rows), 250)
+        self.assertEqual(rows[7]["tenant_id"], records[7]["tenant_id"])
+        self.assertEqual(rows[7]["date"], datetime(2024, 7, 3))
+        self.assertEqual(rows[7]["tenant_usage"], records[7]["tenant_usage"])
+        self.assertEqual(rows[7]["tenant_percent_usage"], records[7]["tenant_percent_usage"])
+
+    def test_parquet_without_service_name(self):
+        # Coarse grained records have no service_name.
+        s3 = StubS3Client()
+        record = {"tenant_id": "tenant1", "date": "2024-07-03 00:00:00.000", "usage_unit": "API Calls",
+                  "tenant_usage": 3, "total_usage": 4, "tenant_percent_usage": 75.0}
+        stats = write_usage_report(s3, 'bucket', 'coarse_grained', 'product', [record], ParquetOutputFormat())
+        rows = pq.read_table(io.BytesIO(s3.objects[stats['key']])).to_pylist()
+        self.assertIsNone(rows[0]["service_name"])
+        self.assertEqual(rows[0]["tenant_usage"], 3.0)
+
+    def test_ndjson_format(self):
+        s3 = StubS3Client()
+        stats = write_usage_report(s3, 'bucket', 'fine_grained', 'product', get_usage_records(3), NdjsonOutputFormat())
+        self.assertTrue(stats['key'].endswith('.json'))
+        lines = s3.objects[stats['key']].decode('utf-8').splitlines()
+        self.assertEqual(json.loads(lines[2])["tenant_usage"], 2.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
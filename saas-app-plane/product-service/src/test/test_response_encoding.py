@@ -0,0 +1,76 @@
+import unittest
+import sys
+import os
+import datetime
+from collections import namedtuple
+from decimal import Decimal
+from types import SimpleNamespace
+
+sys.path.append(
+    os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "")))
+
+from models.order_models import Order, OrderProduct
+from models.product_models import Category, Product
+from utils.utils import encode_to_json_object, encode_with_jsonpickle
+
+
+class UserInfo:
+    def __init__(self, username, created):
+        self.username = username
+        self.created = created
+        self.enabled = True
+        self.role = None
+
+
+class Stateful:
+    def __init__(self):
+        self.value = 1
+
+    def __getstate__(self):
+        return {'state': self.value}
+
+
+def get_product(i):
+    return Product(f"tenant1-{i % 9 + 1}", f"p{i}", f"sku-{i}", f"Name \"{i}\" é ",
+                   Decimal(i) / 100, 'category')
+
+
+class TestResponseEncoding(unittest.TestCase):
+
+    def assert_same_json(self, value):
+        for sort_keys in (True, False):
+            self.assertEqual(encode_to_json_object(value, sort_keys), encode_with_jsonpickle(value, sort_keys))
+
+    def test_products(self):
+        products = [get_product(i) for i in range(50)]
+        self.assert_same_json(products[0])
+        self.assert_same_json(products)
+        self.assert_same_json({'products': products, 'next_cursor': None})
+        self.assert_same_json({'products': products[:3], 'unprocessed_keys': ['tenant1-1:p9']})
+        self.assert_same_json(Category(1, 'c'))
+
+    def test_orders(self):
+        self.assert_same_json(Order('tenant1-1', 'o1', 'order', [
+            SimpleNamespace(productId='p1', price=Decimal('1E+2'), quantity=Decimal('3'))]))
+        self.assert_same_json(Order('tenant1-1', 'o1', 'order', [
+            {'productId': 'p1', 'price': Decimal('10.0'), 'quantity': Decimal('-0')},
+            OrderProduct('p2', Decimal('1.5E-7'), 2)]))
+
+    def test_other_values(self):
+        created = datetime.datetime(2024, 1, 2, 3, 4, 5, tzinfo=datetime.timezone.utc)
+        self.assert_same_json([UserInfo('user1', created)])
+        self.assert_same_json({'message': 'm', 'values': [1.5, 2, True, None, float('inf'), (1, 2), {3, 4}]})
+        self.assert_same_json({'date': datetime.date(2024, 1, 2), 'stateful': Stateful()})
+        self.assert_same_json(namedtuple('Point', ['x', 'y'])(1, Decimal('2.5')))
+        self.assert_same_json('text')
+        self.assert_same_json(Decimal('5'))
+        # Mixed key types go through jsonpickle.
+        self.assert_same_json({'b': 1, 3: 'int key'})
+
+    def test_sorted_keys(self):
+        self.assertEqual(encode_to_json_object(Category(1, 'c'), sort_keys=True), '{"id": 1, "name": "c"}')
+        self.assertEqual(encode_to_json_object({'b': 1, 'a': 2}, sort_keys=False), '{"b": 1, "a": 2}')
+
+
+if __name__ == '__main__':
+    unittest.main()
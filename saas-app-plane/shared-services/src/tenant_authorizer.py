@@ -99,6 +99,8 @@ def lambda_handler(event, context):
             'accesskey': credentials['AccessKeyId'],
             'secretkey': credentials['SecretAccessKey'],
             'sessiontoken': credentials["SessionToken"],
+            # Lets the services drop the clients they cache for these credentials before they expire
+            'expiration': credentials['Expiration'].isoformat(),
             'userName': user_name,
             #TODO: Uncomment the below line to add tenant id to the output of the lambda authorizer.
             #'tenantId': tenant_id,
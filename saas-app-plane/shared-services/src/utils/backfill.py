@@ -0,0 +1,115 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+# Re-runs an aggregator over past days. Each day is queried, apportioned and written to the
+# year=/month= partition of the day it covers, several days at a time.
+#
+# Usage, from the directory that contains the aggregator module:
+#   python -m utils.backfill coarse_grained_aggregator:CoarseGrainedAggregator --start 2024-07-01 --end 2024-07-31
+#
+# Days that already have a report are skipped unless --force is given. Aggregators need the
+# report_prefix and report_service attributes that say where their daily reports are written.
+
+import argparse
+import importlib
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import date, datetime, timedelta
+
+from utils.aggregator_util import get_day_start_end_date_time
+from utils.output_format import get_output_format, usage_report_exists, write_usage_report
+
+DEFAULT_MAX_WORKERS = 4
+
+
+def get_backfill_days(start_date, end_date) -> list:
+    # Every day from start_date to end_date, both included.
+    if end_date < start_date:
+        raise ValueError(f"End date {end_date} is before start date {start_date}")
+    return [start_date + timedelta(days=offset) for offset in range((end_date - start_date).days + 1)]
+
+
+def backfill_day(aggregator, s3, bucket, report_date, force=False, output_format=None) -> dict:
+    if not force and usage_report_exists(s3, bucket, aggregator.report_prefix, aggregator.report_service,
+                                         report_date):
+        return {'date': report_date, 'status': 'skipped', 'records': 0}
+    start_date_time, end_date_time = get_day_start_end_date_time(report_date)
+    usage_by_tenant = aggregator.aggregate_tenant_usage(start_date_time, end_date_time)
+    apportioned_usage = aggregator.apportion_overall_usage_by_tenant(usage_by_tenant)
+    stats = write_usage_report(s3, bucket, aggregator.report_prefix, aggregator.report_service, apportioned_usage,
+                               output_format=output_format, report_date=report_date)
+    return {'date': report_date, 'status': 'written', 'records': stats['records_written'], 'key': stats['key']}
+
+
+def run_backfill(aggregator, s3, bucket, start_date, end_date, max_workers=DEFAULT_MAX_WORKERS, force=False,
+                 output_format=None) -> dict:
+    # Run the days on a bounded pool so the Logs Insights concurrent query limit is not exhausted,
+    # every day may itself run several queries. A failed day is reported and the others go on.
+    if output_format is None:
+        output_format = get_output_format()
+    days = get_backfill_days(start_date, end_date)
+    stats = {'days': len(days), 'written': 0, 'skipped': 0, 'failed': 0, 'records': 0, 'failed_days': []}
+    started = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(backfill_day, aggregator, s3, bucket, day, force, output_format): day
+                   for day in days}
+        for future in as_completed(futures):
+            day = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                print(f"Backfill of {day} failed: {e}")
+                stats['failed'] += 1
+                stats['failed_days'].append(day.isoformat())
+                continue
+            stats[result['status']] += 1
+            stats['records'] += result['records']
+            print(f"Backfill of {day} {result['status']}: {result.get('key', '')}")
+
+    elapsed = time.perf_counter() - started
+    stats['failed_days'].sort()
+    stats['elapsed_seconds'] = round(elapsed, 3)
+    stats['days_per_second'] = round(stats['written'] / elapsed, 3) if elapsed else 0.0
+    stats['records_per_second'] = round(stats['records'] / elapsed, 1) if elapsed else 0.0
+    return stats
+
+
+def load_aggregator(aggregator_path):
+    # module:Class, the module is imported by name so files like ecs-usage-aggregator.py work too.
+    module_name, _, class_name = aggregator_path.partition(':')
+    if not class_name:
+        raise ValueError(f"Expected module:Class, got {aggregator_path}")
+    return getattr(importlib.import_module(module_name), class_name)()
+
+
+def parse_date(value):
+    return datetime.strptime(value, '%Y-%m-%d').date()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Backfill daily tenant usage reports for a date range.')
+    parser.add_argument('aggregator', help='Aggregator to run, as module:Class')
+    parser.add_argument('--start', required=True, type=parse_date, help='First day, YYYY-MM-DD')
+    parser.add_argument('--end', type=parse_date, default=None, help='Last day, YYYY-MM-DD (default: yesterday)')
+    parser.add_argument('--bucket', default=os.getenv("TENANT_USAGE_BUCKET"), help='Tenant usage bucket')
+    parser.add_argument('--workers', type=int, default=DEFAULT_MAX_WORKERS, help='Days processed in parallel')
+    parser.add_argument('--force', action='store_true', help='Rewrite days that already have a report')
+    parser.add_argument('--format', default=None, help='ndjson, ndjson-gzip or parquet (default: USAGE_OUTPUT_FORMAT)')
+    args = parser.parse_args(argv)
+    if not args.bucket:
+        parser.error('--bucket or TENANT_USAGE_BUCKET is required')
+
+    # boto3 is only needed when running against AWS.
+    import boto3
+    aggregator = load_aggregator(args.aggregator)
+    end_date = args.end if args.end is not None else date.today() - timedelta(days=1)
+    stats = run_backfill(aggregator, boto3.client('s3'), args.bucket, args.start, end_date,
+                         max_workers=args.workers, force=args.force, output_format=get_output_format(args.format))
+    print(f"Backfill finished: {stats}")
+    return 1 if stats['failed'] else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,175 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import json
+import os
+import time
+from abc import ABC, abstractmethod
+
+from utils.aggregator_util import get_start_date_time, get_end_date_time
+
+# Logs can take a few minutes to become queryable, so the newest slice stops short of now.
+DEFAULT_INGESTION_LAG_SECONDS = 300
+
+
+class CheckpointStore(ABC):
+    @abstractmethod
+    def load(self, aggregator_name) -> dict:
+        pass
+
+    @abstractmethod
+    def save(self, aggregator_name, checkpoint):
+        pass
+
+
+class LocalFileCheckpointStore(CheckpointStore):
+    def __init__(self, directory):
+        self.directory = directory
+
+    def _get_path(self, aggregator_name):
+        return os.path.join(self.directory, '{}-checkpoint.json'.format(aggregator_name))
+
+    def load(self, aggregator_name) -> dict:
+        try:
+            with open(self._get_path(aggregator_name)) as checkpoint_file:
+                return json.load(checkpoint_file)
+        except FileNotFoundError:
+            return None
+
+    def save(self, aggregator_name, checkpoint):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._get_path(aggregator_name)
+        # Write to a temporary file first so a failed run never leaves a partial checkpoint.
+        temp_path = path + '.tmp'
+        with open(temp_path, 'w') as checkpoint_file:
+            json.dump(checkpoint, checkpoint_file)
+        os.replace(temp_path, path)
+
+
+class S3CheckpointStore(CheckpointStore):
+    def __init__(self, s3, bucket, prefix='checkpoints'):
+        self.s3 = s3
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def _get_key(self, aggregator_name):
+        return '{}/{}-checkpoint.json'.format(self.prefix, aggregator_name)
+
+    def load(self, aggregator_name) -> dict:
+        try:
+            response = self.s3.get_object(Bucket=self.bucket, Key=self._get_key(aggregator_name))
+        except self.s3.exceptions.NoSuchKey:
+            return None
+        return json.loads(response['Body'].read())
+
+    def save(self, aggregator_name, checkpoint):
+        self.s3.put_object(Body=json.dumps(checkpoint), Bucket=self.bucket, Key=self._get_key(aggregator_name))
+
+
+def get_checkpoint_store_from_env(s3):
+    # Incremental mode is enabled by configuring a checkpoint location, otherwise the aggregators
+    # keep re-querying the whole day on every run.
+    checkpoint_bucket = os.getenv("CHECKPOINT_BUCKET")
+    if checkpoint_bucket:
+        return S3CheckpointStore(s3, checkpoint_bucket, os.getenv("CHECKPOINT_PREFIX", "checkpoints"))
+    checkpoint_directory = os.getenv("CHECKPOINT_DIRECTORY")
+    if checkpoint_directory:
+        return LocalFileCheckpointStore(checkpoint_directory)
+    return None
+
+
+def format_metric_value(value):
+    # Logs Insights returns values as strings, keep integral totals parseable with int().
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def sum_query_results(usage_by_tenant, key_fields, metric_fields) -> list:
+    # Collapse a Logs Insights result into one row per key with the metric fields summed.
+    totals = {}
+    for result in usage_by_tenant['results']:
+        values = {field['field']: field['value'] for field in result}
+        key = tuple(values.get(key_field, '') for key_field in key_fields)
+        row = totals.setdefault(key, {metric_field: 0.0 for metric_field in metric_fields})
+        for metric_field in metric_fields:
+            if metric_field in values:
+                row[metric_field] += float(values[metric_field])
+    return [dict(zip(key_fields, key), **metrics) for key, metrics in sorted(totals.items())]
+
+
+def merge_slice_totals(slices, key_fields, metric_fields) -> dict:
+    # Merge the totals of every slice of the day back into a Logs Insights shaped result, so the
+    # aggregator can re-apportion the running daily totals with its existing logic.
+    totals = {}
+    for slice_key in sorted(slices):
+        for row in slices[slice_key]:
+            key = tuple(row[key_field] for key_field in key_fields)
+            merged = totals.setdefault(key, {metric_field: 0.0 for metric_field in metric_fields})
+            for metric_field in metric_fields:
+                merged[metric_field] += row[metric_field]
+
+    results = []
+    for key, metrics in sorted(totals.items()):
+        result = [{'field': key_field, 'value': value} for key_field, value in zip(key_fields, key)]
+        result += [{'field': metric_field, 'value': format_metric_value(metrics[metric_field])}
+                   for metric_field in metric_fields]
+        results.append(result)
+    return {'results': results, 'status': 'Complete'}
+
+
+def get_slice_range(slice_key) -> tuple:
+    start_time, end_time = slice_key.split('-')
+    return int(start_time), int(end_time)
+
+
+def cover_overlapping_slices(slices, slice_start_time, slice_end_time) -> tuple:
+    # Widens the slice until it covers every stored slice it overlaps and returns those slices too. They
+    # are queried again as part of the wider slice and replaced by it, so no time is counted twice.
+    overlapping_keys = []
+    widened = True
+    while widened:
+        widened = False
+        for slice_key in slices:
+            start_time, end_time = get_slice_range(slice_key)
+            if slice_key not in overlapping_keys and start_time < slice_end_time and slice_start_time < end_time:
+                overlapping_keys.append(slice_key)
+                slice_start_time = min(slice_start_time, start_time)
+                slice_end_time = max(slice_end_time, end_time)
+                widened = True
+    return slice_start_time, slice_end_time, overlapping_keys
+
+
+def aggregate_incremental_usage(aggregator, checkpoint_store, aggregator_name, key_fields, metric_fields,
+                                slice_start_time=None, slice_end_time=None,
+                                ingestion_lag_seconds=DEFAULT_INGESTION_LAG_SECONDS) -> dict:
+    # Query only the time slice after the aggregator's high-watermark and merge it into the
+    # daily totals kept in the checkpoint. Slice totals are stored by their time range, and
+    # re-running a time range (by passing its start and end) replaces the totals of the slices
+    # it overlaps instead of adding to them.
+    start_date_time = get_start_date_time()
+    end_date_time = get_end_date_time()
+
+    checkpoint = checkpoint_store.load(aggregator_name)
+    if checkpoint is None or checkpoint['start_date_time'] != start_date_time:
+        checkpoint = {'start_date_time': start_date_time, 'high_watermark': start_date_time, 'slices': {}}
+
+    if slice_start_time is None:
+        slice_start_time = checkpoint['high_watermark']
+    if slice_end_time is None:
+        slice_end_time = int(time.time()) - ingestion_lag_seconds
+    slice_start_time = max(slice_start_time, start_date_time)
+    slice_end_time = min(slice_end_time, end_date_time)
+
+    if slice_end_time > slice_start_time:
+        slice_start_time, slice_end_time, overlapping_keys = cover_overlapping_slices(
+            checkpoint['slices'], slice_start_time, slice_end_time)
+        usage_by_tenant = aggregator.aggregate_tenant_usage(slice_start_time, slice_end_time)
+        for slice_key in overlapping_keys:
+            del checkpoint['slices'][slice_key]
+        slice_key = '{}-{}'.format(slice_start_time, slice_end_time)
+        checkpoint['slices'][slice_key] = sum_query_results(usage_by_tenant, key_fields, metric_fields)
+        checkpoint['high_watermark'] = max(checkpoint['high_watermark'], slice_end_time)
+        checkpoint_store.save(aggregator_name, checkpoint)
+
+    return merge_slice_totals(checkpoint['slices'], key_fields, metric_fields)
@@ -2,10 +2,16 @@
 # SPDX-License-Identifier: MIT-0
 
 import json
+import os
 import jsonpickle
+import simplejson
 import boto3
 from aws_requests_auth.aws_auth import AWSRequestsAuth
 from enum import Enum
+from types import SimpleNamespace
+
+# Sorted keys keep response bodies byte for byte stable, RESPONSE_SORT_KEYS=false skips the sort.
+SORT_KEYS = os.getenv('RESPONSE_SORT_KEYS', 'true').lower() == 'true'
 
 class StatusCodes(Enum):
     SUCCESS    = 200
@@ -83,12 +89,39 @@ def generate_response(inputObject):
         "body": encode_to_json_object(inputObject),
     }
 
-def  encode_to_json_object(inputObject):
-    jsonpickle.set_encoder_options('simplejson', use_decimal=True, sort_keys=True)
+def  encode_to_json_object(inputObject, sort_keys=None):
+    # Same JSON as encode_with_jsonpickle for the model objects, lists and dicts with str keys the
+    # services return, without jsonpickle walking every attribute of every item.
+    sort_keys = SORT_KEYS if sort_keys is None else sort_keys
+    try:
+        return _encoders[sort_keys].encode(inputObject)
+    except TypeError:
+        # Keys of mixed types in one dict, jsonpickle turns them into strings before sorting them.
+        return encode_with_jsonpickle(inputObject, sort_keys)
+
+def encode_with_jsonpickle(inputObject, sort_keys=True):
+    jsonpickle.set_encoder_options('simplejson', use_decimal=True, sort_keys=sort_keys)
     jsonpickle.set_preferred_backend('simplejson')
     return jsonpickle.encode(inputObject, unpicklable=False, use_decimal=True)
 
+def _is_plain_class(cls):
+    # jsonpickle flattens objects to their __dict__ unless their class customizes pickling.
+    plain = _plain_classes.get(cls)
+    if plain is None:
+        plain = not any(name in vars(base) for base in cls.__mro__[:-1]
+                        for name in ('__getstate__', '__reduce__', '__reduce_ex__', '__slots__', '__getnewargs__'))
+        _plain_classes[cls] = plain
+    return plain
 
+def _flatten(obj):
+    if hasattr(obj, '__dict__') and _is_plain_class(type(obj)):
+        return obj.__dict__
+    # datetime, sets and any other type are flattened the way jsonpickle does it.
+    return jsonpickle.Pickler(unpicklable=False, use_decimal=True).flatten(obj)
 
-
-
+# SimpleNamespace (request payloads) pickles by __reduce__ but jsonpickle flattens it to its __dict__.
+_plain_classes = {SimpleNamespace: True}
+# jsonpickle turns tuples (namedtuples too) into lists and lets NaN and Infinity through.
+_encoders = {sort_keys: simplejson.JSONEncoder(use_decimal=True, sort_keys=sort_keys, default=_flatten,
+                                               allow_nan=True, namedtuple_as_object=False)
+             for sort_keys in (True, False)}